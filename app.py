@@ -23,6 +23,10 @@ from blueprints.scrapers import scrapers_bp
 from blueprints.import_config import import_config_bp
 from blueprints.notifications import notifications_bp
 
+# Harmonogram zadań w tle uruchamia main() (serwer deweloperski) albo hook gunicorna
+# (gunicorn.conf.py) - nie import modułu, żeby skrypty i testy importujące app go nie startowały
+from scheduler.job_runner import start_scheduler_service
+
 # Konfiguracja logowania
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -248,9 +252,14 @@ def main():
     except Exception as e:
         logger.warning(f"⚠️ ML Model issue: {e}")
     
+    # Harmonogram zadań w tle - przy debug=True tylko w procesie potomnym reloadera, nie w nadzorcy
+    debug = True
+    if not debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_scheduler_service()
+    
     # Uruchom aplikację
     logger.info("🌐 Starting Flask development server...")
-    app.run(debug=True, host='0.0.0.0', port=5000)
+    app.run(debug=debug, host='0.0.0.0', port=5000)
 
 if __name__ == '__main__':
     main()
@@ -12,6 +12,7 @@ from workers.quotes_daily import get_companies
 from import_historical_data import HistoricalDataImporter
 from import_job_manager import job_manager, run_import_in_background
 from analyze_data import DataAnalyzer
+from utils.ticker_registry import invalidate_ticker_registry
 
 import_config_bp = Blueprint('import_config', __name__)
 logger = logging.getLogger(__name__)
@@ -108,6 +109,7 @@ def add_ticker_mapping():
             })
             conn.commit()
         
+        invalidate_ticker_registry()
         flash(f"✅ Dodano mapowanie {ticker} → {bankier_symbol}", "success")
         
     except Exception as e:
@@ -170,6 +172,7 @@ def edit_ticker_mapping(mapping_id):
             })
             conn.commit()
         
+        invalidate_ticker_registry()
         flash(f"✅ Zaktualizowano mapowanie {ticker} → {bankier_symbol}", "success")
         
     except Exception as e:
@@ -211,6 +214,7 @@ def delete_ticker_mapping(mapping_id):
             conn.execute(text("DELETE FROM ticker_mappings WHERE id = :id"), {"id": mapping_id})
             conn.commit()
         
+        invalidate_ticker_registry()
         flash(f"✅ Usunięto mapowanie dla {ticker}", "success")
         
     except Exception as e:
@@ -262,6 +266,7 @@ def toggle_ticker_mapping(mapping_id):
             })
             conn.commit()
         
+        invalidate_ticker_registry()
         status_text = "aktywny" if new_status else "nieaktywny"
         flash(f"✅ Ticker {ticker} jest teraz {status_text}", "success")
         
@@ -10,6 +10,7 @@ from utils.error_handlers import (
     handle_db_errors, get_ml_status, check_ml_availability, 
     format_error_message, get_companies_safe
 )
+from training_job_manager import training_job_manager
 
 ml_bp = Blueprint('ml', __name__)
 logger = logging.getLogger(__name__)
@@ -207,12 +208,15 @@ def api_ml_prediction():
 def api_ml_train():
     """
     Endpoint do trenowania modelu ML
+    Domyślnie trening uruchamiany jest jako zadanie w tle (zwraca job_id),
+    "async": false wymusza dawny tryb synchroniczny.
     """
     try:
         data = request.get_json() or {}
         tickers = data.get('tickers', ['CDR', 'PKN', 'CCC'])
         days_back = data.get('days_back', 30)
         force_retrain = data.get('force_retrain', False)
+        run_async = data.get('async', True)
         
         ml_model = _get_ml_model()
         
@@ -225,6 +229,19 @@ def api_ml_train():
                 'timestamp': datetime.now().isoformat()
             })
         
+        if run_async:
+            job_id = training_job_manager.submit_job('simple_ml', {
+                'tickers': tickers,
+                'days_back': days_back
+            })
+            return jsonify({
+                'success': True,
+                'job_id': job_id,
+                'message': 'Trening uruchomiony w tle. Użyj job_id aby sprawdzić postęp.',
+                'status_url': f'/api/ml/jobs/{job_id}',
+                'timestamp': datetime.now().isoformat()
+            }), 202
+        
         # Przygotuj dane treningowe
         feature_engineer = _get_ml_feature_engine()
         
@@ -365,6 +382,187 @@ def api_ml_features():
             'error': str(e)
         }), 500
 
+# ================================
+# TRAINING JOBS ENDPOINTS
+# ================================
+
+@ml_bp.route("/api/ml/tune", methods=["POST"])
+def api_ml_tune():
+    """
+    Uruchamia w tle optymalizację hiperparametrów IntradayMLModel
+    """
+    try:
+        data = request.get_json() or {}
+        
+        job_id = training_job_manager.submit_job('intraday_tuning', {
+            'tickers': data.get('tickers', ['CDR', 'PKN', 'CCC']),
+            'model_type': data.get('model_type', 'xgboost'),
+            'start_date': data.get('start_date'),
+            'end_date': data.get('end_date'),
+            'days_back': data.get('days_back', 30)
+        })
+        
+        return jsonify({
+            'success': True,
+            'job_id': job_id,
+            'message': 'Optymalizacja hiperparametrów uruchomiona w tle.',
+            'status_url': f'/api/ml/jobs/{job_id}'
+        }), 202
+        
+    except Exception as e:
+        logger.error(f"Błąd uruchamiania optymalizacji ML: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@ml_bp.route("/api/ml/backtest/intraday", methods=["POST"])
+def api_ml_backtest_intraday():
+    """
+    Uruchamia w tle backtest reguł intraday na słupkach 5-minutowych.
+    Opcjonalny param_grid ({"buy_rules.oversold_rsi_fast.threshold": [30, 35], ...})
+    włącza równoległy przegląd kombinacji parametrów.
+    """
+    try:
+        data = request.get_json() or {}
+        
+        job_id = training_job_manager.submit_job('intraday_backtest', {
+            'tickers': data.get('tickers'),
+            'start_date': data.get('start_date'),
+            'end_date': data.get('end_date'),
+            'days_back': data.get('days_back', 90),
+            'bar_minutes': data.get('bar_minutes', 5),
+            'rules': data.get('rules'),
+            'param_grid': data.get('param_grid'),
+            'commission_rate': data.get('commission_rate', 0.0039),
+            'slippage_rate': data.get('slippage_rate', 0.0005),
+            'position_value': data.get('position_value', 10000.0),
+            'initial_capital': data.get('initial_capital', 100000.0)
+        })
+        
+        return jsonify({
+            'success': True,
+            'job_id': job_id,
+            'message': 'Backtest reguł intraday uruchomiony w tle.',
+            'status_url': f'/api/ml/jobs/{job_id}'
+        }), 202
+    
+    except Exception as e:
+        logger.error(f"Błąd uruchamiania backtestu intraday: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@ml_bp.route("/api/ml/optimize/intraday-rules", methods=["POST"])
+def api_ml_optimize_intraday_rules():
+    """
+    Uruchamia w tle optymalizację walk-forward progów reguł intraday.
+    Wynik zapisywany jest jako rules_config_intraday_optimized.json,
+    a przy "apply": true nadpisuje rules_config_intraday.json (z kopią .bak).
+    """
+    try:
+        data = request.get_json() or {}
+        
+        job_id = training_job_manager.submit_job('intraday_rules_optimization', {
+            'tickers': data.get('tickers'),
+            'start_date': data.get('start_date'),
+            'end_date': data.get('end_date'),
+            'days_back': data.get('days_back', 365),
+            'search_space': data.get('search_space'),
+            'train_sessions': data.get('train_sessions', 60),
+            'test_sessions': data.get('test_sessions', 20),
+            'step_sessions': data.get('step_sessions'),
+            'min_trades': data.get('min_trades', 20),
+            'min_profitable_folds': data.get('min_profitable_folds', 0.5),
+            'max_combinations': data.get('max_combinations'),
+            'apply': bool(data.get('apply', False))
+        })
+        
+        return jsonify({
+            'success': True,
+            'job_id': job_id,
+            'message': 'Optymalizacja reguł intraday uruchomiona w tle.',
+            'status_url': f'/api/ml/jobs/{job_id}'
+        }), 202
+    
+    except Exception as e:
+        logger.error(f"Błąd uruchamiania optymalizacji reguł intraday: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@ml_bp.route("/api/ml/jobs", methods=["GET"])
+def api_ml_jobs():
+    """Lista ostatnich zadań treningu ML"""
+    try:
+        limit = request.args.get('limit', 20, type=int)
+        jobs = training_job_manager.list_jobs(limit)
+        
+        return jsonify({
+            'success': True,
+            'jobs': jobs,
+            'count': len(jobs)
+        })
+        
+    except Exception as e:
+        logger.error(f"Błąd pobierania listy zadań ML: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@ml_bp.route("/api/ml/jobs/<job_id>", methods=["GET"])
+def api_ml_job_status(job_id: str):
+    """
+    Status zadania treningu ML wraz ze zdarzeniami postępu.
+    Parametr ?since=<id ostatniego zdarzenia> zwraca tylko nowe zdarzenia (polling przyrostowy).
+    """
+    try:
+        since = request.args.get('since', 0, type=int)
+        job = training_job_manager.get_job(job_id, since_event=since)
+        
+        if not job:
+            return jsonify({
+                'success': False,
+                'error': 'Job not found'
+            }), 404
+        
+        return jsonify({
+            'success': True,
+            'job': job
+        })
+        
+    except Exception as e:
+        logger.error(f"Błąd pobierania statusu zadania ML {job_id}: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@ml_bp.route("/api/ml/jobs/<job_id>/cancel", methods=["POST"])
+def api_ml_job_cancel(job_id: str):
+    """Anuluje zadanie treningu ML"""
+    try:
+        if training_job_manager.cancel_job(job_id):
+            return jsonify({
+                'success': True,
+                'message': f'Anulowanie zadania {job_id} zlecone'
+            })
+        
+        return jsonify({
+            'success': False,
+            'error': 'Could not cancel job - job not found or already finished'
+        }), 400
+        
+    except Exception as e:
+        logger.error(f"Błąd anulowania zadania ML {job_id}: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
 # ================================
 # MARKET PATTERN ML ENDPOINTS
 # ================================
@@ -373,6 +571,7 @@ def api_ml_features():
 def api_ml_market_pattern_train():
     """
     Trenuje Market Pattern ML model na danych rynkowych
+    Domyślnie jako zadanie w tle (zwraca job_id), "async": false - synchronicznie.
     """
     try:
         data = request.get_json() or {}
@@ -383,6 +582,18 @@ def api_ml_market_pattern_train():
         
         logger.info(f"🤖 Training Market Pattern ML for {len(tickers)} tickers, {days_back} days")
         
+        if data.get('async', True):
+            job_id = training_job_manager.submit_job('market_pattern', {
+                'tickers': tickers,
+                'days_back': days_back
+            })
+            return jsonify({
+                'success': True,
+                'job_id': job_id,
+                'message': 'Trening uruchomiony w tle. Użyj job_id aby sprawdzić postęp.',
+                'status_url': f'/api/ml/jobs/{job_id}'
+            }), 202
+        
         # Inicjalizuj i trenuj model
         ml_model = _get_market_pattern_ml()
         result = ml_model.train_model(tickers, days_back)
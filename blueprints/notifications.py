@@ -82,7 +82,8 @@ def send_test_notification():
             message=message,
             title=title or "",
             notification_type=notification_type,
-            ticker="TEST"
+            ticker="TEST",
+            sync=True  # Wynik wysyłki widoczny od razu w panelu
         )
         
         if success:
@@ -343,14 +344,26 @@ def api_broadcast_notification():
         
         return jsonify({
             'success': True,
-            'sent': result['sent'],
-            'failed': result['failed'],
-            'message': f"Wysłano do {result['sent']} subskrybentów, błędów: {result['failed']}"
+            'queued': result['queued'],
+            'suppressed': result.get('suppressed', 0),
+            'message': f"Dodano do kolejki wysyłki dla {result['queued']} subskrybentów"
         })
         
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@notifications_bp.route("/api/notifications/telegram/outbox")
+def api_notification_outbox():
+    """API - Statystyki kolejki wysyłki powiadomień"""
+    try:
+        from telegram_notifications import TelegramNotificationManager
+        telegram_manager = TelegramNotificationManager()
+        
+        return jsonify({'success': True, 'report': telegram_manager.get_delivery_report()})
+        
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 @notifications_bp.route("/api/alerts/price/check", methods=["POST"])
 def api_check_price_alerts():
     """API - Sprawdza alerty cenowe"""
@@ -298,10 +298,15 @@ def get_recommendation_stats():
     try:
         days_back = request.args.get('days_back', 7, type=int)
         
-        from workers.intraday_recommendation_engine import IntradayRecommendationEngine
+        from workers.recommendation_tracker import get_recommendation_tracker
         
-        engine = IntradayRecommendationEngine()
-        stats = engine.get_tracking_stats(days_back=days_back)
+        # Statystyki czytane z rollupów - bez tworzenia silnika rekomendacji na każde zapytanie
+        tracker = get_recommendation_tracker()
+        stats = {
+            'daily_stats': tracker.get_performance_stats(days_back),
+            'best_configurations': tracker.get_best_configurations(3),
+            'tracking_enabled': True
+        }
         
         return jsonify({
             'success': True,
@@ -317,6 +322,29 @@ def get_recommendation_stats():
             'error': str(e)
         }), 500
 
+@recommendations_bp.route('/api/recommendations/stats/rebuild', methods=['POST'])
+def rebuild_recommendation_stats():
+    """API endpoint do przebudowy rollupów statystyk (backfill)"""
+    try:
+        days_back = request.args.get('days_back', type=int)
+        
+        from workers.recommendation_tracker import get_recommendation_tracker
+        
+        result = get_recommendation_tracker().rebuild_rollups(days_back)
+        
+        return jsonify({
+            'success': True,
+            'result': result,
+            'timestamp': datetime.now().isoformat()
+        })
+    
+    except Exception as e:
+        logger.error(f"Błąd przebudowy statystyk rekomendacji: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
 @recommendations_bp.route('/api/recommendations/history')
 def get_recommendations_history():
     """API endpoint do pobierania historii rekomendacji"""
@@ -324,7 +352,7 @@ def get_recommendations_history():
         limit = request.args.get('limit', 50, type=int)
         status = request.args.get('status', 'all')  # all, active, closed
         
-        from workers.recommendation_tracker_postgresql import RecommendationTracker
+        from workers.recommendation_tracker import RecommendationTracker
         
         tracker = RecommendationTracker()
         
@@ -356,7 +384,7 @@ def api_recommendations_with_tracking():
         import os
         from dotenv import load_dotenv
         from sqlalchemy import create_engine, text
-        from workers.recommendation_tracker_postgresql import RecommendationTracker
+        from workers.recommendation_tracker import RecommendationTracker
         
         load_dotenv('.env')
         
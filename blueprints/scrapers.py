@@ -3,7 +3,7 @@ Scrapers Blueprint - selenium scraper, schedulers, news, communications
 Obsługuje: selenium scraper, multi-ticker scheduler, news scheduler, ESPI scheduler
 """
 
-from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify
+from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, Response
 from datetime import datetime
 import logging
 from workers.quotes_daily import get_companies
@@ -21,6 +21,8 @@ from scheduler.news_scheduler import (
     update_news_interval, update_espi_interval as update_espi_interval_news,
     update_news_days_back, update_espi_days_back
 )
+from scheduler.job_runner import get_scheduler_service
+from utils.event_bus import get_event_bus
 from workers.espi_scraper_rss import ESPIScraperRSS
 from workers.news_scraper_offline import NewsScraperOffline
 
@@ -287,6 +289,7 @@ def scheduler_monitoring():
         multi_status = get_scheduler_status()
         news_status = get_news_scheduler_status()
         espi_status = get_espi_scheduler_status()
+        jobs_status = get_scheduler_service().status()
         
         # Sprawdź status analizy intraday
         analysis_status = {}
@@ -334,6 +337,7 @@ def scheduler_monitoring():
                              multi_status=multi_status,
                              news_status=news_status,
                              espi_status=espi_status,
+                             jobs_status=jobs_status,
                              analysis_status=analysis_status,
                              system_uptime=uptime_str,
                              active_threads=active_threads,
@@ -542,6 +546,8 @@ def api_scheduler_monitoring():
                 'news': news_status,
                 'espi': espi_status
             },
+            'jobs': get_scheduler_service().status(),
+            'events': get_event_bus().status(),
             'system': {
                 'active_threads': active_threads,
                 'cpu_percent': cpu_percent,
@@ -552,3 +558,12 @@ def api_scheduler_monitoring():
         
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
+
+@scrapers_bp.route("/api/monitoring/metrics")
+def api_scheduler_metrics():
+    """Metryki zadań harmonogramu w formacie Prometheus"""
+    try:
+        return Response(get_scheduler_service().prometheus_metrics(),
+                        mimetype='text/plain; version=0.0.4; charset=utf-8')
+    except Exception as e:
+        return Response(f"# error: {e}\n", status=500, mimetype='text/plain')
@@ -0,0 +1,11 @@
+"""
+Konfiguracja gunicorna (wczytywana automatycznie z katalogu roboczego)
+Harmonogram zadań w tle startuje w każdym workerze po jego inicjalizacji - workery
+kandydują na lidera, zadania uruchamia tylko jeden proces (blokada doradcza PostgreSQL).
+"""
+
+
+def post_worker_init(worker):
+    """Uruchamia kandydowanie na lidera harmonogramu w workerze"""
+    from scheduler.job_runner import start_scheduler_service
+    start_scheduler_service()
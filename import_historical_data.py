@@ -16,6 +16,7 @@ from sqlalchemy import create_engine, text
 from datetime import datetime, timedelta
 from typing import Dict, List, Any, Optional
 from dotenv import load_dotenv
+from utils.ticker_registry import get_ticker_registry
 from ticker_manager import auto_register_ticker_from_import
 from enhanced_ticker_registration import enhanced_auto_register_ticker_from_import, EnhancedTickerAutoRegistration
 
@@ -53,6 +54,7 @@ class HistoricalDataManager:
         # Połączenie PostgreSQL
         db_uri = f"postgresql://{self.pg_config['user']}:{self.pg_config['password']}@{self.pg_config['host']}:{self.pg_config['port']}/{self.pg_config['database']}"
         self.engine = create_engine(db_uri)
+        self.registry = get_ticker_registry(self.engine)
         
         # Sprawdź połączenie
         self._test_connection()
@@ -83,16 +85,8 @@ class HistoricalDataManager:
     def ensure_company_exists(self, ticker: str) -> Optional[int]:
         """Sprawdza czy firma istnieje w tabeli companies, jeśli nie - dodaje ją"""
         try:
-            # Użyj TickerManager do zarządzania firmami
-            from ticker_manager import TickerManager
-            manager = TickerManager()
-            
-            # Użyj metody z TickerManager
-            company_id = manager.ensure_company_exists(ticker)
-            if company_id:
-                logger.info(f"✅ Firma {ticker} zapewniona w bazie (ID: {company_id})")
-            
-            return company_id
+            # Wspólna pamięć podręczna company_id (bez nowego TickerManager i połączenia na każdy ticker)
+            return self.registry.company_id(ticker, sector="Unknown", data_source="auto_registered")
                 
         except Exception as e:
             logger.error(f"❌ Błąd zapewnienia istnienia firmy {ticker}: {e}")
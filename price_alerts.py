@@ -162,16 +162,25 @@ class PriceAlertSystem:
             logger.error(f"❌ Błąd pobierania ceny dla {ticker}: {e}")
             return None
     
-    def check_alerts(self) -> Dict[str, Any]:
-        """Sprawdza wszystkie aktywne alerty"""
+    def check_alerts(self, tickers: Optional[List[str]] = None,
+                     prices: Optional[Dict[str, float]] = None) -> Dict[str, Any]:
+        """
+        Sprawdza aktywne alerty
+        
+        Args:
+            tickers: Tylko alerty tych tickerów (domyślnie wszystkie)
+            prices: Znane aktualne ceny {ticker: cena} - dla pozostałych cena pobierana z bazy
+        """
+        prices = {t.upper(): p for t, p in (prices or {}).items()}
         try:
             with self.engine.connect() as conn:
                 # Pobierz aktywne alerty
-                alerts = conn.execute(text("""
+                ticker_filter = "AND ticker = ANY(:tickers)" if tickers is not None else ""
+                alerts = conn.execute(text(f"""
                     SELECT id, ticker, alert_type, threshold_value, current_price, description
                     FROM price_alerts
-                    WHERE is_active = TRUE AND is_triggered = FALSE
-                """)).fetchall()
+                    WHERE is_active = TRUE AND is_triggered = FALSE {ticker_filter}
+                """), {"tickers": [t.upper() for t in tickers or []]}).fetchall()
                 
                 triggered_count = 0
                 checked_count = 0
@@ -180,7 +189,9 @@ class PriceAlertSystem:
                     alert_id, ticker, alert_type, threshold_value, old_price, description = alert
                     
                     # Pobierz aktualną cenę
-                    current_price = self._get_current_price(ticker)
+                    current_price = prices.get(ticker.upper())
+                    if current_price is None:
+                        current_price = self._get_current_price(ticker)
                     if current_price is None:
                         continue
                     
@@ -376,6 +387,15 @@ class PriceAlertSystem:
             logger.error(f"❌ Błąd usuwania alertu: {e}")
             return False
 
+_price_alert_system: Optional[PriceAlertSystem] = None
+
+def get_price_alert_system() -> PriceAlertSystem:
+    """Zwraca współdzieloną instancję systemu alertów (jeden silnik bazy na proces)"""
+    global _price_alert_system
+    if _price_alert_system is None:
+        _price_alert_system = PriceAlertSystem()
+    return _price_alert_system
+
 def main():
     """Funkcja testowa"""
     print("🚨 PRICE ALERT SYSTEM")
@@ -9,15 +9,12 @@ Data: 2025-06-24
 import os
 import sys
 import time
-import threading
-from datetime import datetime, timedelta
-from apscheduler.schedulers.background import BackgroundScheduler
-from apscheduler.triggers.interval import IntervalTrigger
 import logging
 
 # Dodaj ścieżkę do modułów
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from workers.espi_scraper_rss import ESPIScraperRSS
+from scheduler.job_runner import ESPI_SCRAPE_JOB, get_scheduler_service
 
 # Konfiguracja logowania
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -25,81 +22,64 @@ logger = logging.getLogger(__name__)
 
 
 class ESPIScheduler:
-    """Scheduler dla automatycznego pobierania komunikatów ESPI/EBI"""
+    """Komunikaty ESPI/EBI - zadanie espi_scrape we wspólnym harmonogramie"""
     
     def __init__(self):
         """Inicjalizacja schedulera"""
-        self.scheduler = BackgroundScheduler()
         self.scraper = ESPIScraperRSS()
-        self.is_running = False
-        self.last_run = None
-        self.last_results = {'ESPI': 0, 'EBI': 0, 'total': 0}
-        self.interval_hours = 1  # Domyślnie co godzinę
+        self.service = get_scheduler_service()
         
         logger.info("✓ ESPI Scheduler zainicjalizowany")
     
-    def communication_scraping_job(self):
-        """Job do scrapowania komunikatów"""
-        try:
-            logger.info("🚀 Rozpoczynam automatyczne scrapowanie komunikatów ESPI/EBI")
-            
-            # Pobierz komunikaty z ostatnich 2 dni (żeby nie przegapić niczego)
-            results = self.scraper.scrape_all_communications(days_back=2)
-            
-            self.last_run = datetime.now()
-            self.last_results = results
-            
-            if results['total'] > 0:
-                logger.info(f"✅ Pobrano {results['total']} nowych komunikatów (ESPI: {results['ESPI']}, EBI: {results['EBI']})")
-            else:
-                logger.info("📋 Brak nowych komunikatów do pobrania")
-                
-        except Exception as e:
-            logger.error(f"❌ Błąd podczas automatycznego scrapowania komunikatów: {e}")
+    @property
+    def is_running(self) -> bool:
+        return self.service.is_enabled(ESPI_SCRAPE_JOB)
+    
+    @property
+    def interval_hours(self) -> float:
+        interval_seconds = self.service.job_state(ESPI_SCRAPE_JOB).get('interval_seconds') or 3600
+        return round(interval_seconds / 3600, 2)
+    
+    def communication_scraping_job(self, days_back: int = 2) -> dict:
+        """Job do scrapowania komunikatów (wywoływany przez harmonogram)"""
+        logger.info("🚀 Rozpoczynam automatyczne scrapowanie komunikatów ESPI/EBI")
+        
+        # Domyślnie komunikaty z ostatnich 2 dni (żeby nie przegapić niczego)
+        results = self.scraper.scrape_all_communications(days_back=days_back)
+        
+        if results['total'] > 0:
+            logger.info(f"✅ Pobrano {results['total']} nowych komunikatów (ESPI: {results['ESPI']}, EBI: {results['EBI']})")
+        else:
+            logger.info("📋 Brak nowych komunikatów do pobrania")
+        return results
     
     def start_scheduler(self) -> bool:
-        """Uruchamia automatyczne scrapowanie komunikatów"""
+        """Włącza automatyczne scrapowanie komunikatów (pierwszy przebieg od razu)"""
         if self.is_running:
             logger.warning("⚠️ Scheduler komunikatów już jest uruchomiony")
             return False
         
         try:
-            # Dodaj job do schedulera
-            self.scheduler.add_job(
-                func=self.communication_scraping_job,
-                trigger=IntervalTrigger(hours=self.interval_hours),
-                id='espi_scraping_job',
-                name='Scrapowanie komunikatów ESPI/EBI',
-                replace_existing=True
-            )
-            
-            # Uruchom scheduler
-            self.scheduler.start()
-            self.is_running = True
-            
+            if not self.service.set_job(ESPI_SCRAPE_JOB, enabled=True):
+                return False
             logger.info(f"✅ Scheduler komunikatów uruchomiony (interwał: {self.interval_hours}h)")
-            
-            # Wykonaj pierwszy run od razu
-            threading.Thread(target=self.communication_scraping_job, daemon=True).start()
-            
             return True
-            
+        
         except Exception as e:
             logger.error(f"❌ Błąd uruchamiania schedulera komunikatów: {e}")
             return False
     
     def stop_scheduler(self) -> bool:
-        """Zatrzymuje automatyczne scrapowanie komunikatów"""
+        """Wyłącza automatyczne scrapowanie komunikatów"""
         if not self.is_running:
             logger.warning("⚠️ Scheduler komunikatów nie jest uruchomiony")
             return False
         
         try:
-            self.scheduler.shutdown()
-            self.is_running = False
+            self.service.set_job(ESPI_SCRAPE_JOB, enabled=False)
             logger.info("✅ Scheduler komunikatów zatrzymany")
             return True
-            
+        
         except Exception as e:
             logger.error(f"❌ Błąd zatrzymywania schedulera komunikatów: {e}")
             return False
@@ -107,57 +87,41 @@ class ESPIScheduler:
     def update_interval(self, hours: int) -> bool:
         """Aktualizuje interwał scrapowania"""
         try:
-            self.interval_hours = max(1, min(24, hours))  # Min 1h, max 24h
-            
-            if self.is_running:
-                # Zatrzymaj i uruchom ponownie z nowym interwałem
-                self.scheduler.remove_job('espi_scraping_job')
-                self.scheduler.add_job(
-                    func=self.communication_scraping_job,
-                    trigger=IntervalTrigger(hours=self.interval_hours),
-                    id='espi_scraping_job',
-                    name='Scrapowanie komunikatów ESPI/EBI',
-                    replace_existing=True
-                )
+            hours = max(1, min(24, hours))  # Min 1h, max 24h
+            self.service.set_job(ESPI_SCRAPE_JOB, interval_seconds=hours * 3600)
             
-            logger.info(f"✅ Interwał scrapowania komunikatów zmieniony na {self.interval_hours}h")
+            logger.info(f"✅ Interwał scrapowania komunikatów zmieniony na {hours}h")
             return True
-            
+        
         except Exception as e:
             logger.error(f"❌ Błąd zmiany interwału: {e}")
             return False
     
     def get_status(self) -> dict:
         """Zwraca status schedulera"""
-        next_run = None
-        if self.is_running and self.scheduler.get_jobs():
-            job = self.scheduler.get_job('espi_scraping_job')
-            if job and job.next_run_time:
-                next_run = job.next_run_time
+        state = self.service.job_state(ESPI_SCRAPE_JOB)
+        is_running = bool(state.get('enabled'))
         
         return {
-            'is_running': self.is_running,
+            'is_running': is_running,
             'interval_hours': self.interval_hours,
-            'last_run': self.last_run,
-            'next_run': next_run,
-            'last_results': self.last_results
+            'last_run': state.get('last_finished_at'),
+            'next_run': state.get('next_run_at') if is_running else None,
+            'last_results': state.get('last_result') or {'ESPI': 0, 'EBI': 0, 'total': 0}
         }
     
     def manual_run(self) -> dict:
-        """Ręczne uruchomienie scrapowania"""
+        """Ręczne uruchomienie scrapowania (pomijane, gdy zadanie właśnie działa w innym procesie)"""
         logger.info("🔧 Ręczne uruchomienie scrapowania komunikatów")
         
-        try:
-            results = self.scraper.scrape_all_communications(days_back=7)
-            self.last_run = datetime.now()
-            self.last_results = results
-            
-            logger.info(f"✅ Ręczne scrapowanie zakończone: {results['total']} komunikatów")
-            return results
-            
-        except Exception as e:
-            logger.error(f"❌ Błąd ręcznego scrapowania: {e}")
-            return {'ESPI': 0, 'EBI': 0, 'total': 0, 'error': str(e)}
+        run = self.service.run_job(ESPI_SCRAPE_JOB, trigger='manual', options={'days_back': 7})
+        if run['status'] != 'completed':
+            logger.error(f"❌ Błąd ręcznego scrapowania: {run.get('error')}")
+            return {'ESPI': 0, 'EBI': 0, 'total': 0, 'error': run.get('error')}
+        
+        results = run['result']
+        logger.info(f"✅ Ręczne scrapowanie zakończone: {results['total']} komunikatów")
+        return results
 
 
 # Globalna instancja schedulera
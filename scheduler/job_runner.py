@@ -0,0 +1,835 @@
+#!/usr/bin/env python3
+"""
+Wspólny serwis harmonogramu zadań w tle
+Jeden BackgroundScheduler na całą aplikację zamiast osobnych schedulerów (notowania, ESPI,
+newsy, pętla oceny rekomendacji). Zadania uruchamia tylko proces-lider wybrany blokadą
+doradczą PostgreSQL, na wspólnej ograniczonej puli wątków. Każde uruchomienie (także ręczne,
+z dowolnego workera) bierze dodatkowo blokadę zadania, więc to samo zadanie nigdy nie działa
+równolegle w dwóch procesach.
+
+Stan zadań (włączone, interwał, opcje, ostatni przebieg) trzyma tabela scheduler_jobs -
+zmiana z dowolnego workera gunicorna trafia do lidera przy najbliższej synchronizacji.
+
+Metryki przebiegów (histogram czasu trwania, przetworzone elementy, pominięte i spóźnione
+uruchomienia) trzyma tabela scheduler_job_metrics; gdy p95 czasu trwania przekracza interwał,
+zadanie jest oznaczane jako przekraczające (ostrzeżenie w logu, status i metryki Prometheus).
+
+Tryb pracy (zmienna SCHEDULER_MODE):
+- embedded (domyślnie): każdy proces aplikacji kandyduje na lidera,
+- external: procesy aplikacji tylko zapisują stan, zadania uruchamia osobny proces
+  `python -m scheduler.job_runner`,
+- off: harmonogram wyłączony.
+"""
+
+import json
+import logging
+import os
+import socket
+import sys
+import threading
+import time
+import zlib
+from bisect import bisect_left
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from apscheduler.events import EVENT_JOB_MAX_INSTANCES, EVENT_JOB_MISSED
+from apscheduler.executors.pool import ThreadPoolExecutor
+from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.triggers.interval import IntervalTrigger
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, text
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+logger = logging.getLogger(__name__)
+
+# Blokada doradcza lidera harmonogramu (jedna na bazę)
+SCHEDULER_LOCK_KEY = 7_105_221_048
+
+# Przestrzeń blokad pojedynczych zadań: pg_try_advisory_lock(JOB_LOCK_NAMESPACE, klucz zadania)
+JOB_LOCK_NAMESPACE = 7048
+
+# Jak często proces ponawia próbę przejęcia roli lidera i synchronizuje zadania ze stanem w bazie
+LEADER_RETRY_SECONDS = 15
+
+# Ważność podręcznej kopii scheduler_jobs w procesach, które tylko czytają stan
+STATE_CACHE_SECONDS = 5
+
+# Wspólna pula wątków dla wszystkich zadań
+MAX_WORKERS = int(os.getenv('SCHEDULER_MAX_WORKERS', '6'))
+
+SCHEDULER_MODES = ('embedded', 'external', 'off')
+
+# Górne granice przedziałów histogramu czasu trwania zadań w sekundach (ostatni przedział to +Inf)
+DURATION_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600)
+
+# Liczba ostatnich czasów trwania, z których liczone są percentyle
+DURATION_SAMPLE_SIZE = 100
+
+# Prefiks metryk w formacie Prometheus
+METRICS_PREFIX = 'gpw_scheduler_job'
+
+JobFunc = Callable[[Dict[str, Any]], Optional[Dict[str, Any]]]
+
+
+@dataclass
+class JobDefinition:
+    """Pozycja katalogu zadań"""
+    job_id: str
+    name: str
+    func: JobFunc
+    interval_seconds: int
+    max_concurrency: int = 1
+    misfire_grace_seconds: int = 30
+    active_hours: Optional[Tuple[int, int]] = None
+    run_on_enable: bool = False
+    options: Dict[str, Any] = field(default_factory=dict)
+    # Klucz wyniku zadania z liczbą przetworzonych elementów (metryka items)
+    items_key: Optional[str] = None
+
+
+def _create_db_engine():
+    """Tworzy engine PostgreSQL na podstawie zmiennych środowiskowych"""
+    load_dotenv('.env')
+    db_uri = (f"postgresql://{os.getenv('DB_USER')}:{os.getenv('DB_PASSWORD')}"
+              f"@{os.getenv('DB_HOST')}:{os.getenv('DB_PORT')}/{os.getenv('DB_NAME')}")
+    # Lider trzyma jedno połączenie, każde działające zadanie - jedno na blokadę
+    return create_engine(db_uri, pool_pre_ping=True, pool_size=MAX_WORKERS + 2)
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+def _percentile(values: List[float], percent: float) -> Optional[float]:
+    """Percentyl metodą najbliższej pozycji (None dla pustej próbki)"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * percent // 100))
+    return ordered[int(rank) - 1]
+
+
+def _result_items(job: 'JobDefinition', result: Dict[str, Any]) -> Optional[int]:
+    """Liczba przetworzonych elementów z wyniku zadania (lista liczy się jako jej długość)"""
+    if not job.items_key or job.items_key not in result:
+        return None
+    value = result[job.items_key]
+    if isinstance(value, (list, tuple, dict)):
+        return len(value)
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class SchedulerService:
+    """Katalog zadań, wybór lidera i uruchamianie zadań z limitami współbieżności"""
+
+    def __init__(self, engine=None, mode: Optional[str] = None):
+        """
+        Args:
+            engine: Silnik SQLAlchemy (domyślnie z zmiennych środowiskowych)
+            mode: embedded / external / off (domyślnie SCHEDULER_MODE)
+        """
+        self.engine = engine or _create_db_engine()
+        self.mode = mode or os.getenv('SCHEDULER_MODE', 'embedded')
+        if self.mode not in SCHEDULER_MODES:
+            logger.warning(f"⚠️ Nieznany SCHEDULER_MODE={self.mode} - używam 'embedded'")
+            self.mode = 'embedded'
+        self.host = f"{socket.gethostname()}:{os.getpid()}"
+
+        self._jobs: Dict[str, JobDefinition] = {}
+        self._slots: Dict[str, threading.BoundedSemaphore] = {}
+        self._tables_ready = False
+        self._lock = threading.Lock()
+
+        self._states: Dict[str, Dict[str, Any]] = {}
+        self._states_loaded_at = 0.0
+        self._overrunning: set = set()
+
+        self._scheduler: Optional[BackgroundScheduler] = None
+        self._scheduled: Dict[str, int] = {}
+        self._leader_conn = None
+        self._leader_checked_at = 0.0
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+
+    # ------------------------------------------------------------------
+    # Katalog i stan zadań
+    # ------------------------------------------------------------------
+
+    def register(self, job: JobDefinition):
+        """Dodaje zadanie do katalogu (wiersz w scheduler_jobs powstaje przy pierwszym odczycie stanu)"""
+        with self._lock:
+            self._jobs[job.job_id] = job
+            self._slots[job.job_id] = threading.BoundedSemaphore(job.max_concurrency)
+            self._tables_ready = False
+
+    def _ensure_tables(self):
+        if self._tables_ready:
+            return
+        with self.engine.begin() as conn:
+            conn.execute(text("""
+                CREATE TABLE IF NOT EXISTS scheduler_jobs (
+                    job_id VARCHAR(64) PRIMARY KEY,
+                    enabled BOOLEAN NOT NULL DEFAULT FALSE,
+                    interval_seconds INTEGER NOT NULL,
+                    options JSONB NOT NULL DEFAULT '{}'::jsonb,
+                    next_run_at TIMESTAMP,
+                    last_started_at TIMESTAMP,
+                    last_finished_at TIMESTAMP,
+                    last_status VARCHAR(20),
+                    last_error TEXT,
+                    last_result JSONB,
+                    last_host VARCHAR(100),
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """))
+            defaults = [{'job_id': job.job_id, 'interval_seconds': job.interval_seconds}
+                        for job in self._jobs.values()]
+            conn.execute(text("""
+                INSERT INTO scheduler_jobs (job_id, interval_seconds)
+                SELECT r.job_id, r.interval_seconds
+                FROM jsonb_to_recordset(CAST(:rows AS JSONB)) AS r(job_id TEXT, interval_seconds INTEGER)
+                ON CONFLICT (job_id) DO NOTHING
+            """), {'rows': json.dumps(defaults)})
+            # Metryki przebiegów - wspólne dla procesów (API monitoringu obsługuje dowolny worker)
+            conn.execute(text("""
+                CREATE TABLE IF NOT EXISTS scheduler_job_metrics (
+                    job_id VARCHAR(64) PRIMARY KEY,
+                    runs_total BIGINT NOT NULL DEFAULT 0,
+                    failures_total BIGINT NOT NULL DEFAULT 0,
+                    skipped_total BIGINT NOT NULL DEFAULT 0,
+                    misfired_total BIGINT NOT NULL DEFAULT 0,
+                    items_total BIGINT NOT NULL DEFAULT 0,
+                    duration_sum DOUBLE PRECISION NOT NULL DEFAULT 0,
+                    duration_buckets BIGINT[] NOT NULL,
+                    recent_durations DOUBLE PRECISION[] NOT NULL DEFAULT '{}',
+                    last_items INTEGER,
+                    last_duration_seconds DOUBLE PRECISION,
+                    last_skipped_at TIMESTAMP,
+                    last_skip_reason TEXT,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """))
+            conn.execute(text("""
+                INSERT INTO scheduler_job_metrics (job_id, duration_buckets)
+                SELECT r.job_id, array_fill(0::BIGINT, ARRAY[CAST(:buckets AS INTEGER)])
+                FROM jsonb_to_recordset(CAST(:rows AS JSONB)) AS r(job_id TEXT)
+                ON CONFLICT (job_id) DO NOTHING
+            """), {'rows': json.dumps(defaults), 'buckets': len(DURATION_BUCKETS) + 1})
+        self._tables_ready = True
+
+    def job_states(self, fresh: bool = False) -> Dict[str, Dict[str, Any]]:
+        """Stan wszystkich zadań z scheduler_jobs (kopia podręczna ważna STATE_CACHE_SECONDS)"""
+        now = time.monotonic()
+        if not fresh and now - self._states_loaded_at < STATE_CACHE_SECONDS:
+            return self._states
+        self._ensure_tables()
+        with self.engine.connect() as conn:
+            rows = conn.execute(text("SELECT * FROM scheduler_jobs")).mappings().all()
+        self._states = {row['job_id']: dict(row) for row in rows}
+        self._states_loaded_at = now
+        return self._states
+
+    def job_state(self, job_id: str) -> Dict[str, Any]:
+        return self.job_states().get(job_id, {})
+
+    def job_options(self, job_id: str) -> Dict[str, Any]:
+        """Opcje zadania: domyślne z katalogu nadpisane zapisanymi w bazie"""
+        job = self._jobs.get(job_id)
+        return {**(job.options if job else {}), **(self.job_state(job_id).get('options') or {})}
+
+    def is_enabled(self, job_id: str) -> bool:
+        try:
+            return bool(self.job_state(job_id).get('enabled'))
+        except Exception as e:
+            logger.warning(f"⚠️ Nie można odczytać stanu zadania {job_id}: {e}")
+            return False
+
+    def set_job(self, job_id: str, enabled: Optional[bool] = None, interval_seconds: Optional[int] = None,
+                options: Optional[Dict[str, Any]] = None) -> bool:
+        """
+        Zmienia stan zadania - lider zastosuje zmianę przy najbliższej synchronizacji
+
+        Args:
+            job_id: Identyfikator z katalogu
+            enabled: Włączenie / wyłączenie harmonogramu zadania
+            interval_seconds: Nowy interwał
+            options: Opcje scalane z dotychczasowymi (np. days_back)
+        """
+        if job_id not in self._jobs:
+            logger.error(f"❌ Nieznane zadanie harmonogramu: {job_id}")
+            return False
+        self._ensure_tables()
+        with self.engine.begin() as conn:
+            updated = conn.execute(text("""
+                UPDATE scheduler_jobs
+                SET enabled = COALESCE(CAST(:enabled AS BOOLEAN), enabled),
+                    interval_seconds = COALESCE(CAST(:interval_seconds AS INTEGER), interval_seconds),
+                    options = options || CAST(:options AS JSONB),
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE job_id = :job_id
+            """), {'job_id': job_id, 'enabled': enabled, 'interval_seconds': interval_seconds,
+                   'options': json.dumps(options or {})}).rowcount
+        self._states_loaded_at = 0.0
+        self._wake.set()
+        return bool(updated)
+
+    # ------------------------------------------------------------------
+    # Uruchamianie zadań
+    # ------------------------------------------------------------------
+
+    def _acquire_job_lock(self, job: JobDefinition):
+        """Blokada doradcza zadania - pierwszy wolny z max_concurrency slotów (wspólnych dla procesów)"""
+        base_key = zlib.crc32(job.job_id.encode()) & 0x7FFFFF00
+        conn = self.engine.connect()
+        try:
+            for slot in range(job.max_concurrency):
+                key = base_key + slot
+                acquired = conn.execute(text("SELECT pg_try_advisory_lock(:namespace, :key)"),
+                                        {'namespace': JOB_LOCK_NAMESPACE, 'key': key}).scalar()
+                conn.commit()
+                if acquired:
+                    return conn, key
+        except Exception:
+            conn.close()
+            raise
+        conn.close()
+        return None, None
+
+    @staticmethod
+    def _release_job_lock(conn, key: int):
+        try:
+            conn.execute(text("SELECT pg_advisory_unlock(:namespace, :key)"),
+                         {'namespace': JOB_LOCK_NAMESPACE, 'key': key})
+            conn.commit()
+            conn.close()
+        except Exception as e:
+            # Blokada sesyjna zniknie razem z odrzuconym połączeniem
+            logger.warning(f"⚠️ Nie można zwolnić blokady zadania: {e}")
+            conn.invalidate()
+
+    def _record_run(self, job_id: str, started: bool, status: str, error: Optional[str] = None,
+                    result: Optional[Dict[str, Any]] = None):
+        try:
+            with self.engine.begin() as conn:
+                if started:
+                    conn.execute(text("""
+                        UPDATE scheduler_jobs
+                        SET last_started_at = CURRENT_TIMESTAMP, last_status = :status, last_host = :host
+                        WHERE job_id = :job_id
+                    """), {'job_id': job_id, 'status': status, 'host': self.host})
+                else:
+                    conn.execute(text("""
+                        UPDATE scheduler_jobs
+                        SET last_finished_at = CURRENT_TIMESTAMP, last_status = :status, last_error = :error,
+                            last_result = CAST(:result AS JSONB)
+                        WHERE job_id = :job_id
+                    """), {'job_id': job_id, 'status': status, 'error': error,
+                           'result': json.dumps(result or {}, default=_json_default)})
+        except Exception as e:
+            logger.warning(f"⚠️ Nie można zapisać przebiegu zadania {job_id}: {e}")
+        self._states_loaded_at = 0.0
+
+    def _record_metrics(self, job: JobDefinition, status: str, duration: float, items: Optional[int]):
+        """Dopisuje przebieg do histogramu i liczników oraz sprawdza, czy p95 nie przekracza interwału"""
+        bucket = bisect_left(DURATION_BUCKETS, duration) + 1  # tablice PostgreSQL liczone od 1
+        try:
+            with self.engine.begin() as conn:
+                durations = conn.execute(text("""
+                    UPDATE scheduler_job_metrics
+                    SET runs_total = runs_total + 1,
+                        failures_total = failures_total + CAST(:failed AS INTEGER),
+                        items_total = items_total + COALESCE(CAST(:items AS INTEGER), 0),
+                        duration_sum = duration_sum + CAST(:duration AS DOUBLE PRECISION),
+                        duration_buckets[CAST(:bucket AS INTEGER)] = duration_buckets[CAST(:bucket AS INTEGER)] + 1,
+                        recent_durations = (recent_durations || CAST(:duration AS DOUBLE PRECISION))[
+                            GREATEST(cardinality(recent_durations) + 2 - :sample_size, 1):cardinality(recent_durations) + 1],
+                        last_items = CAST(:items AS INTEGER),
+                        last_duration_seconds = CAST(:duration AS DOUBLE PRECISION),
+                        updated_at = CURRENT_TIMESTAMP
+                    WHERE job_id = :job_id
+                    RETURNING recent_durations
+                """), {'job_id': job.job_id, 'failed': int(status == 'failed'), 'items': items,
+                       'duration': duration, 'bucket': bucket, 'sample_size': DURATION_SAMPLE_SIZE}).scalar()
+        except Exception as e:
+            logger.warning(f"⚠️ Nie można zapisać metryk zadania {job.job_id}: {e}")
+            return
+        self._check_overrun(job, durations or [])
+
+    def _record_skip(self, job_id: str, kind: str, reason: str):
+        """Zlicza pominięte uruchomienie: 'skipped' (poprzednie wciąż trwa) lub 'misfired' (spóźnione)"""
+        try:
+            with self.engine.begin() as conn:
+                conn.execute(text("""
+                    UPDATE scheduler_job_metrics
+                    SET skipped_total = skipped_total + CAST(:skipped AS INTEGER),
+                        misfired_total = misfired_total + CAST(:misfired AS INTEGER),
+                        last_skipped_at = CURRENT_TIMESTAMP,
+                        last_skip_reason = :reason,
+                        updated_at = CURRENT_TIMESTAMP
+                    WHERE job_id = :job_id
+                """), {'job_id': job_id, 'skipped': int(kind == 'skipped'), 'misfired': int(kind == 'misfired'),
+                       'reason': reason})
+        except Exception as e:
+            logger.warning(f"⚠️ Nie można zapisać pominięcia zadania {job_id}: {e}")
+
+    def _interval_seconds(self, job: JobDefinition) -> int:
+        try:
+            return int(self.job_state(job.job_id).get('interval_seconds') or job.interval_seconds)
+        except Exception:
+            return job.interval_seconds
+
+    def _check_overrun(self, job: JobDefinition, durations: List[float]):
+        """Ostrzega (raz na przejście stanu), gdy p95 czasu trwania przekracza interwał zadania"""
+        p95 = _percentile(durations, 95)
+        interval = self._interval_seconds(job)
+        if p95 is not None and p95 > interval:
+            if job.job_id not in self._overrunning:
+                self._overrunning.add(job.job_id)
+                logger.warning(f"⚠️ Zadanie {job.job_id}: p95 czasu trwania {p95:.1f}s przekracza interwał "
+                               f"{interval}s - kolejne uruchomienia będą pomijane")
+        elif job.job_id in self._overrunning:
+            self._overrunning.discard(job.job_id)
+            logger.info(f"✅ Zadanie {job.job_id}: p95 czasu trwania ponownie mieści się w interwale {interval}s")
+
+    def _on_scheduler_event(self, event):
+        """Uruchomienia pominięte przez BackgroundScheduler (nie docierają do run_job)"""
+        if event.code == EVENT_JOB_MISSED:
+            logger.warning(f"⚠️ Zadanie {event.job_id} pominięte - opóźnienie przekroczyło misfire_grace_time")
+            self._record_skip(event.job_id, 'misfired', 'Opóźnienie przekroczyło misfire_grace_time')
+        elif event.code == EVENT_JOB_MAX_INSTANCES:
+            logger.warning(f"⚠️ Zadanie {event.job_id} pominięte - poprzednie uruchomienie wciąż trwa")
+            self._record_skip(event.job_id, 'skipped', 'Poprzednie uruchomienie wciąż trwa (max_instances)')
+
+    def job_metrics(self) -> Dict[str, Dict[str, Any]]:
+        """Metryki przebiegów wszystkich zadań (liczniki, histogram, percentyle, przekroczenie interwału)"""
+        self._ensure_tables()
+        with self.engine.connect() as conn:
+            rows = conn.execute(text("SELECT * FROM scheduler_job_metrics")).mappings().all()
+        metrics = {}
+        for row in rows:
+            job = self._jobs.get(row['job_id'])
+            if job is None:
+                continue
+            durations = list(row['recent_durations'] or [])
+            p95 = _percentile(durations, 95)
+            interval = self._interval_seconds(job)
+            metrics[job.job_id] = {
+                'runs': row['runs_total'],
+                'failures': row['failures_total'],
+                'skipped': row['skipped_total'],
+                'misfired': row['misfired_total'],
+                'items_total': row['items_total'],
+                'last_items': row['last_items'],
+                'last_duration_seconds': row['last_duration_seconds'],
+                'duration_sum_seconds': row['duration_sum'],
+                'duration_buckets': {
+                    **{str(bound): count for bound, count in zip(DURATION_BUCKETS, row['duration_buckets'])},
+                    '+Inf': row['duration_buckets'][-1] if len(row['duration_buckets']) > len(DURATION_BUCKETS) else 0
+                },
+                'p50_seconds': _percentile(durations, 50),
+                'p95_seconds': p95,
+                'interval_seconds': interval,
+                'overrun': p95 is not None and p95 > interval,
+                'last_skipped_at': row['last_skipped_at'],
+                'last_skip_reason': row['last_skip_reason']
+            }
+        return metrics
+
+    def prometheus_metrics(self) -> str:
+        """Metryki zadań w formacie tekstowym Prometheus (exposition format 0.0.4)"""
+        states = self.job_states()
+        metrics = self.job_metrics()
+        families = [
+            ('runs_total', 'counter', 'Zakończone uruchomienia zadania', 'runs'),
+            ('failures_total', 'counter', 'Uruchomienia zakończone błędem', 'failures'),
+            ('skipped_total', 'counter', 'Uruchomienia pominięte, bo poprzednie wciąż trwało', 'skipped'),
+            ('misfired_total', 'counter', 'Uruchomienia pominięte po przekroczeniu misfire_grace_time', 'misfired'),
+            ('items_total', 'counter', 'Elementy przetworzone przez zadanie', 'items_total'),
+            ('duration_p95_seconds', 'gauge', 'p95 czasu trwania z ostatnich uruchomień', 'p95_seconds'),
+            ('interval_seconds', 'gauge', 'Skonfigurowany interwał zadania', 'interval_seconds'),
+            ('overrun', 'gauge', '1 gdy p95 czasu trwania przekracza interwał', 'overrun'),
+        ]
+        lines = []
+        for suffix, metric_type, description, key in families:
+            name = f"{METRICS_PREFIX}_{suffix}"
+            lines += [f"# HELP {name} {description}", f"# TYPE {name} {metric_type}"]
+            for job_id, job_metrics in metrics.items():
+                value = job_metrics[key]
+                if value is not None:
+                    lines.append(f'{name}{{job="{job_id}"}} {float(value)}')
+
+        name = f"{METRICS_PREFIX}_enabled"
+        lines += [f"# HELP {name} 1 gdy zadanie jest włączone w harmonogramie", f"# TYPE {name} gauge"]
+        for job_id in self._jobs:
+            lines.append(f'{name}{{job="{job_id}"}} {float(bool(states.get(job_id, {}).get("enabled")))}')
+
+        name = f"{METRICS_PREFIX}_last_started_timestamp_seconds"
+        lines += [f"# HELP {name} Czas rozpoczęcia ostatniego uruchomienia", f"# TYPE {name} gauge"]
+        for job_id in self._jobs:
+            started_at = states.get(job_id, {}).get('last_started_at')
+            if started_at:
+                lines.append(f'{name}{{job="{job_id}"}} {started_at.timestamp()}')
+
+        name = f"{METRICS_PREFIX}_duration_seconds"
+        lines += [f"# HELP {name} Czas trwania uruchomień zadania", f"# TYPE {name} histogram"]
+        for job_id, job_metrics in metrics.items():
+            cumulative = 0
+            for bound, count in job_metrics['duration_buckets'].items():
+                cumulative += count
+                lines.append(f'{name}_bucket{{job="{job_id}",le="{bound}"}} {cumulative}')
+            lines.append(f'{name}_sum{{job="{job_id}"}} {job_metrics["duration_sum_seconds"]}')
+            lines.append(f'{name}_count{{job="{job_id}"}} {job_metrics["runs"]}')
+        return "\n".join(lines) + "\n"
+
+    def run_job(self, job_id: str, trigger: str = 'schedule', options: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Uruchamia zadanie w bieżącym wątku z limitami współbieżności
+
+        Args:
+            job_id: Identyfikator z katalogu
+            trigger: 'schedule' (z harmonogramu lidera) lub 'manual'
+            options: Opcje nadpisujące zapisane (np. dłuższy days_back przy ręcznym uruchomieniu)
+
+        Returns:
+            {'status': completed / failed / skipped, 'result', 'error', 'duration_seconds'}
+        """
+        job = self._jobs.get(job_id)
+        if job is None:
+            return {'status': 'failed', 'error': f'Nieznane zadanie: {job_id}'}
+
+        if trigger == 'schedule':
+            if not self.is_enabled(job_id):
+                return {'status': 'skipped', 'error': 'Zadanie wyłączone'}
+            if job.active_hours and not (job.active_hours[0] <= datetime.now().hour <= job.active_hours[1]):
+                logger.debug(f"⏰ Pomijam {job_id} poza godzinami {job.active_hours[0]}-{job.active_hours[1]}")
+                return {'status': 'skipped', 'error': 'Poza godzinami działania zadania'}
+
+        slot = self._slots[job_id]
+        if not slot.acquire(blocking=False):
+            self._record_skip(job_id, 'skipped', 'Osiągnięto limit równoległych uruchomień')
+            return {'status': 'skipped', 'error': 'Osiągnięto limit równoległych uruchomień'}
+        try:
+            lock_conn, lock_key = self._acquire_job_lock(job)
+            if lock_conn is None:
+                logger.info(f"⏭️ Zadanie {job_id} już działa w innym procesie - pomijam")
+                self._record_skip(job_id, 'skipped', 'Zadanie już działa w innym procesie')
+                return {'status': 'skipped', 'error': 'Zadanie już działa w innym procesie'}
+            try:
+                run_options = {**self.job_options(job_id), **(options or {})}
+                self._record_run(job_id, started=True, status='running')
+                started = time.monotonic()
+                try:
+                    result = job.func(run_options) or {}
+                    status, error = 'completed', None
+                except Exception as e:
+                    logger.error(f"❌ Zadanie {job_id} zakończone błędem: {e}")
+                    result, status, error = {}, 'failed', str(e)
+                duration = time.monotonic() - started
+                self._record_run(job_id, started=False, status=status, error=error, result=result)
+                self._record_metrics(job, status, duration, _result_items(job, result))
+                logger.info(f"⏱️ Zadanie {job_id} ({trigger}): {status} w {duration:.1f}s")
+                return {'status': status, 'result': result, 'error': error,
+                        'duration_seconds': round(duration, 3)}
+            finally:
+                self._release_job_lock(lock_conn, lock_key)
+        finally:
+            slot.release()
+
+    # ------------------------------------------------------------------
+    # Lider
+    # ------------------------------------------------------------------
+
+    @property
+    def is_leader(self) -> bool:
+        return self._leader_conn is not None
+
+    def _ensure_leader(self) -> bool:
+        """Blokada doradcza na dedykowanym połączeniu - harmonogram działa tylko w jednym procesie"""
+        if self._leader_conn is not None:
+            # Zerwane połączenie oznacza utratę blokady
+            try:
+                self._leader_conn.execute(text("SELECT 1"))
+                self._leader_conn.commit()
+                return True
+            except Exception:
+                self._release_leader()
+        conn = self.engine.connect()
+        try:
+            acquired = conn.execute(text("SELECT pg_try_advisory_lock(:key)"), {'key': SCHEDULER_LOCK_KEY}).scalar()
+            conn.commit()
+        except Exception:
+            conn.close()
+            raise
+        if not acquired:
+            conn.close()
+            return False
+        self._leader_conn = conn
+        logger.info(f"⏰ Harmonogram zadań aktywny w tym procesie ({self.host})")
+        return True
+
+    def _release_leader(self):
+        if self._leader_conn is not None:
+            try:
+                self._leader_conn.close()
+            except Exception:
+                pass
+            self._leader_conn = None
+
+    def _sync_schedule(self):
+        """Dopasowuje zadania w BackgroundScheduler do stanu w scheduler_jobs"""
+        states = self.job_states(fresh=True)
+        if self._scheduler is None:
+            self._scheduler = BackgroundScheduler(executors={'default': ThreadPoolExecutor(MAX_WORKERS)},
+                                                  job_defaults={'coalesce': True})
+            self._scheduler.add_listener(self._on_scheduler_event, EVENT_JOB_MISSED | EVENT_JOB_MAX_INSTANCES)
+            self._scheduler.start()
+
+        for job_id, job in self._jobs.items():
+            state = states.get(job_id, {})
+            interval = int(state.get('interval_seconds') or job.interval_seconds)
+            scheduled = self._scheduled.get(job_id)
+            if state.get('enabled'):
+                if scheduled == interval:
+                    continue
+                extra = {'next_run_time': datetime.now()} if job.run_on_enable and scheduled is None else {}
+                self._scheduler.add_job(
+                    func=self.run_job,
+                    trigger=IntervalTrigger(seconds=interval),
+                    args=[job_id],
+                    id=job_id,
+                    name=job.name,
+                    replace_existing=True,
+                    max_instances=job.max_concurrency,
+                    coalesce=True,
+                    misfire_grace_time=job.misfire_grace_seconds,
+                    **extra
+                )
+                self._scheduled[job_id] = interval
+                logger.info(f"📅 Zadanie {job_id} zaplanowane co {interval}s")
+            elif scheduled is not None:
+                try:
+                    self._scheduler.remove_job(job_id)
+                except Exception:
+                    pass
+                del self._scheduled[job_id]
+                logger.info(f"🛑 Zadanie {job_id} wyłączone")
+
+        self._publish_next_runs()
+
+    def _publish_next_runs(self):
+        """Zapisuje terminy następnych uruchomień, żeby widziały je wszystkie procesy"""
+        rows = []
+        for job_id in self._scheduled:
+            job = self._scheduler.get_job(job_id)
+            if job and job.next_run_time:
+                rows.append({'job_id': job_id, 'next_run_at': job.next_run_time.replace(tzinfo=None).isoformat()})
+        with self.engine.begin() as conn:
+            conn.execute(text("""
+                UPDATE scheduler_jobs j
+                SET next_run_at = r.next_run_at
+                FROM (
+                    SELECT s.job_id, n.next_run_at
+                    FROM scheduler_jobs s
+                    LEFT JOIN jsonb_to_recordset(CAST(:rows AS JSONB)) AS n(job_id TEXT, next_run_at TIMESTAMP)
+                      ON n.job_id = s.job_id
+                ) r
+                WHERE j.job_id = r.job_id AND j.next_run_at IS DISTINCT FROM r.next_run_at
+            """), {'rows': json.dumps(rows)})
+
+    def _shutdown_scheduler(self):
+        if self._scheduler is not None:
+            try:
+                self._scheduler.shutdown(wait=False)
+            except Exception:
+                pass
+            self._scheduler = None
+            self._scheduled.clear()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                if self._ensure_leader():
+                    self._sync_schedule()
+                else:
+                    self._shutdown_scheduler()
+            except Exception as e:
+                logger.error(f"❌ Błąd serwisu harmonogramu: {e}")
+                self._shutdown_scheduler()
+                self._release_leader()
+            self._wake.wait(LEADER_RETRY_SECONDS)
+            self._wake.clear()
+        self._shutdown_scheduler()
+        self._release_leader()
+
+    def start(self, dedicated: bool = False) -> bool:
+        """
+        Uruchamia wątek kandydujący na lidera
+
+        Args:
+            dedicated: Wywołanie z osobnego procesu harmonogramu (tryb external)
+        """
+        if self.mode == 'off' or (self.mode == 'external' and not dedicated):
+            logger.info(f"⏸️ Harmonogram zadań nie działa w tym procesie (SCHEDULER_MODE={self.mode})")
+            return False
+        if self._thread and self._thread.is_alive():
+            return True
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='scheduler-service', daemon=True)
+        self._thread.start()
+        return True
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout=15)
+
+    def status(self) -> Dict[str, Any]:
+        """Tryb, lider, stan i metryki wszystkich zadań katalogu"""
+        states = self.job_states()
+        try:
+            metrics = self.job_metrics()
+        except Exception as e:
+            logger.warning(f"⚠️ Nie można odczytać metryk zadań: {e}")
+            metrics = {}
+        jobs = []
+        warnings = []
+        for job_id, job in self._jobs.items():
+            state = states.get(job_id, {})
+            jobs.append({
+                'job_id': job_id,
+                'name': job.name,
+                'enabled': bool(state.get('enabled')),
+                'interval_seconds': state.get('interval_seconds', job.interval_seconds),
+                'max_concurrency': job.max_concurrency,
+                'active_hours': list(job.active_hours) if job.active_hours else None,
+                'options': self.job_options(job_id),
+                'next_run_at': state.get('next_run_at'),
+                'last_started_at': state.get('last_started_at'),
+                'last_finished_at': state.get('last_finished_at'),
+                'last_status': state.get('last_status'),
+                'last_error': state.get('last_error'),
+                'last_host': state.get('last_host'),
+                'metrics': metrics.get(job_id, {})
+            })
+            job_metrics = metrics.get(job_id, {})
+            if job_metrics.get('overrun'):
+                warnings.append(f"{job_id}: p95 czasu trwania {job_metrics['p95_seconds']:.1f}s "
+                                f"przekracza interwał {job_metrics['interval_seconds']}s")
+        return {
+            'mode': self.mode,
+            'host': self.host,
+            'is_leader': self.is_leader,
+            'max_workers': MAX_WORKERS,
+            'jobs': jobs,
+            'warnings': warnings
+        }
+
+
+# ----------------------------------------------------------------------
+# Katalog zadań (importy leniwe - moduły schedulerów importują ten moduł)
+# ----------------------------------------------------------------------
+
+QUOTES_SCRAPE_JOB = 'quotes_scrape'
+ESPI_SCRAPE_JOB = 'espi_scrape'
+NEWS_SCRAPE_JOB = 'news_scrape'
+PRICE_ALERTS_JOB = 'price_alerts_check'
+RECOMMENDATION_EVALUATION_JOB = 'recommendation_evaluation'
+RECOMMENDATION_ROLLUPS_JOB = 'recommendation_rollups'
+
+
+def _scrape_quotes(options: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    from scheduler.multi_ticker_scheduler import get_multi_scheduler
+    return get_multi_scheduler().scrape_job()
+
+
+def _scrape_espi(options: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    from scheduler.espi_scheduler import get_espi_scheduler
+    return get_espi_scheduler().communication_scraping_job(days_back=options.get('days_back', 2))
+
+
+def _scrape_news(options: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    from scheduler.news_scheduler import get_news_scheduler
+    return get_news_scheduler().news_scraping_job(days_back=options.get('days_back', 1))
+
+
+def _check_price_alerts(options: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    from price_alerts import get_price_alert_system
+    return get_price_alert_system().check_alerts()
+
+
+def _evaluate_recommendations(options: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    from workers.recommendation_tracker import get_recommendation_tracker
+    return get_recommendation_tracker().auto_evaluate_active_recommendations()
+
+
+def _rebuild_recommendation_rollups(options: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    from workers.recommendation_tracker import get_recommendation_tracker
+    return get_recommendation_tracker().rebuild_rollups(days_back=options.get('days_back', 2))
+
+
+DEFAULT_JOBS = [
+    JobDefinition(QUOTES_SCRAPE_JOB, 'Scrapowanie notowań', _scrape_quotes, interval_seconds=60,
+                  items_key='success'),
+    JobDefinition(ESPI_SCRAPE_JOB, 'Komunikaty ESPI/EBI', _scrape_espi, interval_seconds=3600,
+                  run_on_enable=True, options={'days_back': 2}, items_key='total'),
+    JobDefinition(NEWS_SCRAPE_JOB, 'Newsy finansowe', _scrape_news, interval_seconds=1800,
+                  options={'days_back': 1}, items_key='total'),
+    JobDefinition(PRICE_ALERTS_JOB, 'Sprawdzanie alertów cenowych', _check_price_alerts, interval_seconds=300,
+                  items_key='checked'),
+    JobDefinition(RECOMMENDATION_EVALUATION_JOB, 'Ocena rekomendacji', _evaluate_recommendations,
+                  interval_seconds=3600, active_hours=(9, 18), items_key='evaluated_count'),
+    JobDefinition(RECOMMENDATION_ROLLUPS_JOB, 'Przeliczenie rollupów statystyk rekomendacji',
+                  _rebuild_recommendation_rollups, interval_seconds=24 * 3600, misfire_grace_seconds=3600,
+                  options={'days_back': 2}, items_key='daily_rows'),
+]
+
+_service: Optional[SchedulerService] = None
+_service_lock = threading.Lock()
+
+
+def get_scheduler_service() -> SchedulerService:
+    """Zwraca współdzielony w procesie serwis harmonogramu z domyślnym katalogiem zadań"""
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = SchedulerService()
+            for job in DEFAULT_JOBS:
+                _service.register(job)
+        return _service
+
+
+def start_scheduler_service(dedicated: bool = False) -> bool:
+    """Uruchamia kandydowanie na lidera harmonogramu w tym procesie"""
+    try:
+        return get_scheduler_service().start(dedicated)
+    except Exception as e:
+        logger.warning(f"⚠️ Nie można uruchomić serwisu harmonogramu: {e}")
+        return False
+
+
+def main():
+    """Osobny proces harmonogramu (SCHEDULER_MODE=external)"""
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    service = get_scheduler_service()
+    if not service.start(dedicated=True):
+        return
+    logger.info("🚀 Proces harmonogramu uruchomiony - Ctrl+C kończy")
+    try:
+        while True:
+            time.sleep(60)
+    except KeyboardInterrupt:
+        service.stop()
+
+
+if __name__ == "__main__":
+    main()
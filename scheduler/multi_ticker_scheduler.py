@@ -5,24 +5,25 @@ import os
 import json
 import sys
 from datetime import datetime, timedelta
-from apscheduler.schedulers.background import BackgroundScheduler
-from apscheduler.triggers.interval import IntervalTrigger
+
+from sqlalchemy import text
 
 # Dodanie ścieżki do workers
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'workers'))
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 
 from bankier_scraper import BankierScraper
+from scheduler.job_runner import QUOTES_SCRAPE_JOB, get_scheduler_service
+from scheduler.scrape_priority import AdaptiveScrapePlanner, staleness_report
+from utils.ticker_registry import invalidate_ticker_registry
 
 
 class MultiTickerScheduler:
     def __init__(self):
-        self.scheduler = BackgroundScheduler()
         self.config = self.load_config()
-        self.is_running = False
         
         # Inicjalizuj scraper do pobierania tickerów z bazy
         try:
-            settings = self.config.get('scraping_settings', {})
             self.scraper = BankierScraper(
                 use_selenium=False,  # Do pobierania listy tickerów nie trzeba Selenium
                 headless=True
@@ -30,6 +31,28 @@ class MultiTickerScheduler:
         except Exception as e:
             print(f"⚠️ Błąd inicjalizacji scrapera: {e}")
             self.scraper = None
+        
+        # Planer interwałów per ticker (płynność, zmienność, otwarte rekomendacje i alerty)
+        settings = self.config.get('scraping_settings', {})
+        self.planner = AdaptiveScrapePlanner(
+            engine=self.scraper.engine if self.scraper else None,
+            base_interval_minutes=settings.get('interval_minutes', 3),
+            max_interval_minutes=settings.get('max_interval_minutes', 30),
+            max_requests_per_minute=settings.get('max_requests_per_minute', 30)
+        )
+        self._status_table_ready = False
+    
+    @property
+    def is_running(self):
+        """Czy zadanie scrapowania jest włączone we wspólnym harmonogramie (stan z bazy)"""
+        return get_scheduler_service().is_enabled(QUOTES_SCRAPE_JOB)
+    
+    def _job_interval_seconds(self):
+        """W trybie adaptacyjnym zadanie budzi się co tick_seconds i scrapuje tylko należne tickery"""
+        settings = self.config['scraping_settings']
+        if settings.get('adaptive', True):
+            return int(settings.get('tick_seconds', 60))
+        return int(settings['interval_minutes'] * 60)
     
     def load_config(self):
         """Ładuje konfigurację tickerów z pliku JSON"""
@@ -66,10 +89,16 @@ class MultiTickerScheduler:
             "scraping_settings": {
                 "interval_minutes": 15,
                 "use_selenium": True,
-                    "headless": True,
-                    "max_retries": 3
-                }
+                "headless": True,
+                "max_retries": 3,
+                "browser_workers": 4,
+                "pages_per_browser": 50,
+                "adaptive": True,
+                "tick_seconds": 60,
+                "max_interval_minutes": 30,
+                "max_requests_per_minute": 30
             }
+        }
     
     def save_config(self):
         """Zapisuje konfigurację do pliku JSON"""
@@ -127,6 +156,7 @@ class MultiTickerScheduler:
                                 'updated_at': datetime.utcnow()
                             })
                             conn.commit()
+                            invalidate_ticker_registry()
                             print(f"Aktywowano istniejący ticker: {ticker}")
                             return True
                         else:
@@ -146,6 +176,7 @@ class MultiTickerScheduler:
                             'updated_at': datetime.utcnow()
                         })
                         conn.commit()
+                        invalidate_ticker_registry()
                         print(f"Dodano nowy ticker do bazy: {ticker}")
                         return True
                         
@@ -193,6 +224,7 @@ class MultiTickerScheduler:
                             'updated_at': datetime.utcnow()
                         })
                         conn.commit()
+                        invalidate_ticker_registry()
                         print(f"Deaktywowano ticker w bazie: {ticker}")
                         return True
                     elif existing and not existing[1]:
@@ -237,18 +269,23 @@ class MultiTickerScheduler:
         self.config['scraping_settings']['interval_minutes'] = minutes
         self.save_config()
         
-        # Restart schedulera jeśli jest uruchomiony
-        if self.is_running:
-            success = self.restart()
-            if success:
-                print(f"Zaktualizowano interwał na {minutes} minut i restartowano scheduler")
-            else:
-                print(f"Zaktualizowano interwał na {minutes} minut ale błąd restartu schedulera")
-        else:
+        # Interwał bazowy planera - przeliczenie interwałów tickerów przy najbliższym cyklu
+        self.planner.set_base_interval(minutes)
+        
+        # Nowy interwał zadania - harmonogram przeplanuje je przy najbliższej synchronizacji
+        try:
+            get_scheduler_service().set_job(QUOTES_SCRAPE_JOB, interval_seconds=self._job_interval_seconds())
             print(f"Zaktualizowano interwał na {minutes} minut")
+        except Exception as e:
+            print(f"Zaktualizowano interwał na {minutes} minut ale błąd aktualizacji harmonogramu: {e}")
     
     def scrape_job(self):
-        """Funkcja wykonywana przez scheduler - scrapuje wszystkie aktywne tickery"""
+        """
+        Funkcja wykonywana przez harmonogram - scrapuje aktywne (w trybie adaptacyjnym należne) tickery
+        
+        Returns:
+            Podsumowanie przebiegu (None gdy nic nie scrapowano)
+        """
         try:
             # Sprawdź czy scheduler nie został zatrzymany w międzyczasie
             if not self.is_running:
@@ -279,7 +316,10 @@ class MultiTickerScheduler:
                 try:
                     self.scraping_scraper = BankierScraper(
                         use_selenium=settings.get('use_selenium', True),
-                        headless=settings.get('headless', True)
+                        headless=settings.get('headless', True),
+                        browser_workers=settings.get('browser_workers', 4),
+                        pages_per_browser=settings.get('pages_per_browser', 50),
+                        use_http=settings.get('use_http', True)
                     )
                 except Exception as e:
                     print(f"Błąd inicjalizacji scrapera: {e}")
@@ -290,7 +330,25 @@ class MultiTickerScheduler:
                 print("Scheduler zatrzymany przed rozpoczęciem scrapowania")
                 return
             
-            results = self.scraping_scraper.scrape_multiple_tickers(active_tickers)
+            if settings.get('adaptive', True):
+                # Tylko tickery, których termin minął, w granicach budżetu zapytań
+                self.planner.sync_tickers(active_tickers)
+                due_tickers = self.planner.take_due()
+                if not due_tickers:
+                    print("Brak tickerów z minionym terminem odświeżenia")
+                    return
+                
+                try:
+                    results = self.scraping_scraper.scrape_multiple_tickers(due_tickers)
+                except Exception:
+                    self.planner.requeue(due_tickers)
+                    raise
+                self.planner.record_results(due_tickers, results['success'])
+            else:
+                results = self.scraping_scraper.scrape_multiple_tickers(active_tickers)
+            
+            # Stan planera i statystyki pobierania zna tylko lider - zapis dla pozostałych workerów
+            self._save_shared_status()
             
             # Sprawdź czy nadal działamy przed wypisaniem wyników
             if self.is_running:
@@ -301,6 +359,20 @@ class MultiTickerScheduler:
                 if results['failed']:
                     print(f"  Błędy dla: {', '.join(results['failed'])}")
                 
+                # Przebieg dłuższy niż interwał - kolejne uruchomienia będą pomijane (max_instances=1)
+                budget_seconds = (settings.get('tick_seconds', 60) if settings.get('adaptive', True)
+                                  else settings['interval_minutes'] * 60)
+                if results.get('elapsed_seconds', 0) > budget_seconds:
+                    print(f"⚠️ Scrapowanie trwało {results['elapsed_seconds']}s - dłużej niż interwał {budget_seconds}s. "
+                          f"Zwiększ browser_workers lub interval_minutes")
+            
+            return {
+                'success': len(results['success']),
+                'failed': len(results['failed']),
+                'failed_tickers': results['failed'],
+                'elapsed_seconds': results.get('elapsed_seconds')
+            }
+                
         except Exception as e:
             print(f"Błąd podczas cyklicznego scrapowania: {e}")
             
@@ -311,170 +383,182 @@ class MultiTickerScheduler:
                     self.scraping_scraper = None
                 except:
                     pass
+            raise
     
     def start(self):
-        """Uruchamia cykliczne scrapowanie"""
+        """Włącza cykliczne scrapowanie we wspólnym harmonogramie"""
         if self.is_running:
             print("Scheduler już jest uruchomiony")
             return False
         
         try:
-            # Bezpieczne zamknięcie poprzedniego schedulera jeśli istnieje
-            if hasattr(self, 'scheduler') and self.scheduler:
-                try:
-                    if self.scheduler.running:
-                        self.scheduler.shutdown(wait=False)
-                except:
-                    pass
-            
-            # Utworzenie nowego schedulera
-            self.scheduler = BackgroundScheduler()
-            
-            interval_minutes = self.config['scraping_settings']['interval_minutes']
+            settings = self.config['scraping_settings']
+            interval_minutes = settings['interval_minutes']
             
             # Sprawdzenie czy interwał nie jest zbyt krótki
             if interval_minutes < 3:
                 print(f"⚠️ Ostrzeżenie: Interwał {interval_minutes} min może być zbyt krótki. Zalecane minimum: 3 min")
             
-            # Dodanie zadania do schedulera
-            self.scheduler.add_job(
-                func=self.scrape_job,
-                trigger=IntervalTrigger(minutes=interval_minutes),
-                id='multi_ticker_scrape',
-                name='Multi Ticker Scraping',
-                replace_existing=True,
-                max_instances=1,  # Tylko jedna instancja na raz
-                coalesce=True,    # Jeśli zadanie się opóźni, nie uruchamiaj kolejnego
-                misfire_grace_time=30  # 30 sekund tolerancji na opóźnienie
-            )
-            
-            # Uruchomienie schedulera
-            self.scheduler.start()
-            self.is_running = True
+            if not get_scheduler_service().set_job(QUOTES_SCRAPE_JOB, enabled=True,
+                                                   interval_seconds=self._job_interval_seconds()):
+                return False
             
-            print(f"Cykliczne scrapowanie uruchomione (interwał: {interval_minutes} min)")
+            mode = "adaptacyjny" if settings.get('adaptive', True) else "stały"
+            print(f"Cykliczne scrapowanie uruchomione (interwał bazowy: {interval_minutes} min, tryb: {mode})")
             print(f"Aktywne tickery: {', '.join(self.get_active_tickers())}")
             
             return True
-            
+        
         except Exception as e:
             print(f"Błąd podczas uruchamiania schedulera: {e}")
-            self.is_running = False
             return False
     
     def stop(self):
-        """Zatrzymuje cykliczne scrapowanie"""
+        """Wyłącza cykliczne scrapowanie we wspólnym harmonogramie"""
         if not self.is_running:
             print("Scheduler nie jest uruchomiony")
             return False
         
         try:
-            # Oznacz jako zatrzymany przed shutdown
-            self.is_running = False
-            
-            # Usuń wszystkie zadania przed shutdown
-            if hasattr(self, 'scheduler') and self.scheduler:
-                if self.scheduler.running:
-                    try:
-                        self.scheduler.remove_all_jobs()
-                    except:
-                        pass
-                    
-                    # Zatrzymaj scheduler bez oczekiwania na zadania
-                    try:
-                        self.scheduler.shutdown(wait=False)
-                    except:
-                        pass
+            get_scheduler_service().set_job(QUOTES_SCRAPE_JOB, enabled=False)
             
-            # Zamknięcie scraperow
+            # Zamknięcie scrapera cyklicznego w tym procesie
             if hasattr(self, 'scraping_scraper') and self.scraping_scraper:
                 try:
                     self.scraping_scraper.close()
                 except:
                     pass
                 self.scraping_scraper = None
-                
-            if self.scraper:
-                try:
-                    self.scraper.close()
-                except:
-                    pass
-                self.scraper = None
             
             print("Cykliczne scrapowanie zatrzymane")
             return True
-            
+        
         except Exception as e:
             print(f"Błąd podczas zatrzymywania schedulera: {e}")
-            self.is_running = False
             return False
     
     def restart(self):
-        """Bezpieczny restart schedulera"""
+        """Ponowne zaplanowanie zadania z bieżącą konfiguracją"""
         try:
-            print("Restartowanie schedulera...")
-            was_running = self.is_running
-            
-            if was_running:
-                self.stop()
-                
-            # Krótka przerwa żeby wszystko się wyczyściło
-            import time
-            time.sleep(2)
-            
-            if was_running:
-                return self.start()
-            else:
+            if not self.is_running:
                 print("Scheduler nie był uruchomiony - brak restartu")
                 return True
-                
+            return get_scheduler_service().set_job(QUOTES_SCRAPE_JOB, interval_seconds=self._job_interval_seconds())
         except Exception as e:
             print(f"Błąd podczas restartu schedulera: {e}")
             return False
     
     def safe_shutdown(self):
-        """Bezpieczne zamknięcie schedulera z obsługą błędów"""
+        """Zamyka scrapery tego procesu (stan zadania w harmonogramie pozostaje bez zmian)"""
         try:
-            if self.is_running and self.scheduler.running:
-                # Usuń wszystkie zadania
-                self.scheduler.remove_all_jobs()
-                
-                # Zatrzymaj scheduler
-                self.scheduler.shutdown(wait=True)
-                
-            self.is_running = False
-            
-            # Zamknij wszystkie scrapery
             if hasattr(self, 'scraping_scraper') and self.scraping_scraper:
                 try:
                     self.scraping_scraper.close()
                 except:
                     pass
                 self.scraping_scraper = None
-                
+            
             if self.scraper:
                 try:
                     self.scraper.close()
                 except:
                     pass
                 self.scraper = None
-                
+            
             print("Scheduler bezpiecznie zamknięty")
             return True
-            
+        
         except Exception as e:
             print(f"Błąd podczas bezpiecznego zamykania: {e}")
-            self.is_running = False
             return False
     
+    def _ensure_status_table(self, conn):
+        if self._status_table_ready:
+            return
+        conn.execute(text("""
+            CREATE TABLE IF NOT EXISTS quote_scrape_status (
+                id SMALLINT PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+                tickers JSONB NOT NULL DEFAULT '[]',
+                fetch_stats JSONB,
+                selenium_fallback_rate DOUBLE PRECISION,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """))
+        self._status_table_ready = True
+    
+    def _save_shared_status(self):
+        """Zapisuje stan planera i statystyki pobierania (wywoływane przez lidera po każdym cyklu)"""
+        engine = self.planner.engine
+        scraping_scraper = getattr(self, 'scraping_scraper', None)
+        if not engine:
+            return
+        try:
+            with engine.begin() as conn:
+                self._ensure_status_table(conn)
+                conn.execute(text("""
+                    INSERT INTO quote_scrape_status (id, tickers, fetch_stats, selenium_fallback_rate, updated_at)
+                    VALUES (1, CAST(:tickers AS JSONB), CAST(:fetch_stats AS JSONB), :fallback_rate, CURRENT_TIMESTAMP)
+                    ON CONFLICT (id) DO UPDATE SET
+                        tickers = EXCLUDED.tickers,
+                        fetch_stats = EXCLUDED.fetch_stats,
+                        selenium_fallback_rate = EXCLUDED.selenium_fallback_rate,
+                        updated_at = EXCLUDED.updated_at
+                """), {
+                    'tickers': json.dumps(self.planner.snapshot()),
+                    'fetch_stats': json.dumps(dict(scraping_scraper.fetch_stats)) if scraping_scraper else None,
+                    'fallback_rate': scraping_scraper.fallback_rate() if scraping_scraper else None
+                })
+        except Exception as e:
+            print(f"⚠️ Nie można zapisać stanu scrapowania: {e}")
+    
+    def _load_shared_status(self):
+        """Stan zapisany przez lidera (None, gdy brak zapisu lub bazy)"""
+        engine = self.planner.engine
+        if not engine:
+            return None
+        try:
+            with engine.begin() as conn:
+                self._ensure_status_table(conn)
+                row = conn.execute(text("""
+                    SELECT tickers, fetch_stats, selenium_fallback_rate, updated_at
+                    FROM quote_scrape_status WHERE id = 1
+                """)).mappings().fetchone()
+            return dict(row) if row else None
+        except Exception as e:
+            print(f"⚠️ Nie można odczytać stanu scrapowania: {e}")
+            return None
+    
     def status(self):
-        """Zwraca status schedulera"""
+        """
+        Zwraca status schedulera
+        
+        Nieaktualność tickerów i statystyki pobierania pochodzą z bazy (zapis lidera), więc są
+        takie same niezależnie od workera obsługującego żądanie; bez zapisu - stan tego procesu.
+        """
+        scraping_scraper = getattr(self, 'scraping_scraper', None)
+        is_running = self.is_running
+        shared = self._load_shared_status()
+        if shared:
+            ticker_staleness = staleness_report(shared['tickers'])
+            fetch_stats = shared['fetch_stats']
+            fallback_rate = shared['selenium_fallback_rate']
+            stats_updated_at = shared['updated_at'].isoformat() if shared['updated_at'] else None
+        else:
+            ticker_staleness = self.planner.status()
+            fetch_stats = dict(scraping_scraper.fetch_stats) if scraping_scraper else None
+            fallback_rate = scraping_scraper.fallback_rate() if scraping_scraper else None
+            stats_updated_at = None
         return {
-            'is_running': self.is_running,
+            'is_running': is_running,
             'active_tickers': self.get_active_tickers(),
             'interval_minutes': self.config['scraping_settings']['interval_minutes'],
             'use_selenium': self.config['scraping_settings']['use_selenium'],
-            'next_run': None if not self.is_running else 'N/A'  # APScheduler nie udostępnia łatwo next_run
+            'next_run': get_scheduler_service().job_state(QUOTES_SCRAPE_JOB).get('next_run_at') if is_running else None,
+            'selenium_fallback_rate': fallback_rate,
+            'fetch_stats': fetch_stats,
+            'stats_updated_at': stats_updated_at,
+            'adaptive': self.config['scraping_settings'].get('adaptive', True),
+            'ticker_staleness': ticker_staleness
         }
     
     def run_manual_scrape(self, tickers=None):
@@ -492,7 +576,10 @@ class MultiTickerScheduler:
         settings = self.config['scraping_settings']
         temp_scraper = BankierScraper(
             use_selenium=settings.get('use_selenium', True),
-            headless=settings.get('headless', True)
+            headless=settings.get('headless', True),
+            browser_workers=settings.get('browser_workers', 4),
+            pages_per_browser=settings.get('pages_per_browser', 50),
+            use_http=settings.get('use_http', True)
         )
         
         try:
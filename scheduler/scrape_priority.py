@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+"""
+Adaptacyjne planowanie scrapowania notowań
+Każdy ticker dostaje własny interwał odświeżania zależny od płynności, zmienności,
+otwartych rekomendacji i aktywnych alertów cenowych. Kolejne terminy trzymane są
+w kopcu (min-heap), a liczba zapytań na minutę nie przekracza globalnego budżetu.
+"""
+
+import heapq
+import logging
+import random
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+# Mnożniki interwału bazowego dla poziomów płynności (percentyl obrotu)
+LIQUIDITY_TIERS = (
+    (0.7, 1),   # najpłynniejsze 30%
+    (0.3, 2),   # środek stawki
+    (0.0, 4),   # najmniej płynne 30%
+)
+UNKNOWN_LIQUIDITY_MULTIPLIER = 2
+
+# Jak często przeliczać interwały tickerów (metryki są dzienne)
+CADENCE_REFRESH_SECONDS = 30 * 60
+
+# Ponowienie nieudanego tickera najpóźniej po tylu sekundach
+FAILED_RETRY_SECONDS = 120
+
+
+class AdaptiveScrapePlanner:
+    """Kolejka priorytetowa tickerów do scrapowania z interwałem per ticker"""
+
+    def __init__(self, engine=None, base_interval_minutes: float = 3, max_interval_minutes: float = 30,
+                 max_requests_per_minute: float = 30):
+        """
+        Args:
+            engine: Silnik SQLAlchemy (metryki płynności, rekomendacje, alerty); bez bazy wszystkie tickery mają interwał bazowy
+            base_interval_minutes: Interwał najważniejszych tickerów
+            max_interval_minutes: Górny limit interwału
+            max_requests_per_minute: Globalny budżet zapytań do źródła
+        """
+        self.engine = engine
+        self.base_interval = base_interval_minutes * 60
+        self.max_interval = max(max_interval_minutes * 60, self.base_interval)
+        self.max_requests_per_minute = max_requests_per_minute
+
+        self._lock = threading.Lock()
+        self._heap: List[Tuple[float, str]] = []
+        self._next_due: Dict[str, float] = {}
+        self._cadence: Dict[str, Dict[str, Any]] = {}
+        self._last_success: Dict[str, float] = {}
+        self._last_attempt: Dict[str, float] = {}
+        self._in_flight = set()
+        self._cadence_refreshed_at = 0.0
+        self._last_take = None
+
+    # ------------------------------------------------------------------
+    # Interwały per ticker
+    # ------------------------------------------------------------------
+
+    def _load_metrics(self, tickers: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Obrót, zmienność (20 sesji), otwarte rekomendacje i aktywne alerty per ticker"""
+        metrics = {ticker: {'turnover': None, 'volatility': None, 'open_recommendations': 0, 'active_alerts': 0}
+                   for ticker in tickers}
+        if not self.engine or not tickers:
+            return metrics
+
+        queries = {
+            'daily': """
+                WITH recent AS (
+                    SELECT c.ticker, q.close_price, q.volume,
+                           ROW_NUMBER() OVER (PARTITION BY q.company_id ORDER BY q.date DESC) AS rn,
+                           q.close_price / NULLIF(LAG(q.close_price) OVER (PARTITION BY q.company_id ORDER BY q.date), 0) - 1 AS ret
+                    FROM quotes_daily q
+                    JOIN companies c ON c.id = q.company_id
+                    WHERE c.ticker = ANY(:tickers)
+                      AND q.date >= CURRENT_DATE - INTERVAL '45 days'
+                )
+                SELECT ticker, AVG(close_price * volume), STDDEV_SAMP(ret)
+                FROM recent
+                WHERE rn <= 20
+                GROUP BY ticker
+            """,
+            'open_recommendations': """
+                SELECT ticker, COUNT(*) FROM recommendations
+                WHERE status = 'ACTIVE' AND ticker = ANY(:tickers)
+                GROUP BY ticker
+            """,
+            'active_alerts': """
+                SELECT ticker, COUNT(*) FROM price_alerts
+                WHERE is_active = true AND is_triggered = false AND ticker = ANY(:tickers)
+                GROUP BY ticker
+            """
+        }
+
+        # Każda metryka osobno - brak tabeli (np. price_alerts) nie blokuje pozostałych
+        for name, query in queries.items():
+            try:
+                with self.engine.connect() as conn:
+                    rows = conn.execute(text(query), {'tickers': tickers}).fetchall()
+            except Exception as e:
+                logger.debug(f"⚠️ Metryka {name} niedostępna: {e}")
+                continue
+            for row in rows:
+                if row[0] not in metrics:
+                    continue
+                if name == 'daily':
+                    metrics[row[0]]['turnover'] = float(row[1]) if row[1] is not None else None
+                    metrics[row[0]]['volatility'] = float(row[2]) if row[2] is not None else None
+                else:
+                    metrics[row[0]][name] = int(row[1])
+        return metrics
+
+    def _compute_cadences(self, metrics: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+        """Interwał i uzasadnienie per ticker"""
+        turnovers = sorted(m['turnover'] for m in metrics.values() if m['turnover'] is not None)
+        volatilities = sorted(m['volatility'] for m in metrics.values() if m['volatility'] is not None)
+        median_volatility = volatilities[len(volatilities) // 2] if volatilities else None
+
+        cadences = {}
+        for ticker, m in metrics.items():
+            reasons = []
+            if m['turnover'] is not None and len(turnovers) > 1:
+                percentile = sum(1 for t in turnovers if t < m['turnover']) / (len(turnovers) - 1)
+                multiplier = next(mult for threshold, mult in LIQUIDITY_TIERS if percentile >= threshold)
+                reasons.append(f"płynność p{percentile * 100:.0f}")
+            else:
+                multiplier = UNKNOWN_LIQUIDITY_MULTIPLIER if turnovers else 1
+                reasons.append("brak danych o płynności")
+
+            if median_volatility is not None and m['volatility'] is not None and m['volatility'] > median_volatility:
+                multiplier = max(1, multiplier / 2)
+                reasons.append("zmienność powyżej mediany")
+
+            if m['open_recommendations'] or m['active_alerts']:
+                multiplier = 1
+                if m['open_recommendations']:
+                    reasons.append(f"otwarte rekomendacje: {m['open_recommendations']}")
+                if m['active_alerts']:
+                    reasons.append(f"aktywne alerty: {m['active_alerts']}")
+
+            cadences[ticker] = {
+                'interval_seconds': min(self.base_interval * multiplier, self.max_interval),
+                'reasons': reasons,
+                **m
+            }
+        return cadences
+
+    def sync_tickers(self, tickers: Iterable[str], force_refresh: bool = False):
+        """
+        Aktualizuje zbiór tickerów i (co CADENCE_REFRESH_SECONDS lub po zmianie listy) ich interwały
+
+        Nowe tickery są od razu należne; usunięte znikają z kolejki.
+        """
+        tickers = sorted({t.upper() for t in tickers})
+        now = time.time()
+        with self._lock:
+            changed = set(tickers) != set(self._cadence)
+            stale = now - self._cadence_refreshed_at > CADENCE_REFRESH_SECONDS
+        if not (changed or stale or force_refresh):
+            return
+
+        cadences = self._compute_cadences(self._load_metrics(tickers))
+
+        with self._lock:
+            for ticker in set(self._cadence) - set(cadences):
+                self._next_due.pop(ticker, None)
+            for ticker, cadence in cadences.items():
+                previous = self._cadence.get(ticker)
+                if ticker in self._in_flight:
+                    continue
+                if ticker not in self._next_due:
+                    self._schedule(ticker, now)
+                elif previous and cadence['interval_seconds'] < previous['interval_seconds']:
+                    # Krótszy interwał obowiązuje od razu, dłuższy - od następnego scrapowania
+                    last = self._last_attempt.get(ticker, now)
+                    self._schedule(ticker, min(self._next_due[ticker], last + cadence['interval_seconds']))
+            self._cadence = cadences
+            self._cadence_refreshed_at = now
+
+        logger.info(f"📅 Interwały scrapowania: {len(cadences)} tickerów, "
+                    f"{sum(1 for c in cadences.values() if c['interval_seconds'] <= self.base_interval)} z interwałem bazowym")
+
+    def set_base_interval(self, base_interval_minutes: float):
+        """Zmienia interwał bazowy - interwały tickerów zostaną przeliczone przy najbliższym sync_tickers()"""
+        with self._lock:
+            self.base_interval = base_interval_minutes * 60
+            self.max_interval = max(self.max_interval, self.base_interval)
+            self._cadence_refreshed_at = 0.0
+
+    def _schedule(self, ticker: str, due: float):
+        self._next_due[ticker] = due
+        heapq.heappush(self._heap, (due, ticker))
+
+    # ------------------------------------------------------------------
+    # Kolejka
+    # ------------------------------------------------------------------
+
+    def take_due(self, now: Optional[float] = None) -> List[str]:
+        """
+        Zdejmuje należne tickery (najbardziej zaległe pierwsze) w granicach budżetu zapytań
+
+        Budżet liczony jest od poprzedniego wywołania: max_requests_per_minute * upłynięte minuty.
+        Tickery ponad budżet zostają w kolejce do następnego cyklu.
+        """
+        now = now or time.time()
+        with self._lock:
+            elapsed = now - self._last_take if self._last_take else 60
+            self._last_take = now
+            budget = max(1, int(self.max_requests_per_minute * min(elapsed, 300) / 60))
+
+            due = []
+            while self._heap and self._heap[0][0] <= now and len(due) < budget:
+                scheduled, ticker = heapq.heappop(self._heap)
+                # Wpisy nieaktualne (ticker usunięty lub przeplanowany)
+                if self._next_due.get(ticker) != scheduled:
+                    continue
+                del self._next_due[ticker]
+                self._in_flight.add(ticker)
+                due.append(ticker)
+            return due
+
+    def record_results(self, attempted: Iterable[str], succeeded: Iterable[str], now: Optional[float] = None):
+        """Planuje kolejne terminy: sukces - za interwał tickera (z jitterem), błąd - wcześniej"""
+        now = now or time.time()
+        succeeded = set(succeeded)
+        with self._lock:
+            for ticker in attempted:
+                self._in_flight.discard(ticker)
+                if ticker not in self._cadence:
+                    continue
+                interval = self._cadence[ticker]['interval_seconds']
+                self._last_attempt[ticker] = now
+                if ticker in succeeded:
+                    self._last_success[ticker] = now
+                    self._schedule(ticker, now + interval * random.uniform(0.95, 1.05))
+                else:
+                    self._schedule(ticker, now + min(interval, FAILED_RETRY_SECONDS))
+
+    def requeue(self, tickers: Iterable[str], now: Optional[float] = None):
+        """Zwraca tickery do kolejki jako należne (np. gdy cykl został przerwany)"""
+        now = now or time.time()
+        with self._lock:
+            for ticker in tickers:
+                self._in_flight.discard(ticker)
+                if ticker in self._cadence:
+                    self._schedule(ticker, now)
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        """Surowy stan tickerów (znaczniki czasu epoch) - do zapisu w bazie i staleness_report()"""
+        with self._lock:
+            return [{
+                'ticker': ticker,
+                'interval_seconds': cadence['interval_seconds'],
+                'reasons': cadence['reasons'],
+                'last_success': self._last_success.get(ticker),
+                'next_due': self._next_due.get(ticker)
+            } for ticker, cadence in sorted(self._cadence.items())]
+
+    def status(self, now: Optional[float] = None) -> List[Dict[str, Any]]:
+        """Stan tickerów: interwał, ostatnie udane scrapowanie, nieaktualność i następny termin"""
+        return staleness_report(self.snapshot(), now)
+
+
+def staleness_report(entries: Iterable[Dict[str, Any]], now: Optional[float] = None) -> List[Dict[str, Any]]:
+    """
+    Raport nieaktualności z wpisów snapshot()
+
+    Nieaktualność liczona jest w chwili odczytu, więc raport z zapisanego w bazie stanu
+    (inny proces) pozostaje poprawny.
+    """
+    now = now or time.time()
+    report = []
+    for entry in entries:
+        last_success = entry.get('last_success')
+        next_due = entry.get('next_due')
+        staleness = now - last_success if last_success else None
+        report.append({
+            'ticker': entry['ticker'],
+            'interval_seconds': round(entry['interval_seconds']),
+            'reasons': entry['reasons'],
+            'last_scraped': datetime.fromtimestamp(last_success).isoformat() if last_success else None,
+            'staleness_seconds': round(staleness) if staleness is not None else None,
+            'is_stale': staleness is None or staleness > entry['interval_seconds'] * 1.5,
+            'next_due': datetime.fromtimestamp(next_due).isoformat() if next_due else None
+        })
+    return report
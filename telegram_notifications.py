@@ -15,6 +15,8 @@ from datetime import datetime
 from sqlalchemy import create_engine, text
 from dotenv import load_dotenv
 
+from utils.notification_outbox import get_notification_outbox
+
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
@@ -46,6 +48,12 @@ class TelegramNotificationManager:
         
         # Utwórz tabele powiadomień
         self._create_notification_tables()
+        
+        # Kolejka wysyłki - producenci tylko dodają wiadomości, wysyła wątek dyspozytora
+        self.outbox = None
+        if self.bot_token:
+            self.outbox = get_notification_outbox(self.engine, self.bot_token)
+            self.outbox.start()
     
     def _create_notification_tables(self):
         """Tworzy tabele do zarządzania powiadomieniami"""
@@ -153,72 +161,45 @@ class TelegramNotificationManager:
     
     def send_message(self, chat_id: str, message: str, title: str = None, 
                     notification_type: str = 'system_alert', ticker: str = None,
-                    metadata: Dict = None) -> bool:
-        """Wysyła wiadomość przez Telegram"""
+                    metadata: Dict = None, sync: bool = False, coalesce_key: str = None,
+                    suppress_seconds: int = None, digest_group: str = None) -> bool:
+        """
+        Dodaje wiadomość do kolejki wysyłki Telegram
+        
+        Args:
+            sync: Wyślij od razu z pominięciem kolejki i zwróć wynik wysyłki (np. wiadomość testowa)
+            coalesce_key: Klucz powtórzeń - ta sama wiadomość w oknie suppress_seconds jest pomijana
+            suppress_seconds: Okno tłumienia powtórzeń (domyślnie 30 min)
+            digest_group: Grupa łączenia - wiadomości serii trafiają do jednego digestu
+        
+        Returns:
+            True jeśli wiadomość została dodana do kolejki lub pominięta jako powtórzenie
+            (przy sync=True - wynik wysyłki)
+        """
         if not self.bot_token:
             logger.error("❌ Brak konfiguracji Telegram Bot Token")
             return False
         
+        notification = {
+            'chat_id': chat_id,
+            'message': message,
+            'formatted_text': self._format_message(message, title, ticker),
+            'title': title,
+            'notification_type': notification_type,
+            'ticker': ticker,
+            'metadata': metadata,
+            'coalesce_key': coalesce_key,
+            'suppress_seconds': suppress_seconds,
+            'digest_group': digest_group
+        }
+        
         try:
-            # Formatuj wiadomość
-            formatted_message = self._format_message(message, title, ticker)
-            
-            # Wyślij przez Telegram API
-            url = f"https://api.telegram.org/bot{self.bot_token}/sendMessage"
-            data = {
-                'chat_id': chat_id,
-                'text': formatted_message,
-                'parse_mode': 'HTML',
-                'disable_web_page_preview': True
-            }
-            
-            response = requests.post(url, data=data, timeout=10)
-            
-            if response.status_code == 200:
-                # Zapisz w historii
-                self._save_notification_history(
-                    chat_id=chat_id,
-                    notification_type=notification_type,
-                    title=title,
-                    message=message,
-                    status='sent',
-                    ticker=ticker,
-                    metadata=metadata
-                )
-                logger.info(f"✅ Wiadomość wysłana do {chat_id}")
-                return True
-            else:
-                error_msg = f"Błąd API Telegram: {response.status_code} - {response.text}"
-                logger.error(f"❌ {error_msg}")
-                
-                # Zapisz błąd w historii
-                self._save_notification_history(
-                    chat_id=chat_id,
-                    notification_type=notification_type,
-                    title=title,
-                    message=message,
-                    status='failed',
-                    error_message=error_msg,
-                    ticker=ticker,
-                    metadata=metadata
-                )
-                return False
-                
+            if sync:
+                return self.outbox.send_now(notification)
+            result = self.outbox.enqueue([notification])
+            return result['queued'] + result['suppressed'] > 0
         except Exception as e:
-            error_msg = f"Błąd wysyłania: {e}"
-            logger.error(f"❌ {error_msg}")
-            
-            # Zapisz błąd w historii
-            self._save_notification_history(
-                chat_id=chat_id,
-                notification_type=notification_type,
-                title=title,
-                message=message,
-                status='failed',
-                error_message=error_msg,
-                ticker=ticker,
-                metadata=metadata
-            )
+            logger.error(f"❌ Błąd dodawania wiadomości do kolejki: {e}")
             return False
     
     def _format_message(self, message: str, title: str = None, ticker: str = None) -> str:
@@ -242,36 +223,24 @@ class TelegramNotificationManager:
         
         return formatted
     
-    def _save_notification_history(self, chat_id: str, notification_type: str,
-                                 title: str, message: str, status: str,
-                                 error_message: str = None, ticker: str = None,
-                                 metadata: Dict = None):
-        """Zapisuje historię powiadomienia"""
-        try:
-            with self.engine.connect() as conn:
-                conn.execute(text("""
-                    INSERT INTO notification_history 
-                    (chat_id, notification_type, title, message, status, error_message, ticker, metadata)
-                    VALUES (:chat_id, :notification_type, :title, :message, :status, :error_message, :ticker, :metadata)
-                """), {
-                    'chat_id': chat_id,
-                    'notification_type': notification_type,
-                    'title': title,
-                    'message': message,
-                    'status': status,
-                    'error_message': error_message,
-                    'ticker': ticker,
-                    'metadata': json.dumps(metadata) if metadata else None
-                })
-                conn.commit()
-                
-        except Exception as e:
-            logger.error(f"❌ Błąd zapisywania historii: {e}")
-    
     def broadcast_message(self, message: str, title: str = None, 
                          notification_type: str = 'system_alert',
-                         ticker: str = None, metadata: Dict = None) -> Dict[str, int]:
-        """Wysyła wiadomość do wszystkich aktywnych subskrybentów"""
+                         ticker: str = None, metadata: Dict = None, coalesce_key: str = None,
+                         suppress_seconds: int = None, digest_group: str = None) -> Dict[str, int]:
+        """
+        Dodaje wiadomość dla wszystkich aktywnych subskrybentów do kolejki wysyłki (jednym INSERT)
+        
+        Args:
+            coalesce_key, suppress_seconds, digest_group: jak w send_message (per czat)
+        
+        Returns:
+            {'queued': liczba wiadomości w kolejce, 'suppressed': pominięte powtórzenia}
+            - wyniki wysyłki trafiają do historii
+        """
+        if not self.bot_token:
+            logger.error("❌ Brak konfiguracji Telegram Bot Token")
+            return {'queued': 0, 'suppressed': 0}
+        
         try:
             with self.engine.connect() as conn:
                 # Pobierz aktywne subskrypcje z włączonym typem powiadomienia
@@ -285,29 +254,33 @@ class TelegramNotificationManager:
                     AND (nt.type_name = :notification_type OR nt.type_name IS NULL)
                 """), {'notification_type': notification_type}).fetchall()
                 
-                sent_count = 0
-                failed_count = 0
-                
-                for sub in subscriptions:
-                    chat_id = sub[0]
-                    if self.send_message(
-                        chat_id=chat_id,
-                        message=message,
-                        title=title,
-                        notification_type=notification_type,
-                        ticker=ticker,
-                        metadata=metadata
-                    ):
-                        sent_count += 1
-                    else:
-                        failed_count += 1
-                
-                logger.info(f"✅ Broadcast: wysłano {sent_count}, błędów {failed_count}")
-                return {'sent': sent_count, 'failed': failed_count}
-                
+            formatted_message = self._format_message(message, title, ticker)
+            result = self.outbox.enqueue({
+                'chat_id': sub[0],
+                'message': message,
+                'formatted_text': formatted_message,
+                'title': title,
+                'notification_type': notification_type,
+                'ticker': ticker,
+                'metadata': metadata,
+                'coalesce_key': coalesce_key,
+                'suppress_seconds': suppress_seconds,
+                'digest_group': digest_group
+            } for sub in subscriptions)
+            
+            logger.info(f"✅ Broadcast: {result['queued']} wiadomości w kolejce wysyłki, "
+                        f"{result['suppressed']} pominiętych powtórzeń")
+            return {'queued': result['queued'], 'suppressed': result['suppressed']}
+            
         except Exception as e:
             logger.error(f"❌ Błąd broadcast: {e}")
-            return {'sent': 0, 'failed': 0}
+            return {'queued': 0, 'suppressed': 0}
+    
+    def get_delivery_report(self) -> Dict[str, Any]:
+        """Statystyki kolejki wysyłki: przepustowość (msg/s), opóźnienia p50/p95/p99, liczba oczekujących"""
+        if not self.outbox:
+            return {'error': 'Brak Bot Token'}
+        return self.outbox.report()
     
     def subscribe_chat(self, chat_id: str, username: str = None, 
                       first_name: str = None, last_name: str = None) -> bool:
@@ -15,6 +15,8 @@ import json
 import os
 from dotenv import load_dotenv
 
+from utils.ticker_registry import get_ticker_registry
+
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
@@ -41,6 +43,7 @@ class TickerManager:
         # Połączenie PostgreSQL
         db_uri = f"postgresql://{self.pg_config['user']}:{self.pg_config['password']}@{self.pg_config['host']}:{self.pg_config['port']}/{self.pg_config['database']}"
         self.engine = create_engine(db_uri)
+        self.registry = get_ticker_registry(self.engine)
         
         # Sprawdź połączenie
         self._test_connection()
@@ -57,41 +60,9 @@ class TickerManager:
             raise
     
     def ensure_company_exists(self, ticker: str) -> Optional[int]:
-        """Zapewnia że spółka istnieje i zwraca jej ID"""
+        """Zapewnia że spółka istnieje i zwraca jej ID (wspólna pamięć podręczna TickerRegistry)"""
         try:
-            with self.engine.begin() as conn:
-                # Sprawdź czy spółka istnieje
-                result = conn.execute(
-                    text("SELECT id FROM companies WHERE ticker = :ticker"), 
-                    {"ticker": ticker.upper()}
-                )
-                row = result.fetchone()
-                
-                if row:
-                    return row[0]
-                
-                # Dodaj nową spółkę
-                result = conn.execute(
-                    text("""
-                        INSERT INTO companies (ticker, name, sector, is_active, data_source)
-                        VALUES (:ticker, :name, :sector, :active, :source)
-                        RETURNING id
-                    """),
-                    {
-                        "ticker": ticker.upper(),
-                        "name": ticker.upper(),
-                        "sector": "Unknown",
-                        "active": True,
-                        "source": "auto_registered"
-                    }
-                )
-                row = result.fetchone()
-                company_id = row[0] if row else None
-                
-                if company_id:
-                    logger.info(f"✅ Auto-dodano spółkę {ticker} (ID: {company_id})")
-                    return company_id
-                
+            return self.registry.company_id(ticker, sector="Unknown", data_source="auto_registered")
         except Exception as e:
             logger.error(f"❌ Błąd zapewniania istnienia spółki {ticker}: {e}")
         
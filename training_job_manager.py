@@ -0,0 +1,782 @@
+#!/usr/bin/env python3
+"""
+Training Job Manager - zadania treningu ML uruchamiane w osobnych procesach
+Trening (/api/ml/train, /api/ml/market-pattern/train, tuning) nie blokuje workerów
+webowych: każde zadanie działa w procesie potomnym z limitami zasobów, a status
+i zdarzenia postępu trafiają do tabel ml_training_jobs / ml_training_job_events,
+więc widzi je każdy worker gunicorna.
+Autor: GPW Investor System
+"""
+
+import logging
+import math
+import multiprocessing
+import os
+import socket
+import threading
+import time
+import uuid
+import json
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional
+
+from sqlalchemy import create_engine, text
+from dotenv import load_dotenv
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_STATUSES = ('starting', 'running', 'cancelling')
+FINAL_STATUSES = ('completed', 'failed', 'cancelled')
+
+# Klucz blokady doradczej PostgreSQL serializującej uruchamianie zadań między workerami
+LAUNCH_LOCK_KEY = 726026
+
+# Zadanie aktywne bez heartbeatu właściciela dłużej niż tyle sekund uznawane jest za osierocone
+HEARTBEAT_TIMEOUT_SECONDS = 60
+
+
+class TrainingCancelled(BaseException):
+    """
+    Przerwanie treningu na żądanie użytkownika.
+    Dziedziczy z BaseException, żeby nie zostało połknięte przez `except Exception`
+    w kodzie modeli.
+    """
+
+
+def _create_db_engine():
+    """Tworzy engine PostgreSQL na podstawie zmiennych środowiskowych"""
+    load_dotenv('.env')
+    db_uri = (f"postgresql://{os.getenv('DB_USER')}:{os.getenv('DB_PASSWORD')}"
+              f"@{os.getenv('DB_HOST')}:{os.getenv('DB_PORT')}/{os.getenv('DB_NAME')}")
+    return create_engine(db_uri, pool_pre_ping=True)
+
+
+def _json_safe(value: Any) -> Any:
+    """Konwertuje wyniki treningu (typy numpy, NaN, daty) do postaci zapisywalnej w JSONB"""
+    if isinstance(value, dict):
+        return {str(k): _json_safe(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_json_safe(v) for v in value]
+    if isinstance(value, float):
+        return value if math.isfinite(value) else None
+    if value is None or isinstance(value, (str, int, bool)):
+        return value
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if hasattr(value, 'tolist'):
+        # numpy array / numpy scalar
+        return _json_safe(value.tolist())
+    return str(value)
+
+
+class TrainingProgressReporter:
+    """
+    Callback postępu przekazywany do kodu treningowego w procesie potomnym.
+    Wywołanie: progress(stage, progress, message, **metryki) - np. fold, n_folds, best_score.
+    Zapisy są dławione (max 1 na min_interval s w obrębie etapu), a przy okazji
+    sprawdzane jest żądanie anulowania.
+    """
+
+    def __init__(self, job_id: str, engine, min_interval: float = 1.0, cancel_check_interval: float = 2.0):
+        self.job_id = job_id
+        self.engine = engine
+        self.min_interval = min_interval
+        self.cancel_check_interval = cancel_check_interval
+        self.metrics: Dict[str, Any] = {}
+        self._last_stage = None
+        self._last_write = 0.0
+        self._last_cancel_check = 0.0
+
+    def __call__(self, stage: str, progress: Optional[float] = None, message: Optional[str] = None, **metrics):
+        now = time.monotonic()
+
+        if now - self._last_cancel_check >= self.cancel_check_interval:
+            self._last_cancel_check = now
+            if self._cancel_requested():
+                raise TrainingCancelled()
+
+        self.metrics.update({k: v for k, v in metrics.items() if v is not None})
+
+        # Zmiana etapu, koniec etapu i nowy najlepszy wynik zawsze są zapisywane
+        force = stage != self._last_stage or (progress is not None and progress >= 100) or 'best_score' in metrics
+        if not force and now - self._last_write < self.min_interval:
+            return
+
+        self._last_stage = stage
+        self._last_write = now
+        self._write_event(stage, progress, message, metrics)
+
+    def _cancel_requested(self) -> bool:
+        try:
+            with self.engine.connect() as conn:
+                status = conn.execute(text("SELECT status FROM ml_training_jobs WHERE id = :id"),
+                                      {'id': self.job_id}).scalar()
+            return status == 'cancelling'
+        except Exception as e:
+            logger.warning(f"Nie można sprawdzić statusu zadania {self.job_id}: {e}")
+            return False
+
+    def _write_event(self, stage: str, progress: Optional[float], message: Optional[str], metrics: Dict[str, Any]):
+        try:
+            with self.engine.begin() as conn:
+                conn.execute(text("""
+                    INSERT INTO ml_training_job_events (job_id, stage, progress, message, metrics)
+                    VALUES (:job_id, :stage, :progress, :message, CAST(:metrics AS JSONB))
+                """), {
+                    'job_id': self.job_id,
+                    'stage': stage,
+                    'progress': progress,
+                    'message': message,
+                    'metrics': json.dumps(_json_safe(metrics))
+                })
+                conn.execute(text("""
+                    UPDATE ml_training_jobs
+                    SET stage = :stage,
+                        progress = COALESCE(:progress, progress),
+                        message = COALESCE(:message, message),
+                        metrics = CAST(:metrics AS JSONB)
+                    WHERE id = :job_id
+                """), {
+                    'job_id': self.job_id,
+                    'stage': stage,
+                    'progress': progress,
+                    'message': message,
+                    'metrics': json.dumps(_json_safe(self.metrics))
+                })
+        except Exception as e:
+            logger.warning(f"Nie można zapisać postępu zadania {self.job_id}: {e}")
+
+
+# ================================
+# HANDLERY ZADAŃ (proces potomny)
+# ================================
+
+def _run_simple_ml_training(params: Dict[str, Any], progress: Callable) -> Dict[str, Any]:
+    """Trening SimpleMLModel - odpowiednik synchronicznego /api/ml/train"""
+    from workers.simple_ml_features import SimpleMLFeatures
+    from workers.simple_ml_model import SimpleMLModel
+
+    tickers = params.get('tickers', ['CDR', 'PKN', 'CCC'])
+    days_back = params.get('days_back', 30)
+
+    progress('load_data', 0, f"Pobieranie dostępnych dat dla {len(tickers)} tickerów")
+    feature_engineer = SimpleMLFeatures()
+    available_dates = feature_engineer.get_available_dates(tickers, days_back)
+
+    if not available_dates:
+        return {'error': f'Brak dostępnych danych dla tickerów {tickers} w ostatnich {days_back} dniach'}
+
+    X, y = feature_engineer.prepare_training_data(tickers, available_dates, progress_callback=progress)
+
+    if len(X) == 0:
+        return {'error': 'Nie udało się przygotować danych treningowych z dostępnych dat'}
+
+    results = SimpleMLModel().train_model(X, y, progress_callback=progress)
+    if 'error' in results:
+        return results
+
+    return {
+        'training_results': results,
+        'tickers_trained': tickers,
+        'dates_used': available_dates,
+        'days_back': days_back
+    }
+
+
+def _run_market_pattern_training(params: Dict[str, Any], progress: Callable) -> Dict[str, Any]:
+    """Trening MarketPatternML - odpowiednik synchronicznego /api/ml/market-pattern/train"""
+    from workers.market_pattern_ml import MarketPatternML
+
+    tickers = params.get('tickers', ['CDR', 'PKN', 'PKO', 'CCC', 'ALE', 'KGH', 'PGE', 'PZU'])
+    days_back = params.get('days_back', 500)
+
+    result = MarketPatternML().train_model(tickers, days_back, progress_callback=progress)
+    if 'success' not in result:
+        return {'error': result.get('error', 'Unknown training error')}
+
+    return {
+        'message': 'Model wytrenowany pomyślnie!',
+        'accuracy': result['test_accuracy'],
+        'samples': result['samples'],
+        'features': result['features'],
+        'positive_ratio': result['positive_ratio'],
+        'top_features': result['top_features'][:5]
+    }
+
+
+def _run_intraday_tuning(params: Dict[str, Any], progress: Callable) -> Dict[str, Any]:
+    """Optymalizacja hiperparametrów IntradayMLModel"""
+    from workers.ml_intraday_model import IntradayMLModel
+
+    tickers = params.get('tickers', ['CDR', 'PKN', 'CCC'])
+    model_type = params.get('model_type', 'xgboost')
+    end_date = params.get('end_date') or datetime.now().strftime('%Y-%m-%d')
+    start_date = params.get('start_date') or (
+        datetime.strptime(end_date, '%Y-%m-%d') - timedelta(days=params.get('days_back', 30))
+    ).strftime('%Y-%m-%d')
+
+    progress('features', 0, f"Przygotowanie danych {start_date} - {end_date}")
+    ml_model = IntradayMLModel()
+    X, y = ml_model.prepare_training_data(tickers, start_date, end_date)
+
+    if len(X) == 0:
+        return {'error': 'Brak danych treningowych'}
+    progress('features', 100, f"Przygotowano {X.shape[0]} próbek, {X.shape[1]} cech")
+
+    results = ml_model.hyperparameter_tuning(X, y, model_type=model_type, progress_callback=progress)
+    if 'error' in results:
+        return results
+
+    return {
+        'model_type': model_type,
+        'best_params': results['best_params'],
+        'best_score': results['best_score'],
+        'rounds': results['rounds'],
+        'n_candidates': results['n_candidates'],
+        'total_seconds': results['total_seconds'],
+        'candidate_timings': results['candidate_timings'],
+        'samples': len(X),
+        'start_date': start_date,
+        'end_date': end_date
+    }
+
+
+def _run_intraday_backtest(params: Dict[str, Any], progress: Callable) -> Dict[str, Any]:
+    """Backtest reguł intraday na słupkach, opcjonalnie z przeglądem siatki parametrów"""
+    from workers.intraday_backtester import IntradayBacktester, compute_indicators
+
+    end_date = params.get('end_date') or datetime.now().strftime('%Y-%m-%d')
+    start_date = params.get('start_date') or (
+        datetime.strptime(end_date, '%Y-%m-%d') - timedelta(days=params.get('days_back', 90))
+    ).strftime('%Y-%m-%d')
+
+    backtester = IntradayBacktester(
+        rules=params.get('rules'),
+        commission_rate=params.get('commission_rate', 0.0039),
+        slippage_rate=params.get('slippage_rate', 0.0005),
+        position_value=params.get('position_value', 10000.0),
+        initial_capital=params.get('initial_capital', 100000.0)
+    )
+
+    progress('load_data', 0, f"Pobieranie słupków {start_date} - {end_date}")
+    bars = backtester.load_bars(params.get('tickers'), start_date, end_date, params.get('bar_minutes', 5))
+    if bars is None:
+        return {'error': f'Brak notowań intraday w zakresie {start_date} - {end_date}'}
+    n_sessions, n_slots, n_tickers = bars.shape
+    progress('load_data', 100, f"{n_sessions} sesji, {n_tickers} spółek")
+
+    progress('indicators', 0, 'Obliczanie wskaźników')
+    indicators = compute_indicators(bars)
+
+    param_grid = params.get('param_grid')
+    if param_grid:
+        results = backtester.run_parameter_sweep(
+            bars, param_grid, indicators=indicators,
+            n_jobs=int(os.environ.get('LOKY_MAX_CPU_COUNT', os.cpu_count() or 1)),
+            progress_callback=progress
+        )
+        return {
+            'start_date': start_date,
+            'end_date': end_date,
+            'sessions': n_sessions,
+            'tickers': n_tickers,
+            'combinations': len(results),
+            'results': results[:params.get('top', 20)]
+        }
+
+    progress('simulate', 0, 'Symulacja transakcji')
+    result = backtester.run(bars, indicators=indicators)
+    equity = result['equity_curve']
+    daily_equity = equity.groupby(equity.index.normalize()).last() if len(equity) else equity
+    trades = result['trades'].tail(params.get('max_trades', 500))
+
+    return {
+        'start_date': start_date,
+        'end_date': end_date,
+        'sessions': n_sessions,
+        'tickers': n_tickers,
+        'summary': result['summary'],
+        'equity_curve': [{'date': idx.strftime('%Y-%m-%d'), 'equity': float(value)}
+                         for idx, value in daily_equity.items()],
+        'trades': [{**row, 'entry_time': row['entry_time'].isoformat(), 'exit_time': row['exit_time'].isoformat()}
+                   for row in trades.to_dict('records')]
+    }
+
+
+def _run_intraday_rules_optimization(params: Dict[str, Any], progress: Callable) -> Dict[str, Any]:
+    """Optymalizacja walk-forward progów reguł intraday"""
+    from workers.intraday_backtester import IntradayBacktester
+    from workers.intraday_rules_optimizer import IntradayRulesOptimizer
+
+    end_date = params.get('end_date') or datetime.now().strftime('%Y-%m-%d')
+    start_date = params.get('start_date') or (
+        datetime.strptime(end_date, '%Y-%m-%d') - timedelta(days=params.get('days_back', 365))
+    ).strftime('%Y-%m-%d')
+
+    backtester = IntradayBacktester(
+        commission_rate=params.get('commission_rate', 0.0039),
+        slippage_rate=params.get('slippage_rate', 0.0005),
+        position_value=params.get('position_value', 10000.0)
+    )
+    optimizer = IntradayRulesOptimizer(
+        backtester,
+        search_space=params.get('search_space'),
+        train_sessions=params.get('train_sessions', 60),
+        test_sessions=params.get('test_sessions', 20),
+        step_sessions=params.get('step_sessions'),
+        min_trades=params.get('min_trades', 20),
+        min_profitable_folds=params.get('min_profitable_folds', 0.5)
+    )
+
+    progress('load_data', 0, f"Pobieranie słupków {start_date} - {end_date}")
+    bars = backtester.load_bars(params.get('tickers'), start_date, end_date, params.get('bar_minutes', 5))
+    if bars is None:
+        return {'error': f'Brak notowań intraday w zakresie {start_date} - {end_date}'}
+    progress('load_data', 100, f"{bars.shape[0]} sesji, {bars.shape[2]} spółek")
+
+    result = optimizer.optimize(
+        bars, n_jobs=int(os.environ.get('LOKY_MAX_CPU_COUNT', os.cpu_count() or 1)),
+        max_combinations=params.get('max_combinations'), top=params.get('top', 20),
+        progress_callback=progress
+    )
+    if 'error' in result:
+        return result
+
+    result['config_path'] = optimizer.save_config(result['config'], apply=params.get('apply', False))
+    result['applied'] = bool(params.get('apply', False))
+    result['start_date'] = start_date
+    result['end_date'] = end_date
+    return result
+
+
+JOB_HANDLERS: Dict[str, Callable[[Dict[str, Any], Callable], Dict[str, Any]]] = {
+    'simple_ml': _run_simple_ml_training,
+    'market_pattern': _run_market_pattern_training,
+    'intraday_tuning': _run_intraday_tuning,
+    'intraday_backtest': _run_intraday_backtest,
+    'intraday_rules_optimization': _run_intraday_rules_optimization,
+}
+
+
+def _apply_resource_limits(limits: Dict[str, Any]):
+    """Ogranicza zasoby procesu treningowego (priorytet CPU, wątki BLAS, pamięć)"""
+    threads = str(limits.get('cpu_threads', 2))
+    for var in ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS', 'LOKY_MAX_CPU_COUNT'):
+        os.environ[var] = threads
+
+    try:
+        os.nice(limits.get('nice', 10))
+    except (AttributeError, OSError) as e:
+        logger.warning(f"Nie można ustawić priorytetu procesu: {e}")
+
+    memory_limit_mb = limits.get('memory_limit_mb', 0)
+    if memory_limit_mb > 0:
+        try:
+            import resource
+            limit_bytes = memory_limit_mb * 1024 * 1024
+            resource.setrlimit(resource.RLIMIT_AS, (limit_bytes, limit_bytes))
+        except (ImportError, ValueError, OSError) as e:
+            logger.warning(f"Nie można ustawić limitu pamięci: {e}")
+
+
+def _pid_alive(pid: int) -> bool:
+    """Czy proces o danym pid działa na tym hoście"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _finish_job(engine, job_id: str, status: str, result: Optional[Dict] = None,
+                error: Optional[str] = None, message: Optional[str] = None):
+    """Zapisuje końcowy status zadania (tylko jeśli zadanie nie jest już zakończone)"""
+    with engine.begin() as conn:
+        conn.execute(text("""
+            UPDATE ml_training_jobs
+            SET status = :status,
+                result = CAST(:result AS JSONB),
+                error = :error,
+                message = COALESCE(:message, message),
+                progress = CASE WHEN :status = 'completed' THEN 100 ELSE progress END,
+                finished_at = NOW()
+            WHERE id = :job_id AND status NOT IN ('completed', 'failed', 'cancelled')
+        """), {
+            'job_id': job_id,
+            'status': status,
+            'result': json.dumps(_json_safe(result)) if result is not None else None,
+            'error': error,
+            'message': message
+        })
+
+
+def _job_process_main(job_id: str, job_type: str, params: Dict[str, Any], limits: Dict[str, Any]):
+    """Punkt wejścia procesu potomnego"""
+    # Proces jest demoniczny z punktu widzenia rodzica (ginie razem z workerem), ale sam
+    # może uruchamiać pule procesów (joblib, przegląd parametrów backtestu)
+    multiprocessing.current_process().daemon = False
+    _apply_resource_limits(limits)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    engine = _create_db_engine()
+    with engine.begin() as conn:
+        conn.execute(text("""
+            UPDATE ml_training_jobs
+            SET status = 'running', started_at = NOW(), worker_pid = :pid, message = 'Trening rozpoczęty'
+            WHERE id = :job_id AND status = 'starting'
+        """), {'job_id': job_id, 'pid': os.getpid()})
+
+    progress = TrainingProgressReporter(job_id, engine)
+
+    try:
+        result = JOB_HANDLERS[job_type](params, progress)
+        if isinstance(result, dict) and 'error' in result:
+            _finish_job(engine, job_id, 'failed', error=str(result['error']), message='Trening nieudany')
+        else:
+            _finish_job(engine, job_id, 'completed', result=result, message='Trening zakończony')
+    except TrainingCancelled:
+        logger.info(f"Zadanie treningu {job_id} anulowane")
+        _finish_job(engine, job_id, 'cancelled', message='Zadanie anulowane przez użytkownika')
+    except MemoryError:
+        _finish_job(engine, job_id, 'failed', error=f"Przekroczono limit pamięci ({limits.get('memory_limit_mb')} MB)")
+    except Exception as e:
+        logger.error(f"Zadanie treningu {job_id} nieudane: {e}")
+        _finish_job(engine, job_id, 'failed', error=str(e), message='Trening nieudany')
+
+
+# ================================
+# MANAGER (proces webowy)
+# ================================
+
+class TrainingJobManager:
+    """Manager zadań treningu ML uruchamianych w procesach potomnych"""
+
+    def __init__(self):
+        self.engine = None
+        self.lock = threading.Lock()
+        # Serializuje uruchamianie w procesie - zadanie jest w self.processes, zanim ktoś sprawdzi osierocone
+        self.launch_lock = threading.Lock()
+        self.processes: Dict[str, Any] = {}
+        self.monitor_thread: Optional[threading.Thread] = None
+        self.mp_context = multiprocessing.get_context('spawn')
+        # Właściciel zadań w ml_training_jobs.owner_host: host:pid procesu managera
+        self.owner_id = f"{socket.gethostname()}:{os.getpid()}"
+
+        # Limity zasobów
+        self.max_concurrent = int(os.getenv('ML_TRAINING_MAX_CONCURRENT', '1'))
+        self.job_timeout = int(os.getenv('ML_TRAINING_TIMEOUT', '3600'))
+        self.cancel_grace_period = 15
+        self.limits = {
+            'cpu_threads': int(os.getenv('ML_TRAINING_CPU_THREADS', '2')),
+            'memory_limit_mb': int(os.getenv('ML_TRAINING_MEMORY_LIMIT_MB', '4096')),
+            'nice': int(os.getenv('ML_TRAINING_NICE', '10'))
+        }
+
+    def _get_engine(self):
+        """Leniwie tworzy engine i tabele zadań"""
+        with self.lock:
+            if self.engine is None:
+                self.engine = _create_db_engine()
+                self._create_tables()
+        return self.engine
+
+    def _create_tables(self):
+        """Tworzy tabele zadań treningowych"""
+        with self.engine.begin() as conn:
+            conn.execute(text("""
+                CREATE TABLE IF NOT EXISTS ml_training_jobs (
+                    id VARCHAR(36) PRIMARY KEY,
+                    job_type VARCHAR(50) NOT NULL,
+                    status VARCHAR(20) NOT NULL DEFAULT 'queued',
+                    stage VARCHAR(50),
+                    progress REAL DEFAULT 0,
+                    message TEXT,
+                    params JSONB,
+                    metrics JSONB,
+                    result JSONB,
+                    error TEXT,
+                    worker_pid INTEGER,
+                    owner_host VARCHAR(100),
+                    heartbeat_at TIMESTAMP,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    started_at TIMESTAMP,
+                    finished_at TIMESTAMP,
+                    cancel_requested_at TIMESTAMP
+                )
+            """))
+            conn.execute(text("""
+                CREATE TABLE IF NOT EXISTS ml_training_job_events (
+                    id BIGSERIAL PRIMARY KEY,
+                    job_id VARCHAR(36) NOT NULL REFERENCES ml_training_jobs(id) ON DELETE CASCADE,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    stage VARCHAR(50),
+                    progress REAL,
+                    message TEXT,
+                    metrics JSONB
+                )
+            """))
+            conn.execute(text("ALTER TABLE ml_training_jobs ADD COLUMN IF NOT EXISTS heartbeat_at TIMESTAMP"))
+            conn.execute(text("CREATE INDEX IF NOT EXISTS idx_ml_training_jobs_status ON ml_training_jobs(status)"))
+            conn.execute(text("CREATE INDEX IF NOT EXISTS idx_ml_training_job_events_job ON ml_training_job_events(job_id, id)"))
+
+    def submit_job(self, job_type: str, params: Dict[str, Any]) -> str:
+        """Dodaje zadanie do kolejki i (jeśli jest wolny slot) od razu je uruchamia"""
+        if job_type not in JOB_HANDLERS:
+            raise ValueError(f"Nieznany typ zadania treningu: {job_type}")
+
+        engine = self._get_engine()
+        job_id = str(uuid.uuid4())
+
+        with engine.begin() as conn:
+            conn.execute(text("""
+                INSERT INTO ml_training_jobs (id, job_type, status, message, params)
+                VALUES (:id, :job_type, 'queued', 'Zadanie w kolejce', CAST(:params AS JSONB))
+            """), {'id': job_id, 'job_type': job_type, 'params': json.dumps(_json_safe(params))})
+
+        logger.info(f"Utworzono zadanie treningu {job_id} ({job_type})")
+
+        self._launch_queued_jobs()
+        self._ensure_monitor()
+        return job_id
+
+    def get_job(self, job_id: str, since_event: int = 0) -> Optional[Dict[str, Any]]:
+        """Zwraca status zadania wraz ze zdarzeniami postępu nowszymi niż since_event"""
+        engine = self._get_engine()
+
+        with engine.connect() as conn:
+            row = conn.execute(text("SELECT * FROM ml_training_jobs WHERE id = :id"), {'id': job_id}).mappings().fetchone()
+            if not row:
+                return None
+
+            events = conn.execute(text("""
+                SELECT id, created_at, stage, progress, message, metrics
+                FROM ml_training_job_events
+                WHERE job_id = :id AND id > :since
+                ORDER BY id
+                LIMIT 500
+            """), {'id': job_id, 'since': since_event}).mappings().fetchall()
+
+        job = self._serialize(row)
+        job['events'] = [self._serialize(event) for event in events]
+        return job
+
+    def list_jobs(self, limit: int = 20) -> List[Dict[str, Any]]:
+        """Zwraca ostatnie zadania (bez zdarzeń)"""
+        engine = self._get_engine()
+
+        with engine.connect() as conn:
+            rows = conn.execute(text("""
+                SELECT id, job_type, status, stage, progress, message, metrics, error,
+                       created_at, started_at, finished_at
+                FROM ml_training_jobs
+                ORDER BY created_at DESC
+                LIMIT :limit
+            """), {'limit': limit}).mappings().fetchall()
+
+        return [self._serialize(row) for row in rows]
+
+    def cancel_job(self, job_id: str) -> bool:
+        """
+        Anuluje zadanie. Zadanie z kolejki jest anulowane od razu, uruchomione dostaje
+        status 'cancelling' i przerywa się przy najbliższym raporcie postępu; po okresie
+        karencji proces jest zabijany przez monitor.
+        """
+        engine = self._get_engine()
+
+        with engine.begin() as conn:
+            new_status = conn.execute(text("""
+                UPDATE ml_training_jobs
+                SET status = CASE WHEN status = 'queued' THEN 'cancelled' ELSE 'cancelling' END,
+                    finished_at = CASE WHEN status = 'queued' THEN NOW() ELSE finished_at END,
+                    cancel_requested_at = NOW(),
+                    message = 'Anulowanie na żądanie użytkownika'
+                WHERE id = :id AND status IN ('queued', 'starting', 'running')
+                RETURNING status
+            """), {'id': job_id}).scalar()
+
+        if new_status is None:
+            logger.warning(f"Nie można anulować zadania {job_id}: brak zadania lub już zakończone")
+            return False
+
+        logger.info(f"Anulowanie zadania treningu {job_id}: {new_status}")
+        return True
+
+    def cleanup_old_jobs(self, max_age_hours: int = 72) -> int:
+        """Usuwa zakończone zadania starsze niż max_age_hours"""
+        engine = self._get_engine()
+
+        with engine.begin() as conn:
+            result = conn.execute(text("""
+                DELETE FROM ml_training_jobs
+                WHERE status IN ('completed', 'failed', 'cancelled')
+                  AND created_at < NOW() - make_interval(hours => :hours)
+            """), {'hours': max_age_hours})
+
+        return result.rowcount
+
+    def _serialize(self, row) -> Dict[str, Any]:
+        data = dict(row)
+        for key, value in data.items():
+            if isinstance(value, datetime):
+                data[key] = value.isoformat()
+        return data
+
+    def _launch_queued_jobs(self):
+        """Uruchamia zadania z kolejki w ramach globalnego limitu równoległości"""
+        with self.launch_lock:
+            self._launch_locked()
+
+    def _launch_locked(self):
+        engine = self._get_engine()
+
+        with engine.begin() as conn:
+            conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {'key': LAUNCH_LOCK_KEY})
+
+            # Zadania osieroconych procesów (restart aplikacji, padnięty worker) nie mogą zajmować slotów
+            self._reclaim_orphaned_jobs(conn)
+
+            active = conn.execute(text("""
+                SELECT COUNT(*) FROM ml_training_jobs WHERE status IN ('starting', 'running', 'cancelling')
+            """)).scalar()
+            slots = self.max_concurrent - active
+            if slots <= 0:
+                return
+
+            jobs = conn.execute(text("""
+                UPDATE ml_training_jobs
+                SET status = 'starting', owner_host = :owner, heartbeat_at = NOW(),
+                    message = 'Uruchamianie procesu treningu'
+                WHERE id IN (
+                    SELECT id FROM ml_training_jobs
+                    WHERE status = 'queued'
+                    ORDER BY created_at
+                    LIMIT :slots
+                )
+                RETURNING id, job_type, params
+            """), {'owner': self.owner_id, 'slots': slots}).fetchall()
+
+        for job_id, job_type, params in jobs:
+            process = self.mp_context.Process(
+                target=_job_process_main,
+                args=(job_id, job_type, params or {}, self.limits),
+                name=f"ml-training-{job_id[:8]}",
+                daemon=True
+            )
+            process.start()
+            with self.lock:
+                self.processes[job_id] = (process, time.monotonic())
+            logger.info(f"Uruchomiono proces treningu {job_id} (pid {process.pid})")
+
+    def _reclaim_orphaned_jobs(self, conn):
+        """
+        Oznacza jako nieudane aktywne zadania, których proces już nie istnieje
+
+        Zadanie jest osierocone, gdy jego właściciel (owner_host = host:pid managera) to ten
+        proces, ale zadania nie ma wśród jego procesów potomnych (pid użyty ponownie po
+        restarcie), gdy właściciel z tego hosta już nie działa, albo gdy heartbeat właściciela
+        jest starszy niż HEARTBEAT_TIMEOUT_SECONDS (inny host).
+        """
+        rows = conn.execute(text("""
+            SELECT id, owner_host, worker_pid,
+                   EXTRACT(EPOCH FROM NOW() - COALESCE(heartbeat_at, started_at, created_at))
+            FROM ml_training_jobs
+            WHERE status IN ('starting', 'running', 'cancelling')
+        """)).fetchall()
+
+        with self.lock:
+            owned = set(self.processes)
+        host = socket.gethostname()
+
+        for job_id, owner, worker_pid, seconds_since_heartbeat in rows:
+            owner_host, _, owner_pid = (owner or '').rpartition(':')
+            if owner == self.owner_id:
+                orphaned = job_id not in owned
+            elif owner_host == host and owner_pid.isdigit():
+                orphaned = not _pid_alive(int(owner_pid))
+            else:
+                orphaned = seconds_since_heartbeat is not None and seconds_since_heartbeat > HEARTBEAT_TIMEOUT_SECONDS
+            if not orphaned:
+                continue
+
+            logger.warning(f"Zadanie treningu {job_id} osierocone (właściciel {owner}, pid {worker_pid}) - oznaczam jako nieudane")
+            conn.execute(text("""
+                UPDATE ml_training_jobs
+                SET status = 'failed', finished_at = NOW(),
+                    error = :error, message = 'Proces treningu przerwany'
+                WHERE id = :id AND status IN ('starting', 'running', 'cancelling')
+            """), {'id': job_id,
+                   'error': f"Proces treningu (właściciel {owner}, pid {worker_pid}) przestał działać"})
+
+    def _ensure_monitor(self):
+        with self.lock:
+            if self.monitor_thread is None or not self.monitor_thread.is_alive():
+                self.monitor_thread = threading.Thread(target=self._monitor_loop, name='ml-training-monitor', daemon=True)
+                self.monitor_thread.start()
+
+    def _monitor_loop(self):
+        """Nadzoruje procesy: timeout, anulowanie, nieoczekiwane zakończenie; uruchamia kolejkę"""
+        while True:
+            try:
+                self._supervise_processes()
+                self._launch_queued_jobs()
+
+                with self.lock:
+                    owned = len(self.processes)
+                if owned == 0:
+                    with self.engine.connect() as conn:
+                        queued = conn.execute(text(
+                            "SELECT COUNT(*) FROM ml_training_jobs WHERE status = 'queued'"
+                        )).scalar()
+                    if queued == 0:
+                        return
+            except Exception as e:
+                logger.error(f"Błąd monitora zadań treningu: {e}")
+
+            time.sleep(2)
+
+    def _supervise_processes(self):
+        with self.lock:
+            owned = list(self.processes.items())
+
+        if owned:
+            # Heartbeat właściciela - pozostałe workery odróżniają dzięki niemu zadania osierocone
+            with self.engine.begin() as conn:
+                conn.execute(text("""
+                    UPDATE ml_training_jobs SET heartbeat_at = NOW()
+                    WHERE id = ANY(:ids) AND status IN ('starting', 'running', 'cancelling')
+                """), {'ids': [job_id for job_id, _ in owned]})
+
+        for job_id, (process, started) in owned:
+            with self.engine.connect() as conn:
+                row = conn.execute(text("""
+                    SELECT status, EXTRACT(EPOCH FROM NOW() - cancel_requested_at)
+                    FROM ml_training_jobs WHERE id = :id
+                """), {'id': job_id}).fetchone()
+            status, seconds_since_cancel = row if row else (None, None)
+
+            if not process.is_alive():
+                process.join(timeout=1)
+                if status not in FINAL_STATUSES:
+                    _finish_job(self.engine, job_id, 'failed',
+                                error=f"Proces treningu zakończył się nieoczekiwanie (exit code {process.exitcode})")
+                with self.lock:
+                    self.processes.pop(job_id, None)
+                continue
+
+            if time.monotonic() - started > self.job_timeout:
+                logger.error(f"Zadanie treningu {job_id} przekroczyło limit czasu {self.job_timeout}s")
+                process.terminate()
+                process.join(timeout=5)
+                _finish_job(self.engine, job_id, 'failed', error=f"Przekroczono limit czasu ({self.job_timeout}s)")
+            elif status == 'cancelling' and seconds_since_cancel is not None and \
+                    seconds_since_cancel > self.cancel_grace_period:
+                logger.info(f"Wymuszone zakończenie procesu treningu {job_id}")
+                process.terminate()
+                process.join(timeout=5)
+                _finish_job(self.engine, job_id, 'cancelled', message='Zadanie anulowane przez użytkownika')
+
+
+# Global training job manager instance
+training_job_manager = TrainingJobManager()
@@ -0,0 +1,129 @@
+"""
+Stabilne identyfikatory komunikatów ESPI/EBI
+communication_id to hash blake2b znormalizowanego URL i tytułu - ten sam komunikat
+dostaje ten sam identyfikator w każdym procesie i przy każdym uruchomieniu
+(wbudowane hash() jest solone per proces, więc nie nadaje się do deduplikacji).
+
+migrate_communication_ids() jednorazowo przelicza identyfikatory zapisanych
+komunikatów i usuwa duplikaty powstałe przy starym schemacie.
+"""
+
+import hashlib
+import json
+import logging
+import re
+from typing import Dict, Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+# Długość skrótu w znakach hex (digest_size * 2)
+ID_DIGEST_SIZE = 10
+
+# Parametry śledzące pomijane przy normalizacji URL
+_TRACKING_PARAMS = re.compile(r'^(utm_\w+|fbclid|gclid)$', re.IGNORECASE)
+
+# communication_id w obecnym schemacie kończy się skrótem hex
+_STABLE_ID_PATTERN = rf'_[0-9a-f]{{{ID_DIGEST_SIZE * 2}}}$'
+
+
+def normalize_url(url: Optional[str]) -> str:
+    """Normalizuje URL: małe litery schematu i hosta, bez fragmentu, parametrów śledzących i końcowego '/'"""
+    if not url:
+        return ''
+    parts = urlsplit(url.strip())
+    query = sorted((k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+                   if not _TRACKING_PARAMS.match(k))
+    path = parts.path.rstrip('/') or '/'
+    return urlunsplit(('https' if parts.scheme.lower() in ('http', 'https') else parts.scheme.lower(),
+                       parts.netloc.lower(), path, urlencode(query), ''))
+
+
+def normalize_title(title: Optional[str]) -> str:
+    """Normalizuje tytuł: pojedyncze spacje, bez wielkości liter"""
+    return ' '.join((title or '').split()).casefold()
+
+
+def make_communication_id(communication_type: str, ticker: str, url: Optional[str], title: Optional[str]) -> str:
+    """
+    Deterministyczny identyfikator komunikatu
+
+    Data publikacji nie wchodzi do hasha - przy braku daty w źródle scrapery
+    podstawiają bieżący czas, co dawałoby różne identyfikatory przy każdym pobraniu.
+    """
+    payload = f"{normalize_url(url)}\n{normalize_title(title)}".encode('utf-8')
+    digest = hashlib.blake2b(payload, digest_size=ID_DIGEST_SIZE).hexdigest()
+    return f"{communication_type}_{ticker}_{digest}"
+
+
+def migrate_communication_ids(engine) -> Dict[str, int]:
+    """
+    Przelicza communication_id zapisanych komunikatów na stabilny schemat i scala duplikaty
+
+    Z każdej grupy komunikatów o tym samym nowym identyfikatorze zostaje wiersz z najdłuższą
+    treścią (przy remisie - najwcześniej zapisany). Migracja jest idempotentna: gdy wszystkie
+    identyfikatory są już w nowym schemacie, kończy się na jednym zapytaniu.
+
+    Returns:
+        {'updated': liczba przeliczonych identyfikatorów, 'removed': liczba usuniętych duplikatów}
+    """
+    stats = {'updated': 0, 'removed': 0}
+
+    legacy_query = text("""
+        SELECT EXISTS (
+            SELECT 1 FROM espi_communications
+            WHERE communication_id IS NULL OR communication_id !~ :pattern
+        )
+    """)
+
+    with engine.begin() as conn:
+        if not conn.execute(legacy_query, {'pattern': _STABLE_ID_PATTERN}).scalar():
+            return stats
+
+        # Blokada przed zapisami scraperów i równoległą migracją z drugiego procesu
+        conn.execute(text("LOCK TABLE espi_communications IN SHARE ROW EXCLUSIVE MODE"))
+        if not conn.execute(legacy_query, {'pattern': _STABLE_ID_PATTERN}).scalar():
+            return stats
+
+        rows = conn.execute(text("""
+            SELECT ctid::text AS row_ref, ticker, communication_type, url, title,
+                   communication_id, COALESCE(LENGTH(content), 0) AS content_length
+            FROM espi_communications
+            ORDER BY ctid
+        """)).mappings().all()
+
+        keepers = {}
+        duplicates = []
+        for row in rows:
+            new_id = make_communication_id(row['communication_type'], row['ticker'], row['url'], row['title'])
+            kept = keepers.get(new_id)
+            if kept is None:
+                keepers[new_id] = row
+            elif row['content_length'] > kept['content_length']:
+                duplicates.append(kept['row_ref'])
+                keepers[new_id] = row
+            else:
+                duplicates.append(row['row_ref'])
+
+        if duplicates:
+            conn.execute(text("""
+                DELETE FROM espi_communications
+                WHERE ctid = ANY(CAST(:refs AS tid[]))
+            """), {'refs': duplicates})
+            stats['removed'] = len(duplicates)
+
+        changed = [{'row_ref': row['row_ref'], 'communication_id': new_id}
+                   for new_id, row in keepers.items() if row['communication_id'] != new_id]
+        if changed:
+            conn.execute(text("""
+                UPDATE espi_communications AS e
+                SET communication_id = r.communication_id
+                FROM jsonb_to_recordset(CAST(:rows AS JSONB)) AS r(row_ref TEXT, communication_id TEXT)
+                WHERE e.ctid = CAST(r.row_ref AS tid)
+            """), {'rows': json.dumps(changed)})
+            stats['updated'] = len(changed)
+
+    logger.info(f"🔁 Migracja communication_id: przeliczono {stats['updated']}, usunięto duplikatów {stats['removed']}")
+    return stats
@@ -0,0 +1,174 @@
+"""
+Wewnątrzprocesowa szyna zdarzeń
+Zapis paczki notowań publikuje quotes.updated z najnowszym notowaniem każdego tickera,
+a subskrybenci (alerty cenowe, ponowna ocena rekomendacji) pracują tylko na tych tickerach
+zamiast odpytywać całą bazę na własnych timerach.
+
+Paczkę notowań zapisuje dokładnie jeden proces, więc zdarzenie obsługuje tylko on - bez
+duplikatów między workerami gunicorna. Subskrybenci działają na wspólnej ograniczonej puli
+wątków i nie blokują zapisu; zdarzenia nadchodzące w trakcie obsługi są scalane (najnowsze
+notowanie per ticker) i obsługiwane jednym kolejnym wywołaniem.
+"""
+
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+QUOTES_UPDATED = 'quotes.updated'
+
+# Wspólna pula wątków subskrybentów
+EVENT_BUS_WORKERS = 4
+
+# handler({klucz (ticker): najnowszy ładunek}) -> opcjonalne podsumowanie
+EventHandler = Callable[[Dict[str, Dict[str, Any]]], Optional[Dict[str, Any]]]
+
+
+def _merge_items(pending: Dict[str, Dict[str, Any]], items: Dict[str, Dict[str, Any]]):
+    """Dokłada ładunki do oczekujących - przy kolizji wygrywa nowszy (po polu datetime, jeśli jest)"""
+    for key, item in items.items():
+        current = pending.get(key)
+        if (current is None or current.get('datetime') is None or item.get('datetime') is None
+                or current['datetime'] <= item['datetime']):
+            pending[key] = item
+
+
+class _Subscription:
+    def __init__(self, topic: str, name: str, handler: EventHandler):
+        self.topic = topic
+        self.name = name
+        self.handler = handler
+        self.lock = threading.Lock()
+        self.pending: Dict[str, Dict[str, Any]] = {}
+        self.running = False
+        self.stats = {'events': 0, 'coalesced': 0, 'runs': 0, 'items': 0, 'errors': 0,
+                      'last_run_at': None, 'last_duration_seconds': None, 'last_error': None}
+
+
+class EventBus:
+    """Tematy z subskrybentami obsługiwanymi asynchronicznie i ze scalaniem zdarzeń"""
+
+    def __init__(self, max_workers: int = EVENT_BUS_WORKERS):
+        self._subscriptions: Dict[str, Dict[str, _Subscription]] = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='event-bus')
+
+    def subscribe(self, topic: str, name: str, handler: EventHandler):
+        """Rejestruje subskrybenta tematu (ponowna rejestracja pod tą samą nazwą nadpisuje)"""
+        with self._lock:
+            self._subscriptions.setdefault(topic, {})[name] = _Subscription(topic, name, handler)
+
+    def unsubscribe(self, topic: str, name: str):
+        with self._lock:
+            self._subscriptions.get(topic, {}).pop(name, None)
+
+    def publish(self, topic: str, items: Dict[str, Dict[str, Any]]) -> int:
+        """
+        Publikuje zdarzenie (nie czeka na subskrybentów)
+
+        Args:
+            topic: Temat, np. QUOTES_UPDATED
+            items: {ticker: ładunek} - dla quotes.updated najnowsze notowanie tickera
+
+        Returns:
+            Liczba powiadomionych subskrybentów
+        """
+        if not items:
+            return 0
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(topic, {}).values())
+
+        for subscription in subscriptions:
+            with subscription.lock:
+                subscription.stats['events'] += 1
+                _merge_items(subscription.pending, items)
+                if subscription.running:
+                    subscription.stats['coalesced'] += 1
+                    continue
+                subscription.running = True
+            self._executor.submit(self._drain, subscription)
+        return len(subscriptions)
+
+    def _drain(self, subscription: _Subscription):
+        """Obsługuje oczekujące ładunki, dopóki w trakcie obsługi dochodzą nowe"""
+        while True:
+            with subscription.lock:
+                if not subscription.pending:
+                    subscription.running = False
+                    return
+                items, subscription.pending = subscription.pending, {}
+
+            started = time.monotonic()
+            error = None
+            try:
+                subscription.handler(items)
+            except Exception as e:
+                error = str(e)
+                logger.warning(f"⚠️ Subskrybent {subscription.topic}/{subscription.name} zakończył się błędem: {e}")
+
+            with subscription.lock:
+                stats = subscription.stats
+                stats['runs'] += 1
+                stats['items'] += len(items)
+                stats['last_run_at'] = datetime.now().isoformat()
+                stats['last_duration_seconds'] = round(time.monotonic() - started, 3)
+                if error:
+                    stats['errors'] += 1
+                    stats['last_error'] = error
+
+    def status(self) -> List[Dict[str, Any]]:
+        """Subskrybenci ze statystykami obsługi (w obrębie procesu)"""
+        with self._lock:
+            subscriptions = [s for topic in self._subscriptions.values() for s in topic.values()]
+        report = []
+        for subscription in subscriptions:
+            with subscription.lock:
+                report.append({'topic': subscription.topic, 'name': subscription.name,
+                               'running': subscription.running, 'pending': len(subscription.pending),
+                               **subscription.stats})
+        return report
+
+
+# ----------------------------------------------------------------------
+# Domyślni subskrybenci (importy leniwe - unikają cykli z modułami workerów)
+# ----------------------------------------------------------------------
+
+def _check_price_alerts(quotes: Dict[str, Dict[str, Any]]):
+    from price_alerts import get_price_alert_system
+    return get_price_alert_system().check_alerts(
+        tickers=list(quotes), prices={ticker: float(q['price']) for ticker, q in quotes.items()})
+
+
+def _rescore_recommendations(quotes: Dict[str, Dict[str, Any]]):
+    from workers.recommendation_tracker import get_recommendation_tracker
+    return get_recommendation_tracker().rescore_active_recommendations(
+        {ticker: float(q['price']) for ticker, q in quotes.items()})
+
+
+DEFAULT_SUBSCRIBERS = [
+    (QUOTES_UPDATED, 'price_alerts', _check_price_alerts),
+    (QUOTES_UPDATED, 'recommendation_rescoring', _rescore_recommendations),
+]
+
+_bus: Optional[EventBus] = None
+_bus_lock = threading.Lock()
+
+
+def get_event_bus() -> EventBus:
+    """Zwraca szynę zdarzeń procesu z zarejestrowanymi domyślnymi subskrybentami"""
+    global _bus
+    with _bus_lock:
+        if _bus is None:
+            _bus = EventBus()
+            for topic, name, handler in DEFAULT_SUBSCRIBERS:
+                _bus.subscribe(topic, name, handler)
+        return _bus
+
+
+def publish_quotes_updated(quotes: Dict[str, Dict[str, Any]]) -> int:
+    """Publikuje quotes.updated z najnowszymi zapisanymi notowaniami {ticker: notowanie}"""
+    return get_event_bus().publish(QUOTES_UPDATED, quotes)
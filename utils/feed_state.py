@@ -0,0 +1,179 @@
+"""
+Stan odpytywania feedów RSS - zapytania warunkowe i wykrywanie zmian treści
+Dla każdego URL feedu przechowuje ETag, Last-Modified i hash treści, dzięki czemu
+niezmieniony feed kończy się na odpowiedzi 304 (albo porównaniu hasha) bez parsowania.
+
+Stan jest w bazie (tabela feed_poll_state), więc współdzielą go wszystkie procesy aplikacji.
+"""
+
+import hashlib
+import logging
+import re
+from datetime import datetime
+from typing import Dict, Iterable, Optional, Tuple
+
+from sqlalchemy import text
+
+from utils.http_fetcher import FetchResult, HttpFetcher
+
+logger = logging.getLogger(__name__)
+
+# Elementy kanału zmieniające się przy każdym wygenerowaniu feedu, pomijane w hashu
+_VOLATILE_FEED_ELEMENTS = re.compile(rb'<lastBuildDate>.*?</lastBuildDate>', re.DOTALL)
+
+
+class FeedStateStore:
+    """ETag/Last-Modified/hash treści per URL feedu"""
+
+    def __init__(self, engine):
+        """
+        Args:
+            engine: Silnik SQLAlchemy scrapera (tabela feed_poll_state tworzona przy starcie)
+        """
+        self.engine = engine
+        self._create_table()
+
+    def _create_table(self):
+        """Tworzy tabelę stanu feedów"""
+        try:
+            with self.engine.begin() as conn:
+                conn.execute(text("""
+                    CREATE TABLE IF NOT EXISTS feed_poll_state (
+                        url TEXT PRIMARY KEY,
+                        etag TEXT,
+                        last_modified TEXT,
+                        content_hash VARCHAR(32),
+                        covered_since TIMESTAMP,
+                        last_status INTEGER,
+                        last_checked_at TIMESTAMP,
+                        last_changed_at TIMESTAMP,
+                        unchanged_polls INTEGER DEFAULT 0
+                    )
+                """))
+        except Exception as e:
+            logger.warning(f"⚠️ Nie można utworzyć tabeli feed_poll_state: {e}")
+
+    @staticmethod
+    def content_hash(content: bytes) -> str:
+        """Hash treści feedu bez elementów zmiennych przy każdym generowaniu"""
+        return hashlib.blake2b(_VOLATILE_FEED_ELEMENTS.sub(b'', content), digest_size=16).hexdigest()
+
+    def load(self, urls: Iterable[str]) -> Dict[str, Dict]:
+        """Ładuje zapisany stan dla podanych URL-i"""
+        urls = list(urls)
+        if not urls:
+            return {}
+        try:
+            with self.engine.connect() as conn:
+                result = conn.execute(text("""
+                    SELECT url, etag, last_modified, content_hash, covered_since
+                    FROM feed_poll_state
+                    WHERE url = ANY(:urls)
+                """), {'urls': urls})
+                return {row['url']: dict(row) for row in result.mappings()}
+        except Exception as e:
+            logger.warning(f"⚠️ Nie można załadować stanu feedów: {e}")
+            return {}
+
+    def fetch_changed(self, fetcher: HttpFetcher, urls: Iterable[str], since: datetime,
+                      headers: Optional[Dict[str, str]] = None) -> Tuple[Dict[str, FetchResult], Dict[str, Dict]]:
+        """
+        Pobiera feedy zapytaniami warunkowymi i odrzuca te, które się nie zmieniły
+
+        Feed jest pomijany tylko wtedy, gdy poprzednio przetworzona treść obejmowała już
+        okno od `since` - dłuższe okno (np. ręczne uruchomienie) wymusza pełne pobranie.
+
+        Args:
+            fetcher: Wspólny klient HTTP
+            urls: URL-e feedów
+            since: Początek okna czasowego przetwarzanych wpisów
+            headers: Nagłówki scrapera
+
+        Returns:
+            (wyniki feedów zmienionych lub z błędem, stan do zapisania przez commit() po przetworzeniu)
+        """
+        urls = list(dict.fromkeys(urls))
+        states = {url: state for url, state in self.load(urls).items()
+                  if state['covered_since'] is not None and state['covered_since'] <= since}
+
+        conditional = {}
+        for url, state in states.items():
+            conditional[url] = {}
+            if state['etag']:
+                conditional[url]['If-None-Match'] = state['etag']
+            if state['last_modified']:
+                conditional[url]['If-Modified-Since'] = state['last_modified']
+
+        results = fetcher.fetch_many(urls, headers=headers, per_url_headers=conditional)
+
+        changed = {}
+        pending = {}
+        unchanged = []
+        for url, result in results.items():
+            state = states.get(url)
+            if result.not_modified and state:
+                unchanged.append((url, result.status))
+                continue
+            if not result.ok:
+                changed[url] = result
+                continue
+
+            digest = self.content_hash(result.content)
+            if state and state['content_hash'] == digest:
+                unchanged.append((url, result.status))
+                continue
+
+            changed[url] = result
+            pending[url] = {
+                'url': url,
+                'etag': result.headers.get('etag'),
+                'last_modified': result.headers.get('last-modified'),
+                'content_hash': digest,
+                'covered_since': since,
+                'last_status': result.status
+            }
+
+        if unchanged:
+            self._mark_unchanged(unchanged)
+            logger.info(f"📡 Feedy bez zmian: {len(unchanged)}/{len(urls)}")
+
+        return changed, pending
+
+    def _mark_unchanged(self, unchanged):
+        try:
+            with self.engine.begin() as conn:
+                conn.execute(text("""
+                    UPDATE feed_poll_state
+                    SET last_status = :status,
+                        last_checked_at = CURRENT_TIMESTAMP,
+                        unchanged_polls = unchanged_polls + 1
+                    WHERE url = :url
+                """), [{'url': url, 'status': status} for url, status in unchanged])
+        except Exception as e:
+            logger.warning(f"⚠️ Nie można zaktualizować stanu feedów: {e}")
+
+    def commit(self, pending: Dict[str, Dict]):
+        """Zapisuje stan feedów po udanym przetworzeniu ich wpisów"""
+        if not pending:
+            return
+        try:
+            with self.engine.begin() as conn:
+                conn.execute(text("""
+                    INSERT INTO feed_poll_state
+                        (url, etag, last_modified, content_hash, covered_since,
+                         last_status, last_checked_at, last_changed_at, unchanged_polls)
+                    VALUES
+                        (:url, :etag, :last_modified, :content_hash, :covered_since,
+                         :last_status, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP, 0)
+                    ON CONFLICT (url) DO UPDATE SET
+                        etag = EXCLUDED.etag,
+                        last_modified = EXCLUDED.last_modified,
+                        content_hash = EXCLUDED.content_hash,
+                        covered_since = EXCLUDED.covered_since,
+                        last_status = EXCLUDED.last_status,
+                        last_checked_at = EXCLUDED.last_checked_at,
+                        last_changed_at = EXCLUDED.last_changed_at,
+                        unchanged_polls = 0
+                """), list(pending.values()))
+        except Exception as e:
+            logger.warning(f"⚠️ Nie można zapisać stanu feedów: {e}")
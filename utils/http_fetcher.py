@@ -0,0 +1,236 @@
+"""
+Wspólna warstwa pobierania HTTP dla scraperów newsów i komunikatów ESPI
+Asynchroniczny klient httpx z pulą połączeń keep-alive, limitem równoległości
+i odstępem między zapytaniami per host oraz ponawianiem z wykładniczym backoffem.
+
+Scrapery są synchroniczne (APScheduler, Flask), dlatego klient działa na własnej
+pętli asyncio w wątku tła, a fetch_many() blokuje do zakończenia całej paczki.
+"""
+
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Tuple
+from urllib.parse import urlparse
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# Statusy, dla których ponawiamy zapytanie
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Nagłówki ustawiane przez klienta httpx, pomijane w nagłówkach przekazanych przez scrapery
+MANAGED_HEADERS = {'accept-encoding', 'connection'}
+
+# Limity per host: (maks. równoległych zapytań, min. odstęp między startami zapytań w sekundach)
+DEFAULT_HOST_LIMITS = {
+    'www.bankier.pl': (3, 0.4),
+    'www.money.pl': (3, 0.4),
+    'www.gpw.pl': (4, 0.25),
+}
+DEFAULT_LIMIT = (2, 0.5)
+
+
+@dataclass
+class FetchResult:
+    """Wynik pobrania pojedynczego URL"""
+    url: str
+    status: Optional[int] = None
+    content: bytes = b''
+    encoding: Optional[str] = None
+    headers: Dict[str, str] = field(default_factory=dict)
+    error: Optional[str] = None
+    attempts: int = 0
+    elapsed: float = 0.0
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None and self.status is not None and 200 <= self.status < 300
+
+    @property
+    def not_modified(self) -> bool:
+        """Odpowiedź 304 na zapytanie warunkowe (If-None-Match / If-Modified-Since)"""
+        return self.status == 304
+
+    @property
+    def text(self) -> str:
+        """Treść zdekodowana wg charset z nagłówka (domyślnie UTF-8)"""
+        try:
+            return self.content.decode(self.encoding or 'utf-8', errors='replace')
+        except LookupError:
+            return self.content.decode('utf-8', errors='replace')
+
+
+class _HostLimiter:
+    """Limit równoległości i minimalny odstęp między startami zapytań dla jednego hosta"""
+
+    def __init__(self, concurrency: int, interval: float):
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.interval = interval
+        self.lock = asyncio.Lock()
+        self.next_slot = 0.0
+
+    async def wait_turn(self):
+        loop = asyncio.get_running_loop()
+        async with self.lock:
+            now = loop.time()
+            start = max(now, self.next_slot)
+            self.next_slot = start + self.interval
+        if start > now:
+            await asyncio.sleep(start - now)
+
+
+class HttpFetcher:
+    """Asynchroniczny klient HTTP współdzielony przez scrapery w ramach procesu"""
+
+    def __init__(self, headers: Optional[Dict[str, str]] = None, timeout: float = 20.0,
+                 max_connections: int = 20, retries: int = 3, backoff: float = 1.0,
+                 host_limits: Optional[Dict[str, Tuple[int, float]]] = None):
+        """
+        Args:
+            headers: Domyślne nagłówki zapytań
+            timeout: Timeout pojedynczego zapytania (sekundy)
+            max_connections: Rozmiar puli połączeń keep-alive
+            retries: Liczba ponowień po błędzie sieci lub statusie 429/5xx
+            backoff: Bazowe opóźnienie ponowienia (podwajane co próbę, z losowym jitterem)
+            host_limits: {host: (równoległość, odstęp_s)} nadpisujące DEFAULT_HOST_LIMITS
+        """
+        self.headers = headers or {}
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.retries = retries
+        self.backoff = backoff
+        self.host_limits = dict(DEFAULT_HOST_LIMITS)
+        self.host_limits.update(host_limits or {})
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._client: Optional[httpx.AsyncClient] = None
+        self._limiters: Dict[str, _HostLimiter] = {}
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_started(self):
+        """Uruchamia pętlę asyncio i klienta w wątku tła (ponownie po fork)"""
+        with self._start_lock:
+            if self._loop is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._loop = asyncio.new_event_loop()
+            self._limiters = {}
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._loop.run_forever, name='http-fetcher', daemon=True)
+            self._thread.start()
+            asyncio.run_coroutine_threadsafe(self._create_client(), self._loop).result()
+
+    async def _create_client(self):
+        self._client = httpx.AsyncClient(
+            headers=self.headers,
+            timeout=self.timeout,
+            follow_redirects=True,
+            limits=httpx.Limits(max_connections=self.max_connections,
+                                max_keepalive_connections=self.max_connections,
+                                keepalive_expiry=60)
+        )
+
+    def _limiter(self, host: str) -> _HostLimiter:
+        if host not in self._limiters:
+            concurrency, interval = self.host_limits.get(host, DEFAULT_LIMIT)
+            self._limiters[host] = _HostLimiter(concurrency, interval)
+        return self._limiters[host]
+
+    def _retry_delay(self, attempt: int, response: Optional[httpx.Response]) -> float:
+        """Opóźnienie przed ponowieniem - Retry-After serwera albo wykładniczy backoff z jitterem"""
+        if response is not None:
+            retry_after = response.headers.get('Retry-After', '')
+            if retry_after.isdigit():
+                return min(float(retry_after), 60.0)
+        return self.backoff * (2 ** attempt) * (0.5 + random.random())
+
+    async def _fetch(self, url: str, headers: Optional[Dict[str, str]]) -> FetchResult:
+        result = FetchResult(url=url)
+        limiter = self._limiter(urlparse(url).netloc.lower())
+        started = time.monotonic()
+
+        for attempt in range(self.retries + 1):
+            result.attempts = attempt + 1
+            response = None
+            async with limiter.semaphore:
+                await limiter.wait_turn()
+                try:
+                    response = await self._client.get(url, headers=headers)
+                    result.status = response.status_code
+                    result.headers = dict(response.headers)
+                    result.content = response.content
+                    result.encoding = response.charset_encoding
+                    result.error = None if response.is_success or response.status_code == 304 else f"HTTP {response.status_code}"
+                except httpx.InvalidURL as e:
+                    result.error = f"InvalidURL: {e}"
+                    break
+                except httpx.HTTPError as e:
+                    result.error = f"{type(e).__name__}: {e}"
+
+            retryable = response is None or response.status_code in RETRY_STATUSES
+            if result.ok or not retryable or attempt == self.retries:
+                break
+            delay = self._retry_delay(attempt, response)
+            logger.debug(f"⚠️ {url}: {result.error}, ponowienie za {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+        result.elapsed = time.monotonic() - started
+        return result
+
+    async def _fetch_all(self, urls: List[str], headers: Dict[str, str],
+                         per_url_headers: Dict[str, Dict[str, str]]) -> List[FetchResult]:
+        return await asyncio.gather(*(self._fetch(url, {**headers, **per_url_headers.get(url, {})}) for url in urls))
+
+    def fetch_many(self, urls: Iterable[str], headers: Optional[Dict[str, str]] = None,
+                   per_url_headers: Optional[Dict[str, Dict[str, str]]] = None) -> Dict[str, FetchResult]:
+        """
+        Pobiera równolegle wszystkie URL-e (z zachowaniem limitów per host)
+
+        Args:
+            urls: Adresy do pobrania (duplikaty pobierane raz)
+            headers: Nagłówki dodawane do domyślnych dla tej paczki
+            per_url_headers: Dodatkowe nagłówki dla poszczególnych URL-i (np. zapytania warunkowe)
+
+        Returns:
+            {url: FetchResult}
+        """
+        unique_urls = list(dict.fromkeys(u for u in urls if u))
+        if not unique_urls:
+            return {}
+        # Kompresją i połączeniami zarządza klient (br tylko z zainstalowanym brotli)
+        headers = {k: v for k, v in (headers or {}).items() if k.lower() not in MANAGED_HEADERS}
+        self._ensure_started()
+        started = time.monotonic()
+        results = asyncio.run_coroutine_threadsafe(
+            self._fetch_all(unique_urls, headers, per_url_headers or {}), self._loop
+        ).result()
+        failed = sum(1 for r in results if not r.ok and not r.not_modified)
+        logger.info(f"🌐 Pobrano {len(results) - failed}/{len(results)} adresów w {time.monotonic() - started:.1f}s")
+        return {r.url: r for r in results}
+
+    def fetch(self, url: str, headers: Optional[Dict[str, str]] = None) -> FetchResult:
+        """Pobiera pojedynczy URL przez wspólną pulę i limity"""
+        return self.fetch_many([url], headers).get(url, FetchResult(url=url, error='Pusty URL'))
+
+
+_fetcher: Optional[HttpFetcher] = None
+_fetcher_lock = threading.Lock()
+
+
+def get_http_fetcher() -> HttpFetcher:
+    """Zwraca współdzielony w procesie HttpFetcher (wspólna pula i limity per host dla wszystkich scraperów)"""
+    global _fetcher
+    with _fetcher_lock:
+        if _fetcher is None:
+            _fetcher = HttpFetcher(headers={
+                'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+                'Accept-Language': 'pl-PL,pl;q=0.9,en;q=0.8',
+            })
+        return _fetcher
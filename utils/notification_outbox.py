@@ -0,0 +1,802 @@
+"""
+Kolejka wychodzących powiadomień Telegram (outbox)
+Producenci (skan intraday, alerty cenowe, broadcast) tylko zapisują wiadomości do tabeli
+notification_outbox i wracają - wysyłką zajmuje się wątek dyspozytora ze wspólną pulą
+połączeń HTTP, limitem globalnym i limitem per czat. Historia zapisywana jest paczkami.
+
+Kolejka jest trwała (wiadomości przeżywają restart), a wysyła tylko jeden proces naraz
+(blokada doradcza PostgreSQL), więc limity Bot API obowiązują dla całej aplikacji.
+
+Przy skokach liczby powiadomień (skan na otwarciu sesji) dwa mechanizmy ograniczają wysyłkę:
+- coalesce_key: powtórzenie tej samej wiadomości (np. ticker + rekomendacja + typ) do tego
+  samego czatu w oknie suppress_seconds jest pomijane,
+- digest_group: wiadomości grupy są przetrzymywane DIGEST_HOLD_SECONDS i łączone w jeden
+  digest na czat (jedna wiadomość Telegram i jeden wiersz historii).
+"""
+
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, List, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+TELEGRAM_SEND_URL = "https://api.telegram.org/bot{token}/sendMessage"
+
+# Limity Bot API: ~30 wiadomości/s łącznie, ~1 wiadomość/s do jednego czatu
+GLOBAL_MESSAGES_PER_SECOND = 30
+PER_CHAT_INTERVAL_SECONDS = 1.0
+
+# Ile wiadomości dyspozytor pobiera z kolejki naraz (~10 s wysyłki przy limicie globalnym)
+CLAIM_BATCH_SIZE = 300
+
+# Wątki równoległej wysyłki - przy ~100-300 ms na zapytanie wystarcza do wysycenia limitu globalnego
+FANOUT_WORKERS = 16
+
+# Po tylu nieudanych próbach wiadomość trafia do historii jako 'failed'
+MAX_ATTEMPTS = 5
+
+# Odpytywanie kolejki, gdy jest pusta (wiadomości z innych procesów)
+POLL_INTERVAL_SECONDS = 2
+
+# Jak często proces bez blokady sprawdza, czy może przejąć wysyłkę
+LEADER_RETRY_SECONDS = 15
+
+# Czat z dłuższą blokadą (429) jest odkładany do kolejnej paczki zamiast blokować bieżącą
+MAX_IN_BATCH_WAIT_SECONDS = 5
+IN_BATCH_429_RETRIES = 2
+
+# Statusy HTTP oznaczające trwały błąd (np. bot zablokowany, nieistniejący czat)
+PERMANENT_ERROR_STATUSES = {400, 401, 403, 404}
+
+# Jak długo wiadomości z digest_group czekają na pozostałe wiadomości serii
+DIGEST_HOLD_SECONDS = 30
+
+# Limit długości wiadomości Telegram (z zapasem) - dłuższy digest jest dzielony
+MAX_MESSAGE_LENGTH = 4000
+
+# Twardy limit długości wiadomości Telegram
+TELEGRAM_MAX_LENGTH = 4096
+
+# Domyślne okno tłumienia powtórzeń dla wiadomości z coalesce_key
+DEFAULT_SUPPRESS_SECONDS = 30 * 60
+
+# notification_suppression.coalesce_key VARCHAR(200) - dłuższe klucze są skracane z hashem
+MAX_COALESCE_KEY_LENGTH = 200
+
+# Tytuły digestów per grupa
+DIGEST_TITLES = {
+    'intraday_scan': 'Skanowanie Intraday - Digest',
+}
+
+# Klucz blokady doradczej dyspozytora
+DISPATCHER_LOCK_KEY = 7_105_221_041
+
+
+_HTML_TAG = re.compile(r'<(/?)([a-zA-Z]+)[^>]*>')
+
+
+def normalize_coalesce_key(key: Optional[str]) -> Optional[str]:
+    """Klucz powtórzeń mieszczący się w kolumnie - długi jest skracany i uzupełniany hashem całości"""
+    if not key or len(key) <= MAX_COALESCE_KEY_LENGTH:
+        return key
+    digest = hashlib.md5(key.encode('utf-8')).hexdigest()
+    return f"{key[:MAX_COALESCE_KEY_LENGTH - len(digest) - 1]}#{digest}"
+
+
+def truncate_html(text: str, limit: int, marker: str = "\n…") -> str:
+    """
+    Skraca tekst HTML Telegrama do limitu na granicy linii, domykając otwarte znaczniki
+
+    Args:
+        text: Tekst z formatowaniem HTML (b, i, u, code, pre, a)
+        limit: Maksymalna długość wyniku
+        marker: Dopisywany po skróceniu
+    """
+    if len(text) <= limit:
+        return text
+    # Zapas na znacznik skrócenia i domknięcia otwartych tagów
+    cut = text[:max(0, limit - len(marker) - 64)]
+    # Granica linii, o ile nie traci się przy tym więcej niż połowy tekstu
+    if cut.rfind('\n') >= len(cut) // 2:
+        cut = cut[:cut.rindex('\n')]
+    # Ucięty w połowie znacznik lub encja
+    if cut.rfind('<') > cut.rfind('>'):
+        cut = cut[:cut.rfind('<')]
+    if cut.rfind('&') > cut.rfind(';'):
+        cut = cut[:cut.rfind('&')]
+
+    open_tags: List[str] = []
+    for closing, tag in _HTML_TAG.findall(cut):
+        tag = tag.lower()
+        if not closing:
+            open_tags.append(tag)
+        elif tag in open_tags:
+            del open_tags[len(open_tags) - 1 - open_tags[::-1].index(tag)]
+    return cut + ''.join(f"</{tag}>" for tag in reversed(open_tags)) + marker
+
+
+class TokenBucket:
+    """Limit zdarzeń na sekundę (bezpieczny dla wielu wątków)"""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def pause(self, seconds: float):
+        """Wstrzymuje wydawanie tokenów (np. po odpowiedzi 429)"""
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def acquire(self):
+        """Blokuje do uzyskania jednego tokenu"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                wait = self.paused_until - now
+                if wait <= 0:
+                    self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class NotificationOutbox:
+    """Trwała kolejka powiadomień i dyspozytor wysyłki"""
+
+    def __init__(self, engine, bot_token: str):
+        """
+        Args:
+            engine: Silnik SQLAlchemy (tabela notification_outbox tworzona przy starcie)
+            bot_token: Token bota Telegram
+        """
+        self.engine = engine
+        self.bot_token = bot_token
+
+        # Jedna pula połączeń keep-alive do api.telegram.org dla wszystkich wysyłek
+        self.session = requests.Session()
+        self.session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=32, max_retries=0))
+
+        self.global_limit = TokenBucket(GLOBAL_MESSAGES_PER_SECOND)
+        self._chat_ready_at: Dict[str, float] = {}
+        self._chat_lock = threading.Lock()
+
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._leader_conn = None
+        self._leader_checked_at = 0.0
+
+        # Równoległa wysyłka - wątki dzielą pulę połączeń i limit globalny
+        self._executor = ThreadPoolExecutor(max_workers=FANOUT_WORKERS, thread_name_prefix='telegram-send')
+
+        self.stats = {'enqueued': 0, 'suppressed': 0, 'digested': 0, 'sent': 0, 'failed': 0, 'retried': 0}
+        self.last_batch: Optional[Dict[str, Any]] = None
+        self._stats_lock = threading.Lock()
+        self._create_table()
+
+    def _create_table(self):
+        """Tworzy tabelę kolejki"""
+        try:
+            with self.engine.begin() as conn:
+                conn.execute(text("""
+                    CREATE TABLE IF NOT EXISTS notification_outbox (
+                        id BIGSERIAL PRIMARY KEY,
+                        chat_id VARCHAR(50) NOT NULL,
+                        notification_type VARCHAR(50) NOT NULL,
+                        title VARCHAR(200),
+                        message TEXT NOT NULL,
+                        formatted_text TEXT NOT NULL,
+                        ticker VARCHAR(20),
+                        metadata JSONB,
+                        status VARCHAR(20) DEFAULT 'pending',
+                        attempts INTEGER DEFAULT 0,
+                        last_error TEXT,
+                        next_attempt_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    )
+                """))
+                conn.execute(text("ALTER TABLE notification_outbox ADD COLUMN IF NOT EXISTS digest_group VARCHAR(50)"))
+                conn.execute(text("""
+                    CREATE TABLE IF NOT EXISTS notification_suppression (
+                        coalesce_key VARCHAR(200) NOT NULL,
+                        chat_id VARCHAR(50) NOT NULL,
+                        suppress_until TIMESTAMP NOT NULL,
+                        suppressed_count INTEGER DEFAULT 0,
+                        PRIMARY KEY (coalesce_key, chat_id)
+                    )
+                """))
+                conn.execute(text("""
+                    CREATE TABLE IF NOT EXISTS notification_batch_report (
+                        id SMALLINT PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+                        report JSONB NOT NULL,
+                        recorded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    )
+                """))
+                conn.execute(text("""
+                    CREATE INDEX IF NOT EXISTS idx_notification_outbox_pending
+                    ON notification_outbox (next_attempt_at, id)
+                    WHERE status = 'pending'
+                """))
+        except Exception as e:
+            logger.error(f"❌ Błąd tworzenia tabeli notification_outbox: {e}")
+
+    # ------------------------------------------------------------------
+    # Producenci
+    # ------------------------------------------------------------------
+
+    def enqueue(self, messages: Iterable[Dict[str, Any]]) -> Dict[str, int]:
+        """
+        Dodaje wiadomości do kolejki jednym zapytaniem i budzi dyspozytora
+
+        Args:
+            messages: Słowniki z kluczami chat_id, message, formatted_text oraz opcjonalnie
+                      title, notification_type, ticker, metadata, coalesce_key,
+                      suppress_seconds (domyślnie DEFAULT_SUPPRESS_SECONDS) i digest_group
+
+        Returns:
+            {'queued': liczba dodanych, 'suppressed': liczba pominiętych powtórzeń}
+        """
+        rows = []
+        seen = set()
+        for m in messages:
+            row = {
+                'chat_id': str(m['chat_id']),
+                'notification_type': m.get('notification_type') or 'system_alert',
+                'title': m.get('title'),
+                'message': m['message'],
+                'formatted_text': m['formatted_text'],
+                'ticker': m.get('ticker'),
+                'metadata': m.get('metadata'),
+                'coalesce_key': normalize_coalesce_key(m.get('coalesce_key')),
+                'suppress_seconds': m.get('suppress_seconds') or DEFAULT_SUPPRESS_SECONDS,
+                'digest_group': m.get('digest_group'),
+                'delay_seconds': DIGEST_HOLD_SECONDS if m.get('digest_group') else 0
+            }
+            # Powtórzenie w obrębie jednego wywołania
+            if row['coalesce_key']:
+                if (row['coalesce_key'], row['chat_id']) in seen:
+                    continue
+                seen.add((row['coalesce_key'], row['chat_id']))
+            rows.append(row)
+
+        result = {'queued': 0, 'suppressed': 0}
+        if not rows:
+            return result
+
+        with self.engine.begin() as conn:
+            keyed = [r for r in rows if r['coalesce_key']]
+            if keyed:
+                # Okno tłumienia odnawia się tylko wtedy, gdy poprzednie już minęło - RETURNING zwraca
+                # wyłącznie wiadomości dopuszczone do wysyłki (atomowo, także między procesami)
+                allowed = conn.execute(text("""
+                    INSERT INTO notification_suppression (coalesce_key, chat_id, suppress_until)
+                    SELECT r.coalesce_key, r.chat_id,
+                           CURRENT_TIMESTAMP + r.suppress_seconds * INTERVAL '1 second'
+                    FROM jsonb_to_recordset(CAST(:rows AS JSONB))
+                         AS r(coalesce_key TEXT, chat_id TEXT, suppress_seconds DOUBLE PRECISION)
+                    ON CONFLICT (coalesce_key, chat_id) DO UPDATE SET
+                        suppress_until = EXCLUDED.suppress_until,
+                        suppressed_count = 0
+                    WHERE notification_suppression.suppress_until <= CURRENT_TIMESTAMP
+                    RETURNING coalesce_key, chat_id
+                """), {'rows': json.dumps(keyed)}).fetchall()
+                allowed = {(row[0], row[1]) for row in allowed}
+
+                suppressed = [r for r in keyed if (r['coalesce_key'], r['chat_id']) not in allowed]
+                if suppressed:
+                    conn.execute(text("""
+                        UPDATE notification_suppression s
+                        SET suppressed_count = s.suppressed_count + 1
+                        FROM jsonb_to_recordset(CAST(:rows AS JSONB)) AS r(coalesce_key TEXT, chat_id TEXT)
+                        WHERE s.coalesce_key = r.coalesce_key AND s.chat_id = r.chat_id
+                    """), {'rows': json.dumps(suppressed)})
+                    result['suppressed'] = len(suppressed)
+                    rows = [r for r in rows if not r['coalesce_key'] or (r['coalesce_key'], r['chat_id']) in allowed]
+
+            if rows:
+                conn.execute(text("""
+                    INSERT INTO notification_outbox
+                        (chat_id, notification_type, title, message, formatted_text, ticker, metadata,
+                         digest_group, next_attempt_at)
+                    SELECT r.chat_id, r.notification_type, r.title, r.message, r.formatted_text, r.ticker, r.metadata,
+                           r.digest_group, CURRENT_TIMESTAMP + r.delay_seconds * INTERVAL '1 second'
+                    FROM jsonb_to_recordset(CAST(:rows AS JSONB))
+                         AS r(chat_id TEXT, notification_type TEXT, title TEXT, message TEXT,
+                              formatted_text TEXT, ticker TEXT, metadata JSONB,
+                              digest_group TEXT, delay_seconds DOUBLE PRECISION)
+                """), {'rows': json.dumps(rows, default=str)})
+                result['queued'] = len(rows)
+
+        self._count('enqueued', result['queued'])
+        self._count('suppressed', result['suppressed'])
+        if result['suppressed']:
+            logger.info(f"🔕 Pominięto {result['suppressed']} powtórzonych powiadomień")
+        if result['queued']:
+            self.start()
+            self._wake.set()
+        return result
+
+    def send_now(self, message: Dict[str, Any]) -> bool:
+        """
+        Wysyła jedną wiadomość od razu, z pominięciem kolejki (np. testowa wiadomość z panelu)
+
+        Obowiązują te same limity co w dyspozytorze; wynik trafia do historii.
+        """
+        chat_id = str(message['chat_id'])
+        status, error, retry_after = self._send_with_retry({**message, 'chat_id': chat_id}, [])
+        if retry_after is not None:
+            error = error or f"Limit Telegram - ponów za {retry_after:.0f}s"
+
+        try:
+            with self.engine.begin() as conn:
+                conn.execute(text("""
+                    INSERT INTO notification_history
+                        (chat_id, notification_type, title, message, status, error_message, ticker, metadata)
+                    VALUES (:chat_id, :notification_type, :title, :message, :status, :error_message,
+                            :ticker, CAST(:metadata AS JSONB))
+                """), {
+                    'chat_id': chat_id,
+                    'notification_type': message.get('notification_type') or 'system_alert',
+                    'title': message.get('title'),
+                    'message': message['message'],
+                    'status': 'sent' if error is None else 'failed',
+                    'error_message': error,
+                    'ticker': message.get('ticker'),
+                    'metadata': json.dumps(message['metadata'], default=str) if message.get('metadata') else None
+                })
+        except Exception as e:
+            logger.error(f"❌ Błąd zapisywania historii: {e}")
+
+        if error is None:
+            logger.info(f"✅ Wiadomość wysłana do {chat_id}")
+        else:
+            logger.error(f"❌ {error}")
+        return error is None
+
+    def pending_count(self) -> int:
+        """Liczba wiadomości oczekujących w kolejce"""
+        with self.engine.connect() as conn:
+            return conn.execute(text(
+                "SELECT COUNT(*) FROM notification_outbox WHERE status IN ('pending', 'sending')"
+            )).scalar() or 0
+
+    # ------------------------------------------------------------------
+    # Wysyłka
+    # ------------------------------------------------------------------
+
+    def _post(self, chat_id: str, formatted_text: str):
+        """Wywołanie sendMessage - zwraca (status HTTP, błąd lub None, retry_after z odpowiedzi 429)"""
+        try:
+            response = self.session.post(TELEGRAM_SEND_URL.format(token=self.bot_token), data={
+                'chat_id': chat_id,
+                'text': formatted_text,
+                'parse_mode': 'HTML',
+                'disable_web_page_preview': True
+            }, timeout=10)
+        except Exception as e:
+            return None, f"Błąd wysyłania: {e}", None
+
+        if response.status_code == 200:
+            return 200, None, None
+
+        retry_after = None
+        if response.status_code == 429:
+            try:
+                retry_after = float(response.json().get('parameters', {}).get('retry_after', 1))
+            except Exception:
+                retry_after = 1.0
+        return response.status_code, f"Błąd API Telegram: {response.status_code} - {response.text}", retry_after
+
+    def _wait_for_chat(self, chat_id: str):
+        with self._chat_lock:
+            wait = self._chat_ready_at.get(chat_id, 0) - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+
+    def _mark_chat_sent(self, chat_id: str, retry_after: Optional[float] = None):
+        with self._chat_lock:
+            self._chat_ready_at[chat_id] = time.monotonic() + max(PER_CHAT_INTERVAL_SECONDS, retry_after or 0)
+
+    def _deliver(self, batch: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Wysyła paczkę równolegle: czaty rozdzielone między wątki puli, wiadomości jednego czatu
+        po kolei (z zachowaniem kolejności), wszystkie pod wspólnym limitem globalnym
+
+        Returns:
+            Wyniki: {'id', 'status' (sent/failed/pending), 'error', 'delay_seconds', 'attempts'}
+        """
+        by_chat: Dict[str, List[Dict[str, Any]]] = {}
+        for message in sorted(batch, key=lambda m: m['id']):
+            by_chat.setdefault(message['chat_id'], []).append(message)
+
+        started = time.monotonic()
+        latencies: List[float] = []
+        futures = [self._executor.submit(self._deliver_chat, messages, latencies) for messages in by_chat.values()]
+        outcomes = []
+        for future in futures:
+            outcomes.extend(future.result())
+
+        self._record_batch(outcomes, latencies, time.monotonic() - started)
+        return outcomes
+
+    def _deliver_chat(self, messages: List[Dict[str, Any]], latencies: List[float]) -> List[Dict[str, Any]]:
+        """Wysyła wiadomości jednego czatu po kolei"""
+        outcomes = []
+        for index, message in enumerate(messages):
+            status, error, retry_after = self._send_with_retry(message, latencies)
+            if retry_after is not None:
+                # Dłuższa blokada (429) - ta i kolejne wiadomości czatu wracają do kolejki bez zużycia próby
+                for pending in messages[index:]:
+                    outcomes.append({'id': pending['id'], 'status': 'pending',
+                                     'error': error if pending is message else None,
+                                     'delay_seconds': retry_after, 'attempts': pending['attempts'] - 1})
+                self._count('retried', len(messages) - index)
+                break
+            outcomes.append(self._outcome(message, status, error))
+        return outcomes
+
+    def _send_with_retry(self, message: Dict[str, Any], latencies: List[float]):
+        """
+        Wysyła jedną wiadomość z poszanowaniem limitów
+
+        Odpowiedź 429 wstrzymuje limit globalny (najwyżej na MAX_IN_BATCH_WAIT_SECONDS) - ponowienia
+        ze wszystkich wątków ruszają razem po jednej wspólnej pauzie zamiast osobno dobijać się do API.
+        Krótkie blokady są ponawiane w tej samej paczce, dłuższe odkładają czat do kolejki.
+
+        Returns:
+            (status HTTP, błąd lub None, retry_after jeśli wiadomość trzeba odłożyć do kolejki)
+        """
+        chat_id = message['chat_id']
+        for retry in range(IN_BATCH_429_RETRIES + 1):
+            self._wait_for_chat(chat_id)
+            self.global_limit.acquire()
+            started = time.monotonic()
+            status, error, retry_after = self._post(chat_id, message['formatted_text'])
+            latencies.append(time.monotonic() - started)
+            self._mark_chat_sent(chat_id, retry_after)
+            if retry_after is None:
+                return status, error, None
+
+            # Pauza globalna ograniczona - długą blokadę odczuwa tylko ten czat (wraca do kolejki)
+            self.global_limit.pause(min(retry_after, MAX_IN_BATCH_WAIT_SECONDS))
+            if retry_after > MAX_IN_BATCH_WAIT_SECONDS or retry == IN_BATCH_429_RETRIES:
+                return status, error, retry_after
+            self._count('retried')
+        return status, error, retry_after
+
+    def _outcome(self, message, status, error) -> Dict[str, Any]:
+        outcome = {'id': message['id'], 'status': 'sent', 'error': None,
+                   'delay_seconds': 0, 'attempts': message['attempts']}
+        if error is None:
+            self._count('sent')
+            return outcome
+
+        outcome['error'] = error
+        if status in PERMANENT_ERROR_STATUSES or message['attempts'] >= MAX_ATTEMPTS:
+            outcome['status'] = 'failed'
+            self._count('failed')
+            logger.error(f"❌ Nie wysłano powiadomienia do {message['chat_id']}: {error}")
+        else:
+            outcome.update(status='pending', delay_seconds=min(600, 5 * 2 ** message['attempts']))
+            self._count('retried')
+        return outcome
+
+    def _count(self, key: str, value: int = 1):
+        with self._stats_lock:
+            self.stats[key] += value
+
+    def _record_batch(self, outcomes: List[Dict[str, Any]], latencies: List[float], elapsed: float):
+        """Przepustowość i opóźnienia ostatniej paczki"""
+        sent = sum(1 for o in outcomes if o['status'] == 'sent')
+        ordered = sorted(latencies)
+
+        def percentile(p):
+            if not ordered:
+                return None
+            return round(ordered[min(len(ordered) - 1, int(p * len(ordered)))] * 1000)
+
+        report = {
+            'messages': len(outcomes),
+            'sent': sent,
+            'failed': sum(1 for o in outcomes if o['status'] == 'failed'),
+            'requeued': sum(1 for o in outcomes if o['status'] == 'pending'),
+            'elapsed_seconds': round(elapsed, 2),
+            'sent_per_second': round(sent / elapsed, 1) if elapsed > 0 else None,
+            'latency_p50_ms': percentile(0.5),
+            'latency_p95_ms': percentile(0.95),
+            'latency_p99_ms': percentile(0.99)
+        }
+        with self._stats_lock:
+            self.last_batch = report
+        # Paczki wysyła tylko lider - raport w bazie widzą wszystkie workery
+        try:
+            with self.engine.begin() as conn:
+                conn.execute(text("""
+                    INSERT INTO notification_batch_report (id, report, recorded_at)
+                    VALUES (1, CAST(:report AS JSONB), CURRENT_TIMESTAMP)
+                    ON CONFLICT (id) DO UPDATE SET report = EXCLUDED.report, recorded_at = EXCLUDED.recorded_at
+                """), {'report': json.dumps(report)})
+        except Exception as e:
+            logger.warning(f"⚠️ Nie można zapisać raportu paczki powiadomień: {e}")
+        logger.info(f"📨 Wysłano {sent}/{len(outcomes)} powiadomień w {report['elapsed_seconds']}s "
+                    f"({report['sent_per_second']} msg/s, p95 {report['latency_p95_ms']} ms, "
+                    f"p99 {report['latency_p99_ms']} ms)")
+
+    def report(self) -> Dict[str, Any]:
+        """
+        Statystyki wysyłki: liczniki tego procesu od jego startu, ostatnia paczka i długość kolejki
+
+        Ostatnia paczka pochodzi z bazy (zapis dyspozytora-lidera), więc jest taka sama w każdym workerze.
+        """
+        with self._stats_lock:
+            report = {'stats': dict(self.stats), 'last_batch': dict(self.last_batch) if self.last_batch else None,
+                      'last_batch_at': None}
+        report['is_dispatcher'] = self._leader_conn is not None
+        try:
+            with self.engine.connect() as conn:
+                row = conn.execute(text("""
+                    SELECT report, recorded_at FROM notification_batch_report WHERE id = 1
+                """)).fetchone()
+            if row:
+                report['last_batch'] = dict(row[0])
+                report['last_batch_at'] = row[1].isoformat() if row[1] else None
+            report['pending'] = self.pending_count()
+        except Exception as e:
+            report['pending'] = None
+            report['error'] = str(e)
+        return report
+
+    # ------------------------------------------------------------------
+    # Kolejka w bazie
+    # ------------------------------------------------------------------
+
+    def _claim(self) -> List[Dict[str, Any]]:
+        """Pobiera paczkę należnych wiadomości i oznacza je jako wysyłane"""
+        with self.engine.begin() as conn:
+            rows = conn.execute(text("""
+                UPDATE notification_outbox o
+                SET status = 'sending', attempts = o.attempts + 1
+                WHERE o.id IN (
+                    SELECT id FROM notification_outbox
+                    WHERE status = 'pending' AND next_attempt_at <= CURRENT_TIMESTAMP
+                      AND digest_group IS NULL
+                    ORDER BY id
+                    LIMIT :limit
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING o.id, o.chat_id, o.formatted_text, o.attempts
+            """), {'limit': CLAIM_BATCH_SIZE}).mappings().all()
+        return [dict(row) for row in rows]
+
+    def _merge_digests(self):
+        """
+        Łączy wiadomości z digest_group w jeden digest na (czat, grupa)
+
+        Seria jest łączona, gdy jej najstarsza wiadomość odczekała DIGEST_HOLD_SECONDS; digest
+        zastępuje oryginały w kolejce i dalej przechodzi zwykłą ścieżką wysyłki.
+        """
+        with self.engine.begin() as conn:
+            rows = conn.execute(text("""
+                SELECT id, chat_id, digest_group, notification_type, title, message, ticker, metadata
+                FROM notification_outbox
+                WHERE status = 'pending' AND digest_group IS NOT NULL
+                  AND (chat_id, digest_group) IN (
+                      SELECT chat_id, digest_group FROM notification_outbox
+                      WHERE status = 'pending' AND digest_group IS NOT NULL
+                        AND next_attempt_at <= CURRENT_TIMESTAMP
+                  )
+                ORDER BY id
+                FOR UPDATE SKIP LOCKED
+            """)).mappings().all()
+            if not rows:
+                return
+
+            groups: Dict[tuple, List[Dict[str, Any]]] = {}
+            for row in rows:
+                groups.setdefault((row['chat_id'], row['digest_group']), []).append(dict(row))
+
+            singles = []
+            digests = []
+            merged_ids = []
+            for (chat_id, group), messages in groups.items():
+                if len(messages) == 1:
+                    singles.append(messages[0]['id'])
+                    continue
+                merged_ids.extend(m['id'] for m in messages)
+                digests.extend(self._build_digests(chat_id, group, messages))
+
+            if singles:
+                conn.execute(text("""
+                    UPDATE notification_outbox SET digest_group = NULL, next_attempt_at = CURRENT_TIMESTAMP
+                    WHERE id = ANY(:ids)
+                """), {'ids': singles})
+            if digests:
+                conn.execute(text("""
+                    INSERT INTO notification_outbox
+                        (chat_id, notification_type, title, message, formatted_text, metadata)
+                    SELECT r.chat_id, r.notification_type, r.title, r.message, r.formatted_text, r.metadata
+                    FROM jsonb_to_recordset(CAST(:rows AS JSONB))
+                         AS r(chat_id TEXT, notification_type TEXT, title TEXT, message TEXT,
+                              formatted_text TEXT, metadata JSONB)
+                """), {'rows': json.dumps(digests, default=str)})
+                conn.execute(text("DELETE FROM notification_outbox WHERE id = ANY(:ids)"), {'ids': merged_ids})
+
+        if merged_ids:
+            self._count('digested', len(merged_ids))
+            logger.info(f"📬 Połączono {len(merged_ids)} powiadomień w {len(digests)} digestów")
+
+    @staticmethod
+    def _build_digests(chat_id: str, group: str, messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Składa wiadomości serii w digest(y) nieprzekraczające MAX_MESSAGE_LENGTH"""
+        title = DIGEST_TITLES.get(group, 'Podsumowanie powiadomień')
+        types = {m['notification_type'] for m in messages}
+        notification_type = types.pop() if len(types) == 1 else group
+        footer = f"\n\n<i>🕐 {time.strftime('%Y-%m-%d %H:%M:%S')}</i>"
+
+        chunks: List[List[Dict[str, Any]]] = [[]]
+        length = 0
+        for message in messages:
+            part_length = len(message['message']) + len(message['title'] or '') + 20
+            if chunks[-1] and length + part_length > MAX_MESSAGE_LENGTH - 200:
+                chunks.append([])
+                length = 0
+            chunks[-1].append(message)
+            length += part_length
+
+        digests = []
+        for index, chunk in enumerate(chunks, 1):
+            header = f"{title} ({len(messages)})" + (f" - część {index}/{len(chunks)}" if len(chunks) > 1 else "")
+            parts = [(f"<b>{m['title']}</b>\n" if m['title'] else "") + m['message'] for m in chunk]
+            body = "\n\n➖➖➖\n\n".join(parts)
+            digests.append({
+                'chat_id': chat_id,
+                'notification_type': notification_type,
+                'title': header,
+                'message': body,
+                'formatted_text': truncate_html(f"<b>📬 {header}</b>\n\n{body}",
+                                                TELEGRAM_MAX_LENGTH - len(footer)) + footer,
+                'metadata': {
+                    'digest_group': group,
+                    'merged_count': len(chunk),
+                    'tickers': sorted({m['ticker'] for m in chunk if m['ticker']})
+                }
+            })
+        return digests
+
+    def _finalize(self, outcomes: List[Dict[str, Any]]):
+        """Zapisuje wyniki paczki: historia jednym INSERT, ponowienia jednym UPDATE, usunięcie zakończonych"""
+        if not outcomes:
+            return
+        finished = [o['id'] for o in outcomes if o['status'] != 'pending']
+        with self.engine.begin() as conn:
+            conn.execute(text("""
+                INSERT INTO notification_history
+                    (chat_id, notification_type, title, message, status, error_message, sent_at, ticker, metadata)
+                SELECT o.chat_id, o.notification_type, o.title, o.message, r.status, r.error,
+                       CURRENT_TIMESTAMP, o.ticker, o.metadata
+                FROM notification_outbox o
+                JOIN jsonb_to_recordset(CAST(:rows AS JSONB)) AS r(id BIGINT, status TEXT, error TEXT)
+                  ON r.id = o.id
+                WHERE r.status IN ('sent', 'failed')
+                ORDER BY o.id
+            """), {'rows': json.dumps(outcomes)})
+            conn.execute(text("""
+                UPDATE notification_outbox o
+                SET status = 'pending',
+                    attempts = r.attempts,
+                    last_error = r.error,
+                    next_attempt_at = CURRENT_TIMESTAMP + r.delay_seconds * INTERVAL '1 second'
+                FROM jsonb_to_recordset(CAST(:rows AS JSONB))
+                     AS r(id BIGINT, status TEXT, error TEXT, delay_seconds DOUBLE PRECISION, attempts INTEGER)
+                WHERE o.id = r.id AND r.status = 'pending'
+            """), {'rows': json.dumps(outcomes)})
+            if finished:
+                conn.execute(text("DELETE FROM notification_outbox WHERE id = ANY(:ids)"), {'ids': finished})
+
+    def _ensure_leader(self) -> bool:
+        """Blokada doradcza na dedykowanym połączeniu - wysyła tylko jeden proces aplikacji"""
+        if self._leader_conn is not None:
+            if time.monotonic() - self._leader_checked_at < LEADER_RETRY_SECONDS:
+                return True
+            # Zerwane połączenie oznacza utratę blokady
+            try:
+                self._leader_conn.execute(text("SELECT 1"))
+                self._leader_conn.commit()
+                self._leader_checked_at = time.monotonic()
+                return True
+            except Exception:
+                self._release_leader()
+        conn = self.engine.connect()
+        try:
+            acquired = conn.execute(text("SELECT pg_try_advisory_lock(:key)"), {'key': DISPATCHER_LOCK_KEY}).scalar()
+            conn.commit()
+            if not acquired:
+                conn.close()
+                return False
+            # Wiadomości przerwane przez poprzedni proces dyspozytora wracają do kolejki
+            with self.engine.begin() as reset:
+                reset.execute(text("UPDATE notification_outbox SET status = 'pending' WHERE status = 'sending'"))
+        except Exception:
+            conn.close()
+            raise
+        self._leader_conn = conn
+        self._leader_checked_at = time.monotonic()
+        logger.info("📮 Dyspozytor powiadomień aktywny w tym procesie")
+        return True
+
+    def _release_leader(self):
+        if self._leader_conn is not None:
+            try:
+                self._leader_conn.close()
+            except Exception:
+                pass
+            self._leader_conn = None
+
+    # ------------------------------------------------------------------
+    # Wątek dyspozytora
+    # ------------------------------------------------------------------
+
+    def start(self):
+        """Uruchamia wątek dyspozytora (jeśli jeszcze nie działa)"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='notification-dispatcher', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout=15)
+        self._release_leader()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                if not self._ensure_leader():
+                    self._wake.wait(LEADER_RETRY_SECONDS)
+                    self._wake.clear()
+                    continue
+
+                self._merge_digests()
+                batch = self._claim()
+                if not batch:
+                    self._wake.wait(POLL_INTERVAL_SECONDS)
+                    self._wake.clear()
+                    continue
+
+                self._finalize(self._deliver(batch))
+            except Exception as e:
+                logger.error(f"❌ Błąd dyspozytora powiadomień: {e}")
+                self._release_leader()
+                self._stop.wait(5)
+
+
+_outboxes: Dict[str, NotificationOutbox] = {}
+_outboxes_lock = threading.Lock()
+
+
+def get_notification_outbox(engine, bot_token: str) -> NotificationOutbox:
+    """Zwraca współdzieloną w procesie kolejkę dla bazy silnika i bota"""
+    key = f"{engine.url}|{bot_token}"
+    with _outboxes_lock:
+        if key not in _outboxes:
+            _outboxes[key] = NotificationOutbox(engine, bot_token)
+        return _outboxes[key]
@@ -0,0 +1,240 @@
+"""
+Ceny "na chwilę" (as-of) dla wielu par (ticker, znacznik czasu)
+Dla każdej pary zwracane jest ostatnie notowanie z chwili <= znacznik czasu - bez zaglądania w przyszłość.
+
+Dwie implementacje o tej samej semantyce:
+- prices_as_of(): jedno zapytanie SQL (LATERAL + indeks quotes_intraday(company_id, datetime)),
+  O(log n) na parę - dla trackera rekomendacji i pojedynczych ocen,
+- AsOfPriceIndex: posortowane tablice notowań per ticker w pamięci i np.searchsorted -
+  dla backtestów, które pytają o tysiące chwil w załadowanym zakresie.
+"""
+
+import json
+import logging
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+PricePair = Tuple[str, datetime]
+
+
+def _pick_quote(i_price, i_volume, i_time, d_price, d_volume, d_date) -> Optional[Dict[str, Any]]:
+    """Notowanie intraday, a gdy go brak lub jest starsze od ostatniego zamknięcia - zamknięcie dzienne"""
+    if i_price is not None and (d_date is None or i_time.date() >= d_date):
+        return {'price': float(i_price), 'volume': int(i_volume or 0), 'quote_time': i_time,
+                'source': 'quotes_intraday'}
+    if d_price is not None:
+        return {'price': float(d_price), 'volume': int(d_volume or 0),
+                'quote_time': datetime.combine(d_date, datetime.min.time()), 'source': 'quotes_daily'}
+    return None
+
+
+def _frame_series(df: pd.DataFrame, ticker_column: str, time_column: str, price_column: str,
+                  volume_column: Optional[str]) -> Dict[str, Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+    """{ticker: (czasy rosnąco, ceny, wolumeny)} z ramki notowań (dowolna kolejność wierszy)"""
+    df = df.dropna(subset=[price_column]).sort_values([ticker_column, time_column], kind='stable')
+    series = {}
+    for ticker, group in df.groupby(ticker_column, sort=False):
+        volumes = group[volume_column].to_numpy(dtype=float) if volume_column else np.zeros(len(group))
+        series[ticker] = (pd.to_datetime(group[time_column]).to_numpy(dtype='datetime64[ns]'),
+                          group[price_column].to_numpy(dtype=float), volumes)
+    return series
+
+
+def prices_as_of(conn, pairs: Iterable[PricePair]) -> Dict[PricePair, Dict[str, Any]]:
+    """
+    Ostatnie notowanie na chwilę dla wielu par (ticker, znacznik czasu) jednym zapytaniem
+
+    Zamknięcie dzienne jest brane tylko z sesji wcześniejszych niż dzień znacznika czasu
+    (zamknięcie bieżącej sesji nie jest jeszcze znane w jej trakcie).
+
+    Args:
+        conn: Otwarte połączenie SQLAlchemy
+        pairs: Pary (ticker, datetime)
+
+    Returns:
+        {(ticker, datetime): {'price', 'volume', 'quote_time', 'source'}} - pary bez notowania są pomijane
+    """
+    pairs = list(dict.fromkeys((ticker.upper(), ts) for ticker, ts in pairs))
+    if not pairs:
+        return {}
+
+    payload = [{'idx': i, 'ticker': ticker, 'ts': ts.isoformat()} for i, (ticker, ts) in enumerate(pairs)]
+    rows = conn.execute(text("""
+        SELECT p.idx,
+               qi.price, qi.volume, qi.datetime,
+               qd.close_price, qd.volume, qd.date
+        FROM jsonb_to_recordset(CAST(:pairs AS JSONB)) AS p(idx INTEGER, ticker TEXT, ts TIMESTAMP)
+        JOIN companies c ON c.ticker = p.ticker
+        LEFT JOIN LATERAL (
+            SELECT price, volume, datetime FROM quotes_intraday
+            WHERE company_id = c.id AND datetime <= p.ts AND price > 0
+            ORDER BY datetime DESC
+            LIMIT 1
+        ) qi ON TRUE
+        LEFT JOIN LATERAL (
+            SELECT close_price, volume, date FROM quotes_daily
+            WHERE company_id = c.id AND date < CAST(p.ts AS DATE)
+            ORDER BY date DESC
+            LIMIT 1
+        ) qd ON TRUE
+    """), {'pairs': json.dumps(payload)}).fetchall()
+
+    prices = {}
+    for idx, *quote in rows:
+        picked = _pick_quote(*quote)
+        if picked:
+            prices[pairs[idx]] = picked
+    return prices
+
+
+class AsOfPriceIndex:
+    """
+    Notowania wielu tickerów w pamięci z wyszukiwaniem as-of przez np.searchsorted
+
+    Jak prices_as_of(): gdy brak notowania intraday lub jest starsze od ostatniego zamknięcia
+    dziennego sprzed dnia chwili, zwracane jest to zamknięcie (source 'quotes_daily').
+    """
+
+    def __init__(self, series: Dict[str, Tuple[np.ndarray, np.ndarray, np.ndarray]],
+                 daily: Optional[Dict[str, Tuple[np.ndarray, np.ndarray, np.ndarray]]] = None):
+        """
+        Args:
+            series: {ticker: (czasy datetime64[ns] rosnąco, ceny, wolumeny)} - notowania intraday
+            daily: {ticker: (daty sesji datetime64[ns] rosnąco, ceny zamknięcia, wolumeny)}
+        """
+        self._series = self._normalize(series)
+        self._daily = self._normalize(daily or {})
+
+    @staticmethod
+    def _normalize(series):
+        return {ticker.upper(): (np.asarray(times, dtype='datetime64[ns]'),
+                                 np.asarray(prices, dtype=float),
+                                 np.asarray(volumes, dtype=float))
+                for ticker, (times, prices, volumes) in series.items()}
+
+    @property
+    def tickers(self) -> List[str]:
+        return sorted(set(self._series) | set(self._daily))
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame, ticker_column: str = 'ticker', time_column: str = 'datetime',
+                   price_column: str = 'price', volume_column: Optional[str] = 'volume',
+                   daily: Optional[pd.DataFrame] = None) -> 'AsOfPriceIndex':
+        """
+        Buduje indeks z ramki notowań (dowolna kolejność wierszy)
+
+        Args:
+            daily: Zamknięcia dzienne (kolumny ticker, date, close_price, volume) - fallback jak w prices_as_of
+        """
+        series = _frame_series(df, ticker_column, time_column, price_column, volume_column)
+        daily_series = _frame_series(daily, 'ticker', 'date', 'close_price', 'volume') if daily is not None else None
+        return cls(series, daily_series)
+
+    @classmethod
+    def load(cls, engine, tickers: Optional[Sequence[str]], start: datetime, end: datetime) -> 'AsOfPriceIndex':
+        """
+        Ładuje notowania intraday i zamknięcia dzienne z zakresu (po jednym zapytaniu)
+
+        Dla chwil z początku zakresu potrzebne jest notowanie sprzed `start` - dołączane jest
+        ostatnie notowanie intraday i ostatnie zamknięcie dzienne każdego tickera przed początkiem zakresu.
+        """
+        params = {'start': start, 'end': end}
+        ticker_filter = ""
+        if tickers:
+            ticker_filter = "AND c.ticker = ANY(:tickers)"
+            params['tickers'] = [t.upper() for t in tickers]
+
+        query = f"""
+            SELECT c.ticker, qi.datetime, qi.price, qi.volume
+            FROM quotes_intraday qi
+            JOIN companies c ON c.id = qi.company_id
+            WHERE qi.datetime >= :start AND qi.datetime <= :end AND qi.price > 0 {ticker_filter}
+            UNION ALL
+            SELECT c.ticker, prev.datetime, prev.price, prev.volume
+            FROM companies c
+            JOIN LATERAL (
+                SELECT datetime, price, volume FROM quotes_intraday
+                WHERE company_id = c.id AND datetime < :start AND price > 0
+                ORDER BY datetime DESC
+                LIMIT 1
+            ) prev ON TRUE
+            WHERE TRUE {ticker_filter}
+        """
+        # Zamknięcie jest używane tylko dla chwil z późniejszych dni, więc wystarczą sesje sprzed dnia `end`
+        daily_query = f"""
+            SELECT c.ticker, qd.date, qd.close_price, qd.volume
+            FROM quotes_daily qd
+            JOIN companies c ON c.id = qd.company_id
+            WHERE qd.date >= CAST(:start AS DATE) AND qd.date < CAST(:end AS DATE) {ticker_filter}
+            UNION ALL
+            SELECT c.ticker, prev.date, prev.close_price, prev.volume
+            FROM companies c
+            JOIN LATERAL (
+                SELECT date, close_price, volume FROM quotes_daily
+                WHERE company_id = c.id AND date < CAST(:start AS DATE)
+                ORDER BY date DESC
+                LIMIT 1
+            ) prev ON TRUE
+            WHERE TRUE {ticker_filter}
+        """
+        with engine.connect() as conn:
+            df = pd.read_sql_query(text(query), conn, params=params)
+            daily = pd.read_sql_query(text(daily_query), conn, params=params)
+
+        index = cls.from_frame(df, daily=daily)
+        logger.info(f"📚 Indeks cen as-of: {len(index.tickers)} tickerów, {len(df)} notowań intraday, "
+                    f"{len(daily)} zamknięć dziennych")
+        return index
+
+    def lookup(self, tickers: Sequence[str], timestamps: Sequence[Any]) -> Dict[str, np.ndarray]:
+        """
+        Ceny as-of dla wektorów tickerów i chwil (ta sama długość)
+
+        Returns:
+            {'price', 'volume', 'quote_time', 'source'} - tablice w kolejności wejścia;
+            NaN/NaT/None gdy brak notowania
+        """
+        tickers = np.asarray([t.upper() for t in tickers])
+        timestamps = pd.to_datetime(pd.Series(timestamps)).to_numpy(dtype='datetime64[ns]')
+        price = np.full(len(tickers), np.nan)
+        volume = np.full(len(tickers), np.nan)
+        quote_time = np.full(len(tickers), np.datetime64('NaT'), dtype='datetime64[ns]')
+        source = np.full(len(tickers), None, dtype=object)
+
+        for ticker in np.unique(tickers):
+            positions = np.flatnonzero(tickers == ticker)
+            if ticker in self._series:
+                times, prices, volumes = self._series[ticker]
+                found = np.searchsorted(times, timestamps[positions], side='right') - 1
+                valid = found >= 0
+                price[positions[valid]] = prices[found[valid]]
+                volume[positions[valid]] = volumes[found[valid]]
+                quote_time[positions[valid]] = times[found[valid]]
+                source[positions[valid]] = 'quotes_intraday'
+
+            if ticker in self._daily:
+                # Zamknięcie z sesji wcześniejszej niż dzień chwili - zastępuje brakujące lub starsze intraday
+                dates, closes, volumes = self._daily[ticker]
+                days = timestamps[positions].astype('datetime64[D]').astype('datetime64[ns]')
+                found = np.searchsorted(dates, days, side='left') - 1
+                valid = found >= 0
+                close_dates = dates[np.maximum(found, 0)]
+                intraday_days = quote_time[positions].astype('datetime64[D]').astype('datetime64[ns]')
+                use = valid & (np.isnan(price[positions]) | (intraday_days < close_dates))
+                price[positions[use]] = closes[found[use]]
+                volume[positions[use]] = volumes[found[use]]
+                quote_time[positions[use]] = close_dates[use]
+                source[positions[use]] = 'quotes_daily'
+
+        return {'price': price, 'volume': volume, 'quote_time': quote_time, 'source': source}
+
+    def price_at(self, ticker: str, timestamp: datetime) -> Optional[float]:
+        """Cena jednego tickera na chwilę (None gdy brak notowania)"""
+        price = self.lookup([ticker], [timestamp])['price'][0]
+        return None if np.isnan(price) else float(price)
@@ -0,0 +1,266 @@
+"""
+Wspólny zapis wyników scraperów newsów i komunikatów ESPI/EBI
+Deduplikacja (indeks zapisanych w oknie czasowym, unikalne indeksy tabel) i zapis
+paczek jednym INSERT dla news (news_scraper_portals / news_scraper_offline)
+oraz espi_communications (espi_scraper / espi_scraper_rss).
+
+Gdy unikalnego indeksu nie da się utworzyć (np. duplikaty w tabeli), ON CONFLICT nie
+miałby na czym działać - zapis przechodzi wtedy na sprawdzanie istniejących wierszy
+(INSERT ... WHERE NOT EXISTS).
+"""
+
+import json
+import logging
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import text
+
+from utils.communication_ids import migrate_communication_ids
+
+logger = logging.getLogger(__name__)
+
+# (połączenie, tickery) -> {ticker: company_id}
+CompanyResolver = Callable[[object, List[str]], Dict[str, int]]
+
+
+# ----------------------------------------------------------------------
+# News
+# ----------------------------------------------------------------------
+
+def ensure_news_dedupe_index(engine) -> bool:
+    """
+    Unikalny indeks news (URL, spółka) - warunek dla INSERT ... ON CONFLICT DO NOTHING
+
+    Returns:
+        True, jeśli indeks istnieje; False - zapis musi sprawdzać istniejące wiersze
+    """
+    try:
+        with engine.begin() as conn:
+            conn.execute(text("""
+                CREATE UNIQUE INDEX IF NOT EXISTS idx_news_source_company_unique
+                ON news (source, COALESCE(company_id, 0))
+            """))
+        return True
+    except Exception as e:
+        logger.error(f"❌ Nie można utworzyć unikalnego indeksu news (duplikaty w tabeli?) - "
+                     f"deduplikacja przez sprawdzanie istniejących wierszy: {e}")
+        return False
+
+
+def load_known_article_urls(engine, since: datetime) -> Set[str]:
+    """Ładuje URL-e artykułów zapisanych od podanej daty (indeks deduplikacji na jedno uruchomienie)"""
+    try:
+        with engine.connect() as conn:
+            result = conn.execute(text("""
+                SELECT DISTINCT source FROM news WHERE date >= :since
+            """), {'since': since})
+            return {row[0] for row in result}
+    except Exception as e:
+        logger.error(f"❌ Błąd ładowania znanych artykułów: {e}")
+        return set()
+
+
+def companies_by_ticker(conn, tickers: List[str]) -> Dict[str, int]:
+    """company_id z tabeli companies"""
+    result = conn.execute(text("""
+        SELECT ticker, id FROM companies WHERE ticker = ANY(:tickers)
+    """), {'tickers': tickers})
+    return {row[0]: row[1] for row in result}
+
+
+def companies_by_ticker_mapping(conn, tickers: List[str]) -> Dict[str, int]:
+    """company_id z aktywnych ticker_mappings"""
+    result = conn.execute(text("""
+        SELECT DISTINCT ON (ticker) ticker, company_id
+        FROM ticker_mappings
+        WHERE ticker = ANY(:tickers) AND is_active = true
+        ORDER BY ticker
+    """), {'tickers': tickers})
+    return {row[0]: row[1] for row in result}
+
+
+def save_articles_batch(engine, articles: List[Dict], resolve_company_ids: CompanyResolver,
+                        unique_index: bool = True, content_limit: Optional[int] = None) -> Optional[Set[str]]:
+    """
+    Zapisuje artykuły do news jednym INSERT
+
+    Artykuł zapisywany jest osobno dla każdej rozpoznanej spółki; bez rozpoznanej
+    spółki - jeden wiersz bez company_id.
+
+    Args:
+        engine: Silnik SQLAlchemy
+        articles: Artykuły z kluczami link, title, content, publication_date, tickers
+        resolve_company_ids: Źródło company_id (companies_by_ticker / companies_by_ticker_mapping)
+        unique_index: Czy istnieje unikalny indeks news (wynik ensure_news_dedupe_index)
+        content_limit: Maksymalna długość zapisywanej treści
+
+    Returns:
+        Zbiór URL-i artykułów, dla których zapisano co najmniej jeden wiersz (None przy błędzie zapisu)
+    """
+    if not articles:
+        return set()
+
+    dedupe = "ON CONFLICT DO NOTHING" if unique_index else """
+        WHERE NOT EXISTS (
+            SELECT 1 FROM news n
+            WHERE n.source = r.source AND COALESCE(n.company_id, 0) = COALESCE(r.company_id, 0)
+        )
+    """
+    try:
+        with engine.begin() as conn:
+            tickers = sorted({ticker for article in articles for ticker in article['tickers']})
+            company_ids = resolve_company_ids(conn, tickers) if tickers else {}
+
+            rows = {}
+            for article in articles:
+                article_company_ids = [company_ids[t] for t in article['tickers'] if t in company_ids]
+                for company_id in article_company_ids or [None]:
+                    # Jeden wiersz na (URL, spółka) także w obrębie paczki
+                    rows[(article['link'], company_id)] = {
+                        'company_id': company_id,
+                        'date': article['publication_date'].isoformat(),
+                        'source': article['link'],
+                        'title': article['title'],
+                        'content': article['content'][:content_limit] if content_limit else article['content']
+                    }
+
+            result = conn.execute(text(f"""
+                INSERT INTO news (company_id, date, source, title, content)
+                SELECT r.company_id, r.date, r.source, r.title, r.content
+                FROM jsonb_to_recordset(CAST(:rows AS JSONB))
+                     AS r(company_id INTEGER, date TIMESTAMP, source TEXT, title TEXT, content TEXT)
+                {dedupe}
+                RETURNING source
+            """), {'rows': json.dumps(list(rows.values()))})
+            saved_urls = {row[0] for row in result}
+
+        for article in articles:
+            if article['link'] in saved_urls:
+                ticker_info = f" (tickery: {', '.join(article['tickers'])})" if article['tickers'] else " (brak tickerów)"
+                logger.info(f"✅ Zapisano artykuł: {article['title'][:50]}...{ticker_info}")
+        return saved_urls
+
+    except Exception as e:
+        logger.error(f"❌ Błąd zapisu artykułów do bazy: {e}")
+        return None
+
+
+# ----------------------------------------------------------------------
+# Komunikaty ESPI/EBI
+# ----------------------------------------------------------------------
+
+def ensure_communications_dedupe_index(engine) -> bool:
+    """
+    Unikalny indeks communication_id - warunek dla INSERT ... ON CONFLICT DO NOTHING
+
+    Returns:
+        True, jeśli indeks istnieje; False - zapis musi sprawdzać istniejące wiersze
+    """
+    try:
+        # Identyfikatory ze starego schematu (hash() solony per proces) - przelicz i scal duplikaty
+        migrate_communication_ids(engine)
+    except Exception as e:
+        logger.warning(f"⚠️ Migracja communication_id nie powiodła się: {e}")
+
+    try:
+        with engine.begin() as conn:
+            conn.execute(text("""
+                CREATE UNIQUE INDEX IF NOT EXISTS idx_espi_communications_communication_id
+                ON espi_communications (communication_id)
+            """))
+        return True
+    except Exception as e:
+        logger.error(f"❌ Nie można utworzyć unikalnego indeksu espi_communications (duplikaty w tabeli?) - "
+                     f"deduplikacja przez sprawdzanie istniejących wierszy: {e}")
+        return False
+
+
+def load_known_communications(engine, since: datetime) -> Tuple[Set[str], Set[str]]:
+    """
+    Ładuje identyfikatory i URL-e komunikatów zapisanych od podanej daty
+
+    Returns:
+        (zbiór communication_id, zbiór URL-i) - indeks deduplikacji na jedno uruchomienie
+    """
+    try:
+        with engine.connect() as conn:
+            result = conn.execute(text("""
+                SELECT communication_id, url FROM espi_communications
+                WHERE publication_date >= :since
+            """), {'since': since})
+            rows = result.fetchall()
+        return {row[0] for row in rows}, {row[1] for row in rows if row[1]}
+    except Exception as e:
+        logger.error(f"❌ Błąd ładowania znanych komunikatów: {e}")
+        return set(), set()
+
+
+def filter_new_communications(communications: List[Dict], known_ids: Set[str], known_urls: Set[str]) -> List[Dict]:
+    """Odrzuca komunikaty już zapisane lub powtórzone (po communication_id albo URL); uzupełnia zbiory"""
+    new_communications = []
+    for comm in communications:
+        if comm['communication_id'] in known_ids or (comm['url'] and comm['url'] in known_urls):
+            continue
+        known_ids.add(comm['communication_id'])
+        if comm['url']:
+            known_urls.add(comm['url'])
+        new_communications.append(comm)
+    return new_communications
+
+
+def save_communications_batch(engine, communications: List[Dict], unique_index: bool = True) -> Optional[Set[str]]:
+    """
+    Zapisuje komunikaty do espi_communications jednym INSERT
+
+    Args:
+        engine: Silnik SQLAlchemy
+        communications: Komunikaty (ticker, communication_id, publication_date, title, content,
+                        communication_type, url)
+        unique_index: Czy istnieje unikalny indeks communication_id (wynik ensure_communications_dedupe_index)
+
+    Returns:
+        Zbiór communication_id faktycznie zapisanych komunikatów (None przy błędzie zapisu)
+    """
+    if not communications:
+        return set()
+
+    rows = {comm['communication_id']: {
+        'ticker': comm['ticker'],
+        'communication_id': comm['communication_id'],
+        'publication_date': comm['publication_date'].isoformat(),
+        'title': comm['title'],
+        'content': comm['content'],
+        'communication_type': comm['communication_type'],
+        'url': comm['url']
+    } for comm in communications}
+    dedupe = "ON CONFLICT DO NOTHING" if unique_index else """
+        WHERE NOT EXISTS (
+            SELECT 1 FROM espi_communications e WHERE e.communication_id = r.communication_id
+        )
+    """
+
+    try:
+        with engine.begin() as conn:
+            result = conn.execute(text(f"""
+                INSERT INTO espi_communications
+                (ticker, communication_id, publication_date, title, content,
+                 communication_type, url, is_processed)
+                SELECT r.ticker, r.communication_id, r.publication_date, r.title, r.content,
+                       r.communication_type, r.url, false
+                FROM jsonb_to_recordset(CAST(:rows AS JSONB))
+                     AS r(ticker TEXT, communication_id TEXT, publication_date TIMESTAMP, title TEXT,
+                          content TEXT, communication_type TEXT, url TEXT)
+                {dedupe}
+                RETURNING communication_id
+            """), {'rows': json.dumps(list(rows.values()))})
+            saved_ids = {row[0] for row in result}
+
+        for comm in communications:
+            if comm['communication_id'] in saved_ids:
+                logger.info(f"✅ Zapisano komunikat {comm['communication_type']} dla {comm['ticker']}")
+        return saved_ids
+
+    except Exception as e:
+        logger.error(f"❌ Błąd zapisu komunikatów: {e}")
+        return None
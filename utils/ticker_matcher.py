@@ -0,0 +1,216 @@
+"""
+Wyszukiwanie tickerów i nazw spółek w tekstach newsów i komunikatów ESPI
+Automat Aho-Corasick budowany raz z ticker_mappings i nazw spółek znajduje wszystkie
+wystąpienia w jednym liniowym przejściu po tekście (zamiast kilku re.search na każdy ticker).
+
+Automat jest współdzielony w procesie i przebudowywany tylko po zmianie mapowań w bazie.
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+# Nazwy potoczne i warianty zapisu spółek (uzupełniają nazwy z tabeli companies)
+NAME_ALIASES = {
+    'PKN ORLEN': 'PKN',
+    'PKNORLEN': 'PKN',
+    'CD PROJEKT': 'CDPROJEKT',
+    'KGHM POLSKA MIEDŹ': 'KGHM',
+    'JASTRZĘBSKA SPÓŁKA WĘGLOWA': 'JSW',
+    'POLISH GAMES': 'PGS',
+    'ALLEGRO': 'ALE',
+    'POLSKA GRUPA ENERGETYCZNA': 'PGE',
+    'ALIOR BANK': 'ALIOR',
+}
+
+# Formy prawne odcinane z nazw spółek
+_LEGAL_SUFFIXES = (' SPÓŁKA AKCYJNA', ' S.A.', ' SA')
+
+# Nazwy krótsze niż to są pomijane (zbyt wiele fałszywych trafień)
+MIN_NAME_LENGTH = 4
+
+# Jak często (sekundy) sprawdzać w bazie, czy mapowania się zmieniły
+SIGNATURE_CHECK_INTERVAL = 60
+
+
+class _Automaton:
+    """Automat Aho-Corasick nad znakami tekstu"""
+
+    def __init__(self, patterns: Iterable[str]):
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        self.output: List[List[int]] = [[]]
+        self.patterns: List[str] = []
+
+        for pattern in patterns:
+            self._add(pattern)
+        self._build_links()
+
+    def _add(self, pattern: str):
+        state = 0
+        for char in pattern:
+            next_state = self.goto[state].get(char)
+            if next_state is None:
+                next_state = len(self.goto)
+                self.goto[state][char] = next_state
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append([])
+            state = next_state
+        self.output[state].append(len(self.patterns))
+        self.patterns.append(pattern)
+
+    def _build_links(self):
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[next_state] = self.goto[fallback].get(char, 0)
+                # Wyjścia stanu awaryjnego są dziedziczone - skan nie musi chodzić po łańcuchu fail
+                self.output[next_state] = self.output[next_state] + self.output[self.fail[next_state]]
+
+    def iter_matches(self, text_to_search: str):
+        """Generuje (indeks_początku, indeks_wzorca) dla wszystkich wystąpień"""
+        goto, fail, output, patterns = self.goto, self.fail, self.output, self.patterns
+        state = 0
+        for i, char in enumerate(text_to_search):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for pattern_index in output[state]:
+                yield i - len(patterns[pattern_index]) + 1, pattern_index
+
+
+def _upper_same_length(value: str) -> str:
+    """Wielkie litery z zachowaniem pozycji znaków (np. 'ß' zostaje bez zmian)"""
+    upper = value.upper()
+    if len(upper) == len(value):
+        return upper
+    return ''.join(c.upper() if len(c.upper()) == 1 else c for c in value)
+
+
+def _strip_legal_suffix(name: str) -> str:
+    for suffix in _LEGAL_SUFFIXES:
+        if name.endswith(suffix):
+            return name[:-len(suffix)].rstrip()
+    return name
+
+
+class TickerMatcher:
+    """Wyszukiwanie tickerów i nazw spółek w jednym przejściu po tekście"""
+
+    def __init__(self, tickers: Iterable[str], company_names: Optional[Dict[str, str]] = None):
+        """
+        Args:
+            tickers: Aktywne tickery
+            company_names: {nazwa spółki: ticker} - nazwy z bazy; aliasy z NAME_ALIASES są dodawane
+        """
+        self.tickers = sorted(set(t.strip().upper() for t in tickers if t and t.strip()))
+        active = set(self.tickers)
+
+        # (ticker, czy_wzorzec_to_ticker) - tickery muszą wystąpić wielkimi literami w oryginale
+        targets: Dict[str, Tuple[str, bool]] = {}
+        names = dict(NAME_ALIASES)
+        names.update(company_names or {})
+        for name, ticker in names.items():
+            name = _strip_legal_suffix(' '.join(_upper_same_length(name or '').split()))
+            if ticker in active and len(name) >= MIN_NAME_LENGTH:
+                targets.setdefault(name, (ticker, False))
+        for ticker in self.tickers:
+            targets[ticker] = (ticker, True)
+
+        self._automaton = _Automaton(targets)
+        self._targets = [targets[pattern] for pattern in self._automaton.patterns]
+
+    def find_tickers(self, text_to_search: str) -> List[str]:
+        """Tickery wspomniane w tekście (bez powtórzeń, w kolejności pierwszego wystąpienia)"""
+        if not text_to_search or not self.tickers:
+            return []
+
+        upper = _upper_same_length(text_to_search)
+        length = len(upper)
+        found = {}
+        for start, pattern_index in self._automaton.iter_matches(upper):
+            end = start + len(self._automaton.patterns[pattern_index])
+            # Granice słowa
+            if start > 0 and upper[start - 1].isalnum():
+                continue
+            if end < length and upper[end].isalnum():
+                continue
+            ticker, is_ticker = self._targets[pattern_index]
+            if is_ticker and text_to_search[start:end] != ticker:
+                continue
+            if ticker not in found:
+                found[ticker] = start
+        return sorted(found, key=found.get)
+
+    def first_ticker(self, text_to_search: str) -> Optional[str]:
+        """Pierwszy ticker wspomniany w tekście"""
+        tickers = self.find_tickers(text_to_search)
+        return tickers[0] if tickers else None
+
+
+_matchers: Dict[str, Dict] = {}
+_matchers_lock = threading.Lock()
+
+
+def _load_mappings(engine) -> Tuple[str, List[str], Dict[str, str]]:
+    """Ładuje (sygnatura, aktywne tickery, {nazwa spółki: ticker}) z bazy"""
+    with engine.connect() as conn:
+        rows = conn.execute(text("""
+            SELECT tm.ticker, c.name
+            FROM ticker_mappings tm
+            LEFT JOIN companies c ON c.ticker = tm.ticker
+            WHERE tm.is_active = true
+            ORDER BY tm.ticker
+        """)).fetchall()
+    tickers = [row[0] for row in rows]
+    names = {row[1]: row[0] for row in rows if row[1]}
+    signature = '|'.join(f"{ticker}:{name or ''}" for ticker, name in rows)
+    return signature, tickers, names
+
+
+def get_ticker_matcher(engine, fallback_tickers: Optional[Iterable[str]] = None) -> TickerMatcher:
+    """
+    Zwraca współdzielony TickerMatcher dla bazy silnika
+
+    Mapowania są sprawdzane w bazie co SIGNATURE_CHECK_INTERVAL sekund, a automat
+    przebudowywany tylko wtedy, gdy lista aktywnych tickerów lub nazw spółek się zmieniła.
+
+    Args:
+        engine: Silnik SQLAlchemy
+        fallback_tickers: Tickery używane, gdy baza jest niedostępna i nie ma jeszcze automatu
+    """
+    key = str(engine.url)
+    with _matchers_lock:
+        entry = _matchers.get(key)
+        if entry and time.monotonic() - entry['checked_at'] < SIGNATURE_CHECK_INTERVAL:
+            return entry['matcher']
+
+        try:
+            signature, tickers, names = _load_mappings(engine)
+        except Exception as e:
+            logger.warning(f"⚠️ Nie można załadować mapowań tickerów: {e}")
+            if entry:
+                entry['checked_at'] = time.monotonic()
+                return entry['matcher']
+            return TickerMatcher(fallback_tickers or [])
+
+        if entry is None or entry['signature'] != signature:
+            started = time.monotonic()
+            entry = {'matcher': TickerMatcher(tickers, names), 'signature': signature}
+            _matchers[key] = entry
+            logger.info(f"🔤 Zbudowano wyszukiwarkę tickerów: {len(tickers)} tickerów, "
+                        f"{len(entry['matcher']._targets) - len(tickers)} nazw ({time.monotonic() - started:.2f}s)")
+        entry['checked_at'] = time.monotonic()
+        return entry['matcher']
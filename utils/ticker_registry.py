@@ -0,0 +1,206 @@
+"""
+Wspólna pamięć podręczna tożsamości tickerów
+ticker -> company_id (tabela companies) i ticker -> bankier_symbol (tabela ticker_mappings)
+ładowane hurtowo przy pierwszym użyciu; brakujące spółki tworzone jednym
+INSERT ... ON CONFLICT ... RETURNING zamiast SELECT + INSERT na każdy ticker.
+
+Mapowania są sprawdzane w bazie co SIGNATURE_CHECK_INTERVAL sekund (zmiany z innych
+procesów), a edycja w /manage/tickers unieważnia pamięć od razu przez invalidate_ticker_registry().
+"""
+
+import json
+import logging
+import re
+import threading
+import time
+from typing import Dict, Iterable, Optional
+
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+# Jak często (sekundy) sprawdzać, czy ticker_mappings zmieniły się w innym procesie
+SIGNATURE_CHECK_INTERVAL = 60
+
+# companies.ticker VARCHAR(10) - dłuższe lub zniekształcone tickery nie trafiają do INSERT
+MAX_TICKER_LENGTH = 10
+TICKER_PATTERN = re.compile(r'^[A-Z0-9][A-Z0-9._&-]*$')
+
+
+class TickerRegistry:
+    """ticker <-> company_id i ticker <-> bankier_symbol dla jednej bazy"""
+
+    def __init__(self, engine):
+        """
+        Args:
+            engine: Silnik SQLAlchemy
+        """
+        self.engine = engine
+        self._lock = threading.Lock()
+        self._company_ids: Dict[str, int] = {}
+        self._companies_loaded = False
+        self._mappings: Dict[str, Dict] = {}
+        self._mappings_signature = None
+        self._mappings_checked_at = 0.0
+
+    # ------------------------------------------------------------------
+    # Spółki
+    # ------------------------------------------------------------------
+
+    def _load_companies(self):
+        with self.engine.connect() as conn:
+            rows = conn.execute(text("SELECT ticker, id FROM companies")).fetchall()
+        self._company_ids = {row[0].upper(): row[1] for row in rows}
+        self._companies_loaded = True
+        logger.info(f"🏢 Załadowano {len(self._company_ids)} spółek do pamięci podręcznej")
+
+    def known_tickers(self):
+        """Tickery, których company_id jest już w pamięci podręcznej"""
+        with self._lock:
+            return set(self._company_ids)
+
+    def company_ids(self, tickers: Iterable[str], name: Optional[str] = None, sector: str = '',
+                    data_source: Optional[str] = None) -> Dict[str, int]:
+        """
+        Zwraca {ticker: company_id}, tworząc brakujące spółki
+
+        Args:
+            tickers: Tickery (wielkość liter bez znaczenia)
+            name: Nazwa nowych spółek (domyślnie ticker)
+            sector: Sektor nowych spółek
+            data_source: Źródło danych nowych spółek (domyślnie wartość domyślna kolumny)
+
+        Niepoprawne tickery (za długie, niedozwolone znaki) są pomijane - nie ma ich w wyniku.
+        """
+        tickers = {t.strip().upper() for t in tickers if t and t.strip()}
+        with self._lock:
+            if not self._companies_loaded:
+                self._load_companies()
+            missing = sorted(t for t in tickers if t not in self._company_ids)
+            invalid = [t for t in missing if not is_valid_ticker(t)]
+            if invalid:
+                logger.warning(f"⚠️ Pomijam niepoprawne tickery: {', '.join(invalid)}")
+                missing = [t for t in missing if t not in invalid]
+            if missing:
+                self._insert_or_get(missing, name, sector, data_source)
+            return {t: self._company_ids[t] for t in tickers if t in self._company_ids}
+
+    def company_id(self, ticker: str, name: Optional[str] = None, sector: str = '',
+                   data_source: Optional[str] = None) -> Optional[int]:
+        """company_id jednej spółki (tworzy ją, jeśli nie istnieje)"""
+        return self.company_ids([ticker], name, sector, data_source).get(ticker.strip().upper())
+
+    def _insert_or_get(self, tickers, name, sector, data_source):
+        # DO UPDATE (zamiast DO NOTHING) sprawia, że RETURNING zwraca też spółki
+        # dodane w międzyczasie przez inny proces - jedno zapytanie na wszystkie brakujące
+        rows = [{'ticker': t, 'name': name or t, 'sector': sector, 'data_source': data_source}
+                for t in tickers]
+        try:
+            result = self._insert_rows(rows, data_source is not None)
+        except Exception as e:
+            # Jeden wadliwy wiersz nie może blokować pozostałych - ponów pojedynczo
+            logger.warning(f"⚠️ Zbiorcze dodanie {len(rows)} spółek nie powiodło się, ponawiam pojedynczo: {e}")
+            result = []
+            for row in rows:
+                try:
+                    result += self._insert_rows([row], data_source is not None)
+                except Exception as row_error:
+                    logger.error(f"❌ Nie można dodać spółki {row['ticker']}: {row_error}")
+
+        created = []
+        for row in result:
+            self._company_ids[row[0].upper()] = row[1]
+            if row[2]:
+                created.append(row[0])
+        if created:
+            logger.info(f"➕ Dodano spółki: {', '.join(created)}")
+
+    def _insert_rows(self, rows, with_data_source: bool):
+        # Bez podanego źródła kolumna data_source nie jest wstawiana - obowiązuje jej wartość domyślna
+        columns = "ticker, name, sector" + (", data_source" if with_data_source else "")
+        with self.engine.begin() as conn:
+            return conn.execute(text(f"""
+                INSERT INTO companies ({columns})
+                SELECT {', '.join('r.' + c for c in columns.split(', '))}
+                FROM jsonb_to_recordset(CAST(:rows AS JSONB))
+                     AS r(ticker TEXT, name TEXT, sector TEXT, data_source TEXT)
+                ON CONFLICT (ticker) DO UPDATE SET ticker = EXCLUDED.ticker
+                RETURNING ticker, id, (xmax = 0) AS inserted
+            """), {'rows': json.dumps(rows)}).fetchall()
+
+    # ------------------------------------------------------------------
+    # Mapowania Bankier.pl
+    # ------------------------------------------------------------------
+
+    def _mappings_up_to_date(self, now: float) -> bool:
+        if self._mappings_signature is None:
+            return False
+        if now - self._mappings_checked_at < SIGNATURE_CHECK_INTERVAL:
+            return True
+        with self.engine.connect() as conn:
+            signature = tuple(conn.execute(text("SELECT COUNT(*), MAX(updated_at) FROM ticker_mappings")).fetchone())
+        self._mappings_checked_at = now
+        return signature == self._mappings_signature
+
+    def _load_mappings(self, now: float):
+        with self.engine.connect() as conn:
+            signature = tuple(conn.execute(text("SELECT COUNT(*), MAX(updated_at) FROM ticker_mappings")).fetchone())
+            rows = conn.execute(text("SELECT ticker, bankier_symbol, is_active FROM ticker_mappings")).fetchall()
+        self._mappings = {row[0].upper(): {'bankier_symbol': row[1] or row[0], 'is_active': bool(row[2])}
+                          for row in rows}
+        self._mappings_signature = signature
+        self._mappings_checked_at = now
+        logger.info(f"🔗 Załadowano {len(self._mappings)} mapowań tickerów")
+
+    def bankier_symbols(self, active_only: bool = True) -> Dict[str, str]:
+        """
+        {ticker: bankier_symbol} z ticker_mappings
+
+        Przy błędzie bazy zwraca ostatnio załadowane mapowania (pusty słownik, jeśli ich brak).
+        """
+        now = time.monotonic()
+        with self._lock:
+            try:
+                if not self._mappings_up_to_date(now):
+                    self._load_mappings(now)
+            except Exception as e:
+                logger.warning(f"⚠️ Nie można odświeżyć mapowań tickerów: {e}")
+                self._mappings_checked_at = now
+            return {ticker: m['bankier_symbol'] for ticker, m in self._mappings.items()
+                    if m['is_active'] or not active_only}
+
+    def bankier_symbol(self, ticker: str) -> Optional[str]:
+        return self.bankier_symbols().get(ticker.strip().upper())
+
+    def invalidate(self):
+        """Unieważnia pamięć podręczną - kolejne wywołania przeładują dane z bazy"""
+        with self._lock:
+            self._company_ids = {}
+            self._companies_loaded = False
+            self._mappings_signature = None
+
+
+def is_valid_ticker(ticker: str) -> bool:
+    """Czy ticker (wielkie litery) mieści się w companies.ticker i ma dozwolone znaki"""
+    return len(ticker) <= MAX_TICKER_LENGTH and bool(TICKER_PATTERN.match(ticker))
+
+
+_registries: Dict[str, TickerRegistry] = {}
+_registries_lock = threading.Lock()
+
+
+def get_ticker_registry(engine) -> TickerRegistry:
+    """Zwraca współdzielony w procesie rejestr dla bazy silnika"""
+    key = str(engine.url)
+    with _registries_lock:
+        if key not in _registries:
+            _registries[key] = TickerRegistry(engine)
+        return _registries[key]
+
+
+def invalidate_ticker_registry():
+    """Unieważnia rejestry wszystkich baz (wywoływane po edycji ticker_mappings)"""
+    with _registries_lock:
+        registries = list(_registries.values())
+    for registry in registries:
+        registry.invalidate()
@@ -3,37 +3,213 @@ from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
+from selenium.common.exceptions import TimeoutException, WebDriverException
 from bs4 import BeautifulSoup
 import time
 import re
 import random
+import queue
+import threading
 from typing import Dict, List, Optional, Any
-from datetime import datetime
 from sqlalchemy import create_engine, text
 import os
 from dotenv import load_dotenv
 
+from utils.http_fetcher import get_http_fetcher
+from utils.ticker_registry import get_ticker_registry
+from workers.quote_writer import get_quote_writer
+
 load_dotenv('.env')
 
+# Atrybuty data-* elementu #last-trade-<SYMBOL> z notowaniem
+_TAG_ATTR_PATTERN = re.compile(r'([\w:-]+)\s*=\s*(?:"([^"]*)"|\'([^\']*)\')')
+
+
+def extract_last_trade_attrs(html: str, bankier_symbol: str) -> Optional[Dict[str, str]]:
+    """
+    Wyciąga atrybuty elementu #last-trade-<SYMBOL> bez parsowania całego dokumentu
+    
+    Szuka id w surowym HTML i parsuje tylko otwierający znacznik tego elementu.
+    """
+    for quote in ('"', "'"):
+        position = html.find(f'id={quote}last-trade-{bankier_symbol}{quote}')
+        if position != -1:
+            break
+    else:
+        return None
+    
+    tag_start = html.rfind('<', 0, position)
+    tag_end = html.find('>', position)
+    if tag_start == -1 or tag_end == -1:
+        return None
+    
+    return {m.group(1): m.group(2) if m.group(2) is not None else m.group(3)
+            for m in _TAG_ATTR_PATTERN.finditer(html, tag_start, tag_end)}
+
+
+USER_AGENTS = [
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
+    "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
+]
+
+
+def create_chrome_driver(headless: bool = True):
+    """Tworzy skonfigurowany Chrome WebDriver"""
+    chrome_options = Options()
+    
+    if headless:
+        chrome_options.add_argument("--headless")
+    
+    chrome_options.add_argument("--no-sandbox")
+    chrome_options.add_argument("--disable-dev-shm-usage")
+    chrome_options.add_argument("--disable-blink-features=AutomationControlled")
+    chrome_options.add_experimental_option("excludeSwitches", ["enable-automation"])
+    chrome_options.add_experimental_option('useAutomationExtension', False)
+    chrome_options.add_argument(f"--user-agent={random.choice(USER_AGENTS)}")
+    
+    driver = webdriver.Chrome(options=chrome_options)
+    driver.execute_script("Object.defineProperty(navigator, 'webdriver', {get: () => undefined})")
+    return driver
+
+
+class BrowserWorker:
+    """
+    Długo żyjąca przeglądarka w puli - sprawdzanie stanu przed każdą stroną
+    i wymiana (recykling) po max_pages stronach lub serii błędów
+    """
+    
+    def __init__(self, worker_id: int, headless: bool = True, max_pages: int = 50, max_consecutive_failures: int = 3):
+        self.worker_id = worker_id
+        self.headless = headless
+        self.max_pages = max_pages
+        self.max_consecutive_failures = max_consecutive_failures
+        self.driver = None
+        self.pages_on_driver = 0
+        self.consecutive_failures = 0
+        self.stats = {
+            'worker': worker_id,
+            'pages': 0,
+            'success': 0,
+            'failed': 0,
+            'recycled': 0,
+            'busy_seconds': 0.0,
+            'max_page_seconds': 0.0
+        }
+    
+    def _is_healthy(self) -> bool:
+        """Sprawdza czy przeglądarka odpowiada"""
+        try:
+            self.driver.execute_script("return document.readyState")
+            return True
+        except Exception:
+            return False
+    
+    def get_driver(self):
+        """Zwraca sprawną przeglądarkę, w razie potrzeby tworząc nową"""
+        needs_recycle = self.driver is not None and (
+            self.pages_on_driver >= self.max_pages
+            or self.consecutive_failures >= self.max_consecutive_failures
+            or not self._is_healthy()
+        )
+        if needs_recycle:
+            print(f"♻️ Worker {self.worker_id}: wymiana przeglądarki po {self.pages_on_driver} stronach")
+            self.quit()
+            self.stats['recycled'] += 1
+        
+        if self.driver is None:
+            self.driver = create_chrome_driver(self.headless)
+            self.pages_on_driver = 0
+            self.consecutive_failures = 0
+        return self.driver
+    
+    def record(self, success: bool, seconds: float):
+        """Zapisuje wynik strony w statystykach workera"""
+        self.pages_on_driver += 1
+        self.stats['pages'] += 1
+        self.stats['busy_seconds'] += seconds
+        self.stats['max_page_seconds'] = max(self.stats['max_page_seconds'], seconds)
+        if success:
+            self.stats['success'] += 1
+            self.consecutive_failures = 0
+        else:
+            self.stats['failed'] += 1
+            self.consecutive_failures += 1
+    
+    def report(self) -> Dict[str, Any]:
+        """Statystyki workera: przepustowość i średni czas strony"""
+        report = dict(self.stats)
+        pages = report['pages']
+        report['busy_seconds'] = round(report['busy_seconds'], 2)
+        report['max_page_seconds'] = round(report['max_page_seconds'], 2)
+        report['avg_page_seconds'] = round(self.stats['busy_seconds'] / pages, 2) if pages else None
+        report['pages_per_minute'] = round(pages * 60 / self.stats['busy_seconds'], 1) if self.stats['busy_seconds'] else None
+        return report
+    
+    def reset_stats(self):
+        for key in ('pages', 'success', 'failed', 'recycled'):
+            self.stats[key] = 0
+        self.stats['busy_seconds'] = 0.0
+        self.stats['max_page_seconds'] = 0.0
+    
+    def quit(self):
+        if self.driver:
+            try:
+                self.driver.quit()
+            except Exception:
+                pass
+            self.driver = None
+
+
 class BankierScraper:
     """
     Scraper dla danych giełdowych z Bankier.pl
     Obsługuje wiele tickerów z mapowaniem na właściwe symbole Bankier.pl
     """
     
-    def __init__(self, use_selenium: bool = True, headless: bool = True):
+    def __init__(self, use_selenium: bool = True, headless: bool = True,
+                 browser_workers: int = 4, pages_per_browser: int = 50, page_timeout: float = 10.0,
+                 max_retries: int = 1, use_http: bool = True):
+        """
+        Args:
+            use_selenium: Pobieranie stron przez Chrome (Selenium) - przy use_http tylko jako fallback
+            headless: Przeglądarki bez okna
+            browser_workers: Liczba równoległych przeglądarek w scrape_multiple_tickers
+            pages_per_browser: Po tylu stronach przeglądarka jest wymieniana na nową
+            page_timeout: Maksymalny czas oczekiwania na notowanie na stronie (sekundy)
+            max_retries: Ile razy ponowić ticker po błędzie przeglądarki
+            use_http: Najpierw zwykłe zapytanie HTTP (bez renderowania strony), Selenium tylko gdy się nie uda
+        """
         self.use_selenium = use_selenium
+        self.use_http = use_http
         self.headless = headless
+        self.browser_workers = max(1, browser_workers)
+        self.pages_per_browser = pages_per_browser
+        self.page_timeout = page_timeout
+        self.max_retries = max_retries
         self.driver = None
         self.session = None
         
+        # Pula przeglądarek - tworzona przy pierwszym scrape_multiple_tickers i utrzymywana między przebiegami
+        self.workers: List[BrowserWorker] = []
+        
+        # Wspólny klient HTTP (pula keep-alive, limit zapytań do bankier.pl)
+        self.fetcher = get_http_fetcher() if use_http else None
+        
+        # Skumulowane statystyki ścieżki HTTP i fallbacku do Selenium
+        self.fetch_stats = {'http_success': 0, 'selenium_fallback': 0, 'selenium_success': 0}
+        self._stats_lock = threading.Lock()
+        
         self._setup_database()
         
+        # Buforowany zapis notowań - jedna paczka na cykl scrapowania
+        self.quote_writer = get_quote_writer(self.engine) if self.engine else None
+        
+        # Wspólna pamięć podręczna mapowań ticker -> symbol Bankier.pl (unieważniana z /manage/tickers)
+        self.registry = get_ticker_registry(self.engine) if self.engine else None
+        
         # Ładuj mapowanie tickerów z bazy danych
         self.ticker_mapping = self._load_ticker_mappings()
-        
-        if self.use_selenium:
-            self._setup_selenium()
     
     def _setup_database(self):
         """Konfiguracja połączenia z bazą danych"""
@@ -71,26 +247,12 @@ class BankierScraper:
                 'CCC': 'CCC'
             }
         
-        try:
-            with self.engine.connect() as conn:
-                result = conn.execute(text("""
-                    SELECT ticker, bankier_symbol 
-                    FROM ticker_mappings 
-                    WHERE is_active = true
-                    ORDER BY ticker
-                """))
-                
-                mappings = {}
-                for row in result:
-                    ticker, bankier_symbol = row
-                    mappings[ticker] = bankier_symbol
-                
-                print(f"✓ Załadowano {len(mappings)} mapowań tickerów z bazy danych")
-                return mappings
-                
-        except Exception as e:
-            print(f"❌ Błąd ładowania mapowań z bazy: {e}")
-            print("⚠️ Używam domyślnego mapowania")
+        mappings = self.registry.bankier_symbols()
+        if mappings:
+            print(f"✓ Załadowano {len(mappings)} mapowań tickerów z bazy danych")
+            return mappings
+        else:
+            print("⚠️ Brak mapowań w bazie, używam domyślnego mapowania")
             return {
                 'PKN': 'PKNORLEN',
                 'PKNORLEN': 'PKNORLEN',
@@ -107,29 +269,9 @@ class BankierScraper:
             }
     
     def _setup_selenium(self):
-        """Konfiguracja WebDriver"""
-        chrome_options = Options()
-        
-        if self.headless:
-            chrome_options.add_argument("--headless")
-        
-        chrome_options.add_argument("--no-sandbox")
-        chrome_options.add_argument("--disable-dev-shm-usage")
-        chrome_options.add_argument("--disable-blink-features=AutomationControlled")
-        chrome_options.add_experimental_option("excludeSwitches", ["enable-automation"])
-        chrome_options.add_experimental_option('useAutomationExtension', False)
-        
-        user_agents = [
-            "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
-            "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
-            "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
-        ]
-        
-        chrome_options.add_argument(f"--user-agent={random.choice(user_agents)}")
-        
+        """Konfiguracja WebDriver (pojedyncza przeglądarka dla scrape_single_ticker)"""
         try:
-            self.driver = webdriver.Chrome(options=chrome_options)
-            self.driver.execute_script("Object.defineProperty(navigator, 'webdriver', {get: () => undefined})")
+            self.driver = create_chrome_driver(self.headless)
             print("✓ Selenium WebDriver skonfigurowany")
         except Exception as e:
             print(f"❌ Błąd konfiguracji Selenium: {e}")
@@ -137,8 +279,32 @@ class BankierScraper:
     
     def get_bankier_symbol(self, ticker: str) -> Optional[str]:
         """Konwertuje ticker na symbol Bankier.pl"""
+        if self.registry:
+            # Rejestr sam odświeża mapowania po zmianach w bazie
+            symbol = self.registry.bankier_symbol(ticker)
+            if symbol:
+                return symbol
         return self.ticker_mapping.get(ticker.upper())
     
+    def _quote_url(self, bankier_symbol: str) -> str:
+        return f"https://www.bankier.pl/inwestowanie/profile/quote.html?symbol={bankier_symbol}"
+    
+    def load_quote_page(self, driver, bankier_symbol: str) -> str:
+        """
+        Otwiera stronę notowania i czeka na element z notowaniem (zamiast stałego opóźnienia)
+        
+        Returns:
+            HTML strony (także po przekroczeniu page_timeout - parser spróbuje selektorów zapasowych)
+        """
+        driver.get(self._quote_url(bankier_symbol))
+        try:
+            WebDriverWait(driver, self.page_timeout).until(
+                EC.presence_of_element_located((By.ID, f'last-trade-{bankier_symbol}'))
+            )
+        except TimeoutException:
+            pass
+        return driver.page_source
+    
     def scrape_single_ticker(self, ticker: str) -> Optional[Dict[str, Any]]:
         """
         Scrapuje dane dla pojedynczego tickera z Bankier.pl
@@ -148,209 +314,352 @@ class BankierScraper:
             print(f"❌ Nieznany ticker: {ticker}")
             return None
         
-        url = f"https://www.bankier.pl/inwestowanie/profile/quote.html?symbol={bankier_symbol}"
-        print(f"📡 Scrapowanie {ticker} ({bankier_symbol}) z: {url}")
+        print(f"📡 Scrapowanie {ticker} ({bankier_symbol}) z: {self._quote_url(bankier_symbol)}")
+        
+        if self.use_http:
+            data = self.fetch_quotes_http({ticker.upper(): bankier_symbol}).get(ticker.upper())
+            if data:
+                return data
+            if not self.use_selenium:
+                return None
+            self._count('selenium_fallback')
         
         try:
+            if not self.driver and self.use_selenium:
+                self._setup_selenium()
             if not self.driver:
                 print("❌ WebDriver nie jest dostępny")
                 return None
             
-            self.driver.get(url)
-            time.sleep(random.uniform(3, 6))  # Losowe opóźnienie
-            
-            html = self.driver.page_source
-            soup = BeautifulSoup(html, 'html.parser')
-            
-            # Sprawdź czy strona się załadowała poprawnie
-            if "404" in soup.title.text if soup.title else "":
-                print(f"❌ Strona nie znaleziona dla {ticker}")
-                return None
-            
-            # Metoda 1: Dane z atrybutów data-*
-            last_trade_element = soup.find('div', id=f'last-trade-{bankier_symbol}')
-            if last_trade_element and hasattr(last_trade_element, 'attrs'):
-                try:
-                    attrs = last_trade_element.attrs
-                    
-                    # Bezpieczne pobieranie atrybutów z konwersją typów
-                    def safe_float(value, default=0.0):
-                        try:
-                            return float(str(value)) if value else default
-                        except (ValueError, TypeError):
-                            return default
-                    
-                    def safe_int(value, default=0):
-                        try:
-                            return int(str(value)) if value else default
-                        except (ValueError, TypeError):
-                            return default
-                    
-                    data = {
-                        'ticker': ticker.upper(),
-                        'bankier_symbol': bankier_symbol,
-                        'price': safe_float(attrs.get('data-last', '0')),
-                        'open': safe_float(attrs.get('data-open', '0')),
-                        'high': safe_float(attrs.get('data-high', '0')),
-                        'low': safe_float(attrs.get('data-low', '0')),
-                        'volume': safe_int(attrs.get('data-volume', '0')),
-                        'date': str(attrs.get('data-last-date', '')),
-                        'epoch': safe_int(attrs.get('data-last-epoch', '0')),
-                        'source': 'bankier_data_attrs'
-                    }
-                    
-                    if data['price'] > 0:
-                        print(f"✅ {ticker}: {data['price']} PLN (vol: {data['volume']:,})")
-                        return data
-                except (ValueError, TypeError) as e:
-                    print(f"⚠️ Błąd parsowania atrybutów data-*: {e}")
-            
-            # Metoda 2: Fallback - szukanie w selektorach CSS
-            price_selectors = [
-                '.profilLast',
-                '.price',
-                '.quote-price', 
-                '.current-price',
-                '[data-field="c"]',
-                '.value',
-                '.quote-value'
-            ]
-            
-            for selector in price_selectors:
-                try:
-                    elements = soup.select(selector)
-                    for element in elements:
-                        text = element.get_text(strip=True)
-                        price_match = re.search(r'(\d+[,.]?\d*)', text)
-                        if price_match:
-                            price_str = price_match.group(1).replace(',', '.')
-                            try:
-                                price = float(price_str)
-                                if 1 <= price <= 10000:  # Rozsądny zakres cen
-                                    print(f"✅ {ticker}: {price} PLN (selector: {selector})")
-                                    return {
-                                        'ticker': ticker.upper(),
-                                        'bankier_symbol': bankier_symbol,
-                                        'price': price,
-                                        'source': f'selector_{selector}'
-                                    }
-                            except ValueError:
-                                continue
-                except Exception as e:
-                    continue
-            
-            print(f"❌ Nie znaleziono ceny dla {ticker}")
-            return None
+            html = self.load_quote_page(self.driver, bankier_symbol)
+            data = self.parse_quote_html(html, ticker, bankier_symbol)
+            if data and self.use_http:
+                self._count('selenium_success')
+            return data
             
         except Exception as e:
             print(f"❌ Błąd podczas scrapowania {ticker}: {e}")
             return None
     
-    def scrape_multiple_tickers(self, tickers: List[str]) -> Dict[str, List[str]]:
+    def _count(self, key: str, value: int = 1):
+        with self._stats_lock:
+            self.fetch_stats[key] += value
+    
+    def _quote_from_attrs(self, attrs: Dict[str, Any], ticker: str, bankier_symbol: str,
+                          source: str) -> Optional[Dict[str, Any]]:
+        """Buduje notowanie z atrybutów data-* elementu #last-trade-<SYMBOL> (None bez ceny)"""
+        # Bezpieczne pobieranie atrybutów z konwersją typów
+        def safe_float(value, default=0.0):
+            try:
+                return float(str(value)) if value else default
+            except (ValueError, TypeError):
+                return default
+        
+        def safe_int(value, default=0):
+            try:
+                return int(str(value)) if value else default
+            except (ValueError, TypeError):
+                return default
+        
+        data = {
+            'ticker': ticker.upper(),
+            'bankier_symbol': bankier_symbol,
+            'price': safe_float(attrs.get('data-last', '0')),
+            'open': safe_float(attrs.get('data-open', '0')),
+            'high': safe_float(attrs.get('data-high', '0')),
+            'low': safe_float(attrs.get('data-low', '0')),
+            'volume': safe_int(attrs.get('data-volume', '0')),
+            'date': str(attrs.get('data-last-date', '')),
+            'epoch': safe_int(attrs.get('data-last-epoch', '0')),
+            'source': source
+        }
+        return data if data['price'] > 0 else None
+    
+    def fetch_quotes_http(self, symbols: Dict[str, str]) -> Dict[str, Dict[str, Any]]:
+        """
+        Pobiera notowania zwykłym HTTP, bez renderowania strony w przeglądarce
+        
+        Args:
+            symbols: {ticker: symbol Bankier.pl}
+        
+        Returns:
+            {ticker: notowanie} tylko dla tickerów, których notowanie udało się odczytać
+        """
+        urls = {ticker: self._quote_url(symbol) for ticker, symbol in symbols.items()}
+        pages = self.fetcher.fetch_many(urls.values())
+        
+        quotes = {}
+        for ticker, url in urls.items():
+            page = pages.get(url)
+            if page is None or not page.ok:
+                continue
+            attrs = extract_last_trade_attrs(page.text, symbols[ticker])
+            data = self._quote_from_attrs(attrs, ticker, symbols[ticker], 'bankier_http') if attrs else None
+            if data:
+                quotes[ticker] = data
+        
+        self._count('http_success', len(quotes))
+        return quotes
+    
+    def fallback_rate(self) -> Optional[float]:
+        """Odsetek tickerów, dla których ścieżka HTTP zawiodła i potrzebne było Selenium"""
+        with self._stats_lock:
+            attempts = self.fetch_stats['http_success'] + self.fetch_stats['selenium_fallback']
+            return round(self.fetch_stats['selenium_fallback'] / attempts, 3) if attempts else None
+    
+    def parse_quote_html(self, html: str, ticker: str, bankier_symbol: str) -> Optional[Dict[str, Any]]:
+        """Wyciąga notowanie z HTML strony Bankier.pl"""
+        soup = BeautifulSoup(html, 'html.parser')
+        
+        # Sprawdź czy strona się załadowała poprawnie
+        if "404" in soup.title.text if soup.title else "":
+            print(f"❌ Strona nie znaleziona dla {ticker}")
+            return None
+        
+        # Metoda 1: Dane z atrybutów data-*
+        last_trade_element = soup.find('div', id=f'last-trade-{bankier_symbol}')
+        if last_trade_element and hasattr(last_trade_element, 'attrs'):
+            data = self._quote_from_attrs(last_trade_element.attrs, ticker, bankier_symbol, 'bankier_data_attrs')
+            if data:
+                print(f"✅ {ticker}: {data['price']} PLN (vol: {data['volume']:,})")
+                return data
+        
+        # Metoda 2: Fallback - szukanie w selektorach CSS
+        price_selectors = [
+            '.profilLast',
+            '.price',
+            '.quote-price', 
+            '.current-price',
+            '[data-field="c"]',
+            '.value',
+            '.quote-value'
+        ]
+        
+        for selector in price_selectors:
+            try:
+                elements = soup.select(selector)
+                for element in elements:
+                    text = element.get_text(strip=True)
+                    price_match = re.search(r'(\d+[,.]?\d*)', text)
+                    if price_match:
+                        price_str = price_match.group(1).replace(',', '.')
+                        try:
+                            price = float(price_str)
+                            if 1 <= price <= 10000:  # Rozsądny zakres cen
+                                print(f"✅ {ticker}: {price} PLN (selector: {selector})")
+                                return {
+                                    'ticker': ticker.upper(),
+                                    'bankier_symbol': bankier_symbol,
+                                    'price': price,
+                                    'source': f'selector_{selector}'
+                                }
+                        except ValueError:
+                            continue
+            except Exception as e:
+                continue
+        
+        print(f"❌ Nie znaleziono ceny dla {ticker}")
+        return None
+    
+    def scrape_multiple_tickers(self, tickers: List[str]) -> Dict[str, Any]:
         """
         Scrapuje dane dla wielu tickerów
+        
+        Najpierw wszystkie notowania pobierane są zwykłym HTTP (use_http). Tickery, których
+        nie udało się tak odczytać, trafiają do wspólnej kolejki obsługiwanej równolegle przez
+        pulę browser_workers przeglądarek. Ticker, przy którym przeglądarka uległa awarii,
+        wraca do kolejki (max_retries razy) i trafia do innej, sprawnej przeglądarki.
         """
-        print(f"🚀 Rozpoczęcie scrapowania {len(tickers)} tickerów z Bankier.pl")
+        started = time.monotonic()
+        tickers = list(dict.fromkeys(ticker.upper() for ticker in tickers))
         
         results = {
             'success': [],
             'failed': [],
             'data': []
         }
+        if not tickers:
+            return results
         
-        for i, ticker in enumerate(tickers):
-            print(f"\n[{i+1}/{len(tickers)}] Scrapowanie {ticker}...")
+        print(f"🚀 Rozpoczęcie scrapowania {len(tickers)} tickerów z Bankier.pl")
+        
+        remaining = tickers
+        if self.use_http:
+            symbols = {ticker: self.get_bankier_symbol(ticker) for ticker in tickers}
+            for ticker in [t for t, symbol in symbols.items() if not symbol]:
+                print(f"❌ Nieznany ticker: {ticker}")
+                results['failed'].append(ticker)
             
-            data = self.scrape_single_ticker(ticker)
-            if data:
+            quotes = self.fetch_quotes_http({t: symbol for t, symbol in symbols.items() if symbol})
+            for ticker, data in quotes.items():
                 results['success'].append(ticker)
                 results['data'].append(data)
-                
-                # Zapis do bazy danych
-                if self.engine:
-                    self._save_to_database(data)
-            else:
-                results['failed'].append(ticker)
+                if self.quote_writer:
+                    self.quote_writer.add(data)
+            
+            remaining = [t for t, symbol in symbols.items() if symbol and t not in quotes]
+            results['http_success'] = len(quotes)
+            results['selenium_fallback'] = len(remaining) if self.use_selenium else 0
+            attempts = len(quotes) + len(remaining)
+            results['fallback_rate'] = round(len(remaining) / attempts, 3) if attempts else None
+            print(f"⚡ HTTP: {len(quotes)}/{attempts} notowań w {time.monotonic() - started:.1f}s"
+                  + (f", {len(remaining)} do Selenium" if remaining and self.use_selenium else ""))
             
-            # Opóźnienie między tickerami
-            if i < len(tickers) - 1:
-                delay = random.uniform(2, 5)
-                print(f"💤 Czekanie {delay:.1f}s przed następnym tickerem...")
-                time.sleep(delay)
+            if not self.use_selenium:
+                results['failed'].extend(remaining)
+                remaining = []
+            elif remaining:
+                self._count('selenium_fallback', len(remaining))
+        
+        if remaining:
+            results['workers'] = self._scrape_with_browsers(remaining, results)
+        
+        # Zapis całego cyklu jednym zapytaniem
+        if self.quote_writer:
+            results['saved'] = self.quote_writer.flush()
         
-        print(f"\n📊 Podsumowanie scrapowania:")
+        results['elapsed_seconds'] = round(time.monotonic() - started, 1)
+        
+        print(f"\n📊 Podsumowanie scrapowania ({results['elapsed_seconds']}s):")
         print(f"  ✅ Udane: {len(results['success'])} tickerów")
         print(f"  ❌ Nieudane: {len(results['failed'])} tickerów")
+        for report in results.get('workers', []):
+            print(f"  🖥️ Worker {report['worker']}: {report['pages']} stron, {report['success']} OK, "
+                  f"śr. {report['avg_page_seconds']}s/stronę, {report['pages_per_minute']} stron/min, "
+                  f"wymian: {report['recycled']}")
         
         if results['failed']:
             print(f"  🔴 Błędy: {', '.join(results['failed'])}")
         
         return results
     
+    def _scrape_with_browsers(self, tickers: List[str], results: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Scrapuje tickery pulą przeglądarek; zwraca statystyki workerów"""
+        # Pula przeglądarek utrzymywana między przebiegami (nowe tworzone tylko gdy brakuje)
+        workers_count = min(self.browser_workers, len(tickers))
+        while len(self.workers) < workers_count:
+            self.workers.append(BrowserWorker(len(self.workers) + 1, self.headless, self.pages_per_browser))
+        active_workers = self.workers[:workers_count]
+        for worker in active_workers:
+            worker.reset_stats()
+        
+        print(f"🖥️ Scrapowanie {len(tickers)} tickerów przez {workers_count} przeglądarek")
+        
+        work = queue.Queue()
+        for ticker in tickers:
+            work.put((ticker, 0))
+        results_lock = threading.Lock()
+        
+        threads = [
+            threading.Thread(target=self._run_browser_worker, args=(worker, work, results, results_lock),
+                             name=f"bankier-browser-{worker.worker_id}", daemon=True)
+            for worker in active_workers
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        return [worker.report() for worker in active_workers]
+    
+    def _run_browser_worker(self, worker: BrowserWorker, work: queue.Queue, results: Dict[str, Any],
+                            results_lock: threading.Lock):
+        """Pętla workera: pobiera tickery ze wspólnej kolejki aż do jej opróżnienia"""
+        while True:
+            try:
+                ticker, attempt = work.get_nowait()
+            except queue.Empty:
+                return
+            
+            bankier_symbol = self.get_bankier_symbol(ticker)
+            if not bankier_symbol:
+                print(f"❌ Nieznany ticker: {ticker}")
+                with results_lock:
+                    results['failed'].append(ticker)
+                continue
+            
+            page_started = time.monotonic()
+            try:
+                driver = worker.get_driver()
+                html = self.load_quote_page(driver, bankier_symbol)
+                data = self.parse_quote_html(html, ticker, bankier_symbol)
+            except WebDriverException as e:
+                worker.record(False, time.monotonic() - page_started)
+                # Przeglądarka po awarii jest wymieniana przed następną stroną
+                worker.consecutive_failures = worker.max_consecutive_failures
+                if attempt < self.max_retries:
+                    print(f"⚠️ Worker {worker.worker_id}: błąd przeglądarki dla {ticker}, ponowienie: {e.msg}")
+                    work.put((ticker, attempt + 1))
+                else:
+                    print(f"❌ Worker {worker.worker_id}: błąd przeglądarki dla {ticker}: {e.msg}")
+                    with results_lock:
+                        results['failed'].append(ticker)
+                continue
+            except Exception as e:
+                worker.record(False, time.monotonic() - page_started)
+                print(f"❌ Błąd podczas scrapowania {ticker}: {e}")
+                with results_lock:
+                    results['failed'].append(ticker)
+                continue
+            
+            worker.record(data is not None, time.monotonic() - page_started)
+            
+            if data:
+                with results_lock:
+                    results['success'].append(ticker)
+                    results['data'].append(data)
+                if self.use_http:
+                    self._count('selenium_success')
+                
+                # Zapis do bufora - paczka zapisywana po zakończeniu cyklu
+                if self.quote_writer:
+                    self.quote_writer.add(data)
+            else:
+                with results_lock:
+                    results['failed'].append(ticker)
+            
+            # Krótki losowy odstęp między stronami jednej przeglądarki
+            time.sleep(random.uniform(0.5, 1.5))
+    
     def ensure_company_exists(self, ticker: str) -> Optional[int]:
         """Zapewnia istnienie firmy w tabeli companies"""
-        if not self.engine:
+        if not self.quote_writer:
             return None
             
         try:
-            with self.engine.begin() as conn:
-                result = conn.execute(
-                    text("SELECT id FROM companies WHERE ticker = :ticker"), 
-                    {"ticker": ticker.upper()}
-                )
-                row = result.fetchone()
-                if row:
-                    return row[0]
-                
-                # Dodaj nową firmę
-                res = conn.execute(
-                    text("INSERT INTO companies (ticker, name, sector) VALUES (:ticker, :name, :sector) RETURNING id"),
-                    {"ticker": ticker.upper(), "name": ticker.upper(), "sector": ""}
-                )
-                row = res.fetchone()
-                return row[0] if row else None
+            return self.quote_writer.resolve_company_ids([ticker]).get(ticker.upper())
         except Exception as e:
             print(f"❌ Błąd zapewnienia istnienia firmy {ticker}: {e}")
             return None
     
     def _save_to_database(self, data: Dict[str, Any]) -> bool:
-        """Zapisuje dane do bazy"""
-        if not self.engine:
+        """Zapisuje pojedyncze notowanie do bazy (scrape_multiple_tickers zapisuje paczkami)"""
+        if not self.quote_writer:
             print("⚠️ Brak połączenia z bazą - pomijanie zapisu")
             return False
         
-        try:
-            company_id = self.ensure_company_exists(data['ticker'])
-            if not company_id:
-                return False
-            
-            with self.engine.begin() as conn:
-                conn.execute(text("""
-                    INSERT INTO quotes_intraday (datetime, price, volume, company_id)
-                    VALUES (:dt, :price, :volume, :company_id)
-                """), {
-                    "dt": datetime.now(),
-                    "price": data['price'],
-                    "volume": data.get('volume', 0),
-                    "company_id": company_id
-                })
-            
+        self.quote_writer.add(data)
+        if self.quote_writer.flush():
             print(f"💾 Zapisano {data['ticker']} do bazy")
             return True
-            
-        except Exception as e:
-            print(f"❌ Błąd zapisu do bazy {data['ticker']}: {e}")
-            return False
+        return False
     
     def close(self):
-        """Zamyka WebDriver"""
+        """Zamyka WebDriver i przeglądarki z puli"""
         if self.driver:
             self.driver.quit()
             self.driver = None
             print("🔒 WebDriver zamknięty")
+        if self.workers:
+            for worker in self.workers:
+                worker.quit()
+            print(f"🔒 Zamknięto pulę {len(self.workers)} przeglądarek")
+            self.workers = []
     
     def reload_ticker_mappings(self):
         """Odświeża mapowanie tickerów z bazy danych"""
+        if self.registry:
+            self.registry.invalidate()
         self.ticker_mapping = self._load_ticker_mappings()
         return len(self.ticker_mapping)
     
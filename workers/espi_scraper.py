@@ -9,16 +9,22 @@ Data: 2025-06-24
 import os
 import re
 import sys
-import requests
 import feedparser
 from datetime import datetime, timedelta
 from bs4 import BeautifulSoup
 from sqlalchemy import create_engine, text
 from dotenv import load_dotenv
-from typing import List, Dict, Optional
-import time
+from typing import List, Dict, Optional, Set, Tuple
 import logging
 
+from utils.http_fetcher import get_http_fetcher
+from utils.ticker_matcher import get_ticker_matcher
+from utils.communication_ids import make_communication_id
+from utils.scraper_storage import (
+    ensure_communications_dedupe_index, filter_new_communications, load_known_communications,
+    save_communications_batch
+)
+
 # Konfiguracja logowania
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -56,10 +62,15 @@ class ESPIScraper:
             'Cache-Control': 'no-cache'
         }
         
+        # Wspólny klient HTTP (pula keep-alive, limity per host, ponowienia)
+        self.fetcher = get_http_fetcher()
+        
         # Lista aktywnych tickerów (będzie ładowana z bazy)
         self.active_tickers = []
         self.load_active_tickers()
         
+        self.ensure_dedupe_index()
+        
         logger.info("✓ ESPI Scraper zainicjalizowany")
     
     def load_active_tickers(self):
@@ -81,50 +92,39 @@ class ESPIScraper:
             self.active_tickers = []
     
     def extract_ticker_from_title(self, title: str) -> Optional[str]:
-        """Wyciąga ticker spółki z tytułu komunikatu"""
-        # Wzorce do wyszukiwania tickerów w tytule
-        patterns = [
-            r'\b([A-Z]{2,10})\s*[-–]\s*',  # TICKER - tytuł
-            r'^\s*([A-Z]{2,10})\s*:',      # TICKER: tytuł
-            r'\(([A-Z]{2,10})\)',          # (TICKER)
-            r'\b([A-Z]{2,10})\s+S\.A\.',   # TICKER S.A.
-        ]
-        
-        for pattern in patterns:
-            match = re.search(pattern, title)
-            if match:
-                potential_ticker = match.group(1)
-                # Sprawdź czy to jeden z naszych aktywnych tickerów
-                if potential_ticker in self.active_tickers:
-                    return potential_ticker
-        
-        # Jeśli nie znaleziono w tytule, spróbuj dopasować do nazw spółek
-        title_upper = title.upper()
-        
-        # Mapowanie nazw na tickery (można rozszerzyć)
-        name_mapping = {
-            'PKN ORLEN': 'PKN',
-            'CD PROJEKT': 'CDPROJEKT',
-            'KGHM': 'KGHM',
-            'JSW': 'JSW',
-            'CCC': 'CCC'
-        }
-        
-        for name, ticker in name_mapping.items():
-            if name in title_upper and ticker in self.active_tickers:
-                return ticker
+        """Wyciąga ticker spółki z tytułu komunikatu (pierwszy wspomniany ticker lub nazwa spółki)"""
+        if not title:
+            return None
         
-        return None
+        matcher = get_ticker_matcher(self.engine, fallback_tickers=self.active_tickers)
+        return matcher.first_ticker(title)
     
+
     def scrape_gpw_page(self, page_url: str, communication_type: str) -> List[Dict]:
         """Scrapuje stronę GPW z komunikatami zamiast RSS"""
         try:
             logger.info(f"📡 Scraping {communication_type} z {page_url}")
             
-            response = requests.get(page_url, headers=self.headers, timeout=30)
-            response.raise_for_status()
+            response = self.fetcher.fetch(page_url, headers=self.headers)
+            if not response.ok:
+                raise RuntimeError(response.error)
+            
+            communications = self.parse_gpw_page(response.content, communication_type)
+            self.fetch_communication_contents(communications)
+            return communications
             
-            soup = BeautifulSoup(response.content, 'html.parser')
+        except Exception as e:
+            logger.error(f"❌ Błąd scrapowania strony {communication_type}: {e}")
+            return []
+    
+    def parse_gpw_page(self, html: bytes, communication_type: str) -> List[Dict]:
+        """
+        Parsuje pobraną stronę GPW z listą komunikatów
+        
+        Treść komunikatów uzupełnia fetch_communication_contents.
+        """
+        try:
+            soup = BeautifulSoup(html, 'html.parser')
             
             communications = []
             
@@ -203,22 +203,20 @@ class ESPIScraper:
                     if not ticker:
                         continue
                     
-                    # Utwórz unikalny ID
-                    comm_id = f"{communication_type}_{ticker}_{pub_date.strftime('%Y%m%d')}_{abs(hash(title)) % 10000}"
-                    
                     # Pobierz pełną treść jeśli jest link
                     full_url = link
                     if link and not link.startswith('http'):
                         full_url = f"https://www.gpw.pl{link}"
                     
-                    content = self.extract_communication_content(full_url) if full_url else None
+                    # Utwórz unikalny ID (z pełnego URL - tak jak jest zapisany w bazie)
+                    comm_id = make_communication_id(communication_type, ticker, full_url, title)
                     
                     communication = {
                         'ticker': ticker,
                         'communication_id': comm_id,
                         'publication_date': pub_date,
                         'title': title,
-                        'content': content,
+                        'content': None,
                         'communication_type': communication_type,
                         'url': full_url
                     }
@@ -234,19 +232,38 @@ class ESPIScraper:
             return communications
             
         except Exception as e:
-            logger.error(f"❌ Błąd scrapowania strony {communication_type}: {e}")
+            logger.error(f"❌ Błąd parsowania strony {communication_type}: {e}")
             return []
     
+    def fetch_communication_contents(self, communications: List[Dict]) -> None:
+        """Równolegle pobiera strony komunikatów i uzupełnia ich treść (w miejscu)"""
+        pages = self.fetcher.fetch_many((comm['url'] for comm in communications), headers=self.headers)
+        
+        for comm in communications:
+            page = pages.get(comm['url'])
+            if page is None:
+                continue
+            if not page.ok:
+                logger.warning(f"⚠️ Nie udało się pobrać treści z {comm['url']}: {page.error}")
+                continue
+            comm['content'] = self.parse_communication_html(page.content, comm['url'])
+    
     def extract_communication_content(self, url: str) -> Optional[str]:
         """Wyciąga treść komunikatu ze strony GPW"""
         if not url:
             return None
         
+        response = self.fetcher.fetch(url, headers=self.headers)
+        if not response.ok:
+            logger.warning(f"⚠️ Nie udało się pobrać treści z {url}: {response.error}")
+            return None
+        
+        return self.parse_communication_html(response.content, url)
+    
+    def parse_communication_html(self, html: bytes, url: str = "") -> Optional[str]:
+        """Wyciąga treść komunikatu z pobranej strony GPW"""
         try:
-            response = requests.get(url, headers=self.headers, timeout=20)
-            response.raise_for_status()
-            
-            soup = BeautifulSoup(response.content, 'html.parser')
+            soup = BeautifulSoup(html, 'html.parser')
             
             # Spróbuj znaleźć treść komunikatu (może wymagać dostosowania do struktury GPW)
             content_selectors = [
@@ -272,85 +289,81 @@ class ESPIScraper:
                 return text[:5000] if len(text) > 5000 else text
             
         except Exception as e:
-            logger.warning(f"⚠️ Nie udało się pobrać treści z {url}: {e}")
+            logger.warning(f"⚠️ Nie udało się sparsować treści z {url}: {e}")
         
         return None
     
+    def ensure_dedupe_index(self):
+        """Unikalny indeks communication_id - bez niego zapis sprawdza istniejące wiersze"""
+        self.has_unique_index = ensure_communications_dedupe_index(self.engine)
+    
+    def load_known_communications(self, since: datetime) -> Tuple[Set[str], Set[str]]:
+        """(communication_id, URL-e) komunikatów zapisanych od podanej daty"""
+        return load_known_communications(self.engine, since)
+    
+    def filter_new_communications(self, communications: List[Dict], known_ids: Set[str], known_urls: Set[str]) -> List[Dict]:
+        """Odrzuca komunikaty już zapisane lub powtórzone (po communication_id albo URL); uzupełnia zbiory"""
+        return filter_new_communications(communications, known_ids, known_urls)
+    
+    def save_communications_batch(self, communications: List[Dict]) -> Optional[Set[str]]:
+        """
+        Zapisuje komunikaty do bazy jednym INSERT
+        
+        Returns:
+            Zbiór communication_id faktycznie zapisanych komunikatów (None przy błędzie zapisu)
+        """
+        return save_communications_batch(self.engine, communications, unique_index=self.has_unique_index)
+    
     def save_communication(self, communication: Dict) -> bool:
         """Zapisuje komunikat do bazy danych"""
-        try:
-            with self.engine.connect() as conn:
-                # Sprawdź czy komunikat już istnieje
-                existing = conn.execute(text("""
-                    SELECT id FROM espi_communications 
-                    WHERE communication_id = :comm_id
-                """), {'comm_id': communication['communication_id']})
-                
-                if existing.fetchone():
-                    logger.debug(f"📋 Komunikat już istnieje: {communication['communication_id']}")
-                    return False
-                
-                # Zapisz nowy komunikat
-                conn.execute(text("""
-                    INSERT INTO espi_communications 
-                    (ticker, communication_id, publication_date, title, content, 
-                     communication_type, url, is_processed)
-                    VALUES 
-                    (:ticker, :communication_id, :publication_date, :title, :content,
-                     :communication_type, :url, :is_processed)
-                """), {
-                    'ticker': communication['ticker'],
-                    'communication_id': communication['communication_id'],
-                    'publication_date': communication['publication_date'],
-                    'title': communication['title'],
-                    'content': communication['content'],
-                    'communication_type': communication['communication_type'],
-                    'url': communication['url'],
-                    'is_processed': False
-                })
-                
-                conn.commit()
-                logger.info(f"✅ Zapisano komunikat {communication['communication_type']} dla {communication['ticker']}")
-                return True
-                
-        except Exception as e:
-            logger.error(f"❌ Błąd zapisu komunikatu: {e}")
-            return False
+        return communication['communication_id'] in (self.save_communications_batch([communication]) or set())
     
     def scrape_all_communications(self, days_back: int = 7) -> Dict[str, int]:
         """Scrapuje wszystkie komunikaty ESPI/EBI z ostatnich dni"""
         logger.info(f"🚀 Rozpoczynam scrapowanie komunikatów z ostatnich {days_back} dni")
         
         results = {'ESPI': 0, 'EBI': 0, 'total': 0}
+        cutoff_date = datetime.now() - timedelta(days=days_back)
+        
+        # Pobierz strony ESPI i EBI równolegle
+        pages = self.fetcher.fetch_many(self.communication_urls.values(), headers=self.headers)
         
+        recent_by_type = {}
         for comm_type, page_url in self.communication_urls.items():
             logger.info(f"\n📊 Przetwarzanie {comm_type}...")
             
-            communications = self.scrape_gpw_page(page_url, comm_type)
+            page = pages[page_url]
+            if not page.ok:
+                logger.error(f"❌ Błąd scrapowania strony {comm_type}: {page.error}")
+                recent_by_type[comm_type] = []
+                continue
             
             # Filtruj komunikaty z ostatnich X dni
-            cutoff_date = datetime.now() - timedelta(days=days_back)
-            recent_communications = [
-                comm for comm in communications 
+            recent_by_type[comm_type] = [
+                comm for comm in self.parse_gpw_page(page.content, comm_type)
                 if comm['publication_date'] >= cutoff_date
             ]
-            
-            # Zapisz do bazy danych
-            saved_count = 0
-            for comm in recent_communications:
-                if self.save_communication(comm):
-                    saved_count += 1
-                
-                # Krótka przerwa między zapisami
-                time.sleep(0.1)
-            
+        
+        # Pomiń komunikaty już zapisane, zanim pobierzemy ich treść
+        known_ids, known_urls = self.load_known_communications(cutoff_date - timedelta(days=1))
+        new_by_type = {
+            comm_type: self.filter_new_communications(communications, known_ids, known_urls)
+            for comm_type, communications in recent_by_type.items()
+        }
+        new_communications = [comm for comms in new_by_type.values() for comm in comms]
+        
+        # Treść tylko dla nowych komunikatów, wszystkie strony naraz
+        self.fetch_communication_contents(new_communications)
+        
+        # Zapisz do bazy danych jednym zapytaniem
+        saved_ids = self.save_communications_batch(new_communications) or set()
+        
+        for comm_type, communications in new_by_type.items():
+            saved_count = sum(1 for comm in communications if comm['communication_id'] in saved_ids)
             results[comm_type] = saved_count
             results['total'] += saved_count
             
             logger.info(f"✅ Zapisano {saved_count} nowych komunikatów {comm_type}")
-            
-            # Przerwa między różnymi typami komunikatów
-            time.sleep(1)
         
         return results
     
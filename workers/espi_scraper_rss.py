@@ -7,18 +7,24 @@ Data: 2025-06-24
 """
 
 import os
-import re
 import sys
-import requests
 import feedparser
 from datetime import datetime, timedelta
 from bs4 import BeautifulSoup
 from sqlalchemy import create_engine, text
 from dotenv import load_dotenv
-from typing import List, Dict, Optional
-import time
+from typing import List, Dict, Optional, Set, Tuple
 import logging
 
+from utils.http_fetcher import get_http_fetcher
+from utils.ticker_matcher import get_ticker_matcher
+from utils.communication_ids import make_communication_id
+from utils.scraper_storage import (
+    ensure_communications_dedupe_index, filter_new_communications, load_known_communications,
+    save_communications_batch
+)
+from utils.feed_state import FeedStateStore
+
 # Konfiguracja logowania
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -61,10 +67,18 @@ class ESPIScraperRSS:
             'Connection': 'keep-alive'
         }
         
+        # Wspólny klient HTTP (pula keep-alive, limity per host, ponowienia)
+        self.fetcher = get_http_fetcher()
+        
+        # Stan feedów RSS (ETag / Last-Modified / hash) - pomijanie niezmienionych feedów
+        self.feed_state = FeedStateStore(self.engine)
+        
         # Lista aktywnych tickerów (będzie ładowana z bazy)
         self.active_tickers = []
         self.load_active_tickers()
         
+        self.ensure_dedupe_index()
+        
         logger.info("✓ ESPI RSS Scraper zainicjalizowany")
     
     def load_active_tickers(self):
@@ -86,149 +100,156 @@ class ESPIScraperRSS:
             self.active_tickers = ['PKN', 'CDPROJEKT', 'KGHM', 'JSW', 'CCC', 'PGE', 'ALIOR']
     
     def extract_ticker_from_title(self, title: str) -> Optional[str]:
-        """Wyciąga ticker spółki z tytułu komunikatu"""
+        """Wyciąga ticker spółki z tytułu komunikatu (pierwszy wspomniany ticker lub nazwa spółki)"""
         if not title:
             return None
-            
-        # Wzorce do wyszukiwania tickerów w tytule
-        patterns = [
-            r'\b([A-Z]{2,10})\s*[-–]\s*',  # TICKER - tytuł
-            r'^\s*([A-Z]{2,10})\s*:',      # TICKER: tytuł
-            r'\(([A-Z]{2,10})\)',          # (TICKER)
-            r'\b([A-Z]{2,10})\s+S\.A\.',   # TICKER S.A.
-            r'^([A-Z]{2,10})\s+',          # TICKER na początku
-        ]
-        
-        for pattern in patterns:
-            match = re.search(pattern, title.upper())
-            if match:
-                potential_ticker = match.group(1)
-                # Sprawdź czy to jeden z naszych aktywnych tickerów
-                if potential_ticker in self.active_tickers:
-                    return potential_ticker
-        
-        # Mapowanie pełnych nazw na tickery
-        name_mapping = {
-            'PKN ORLEN': 'PKN',
-            'PKNORLEN': 'PKN', 
-            'CD PROJEKT': 'CDPROJEKT',
-            'CDPROJEKT': 'CDPROJEKT',
-            'KGHM POLSKA MIEDŹ': 'KGHM',
-            'KGHM': 'KGHM',
-            'JASTRZĘBSKA SPÓŁKA WĘGLOWA': 'JSW',
-            'JSW': 'JSW',
-            'CCC': 'CCC',
-            'POLSKA GRUPA ENERGETYCZNA': 'PGE',
-            'PGE': 'PGE',
-            'ALIOR BANK': 'ALIOR',
-            'ALIOR': 'ALIOR'
-        }
         
-        title_upper = title.upper()
-        for name, ticker in name_mapping.items():
-            if name in title_upper and ticker in self.active_tickers:
-                return ticker
-        
-        return None
+        matcher = get_ticker_matcher(self.engine, fallback_tickers=self.active_tickers)
+        return matcher.first_ticker(title)
     
+
     def parse_rss_feed(self, rss_url: str, feed_type: str) -> List[Dict]:
         """Parsuje RSS feed z komunikatami"""
         try:
             logger.info(f"📡 Pobieranie RSS feed {feed_type} z {rss_url}")
             
             # Pobierz RSS feed
-            response = requests.get(rss_url, headers=self.headers, timeout=30)
-            response.raise_for_status()
+            response = self.fetcher.fetch(rss_url, headers=self.headers)
+            if not response.ok:
+                raise RuntimeError(response.error)
             
-            # Parsuj feed
-            feed = feedparser.parse(response.content)
-            
-            if not feed.entries:
-                logger.warning(f"⚠️ Brak wpisów w RSS feed {feed_type}")
-                return []
-            
-            logger.info(f"✓ Znaleziono {len(feed.entries)} wpisów w RSS feed {feed_type}")
-            
-            communications = []
-            
-            for entry in feed.entries:
-                try:
-                    # Wyciągnij dane z wpisu RSS
-                    title = str(entry.title) if hasattr(entry, 'title') and entry.title else ""
-                    link = str(entry.link) if hasattr(entry, 'link') and entry.link else ""
-                    description = str(entry.description) if hasattr(entry, 'description') and entry.description else ""
-                    
-                    # Parsuj datę publikacji
-                    pub_date = datetime.now()
-                    try:
-                        if hasattr(entry, 'published_parsed') and entry.published_parsed and isinstance(entry.published_parsed, tuple):
-                            pub_date = datetime(*entry.published_parsed[:6])
-                        elif hasattr(entry, 'updated_parsed') and entry.updated_parsed and isinstance(entry.updated_parsed, tuple):
-                            pub_date = datetime(*entry.updated_parsed[:6])
-                    except (TypeError, ValueError) as e:
-                        logger.debug(f"⚠️ Błąd parsowania daty: {e}")
-                        pub_date = datetime.now()
-                    
-                    # Sprawdź czy link jest poprawny
-                    if not link or not link.startswith('http'):
-                        logger.debug(f"⚠️ Niepoprawny link: {link}")
-                        continue
-                    
-                    # Wyciągnij ticker z tytułu
-                    ticker = self.extract_ticker_from_title(title)
-                    if not ticker:
-                        logger.debug(f"⚠️ Nie znaleziono tickera w tytule: {title}")
-                        continue
-                    
-                    # Określ typ komunikatu na podstawie URL lub tytułu
-                    communication_type = feed_type
-                    if 'espi' in link.lower() or 'espi' in title.lower():
-                        communication_type = 'ESPI'
-                    elif 'ebi' in link.lower() or 'ebi' in title.lower():
-                        communication_type = 'EBI'
-                    
-                    # Utwórz unikalny ID komunikatu
-                    comm_id = f"{communication_type}_{ticker}_{pub_date.strftime('%Y%m%d_%H%M')}_{abs(hash(title)) % 10000}"
-                    
-                    # Pobierz pełną treść komunikatu ze strony
-                    content = self.extract_communication_content(link)
-                    if not content:
-                        content = description  # Fallback na opis z RSS
-                    
-                    communication = {
-                        'ticker': ticker,
-                        'communication_id': comm_id,
-                        'publication_date': pub_date,
-                        'title': title.strip(),
-                        'content': content.strip() if content else "",
-                        'communication_type': communication_type,
-                        'url': link
-                    }
-                    
-                    communications.append(communication)
-                    logger.info(f"✓ Przetworzone {communication_type} dla {ticker}: {title[:60]}...")
-                    
-                except Exception as e:
-                    logger.debug(f"⚠️ Błąd przetwarzania wpisu RSS: {e}")
-                    continue
-            
-            logger.info(f"✅ Przetworzone {len(communications)} komunikatów z RSS {feed_type}")
+            communications = self.parse_feed_content(response.content, feed_type)
+            self.fetch_communication_contents(communications)
             return communications
             
         except Exception as e:
             logger.error(f"❌ Błąd pobierania RSS feed {feed_type}: {e}")
             return []
     
+    def parse_feed_content(self, content: bytes, feed_type: str) -> List[Dict]:
+        """
+        Parsuje pobraną treść RSS feed na listę komunikatów
+        
+        Treść komunikatu to na razie opis z RSS - pełną treść uzupełnia fetch_communication_contents.
+        """
+        try:
+            communications, _ = self._parse_feed(content, feed_type)
+            return communications
+        except Exception as e:
+            logger.error(f"❌ Błąd parsowania RSS feed {feed_type}: {e}")
+            return []
+    
+    def _parse_feed(self, content: bytes, feed_type: str) -> Tuple[List[Dict], int]:
+        """
+        Parsuje treść RSS feed; błąd całego feedu (np. niepoprawny XML) jest zgłaszany wyjątkiem
+        
+        Returns:
+            (komunikaty, liczba wpisów, których nie udało się przetworzyć)
+        """
+        # Parsuj feed
+        feed = feedparser.parse(content)
+        
+        if not feed.entries:
+            if feed.bozo:
+                raise ValueError(f"niepoprawna treść feedu: {feed.bozo_exception}")
+            logger.warning(f"⚠️ Brak wpisów w RSS feed {feed_type}")
+            return [], 0
+        
+        logger.info(f"✓ Znaleziono {len(feed.entries)} wpisów w RSS feed {feed_type}")
+        
+        communications = []
+        failed_entries = 0
+        
+        for entry in feed.entries:
+            try:
+                # Wyciągnij dane z wpisu RSS
+                title = str(entry.title) if hasattr(entry, 'title') and entry.title else ""
+                link = str(entry.link) if hasattr(entry, 'link') and entry.link else ""
+                description = str(entry.description) if hasattr(entry, 'description') and entry.description else ""
+                
+                # Parsuj datę publikacji
+                pub_date = datetime.now()
+                try:
+                    if hasattr(entry, 'published_parsed') and entry.published_parsed and isinstance(entry.published_parsed, tuple):
+                        pub_date = datetime(*entry.published_parsed[:6])
+                    elif hasattr(entry, 'updated_parsed') and entry.updated_parsed and isinstance(entry.updated_parsed, tuple):
+                        pub_date = datetime(*entry.updated_parsed[:6])
+                except (TypeError, ValueError) as e:
+                    logger.debug(f"⚠️ Błąd parsowania daty: {e}")
+                    pub_date = datetime.now()
+                
+                # Sprawdź czy link jest poprawny
+                if not link or not link.startswith('http'):
+                    logger.debug(f"⚠️ Niepoprawny link: {link}")
+                    continue
+                
+                # Wyciągnij ticker z tytułu
+                ticker = self.extract_ticker_from_title(title)
+                if not ticker:
+                    logger.debug(f"⚠️ Nie znaleziono tickera w tytule: {title}")
+                    continue
+                
+                # Określ typ komunikatu na podstawie URL lub tytułu
+                communication_type = feed_type
+                if 'espi' in link.lower() or 'espi' in title.lower():
+                    communication_type = 'ESPI'
+                elif 'ebi' in link.lower() or 'ebi' in title.lower():
+                    communication_type = 'EBI'
+                
+                # Utwórz unikalny ID komunikatu
+                comm_id = make_communication_id(communication_type, ticker, link, title)
+                
+                communication = {
+                    'ticker': ticker,
+                    'communication_id': comm_id,
+                    'publication_date': pub_date,
+                    'title': title.strip(),
+                    'content': description.strip(),  # Fallback na opis z RSS
+                    'communication_type': communication_type,
+                    'url': link
+                }
+                
+                communications.append(communication)
+                logger.debug(f"✓ Przetworzone {communication_type} dla {ticker}: {title[:60]}...")
+                
+            except Exception as e:
+                logger.warning(f"⚠️ Błąd przetwarzania wpisu RSS: {e}")
+                failed_entries += 1
+                continue
+        
+        logger.info(f"✅ Przetworzone {len(communications)} komunikatów z RSS {feed_type}")
+        return communications, failed_entries
+        
+    
+    def fetch_communication_contents(self, communications: List[Dict]) -> None:
+        """Równolegle pobiera strony komunikatów i uzupełnia ich pełną treść (w miejscu)"""
+        pages = self.fetcher.fetch_many((comm['url'] for comm in communications), headers=self.headers)
+        
+        for comm in communications:
+            page = pages.get(comm['url'])
+            if page is None or not page.ok:
+                logger.debug(f"⚠️ Błąd pobierania treści z {comm['url']}: {page.error if page else 'brak'}")
+                continue
+            content = self.parse_communication_html(page.content, comm['url'])
+            if content:
+                comm['content'] = content.strip()
+    
     def extract_communication_content(self, url: str) -> Optional[str]:
         """Wyciąga pełną treść komunikatu ze strony GPW"""
         if not url:
             return None
         
+        response = self.fetcher.fetch(url, headers=self.headers)
+        if not response.ok:
+            logger.debug(f"⚠️ Błąd pobierania treści z {url}: {response.error}")
+            return None
+        
+        return self.parse_communication_html(response.content, url)
+    
+    def parse_communication_html(self, html: bytes, url: str = "") -> Optional[str]:
+        """Wyciąga treść komunikatu z pobranej strony GPW"""
         try:
-            response = requests.get(url, headers=self.headers, timeout=20)
-            response.raise_for_status()
-            
-            soup = BeautifulSoup(response.content, 'html.parser')
+            soup = BeautifulSoup(html, 'html.parser')
             
             # Szukaj głównej treści komunikatu
             content_selectors = [
@@ -268,49 +289,33 @@ class ESPIScraperRSS:
             return content
             
         except Exception as e:
-            logger.debug(f"⚠️ Błąd pobierania treści z {url}: {e}")
+            logger.debug(f"⚠️ Błąd parsowania treści z {url}: {e}")
             return None
     
+    def ensure_dedupe_index(self):
+        """Unikalny indeks communication_id - bez niego zapis sprawdza istniejące wiersze"""
+        self.has_unique_index = ensure_communications_dedupe_index(self.engine)
+    
+    def load_known_communications(self, since: datetime) -> Tuple[Set[str], Set[str]]:
+        """(communication_id, URL-e) komunikatów zapisanych od podanej daty"""
+        return load_known_communications(self.engine, since)
+    
+    def filter_new_communications(self, communications: List[Dict], known_ids: Set[str], known_urls: Set[str]) -> List[Dict]:
+        """Odrzuca komunikaty już zapisane lub powtórzone (po communication_id albo URL); uzupełnia zbiory"""
+        return filter_new_communications(communications, known_ids, known_urls)
+    
+    def save_communications_batch(self, communications: List[Dict]) -> Optional[Set[str]]:
+        """
+        Zapisuje komunikaty do bazy jednym INSERT
+        
+        Returns:
+            Zbiór communication_id faktycznie zapisanych komunikatów (None przy błędzie zapisu)
+        """
+        return save_communications_batch(self.engine, communications, unique_index=self.has_unique_index)
+    
     def save_communication(self, communication: Dict) -> bool:
         """Zapisuje komunikat do bazy danych"""
-        try:
-            with self.engine.connect() as conn:
-                # Sprawdź czy komunikat już istnieje
-                existing = conn.execute(text("""
-                    SELECT id FROM espi_communications 
-                    WHERE communication_id = :comm_id
-                """), {'comm_id': communication['communication_id']})
-                
-                if existing.fetchone():
-                    logger.debug(f"📋 Komunikat już istnieje: {communication['communication_id']}")
-                    return False
-                
-                # Zapisz nowy komunikat
-                conn.execute(text("""
-                    INSERT INTO espi_communications 
-                    (ticker, communication_id, publication_date, title, content, 
-                     communication_type, url, is_processed)
-                    VALUES 
-                    (:ticker, :communication_id, :publication_date, :title, :content,
-                     :communication_type, :url, :is_processed)
-                """), {
-                    'ticker': communication['ticker'],
-                    'communication_id': communication['communication_id'],
-                    'publication_date': communication['publication_date'],
-                    'title': communication['title'],
-                    'content': communication['content'],
-                    'communication_type': communication['communication_type'],
-                    'url': communication['url'],
-                    'is_processed': False
-                })
-                
-                conn.commit()
-                logger.info(f"✅ Zapisano komunikat {communication['communication_type']} dla {communication['ticker']}")
-                return True
-                
-        except Exception as e:
-            logger.error(f"❌ Błąd zapisu komunikatu: {e}")
-            return False
+        return communication['communication_id'] in (self.save_communications_batch([communication]) or set())
     
     def scrape_all_communications(self, days_back: int = 7) -> Dict[str, int]:
         """Scrapuje wszystkie komunikaty z RSS feeds"""
@@ -328,29 +333,63 @@ class ESPIScraperRSS:
             ('KOMUNIKATY_INDEKSOWE', 'INDEKSOWE')
         ]
         
+        # Pobierz wszystkie feedy równolegle, zapytaniami warunkowymi (niezmienione feedy są pomijane)
+        feed_urls = [self.rss_urls[feed_key] for feed_key, _ in feeds_to_scrape]
+        feeds, feed_states = self.feed_state.fetch_changed(self.fetcher, feed_urls, cutoff_date, headers=self.headers)
+        
+        recent_by_feed = {}
+        # Feedy z błędami parsowania - ich stan nie jest zapisywany, zostaną przetworzone ponownie
+        failed_feeds = set()
         for feed_key, result_key in feeds_to_scrape:
-            feed_url = self.rss_urls[feed_key]
-            logger.info(f"\n📊 Przetwarzanie RSS feed {feed_key}...")
+            feed = feeds.get(self.rss_urls[feed_key])
+            if feed is None:
+                recent_by_feed[feed_key] = []
+                continue
+            if not feed.ok:
+                logger.error(f"❌ Błąd pobierania RSS feed {feed_key}: {feed.error}")
+                recent_by_feed[feed_key] = []
+                continue
             
-            communications = self.parse_rss_feed(feed_url, feed_key)
+            try:
+                communications, failed_entries = self._parse_feed(feed.content, feed_key)
+            except Exception as e:
+                logger.error(f"❌ Błąd parsowania RSS feed {feed_key}: {e}")
+                failed_feeds.add(self.rss_urls[feed_key])
+                recent_by_feed[feed_key] = []
+                continue
+            if failed_entries:
+                failed_feeds.add(self.rss_urls[feed_key])
             
             # Filtruj komunikaty z ostatnich X dni
-            recent_communications = [
-                comm for comm in communications 
+            recent_by_feed[feed_key] = [
+                comm for comm in communications
                 if comm['publication_date'] >= cutoff_date
             ]
-            
-            logger.info(f"✓ Znaleziono {len(recent_communications)} komunikatów z ostatnich {days_back} dni")
-            
-            # Zapisz do bazy danych
-            saved_count = 0
-            for comm in recent_communications:
-                if self.save_communication(comm):
-                    saved_count += 1
-                
-                # Krótka przerwa między zapisami
-                time.sleep(0.2)
-            
+            logger.info(f"✓ {feed_key}: {len(recent_by_feed[feed_key])} komunikatów z ostatnich {days_back} dni")
+        
+        # Pomiń komunikaty już zapisane, zanim pobierzemy ich treść
+        known_ids, known_urls = self.load_known_communications(cutoff_date - timedelta(days=1))
+        new_by_feed = {
+            feed_key: self.filter_new_communications(communications, known_ids, known_urls)
+            for feed_key, communications in recent_by_feed.items()
+        }
+        new_communications = [comm for comms in new_by_feed.values() for comm in comms]
+        logger.info(f"✓ Nowych komunikatów: {len(new_communications)} "
+                    f"(pominięto {sum(len(c) for c in recent_by_feed.values()) - len(new_communications)} znanych)")
+        
+        # Pełna treść tylko dla nowych komunikatów, wszystkie strony naraz
+        self.fetch_communication_contents(new_communications)
+        
+        # Zapisz do bazy danych jednym zapytaniem
+        saved_ids = self.save_communications_batch(new_communications)
+        
+        # Stan feedów zapisujemy dopiero po udanym zapisie komunikatów (bez feedów z błędami parsowania)
+        if saved_ids is not None:
+            self.feed_state.commit({url: state for url, state in feed_states.items() if url not in failed_feeds})
+        saved_ids = saved_ids or set()
+        
+        for feed_key, result_key in feeds_to_scrape:
+            saved_count = sum(1 for comm in new_by_feed[feed_key] if comm['communication_id'] in saved_ids)
             results[result_key] = saved_count
             total_saved += saved_count
             
@@ -0,0 +1,882 @@
+#!/usr/bin/env python3
+"""
+Wektorowy backtester strategii intraday
+Odtwarza reguły IntradayRecommendationEngine (wejścia, take-profit, ciasny stop loss,
+wyjście przed końcem sesji) na słupkach wielu spółek jednocześnie, z prowizją i poślizgiem.
+Autor: GPW Investor System
+Data: 2025-07-01
+"""
+
+import os
+import json
+import copy
+import itertools
+import logging
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine, text
+from dotenv import load_dotenv
+
+from utils.price_lookup import AsOfPriceIndex
+
+# Konfiguracja logowania
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Domyślne koszty transakcyjne (typowa prowizja maklerska na GPW)
+DEFAULT_COMMISSION_RATE = 0.0039
+DEFAULT_MIN_COMMISSION = 0.0
+DEFAULT_SLIPPAGE_RATE = 0.0005
+DEFAULT_POSITION_VALUE = 10000.0
+DEFAULT_INITIAL_CAPITAL = 100000.0
+
+
+@dataclass
+class IntradayBars:
+    """
+    Słupki intraday wielu spółek na wspólnej siatce (sesja x slot x ticker)
+
+    Ceny zamknięcia są uzupełniane w przód w obrębie sesji; sloty przed pierwszą
+    transakcją w sesji mają NaN. Wolumen jest skumulowanym wolumenem sesji.
+    """
+    tickers: List[str]
+    sessions: np.ndarray        # (S,) datetime64[D]
+    slot_minutes: np.ndarray    # (B,) minuty od północy dla początku slotu
+    bar_minutes: int
+    close: np.ndarray           # (S, B, N)
+    high: np.ndarray            # (S, B, N)
+    low: np.ndarray             # (S, B, N)
+    volume: np.ndarray          # (S, B, N)
+
+    @property
+    def shape(self) -> Tuple[int, int, int]:
+        return self.close.shape
+
+    def flatten(self, array: np.ndarray) -> np.ndarray:
+        """Spłaszcza tablicę (S, B, N) do układu ticker -> sesja -> slot"""
+        return np.ascontiguousarray(np.transpose(array, (2, 0, 1))).reshape(-1)
+
+    def flat_layout(self) -> Dict[str, np.ndarray]:
+        """Indeksy pomocnicze dla układu spłaszczonego (koniec grupy sesji, minuty, znaczniki czasu)"""
+        n_sessions, n_slots, n_tickers = self.shape
+        size = n_sessions * n_slots * n_tickers
+        row = np.arange(size)
+        group_end = (row // n_slots + 1) * n_slots
+        minutes = np.tile(self.slot_minutes, n_sessions * n_tickers)
+        day_ns = np.tile(np.repeat(self.sessions.astype('datetime64[ns]'), n_slots), n_tickers)
+        timestamps = day_ns + (minutes.astype(np.int64) * 60 * 10**9).astype('timedelta64[ns]')
+        ticker_index = row // (n_sessions * n_slots)
+        session_index = (row // n_slots) % n_sessions
+        return {
+            'group_end': group_end,
+            'minutes': minutes,
+            'timestamps': timestamps,
+            'ticker_index': ticker_index,
+            'session_index': session_index
+        }
+
+
+def _create_db_engine():
+    load_dotenv('.env')
+
+    db_user = os.getenv('DB_USER')
+    db_password = os.getenv('DB_PASSWORD')
+    db_host = os.getenv('DB_HOST')
+    db_port = os.getenv('DB_PORT')
+    db_name = os.getenv('DB_NAME')
+
+    db_uri = f"postgresql://{db_user}:{db_password}@{db_host}:{db_port}/{db_name}"
+    return create_engine(db_uri)
+
+
+def _minutes_of_day(value: str) -> int:
+    hours, minutes = value.split(':')[:2]
+    return int(hours) * 60 + int(minutes)
+
+
+def get_default_rules_path() -> str:
+    """Ścieżka do rules_config_intraday.json (ta sama co w IntradayRecommendationEngine)"""
+    base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    return os.path.join(base_dir, "rules_config_intraday.json")
+
+
+def load_intraday_rules(path: Optional[str] = None) -> Dict[str, Any]:
+    """Wczytuje reguły intraday z pliku JSON silnika rekomendacji"""
+    path = path or get_default_rules_path()
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    logger.warning(f"Brak pliku reguł {path}, używam reguł domyślnych silnika")
+    return {
+        "meta": {"version": "2.0", "trading_style": "intraday"},
+        "buy_rules": {"price_drop_intraday": {"enabled": True, "threshold_percent": -2.5}},
+        "sell_rules": {"quick_profit_intraday": {"enabled": True, "profit_threshold_percent": 1.5}},
+        "general_settings": {"min_confidence_buy": 0.8}
+    }
+
+
+def load_intraday_bars(tickers: Optional[List[str]], start_date: str, end_date: str,
+                       bar_minutes: int = 5, trading_hours: Optional[Dict[str, str]] = None,
+                       engine=None) -> Optional[IntradayBars]:
+    """
+    Pobiera notowania intraday jednym zapytaniem i układa je w siatkę słupków
+
+    Args:
+        tickers: Lista tickerów (None = wszystkie spółki z notowaniami)
+        start_date: Data początkowa (YYYY-MM-DD)
+        end_date: Data końcowa (YYYY-MM-DD, włącznie)
+        bar_minutes: Długość słupka w minutach
+        trading_hours: Godziny sesji {"start": "09:00", "end": "17:00"}
+        engine: Opcjonalny silnik SQLAlchemy
+
+    Returns:
+        IntradayBars lub None jeśli brak danych
+    """
+    trading_hours = trading_hours or {}
+    open_minutes = _minutes_of_day(trading_hours.get('start', '09:00'))
+    close_minutes = _minutes_of_day(trading_hours.get('end', '17:00'))
+    engine = engine or _create_db_engine()
+
+    # high/low w quotes_intraday to wartości sesyjne - ekstrema słupka liczymy z cen
+    query = """
+        SELECT c.ticker,
+               DATE_TRUNC('minute', qi.datetime)
+                   - (EXTRACT(MINUTE FROM qi.datetime)::int % :bar_minutes) * INTERVAL '1 minute' AS bar_time,
+               (ARRAY_AGG(qi.price ORDER BY qi.datetime DESC))[1] AS close,
+               MAX(qi.price) AS high,
+               MIN(qi.price) AS low,
+               MAX(qi.volume) AS volume
+        FROM quotes_intraday qi
+        JOIN companies c ON qi.company_id = c.id
+        WHERE qi.datetime >= :start_date
+          AND qi.datetime < :end_date
+          AND qi.price > 0
+    """
+    params = {
+        'bar_minutes': bar_minutes,
+        'start_date': start_date,
+        'end_date': (datetime.strptime(end_date, '%Y-%m-%d') + timedelta(days=1)).strftime('%Y-%m-%d')
+    }
+    if tickers:
+        query += " AND c.ticker = ANY(:tickers)"
+        params['tickers'] = list(tickers)
+    query += " GROUP BY c.ticker, bar_time ORDER BY c.ticker, bar_time"
+
+    with engine.connect() as conn:
+        df = pd.read_sql_query(text(query), conn, params=params)
+
+    if df.empty:
+        logger.warning(f"Brak notowań intraday w zakresie {start_date} - {end_date}")
+        return None
+
+    df['bar_time'] = pd.to_datetime(df['bar_time'])
+    df['session'] = df['bar_time'].dt.normalize()
+    df['minute'] = df['bar_time'].dt.hour * 60 + df['bar_time'].dt.minute
+    df = df[(df['minute'] >= open_minutes) & (df['minute'] < close_minutes)]
+    if df.empty:
+        return None
+
+    slot_minutes = np.arange(open_minutes, close_minutes, bar_minutes)
+    sessions = np.sort(df['session'].unique()).astype('datetime64[D]')
+    bar_tickers = sorted(df['ticker'].unique())
+
+    s_idx = np.searchsorted(sessions, df['session'].to_numpy().astype('datetime64[D]'))
+    b_idx = ((df['minute'].to_numpy() - open_minutes) // bar_minutes).astype(int)
+    n_idx = np.searchsorted(np.array(bar_tickers), df['ticker'].to_numpy())
+
+    shape = (len(sessions), len(slot_minutes), len(bar_tickers))
+    grids = {}
+    for column in ('close', 'high', 'low', 'volume'):
+        grid = np.full(shape, np.nan)
+        grid[s_idx, b_idx, n_idx] = df[column].to_numpy(dtype=float)
+        grids[column] = grid
+
+    # Uzupełnij braki w przód w obrębie sesji (oś slotów)
+    close = _ffill_axis1(grids['close'])
+    high = np.where(np.isnan(grids['high']), close, grids['high'])
+    low = np.where(np.isnan(grids['low']), close, grids['low'])
+    volume = _ffill_axis1(grids['volume'])
+    volume = np.where(np.isnan(volume), 0.0, volume)
+
+    logger.info(f"✓ Załadowano słupki {bar_minutes}min: {shape[0]} sesji x {shape[1]} slotów x {shape[2]} spółek")
+    return IntradayBars(
+        tickers=bar_tickers,
+        sessions=sessions,
+        slot_minutes=slot_minutes,
+        bar_minutes=bar_minutes,
+        close=close,
+        high=high,
+        low=low,
+        volume=volume
+    )
+
+
+def _ffill_axis1(array: np.ndarray) -> np.ndarray:
+    """Uzupełnia NaN ostatnią znaną wartością wzdłuż osi 1 (bez przenoszenia między sesjami)"""
+    mask = np.isnan(array)
+    idx = np.where(~mask, np.arange(array.shape[1])[None, :, None], 0)
+    np.maximum.accumulate(idx, axis=1, out=idx)
+    filled = np.take_along_axis(array, idx, axis=1)
+    # Sloty przed pierwszą wartością w sesji pozostają NaN
+    return filled
+
+
+def compute_indicators(bars: IntradayBars, rsi_period: int = 14, bb_period: int = 20,
+                       bb_std: float = 2.0, volume_lookback: int = 20) -> Dict[str, np.ndarray]:
+    """
+    Oblicza wskaźniki używane przez reguły intraday dla całej siatki naraz
+
+    Returns:
+        Słownik tablic (S, B, N): price_change_1d, volume_ratio, rsi, bb_lower, bb_upper
+    """
+    n_sessions, n_slots, n_tickers = bars.shape
+    close = bars.close
+
+    # Zmiana ceny względem zamknięcia poprzedniej sesji (odpowiednik price_change_1d)
+    session_close = pd.DataFrame(close[:, -1, :]).ffill().to_numpy()
+    prev_close = np.vstack([np.full((1, n_tickers), np.nan), session_close[:-1]])
+    price_change_1d = (close / prev_close[:, None, :] - 1.0) * 100
+
+    # Wolumen skumulowany względem średniej z poprzednich sesji o tej samej porze dnia
+    volume_2d = pd.DataFrame(bars.volume.reshape(n_sessions, -1))
+    avg_volume = volume_2d.rolling(volume_lookback, min_periods=min(5, volume_lookback)).mean().shift(1)
+    avg_volume = avg_volume.to_numpy().reshape(n_sessions, n_slots, n_tickers)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        volume_ratio = np.where(avg_volume > 0, bars.volume / avg_volume, 0.0)
+
+    # RSI (Wilder) i wstęgi Bollingera na ciągłym szeregu słupków
+    series = pd.DataFrame(close.reshape(-1, n_tickers))
+    delta = series.diff()
+    gain = delta.clip(lower=0).ewm(alpha=1.0 / rsi_period, adjust=False, min_periods=rsi_period).mean()
+    loss = (-delta.clip(upper=0)).ewm(alpha=1.0 / rsi_period, adjust=False, min_periods=rsi_period).mean()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rsi = 100 - 100 / (1 + gain / loss)
+    rsi = rsi.where(loss > 0, 100.0).where(gain.notna())
+
+    middle = series.rolling(bb_period, min_periods=bb_period).mean()
+    std = series.rolling(bb_period, min_periods=bb_period).std()
+
+    shape = (n_sessions, n_slots, n_tickers)
+    return {
+        'price_change_1d': price_change_1d,
+        'volume_ratio': volume_ratio,
+        'rsi': rsi.to_numpy().reshape(shape),
+        'bb_lower': (middle - bb_std * std).to_numpy().reshape(shape),
+        'bb_upper': (middle + bb_std * std).to_numpy().reshape(shape)
+    }
+
+
+def buy_confidence(indicators: Dict[str, np.ndarray], close: np.ndarray, buy_rules: Dict[str, Any]) -> np.ndarray:
+    """Suma wag reguł kupna spełnionych w każdym słupku (jak evaluate_intraday_buy_signals)"""
+    confidence = np.zeros(close.shape)
+    price_change = np.nan_to_num(indicators['price_change_1d'], nan=0.0)
+    volume_ratio = indicators['volume_ratio']
+
+    rule = buy_rules.get('price_drop_intraday', {})
+    if rule.get('enabled', False):
+        hit = (price_change <= rule.get('threshold_percent', -2.5)) & \
+              (volume_ratio >= rule.get('min_volume_multiplier', 1.8))
+        confidence += hit * rule.get('confidence_weight', 1.2)
+
+    rule = buy_rules.get('oversold_rsi_fast', {})
+    if rule.get('enabled', False):
+        hit = indicators['rsi'] < rule.get('threshold', 35)
+        confidence += hit * rule.get('confidence_weight', 1.0)
+
+    rule = buy_rules.get('momentum_reversal', {})
+    if rule.get('enabled', False):
+        hit = (price_change <= rule.get('price_change_threshold', -1.5)) & \
+              (volume_ratio >= rule.get('min_volume_spike', 2.5))
+        confidence += hit * rule.get('confidence_weight', 1.1)
+
+    rule = buy_rules.get('bollinger_bounce', {})
+    if rule.get('enabled', False):
+        bb_lower = indicators['bb_lower']
+        with np.errstate(divide='ignore', invalid='ignore'):
+            distance = (close - bb_lower) / bb_lower * 100
+        hit = (distance >= 0) & (distance <= rule.get('touch_threshold_percent', 2.0))
+        confidence += hit * rule.get('confidence_weight', 0.9)
+
+    return confidence
+
+
+def indicator_sell_confidence(indicators: Dict[str, np.ndarray], close: np.ndarray,
+                              sell_rules: Dict[str, Any]) -> np.ndarray:
+    """Suma wag reguł sprzedaży niezależnych od pozycji (RSI wykupienie, opór Bollingera)"""
+    confidence = np.zeros(close.shape)
+
+    rule = sell_rules.get('overbought_rsi_aggressive', {})
+    if rule.get('enabled', False):
+        hit = indicators['rsi'] > rule.get('threshold', 65)
+        confidence += hit * rule.get('confidence_weight', 0.9)
+
+    rule = sell_rules.get('resistance_hit_intraday', {})
+    if rule.get('enabled', False):
+        bb_upper = indicators['bb_upper']
+        with np.errstate(divide='ignore', invalid='ignore'):
+            distance = np.abs(close - bb_upper) / bb_upper * 100
+        hit = distance <= rule.get('resistance_buffer_percent', 1.0)
+        confidence += hit * rule.get('confidence_weight', 1.0)
+
+    return confidence
+
+
+def exit_parameters(rules: Dict[str, Any]) -> Dict[str, Any]:
+    """Wyciąga z reguł sprzedaży parametry wyjścia zależne od pozycji"""
+    sell_rules = rules.get('sell_rules', {})
+    settings = rules.get('general_settings', {})
+    trading_hours = settings.get('trading_hours', {})
+
+    take_profit = sell_rules.get('quick_profit_intraday', {})
+    stop_loss = sell_rules.get('tight_stop_loss', {})
+    session_end = sell_rules.get('session_end_exit', {})
+
+    return {
+        'take_profit_percent': take_profit.get('profit_threshold_percent', 1.5) if take_profit.get('enabled', False) else None,
+        'take_profit_weight': take_profit.get('confidence_weight', 1.5),
+        'stop_loss_percent': stop_loss.get('loss_threshold_percent', -1.5) if stop_loss.get('enabled', False) else None,
+        'stop_loss_weight': stop_loss.get('confidence_weight', 1.5),
+        'minutes_before_close': session_end.get('minutes_before_close', 30) if session_end.get('enabled', False) else None,
+        'session_end_weight': session_end.get('confidence_weight', 1.0),
+        'session_close_minutes': _minutes_of_day(trading_hours.get('end', '17:00')),
+        'min_confidence_buy': settings.get('min_confidence_buy', 0.8),
+        'min_confidence_sell': settings.get('min_confidence_sell', 0.7)
+    }
+
+
+def _resolve_exits(entry: np.ndarray, close: np.ndarray, high: np.ndarray, low: np.ndarray,
+                   last_index: np.ndarray, minutes: Optional[np.ndarray], cutoff: Optional[int],
+                   exit_params: Dict[str, Any], sell_confidence: Optional[np.ndarray]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Wyznacza słupek, cenę i powód wyjścia dla pozycji otwartych w indeksach entry
+
+    Okno przeszukiwania rośnie geometrycznie - większość pozycji zamyka się po kilku
+    słupkach, więc tylko nieliczne wymagają przeglądania całej sesji.
+    """
+    take_profit = exit_params.get('take_profit_percent')
+    stop_loss = exit_params.get('stop_loss_percent')
+    min_sell = exit_params.get('min_confidence_sell', 0.7)
+
+    exit_index = last_index.copy()
+    exit_price = close[last_index].copy()
+    exit_reason = np.full(len(entry), 'session_close', dtype=object)
+
+    entry_close = close[entry]
+    tp_level = entry_close * (1 + take_profit / 100) if take_profit is not None else None
+    sl_level = entry_close * (1 + stop_loss / 100) if stop_loss is not None else None
+
+    pending = np.arange(len(entry))
+    offset, width = 1, 8
+    while len(pending):
+        rows = entry[pending][:, None] + np.arange(offset, offset + width)[None, :]
+        valid = rows <= last_index[pending][:, None]
+        rows = np.minimum(rows, last_index[pending][:, None])
+
+        conf = np.zeros(rows.shape) if sell_confidence is None else sell_confidence[rows]
+        tp_hit = sl_hit = near_end = None
+        if tp_level is not None:
+            tp_hit = high[rows] >= tp_level[pending][:, None]
+            conf = conf + tp_hit * exit_params.get('take_profit_weight', 1.5)
+        if sl_level is not None:
+            sl_hit = low[rows] <= sl_level[pending][:, None]
+            conf = conf + sl_hit * exit_params.get('stop_loss_weight', 1.5)
+        if cutoff is not None:
+            near_end = minutes[rows] >= cutoff
+            conf = conf + near_end * exit_params.get('session_end_weight', 1.0)
+
+        signal = valid & (conf >= min_sell)
+        hit = signal.any(axis=1)
+        if hit.any():
+            hit_rows = np.flatnonzero(hit)
+            first = signal[hit_rows].argmax(axis=1)
+            target = pending[hit_rows]
+            bar = rows[hit_rows, first]
+
+            at_sl = sl_hit[hit_rows, first] if sl_hit is not None else np.zeros(len(hit_rows), dtype=bool)
+            at_tp = (tp_hit[hit_rows, first] if tp_hit is not None else np.zeros(len(hit_rows), dtype=bool)) & ~at_sl
+            at_end = (near_end[hit_rows, first] if near_end is not None else np.zeros(len(hit_rows), dtype=bool)) & ~at_sl & ~at_tp
+
+            price = close[bar]
+            if sl_level is not None:
+                price = np.where(at_sl, sl_level[target], price)
+            if tp_level is not None:
+                price = np.where(at_tp, tp_level[target], price)
+
+            exit_index[target] = bar
+            exit_price[target] = price
+            exit_reason[target] = np.where(at_sl, 'stop_loss', np.where(
+                at_tp, 'take_profit', np.where(at_end, 'session_end', 'sell_signal')))
+
+        # Pozycje bez sygnału, dla których okno objęło już ostatni dopuszczalny słupek, zostają z wyjściem domyślnym
+        exhausted = entry[pending] + offset + width - 1 >= last_index[pending]
+        pending = pending[~hit & ~exhausted]
+        offset += width
+        width *= 2
+
+    return exit_index, exit_price, exit_reason
+
+
+def simulate_trades(close: np.ndarray, high: np.ndarray, low: np.ndarray,
+                    group_end: np.ndarray, minutes: Optional[np.ndarray], entries: np.ndarray,
+                    exit_params: Dict[str, Any], sell_confidence: Optional[np.ndarray] = None,
+                    max_holding_bars: Optional[int] = None,
+                    commission_rate: float = DEFAULT_COMMISSION_RATE,
+                    min_commission: float = DEFAULT_MIN_COMMISSION,
+                    slippage_rate: float = DEFAULT_SLIPPAGE_RATE,
+                    position_value: float = DEFAULT_POSITION_VALUE) -> Dict[str, np.ndarray]:
+    """
+    Symuluje transakcje long na spłaszczonych szeregach (ticker -> sesja -> słupek)
+
+    Wejście po cenie zamknięcia słupka z sygnałem, wyjście w pierwszym kolejnym słupku tej
+    samej sesji, w którym suma wag reguł sprzedaży osiągnie min_confidence_sell (take-profit
+    i stop loss liczone z high/low słupka, przy obu w jednym słupku - stop loss), najpóźniej
+    na ostatnim słupku sesji. Na danym tickerze otwarta jest co najwyżej jedna pozycja.
+
+    Sesje są od siebie niezależne, więc pozycje wyznaczane są rundami: w każdej rundzie
+    wszystkie sesje naraz otwierają pierwszą dostępną pozycję, a sygnały wejścia sprzed
+    jej zamknięcia są odrzucane.
+
+    Args:
+        close, high, low: Ceny (M,)
+        group_end: Indeks (wyłączny) końca sesji, do której należy wiersz (M,)
+        minutes: Minuty od północy (M,) - potrzebne dla wyjścia przed końcem sesji
+        entries: Maska sygnałów wejścia (M,)
+        exit_params: Wynik exit_parameters()
+        sell_confidence: Wagi reguł sprzedaży niezależnych od pozycji (M,)
+        max_holding_bars: Maksymalna liczba słupków trzymania pozycji
+
+    Returns:
+        Słownik tablic opisujących transakcje (entry_index, exit_index, ceny, wynik, powód)
+    """
+    size = len(close)
+    entries = np.asarray(entries, dtype=bool) & ~np.isnan(close)
+    entries &= np.arange(size) + 1 < group_end
+
+    cutoff = None
+    if exit_params.get('minutes_before_close') is not None and minutes is not None:
+        cutoff = exit_params['session_close_minutes'] - exit_params['minutes_before_close']
+        entries &= minutes < cutoff
+
+    pending = np.flatnonzero(entries)
+    entry_parts, exit_parts, price_parts, reason_parts = [], [], [], []
+
+    while len(pending):
+        # Pierwszy dostępny sygnał w każdej sesji
+        group = group_end[pending]
+        first_in_group = np.r_[True, group[1:] != group[:-1]]
+        entry = pending[first_in_group]
+
+        last_index = group_end[entry] - 1
+        if max_holding_bars:
+            last_index = np.minimum(last_index, entry + int(max_holding_bars))
+
+        exit_index, exit_price, exit_reason = _resolve_exits(
+            entry, close, high, low, last_index, minutes, cutoff, exit_params, sell_confidence
+        )
+        if max_holding_bars:
+            timed_out = (exit_reason == 'session_close') & (last_index < group_end[entry] - 1)
+            exit_reason[timed_out] = 'max_holding'
+
+        entry_parts.append(entry)
+        exit_parts.append(exit_index)
+        price_parts.append(exit_price)
+        reason_parts.append(exit_reason)
+
+        run_lengths = np.diff(np.r_[np.flatnonzero(first_in_group), len(pending)])
+        pending = pending[pending > np.repeat(exit_index, run_lengths)]
+
+    if not entry_parts:
+        return {
+            'entry_index': np.array([], dtype=np.int64), 'exit_index': np.array([], dtype=np.int64),
+            'entry_price': np.array([]), 'exit_price': np.array([]), 'return_pct': np.array([]),
+            'pnl': np.array([]), 'commission': np.array([]), 'exit_reason': np.array([], dtype=object)
+        }
+
+    entry_index = np.concatenate(entry_parts)
+    order = np.argsort(entry_index, kind='stable')
+    entry_index = entry_index[order]
+    exit_index = np.concatenate(exit_parts)[order]
+    exit_price = np.concatenate(price_parts)[order]
+    exit_reason = np.concatenate(reason_parts)[order]
+
+    entry_fill = close[entry_index] * (1 + slippage_rate)
+    exit_fill = exit_price * (1 - slippage_rate)
+    shares = position_value / entry_fill
+    commission = np.maximum(position_value * commission_rate, min_commission) + \
+        np.maximum(shares * exit_fill * commission_rate, min_commission)
+    pnl = shares * (exit_fill - entry_fill) - commission
+
+    return {
+        'entry_index': entry_index,
+        'exit_index': exit_index,
+        'entry_price': entry_fill,
+        'exit_price': exit_fill,
+        'return_pct': pnl / position_value * 100,
+        'pnl': pnl,
+        'commission': commission,
+        'exit_reason': exit_reason
+    }
+
+
+def summarize_trades(trades: Dict[str, np.ndarray], initial_capital: float = DEFAULT_INITIAL_CAPITAL,
+                     exit_times: Optional[np.ndarray] = None) -> Tuple[Dict[str, Any], pd.Series]:
+    """
+    Liczy metryki backtestu i krzywą kapitału (kapitał po każdym zamknięciu pozycji)
+
+    Returns:
+        Tuple (metryki, krzywa kapitału)
+    """
+    pnl = trades['pnl']
+    total_trades = len(pnl)
+
+    if exit_times is not None and total_trades > 0:
+        order = np.argsort(exit_times, kind='stable')
+        index = pd.DatetimeIndex(exit_times[order])
+    else:
+        order = np.arange(total_trades)
+        index = pd.RangeIndex(1, total_trades + 1)
+    equity = pd.Series(initial_capital + np.cumsum(pnl[order]), index=index, name='equity')
+
+    if total_trades == 0:
+        return {
+            'total_trades': 0, 'winning_trades': 0, 'win_rate': 0.0, 'total_pnl': 0.0,
+            'total_return_percent': 0.0, 'avg_trade_return_percent': 0.0, 'profit_factor': None,
+            'max_drawdown_percent': 0.0, 'sharpe_ratio': None, 'total_commission': 0.0,
+            'exit_reasons': {}
+        }, equity
+
+    peak = np.maximum.accumulate(np.concatenate([[initial_capital], equity.to_numpy()]))
+    drawdown = (np.concatenate([[initial_capital], equity.to_numpy()]) - peak) / peak
+    gross_profit = pnl[pnl > 0].sum()
+    gross_loss = -pnl[pnl < 0].sum()
+
+    sharpe = None
+    if exit_times is not None:
+        daily_returns = pd.Series(pnl[order], index=index).groupby(index.normalize()).sum() / initial_capital
+        if len(daily_returns) > 1 and daily_returns.std() > 0:
+            sharpe = float(daily_returns.mean() / daily_returns.std() * np.sqrt(252))
+
+    reasons, counts = np.unique(trades['exit_reason'].astype(str), return_counts=True)
+    return {
+        'total_trades': int(total_trades),
+        'winning_trades': int((pnl > 0).sum()),
+        'win_rate': float((pnl > 0).mean()),
+        'total_pnl': float(pnl.sum()),
+        'total_return_percent': float(pnl.sum() / initial_capital * 100),
+        'avg_trade_return_percent': float(trades['return_pct'].mean()),
+        'profit_factor': float(gross_profit / gross_loss) if gross_loss > 0 else None,
+        'max_drawdown_percent': float(drawdown.min() * 100),
+        'sharpe_ratio': sharpe,
+        'total_commission': float(trades['commission'].sum()),
+        'exit_reasons': {str(r): int(c) for r, c in zip(reasons, counts)}
+    }, equity
+
+
+def set_rule_param(rules: Dict[str, Any], path: str, value: Any) -> None:
+    """Ustawia parametr reguł wskazany ścieżką z kropkami, np. buy_rules.oversold_rsi_fast.threshold"""
+    node = rules
+    keys = path.split('.')
+    for key in keys[:-1]:
+        node = node.setdefault(key, {})
+    node[keys[-1]] = value
+
+
+def expand_param_grid(param_grid: Dict[str, List[Any]]) -> List[Dict[str, Any]]:
+    """Rozwija siatkę {ścieżka: [wartości]} w listę kombinacji"""
+    keys = list(param_grid.keys())
+    return [dict(zip(keys, values)) for values in itertools.product(*(param_grid[k] for k in keys))]
+
+
+class _SweepContext:
+    """Dane współdzielone przez wszystkie kombinacje parametrów (w procesie roboczym)"""
+    backtester = None
+    bars = None
+    indicators = None
+    layout = None
+    flat_close = None
+    flat_high = None
+    flat_low = None
+    mask = None
+    session_detail = False
+
+
+def _init_sweep_worker(backtester: 'IntradayBacktester', bars: IntradayBars, indicators: Dict[str, np.ndarray],
+                       mask: Optional[np.ndarray] = None, session_detail: bool = False):
+    _SweepContext.backtester = backtester
+    _SweepContext.mask = mask
+    _SweepContext.session_detail = session_detail
+    _SweepContext.bars = bars
+    _SweepContext.indicators = indicators
+    _SweepContext.layout = bars.flat_layout()
+    _SweepContext.flat_close = bars.flatten(bars.close)
+    _SweepContext.flat_high = bars.flatten(bars.high)
+    _SweepContext.flat_low = bars.flatten(bars.low)
+
+
+def _run_sweep_combination(rules: Dict[str, Any]) -> Dict[str, Any]:
+    context = _SweepContext
+    trades = context.backtester._simulate_rules(
+        context.bars, context.indicators, rules, context.layout,
+        (context.flat_close, context.flat_high, context.flat_low), context.mask
+    )
+    summary, _ = summarize_trades(trades, context.backtester.initial_capital,
+                                  context.layout['timestamps'][trades['exit_index']])
+    if context.session_detail:
+        # Wynik i liczba transakcji per sesja - pozwala ocenić dowolne okna sesji bez ponownej symulacji
+        sessions = context.layout['session_index'][trades['entry_index']]
+        n_sessions = context.bars.shape[0]
+        summary['session_pnl'] = np.bincount(sessions, weights=trades['pnl'], minlength=n_sessions)
+        summary['session_trades'] = np.bincount(sessions, minlength=n_sessions)
+    return summary
+
+
+class IntradayBacktester:
+    """Backtester reguł intraday i sygnałów modeli ML na słupkach wielu spółek"""
+
+    def __init__(self, rules: Optional[Dict[str, Any]] = None,
+                 commission_rate: float = DEFAULT_COMMISSION_RATE,
+                 min_commission: float = DEFAULT_MIN_COMMISSION,
+                 slippage_rate: float = DEFAULT_SLIPPAGE_RATE,
+                 position_value: float = DEFAULT_POSITION_VALUE,
+                 initial_capital: float = DEFAULT_INITIAL_CAPITAL):
+        self.rules = rules if rules is not None else load_intraday_rules()
+        self.commission_rate = commission_rate
+        self.min_commission = min_commission
+        self.slippage_rate = slippage_rate
+        self.position_value = position_value
+        self.initial_capital = initial_capital
+
+    def _costs(self) -> Dict[str, float]:
+        return {
+            'commission_rate': self.commission_rate,
+            'min_commission': self.min_commission,
+            'slippage_rate': self.slippage_rate,
+            'position_value': self.position_value
+        }
+
+    def load_bars(self, tickers: Optional[List[str]], start_date: str, end_date: str,
+                  bar_minutes: int = 5, engine=None) -> Optional[IntradayBars]:
+        """Pobiera słupki w godzinach sesji z konfiguracji reguł"""
+        trading_hours = self.rules.get('general_settings', {}).get('trading_hours')
+        return load_intraday_bars(tickers, start_date, end_date, bar_minutes, trading_hours, engine)
+
+    def _simulate_rules(self, bars: IntradayBars, indicators: Dict[str, np.ndarray], rules: Dict[str, Any],
+                        layout: Dict[str, np.ndarray], flat_prices: Tuple[np.ndarray, np.ndarray, np.ndarray],
+                        mask: Optional[np.ndarray] = None) -> Dict[str, np.ndarray]:
+        exits = exit_parameters(rules)
+        entries = buy_confidence(indicators, bars.close, rules.get('buy_rules', {})) >= exits['min_confidence_buy']
+        entries = bars.flatten(entries)
+        if mask is not None:
+            entries &= mask
+        sell_conf = bars.flatten(indicator_sell_confidence(indicators, bars.close, rules.get('sell_rules', {})))
+        close, high, low = flat_prices
+        return simulate_trades(close, high, low, layout['group_end'], layout['minutes'], entries,
+                               exits, sell_conf, **self._costs())
+
+    def run(self, bars: IntradayBars, rules: Optional[Dict[str, Any]] = None,
+            indicators: Optional[Dict[str, np.ndarray]] = None) -> Dict[str, Any]:
+        """
+        Backtest reguł intraday na słupkach
+
+        Returns:
+            Słownik z metrykami (summary), listą transakcji (trades) i krzywą kapitału (equity_curve)
+        """
+        started = time.monotonic()
+        rules = rules or self.rules
+        indicators = indicators or compute_indicators(bars)
+        layout = bars.flat_layout()
+        flat_prices = (bars.flatten(bars.close), bars.flatten(bars.high), bars.flatten(bars.low))
+
+        trades = self._simulate_rules(bars, indicators, rules, layout, flat_prices)
+        exit_times = layout['timestamps'][trades['exit_index']]
+        summary, equity = summarize_trades(trades, self.initial_capital, exit_times)
+        summary['elapsed_seconds'] = round(time.monotonic() - started, 3)
+
+        trade_list = pd.DataFrame({
+            'ticker': np.array(bars.tickers)[layout['ticker_index'][trades['entry_index']]],
+            'entry_time': layout['timestamps'][trades['entry_index']],
+            'exit_time': exit_times,
+            'entry_price': trades['entry_price'],
+            'exit_price': trades['exit_price'],
+            'return_pct': trades['return_pct'],
+            'pnl': trades['pnl'],
+            'exit_reason': trades['exit_reason']
+        }).sort_values('entry_time', kind='stable').reset_index(drop=True)
+
+        return {'summary': summary, 'trades': trade_list, 'equity_curve': equity}
+
+    def evaluate_recommendation_horizons(self, start_date: str, end_date: str,
+                                         hours: Optional[List[int]] = None, engine=None) -> Dict[str, Any]:
+        """
+        Wynik zapisanych rekomendacji BUY/SELL po 1..8 godzinach od utworzenia
+
+        Cena każdej pary (rekomendacja, godzina) to notowanie as-of z chwili created_at + godzina
+        (AsOfPriceIndex - jedno zapytanie o notowania, wyszukiwanie binarne w pamięci).
+
+        Returns:
+            Słownik z tabelą ocen (evaluations) i statystykami per godzina (by_hour)
+        """
+        hours = hours or list(range(1, 9))
+        engine = engine or _create_db_engine()
+        start = datetime.strptime(start_date, '%Y-%m-%d')
+        end = datetime.strptime(end_date, '%Y-%m-%d') + timedelta(days=1)
+
+        with engine.connect() as conn:
+            recs = pd.read_sql_query(text("""
+                SELECT id, ticker, recommendation, entry_price, created_at
+                FROM recommendations
+                WHERE recommendation IN ('BUY', 'SELL')
+                  AND created_at >= :start AND created_at < :end
+            """), conn, params={'start': start, 'end': end})
+
+        if recs.empty:
+            return {'evaluations': pd.DataFrame(), 'by_hour': []}
+
+        index = AsOfPriceIndex.load(engine, recs['ticker'].unique().tolist(), start,
+                                    end + timedelta(hours=max(hours)))
+
+        pairs = recs.loc[recs.index.repeat(len(hours))].reset_index(drop=True)
+        pairs['hour'] = np.tile(hours, len(recs))
+        pairs['evaluated_at'] = pd.to_datetime(pairs['created_at']) + pd.to_timedelta(pairs['hour'], unit='h')
+        found = index.lookup(pairs['ticker'].tolist(), pairs['evaluated_at'])
+        pairs['price'] = found['price']
+        pairs['quote_time'] = found['quote_time']
+
+        entry = pairs['entry_price'].astype(float).to_numpy()
+        direction = np.where(pairs['recommendation'].to_numpy() == 'BUY', 1.0, -1.0)
+        pairs['return_pct'] = direction * (pairs['price'].to_numpy() - entry) / entry * 100
+        pairs = pairs.dropna(subset=['price'])
+
+        by_hour = [{
+            'hour': int(hour),
+            'count': int(len(group)),
+            'avg_return_pct': round(float(group['return_pct'].mean()), 4),
+            'win_rate': round(float((group['return_pct'] > 0).mean()), 4)
+        } for hour, group in pairs.groupby('hour')]
+
+        return {'evaluations': pairs.reset_index(drop=True), 'by_hour': by_hour}
+
+    def run_signals(self, close: np.ndarray, high: np.ndarray, low: np.ndarray, group_end: np.ndarray,
+                    entries: np.ndarray, minutes: Optional[np.ndarray] = None,
+                    max_holding_bars: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Backtest zewnętrznych sygnałów wejścia (np. predykcji modelu ML)
+
+        Wyjścia według reguł sprzedaży z konfiguracji (take-profit, stop loss, koniec sesji).
+        """
+        exits = exit_parameters(self.rules)
+        trades = simulate_trades(np.asarray(close, dtype=float), np.asarray(high, dtype=float),
+                                 np.asarray(low, dtype=float), np.asarray(group_end), minutes,
+                                 np.asarray(entries, dtype=bool), exits,
+                                 max_holding_bars=max_holding_bars, **self._costs())
+        summary, equity = summarize_trades(trades, self.initial_capital)
+        return {'summary': summary, 'trades': trades, 'equity_curve': equity}
+
+    def run_parameter_sweep(self, bars: IntradayBars, param_grid: Dict[str, List[Any]],
+                            rules: Optional[Dict[str, Any]] = None, n_jobs: Optional[int] = None,
+                            indicators: Optional[Dict[str, np.ndarray]] = None,
+                            session_mask: Optional[np.ndarray] = None,
+                            session_detail: bool = False,
+                            max_combinations: Optional[int] = None, random_state: int = 42,
+                            progress_callback: Optional[Callable] = None) -> List[Dict[str, Any]]:
+        """
+        Równoległy przegląd siatki parametrów reguł
+
+        Wskaźniki liczone są raz i przekazywane do procesów roboczych przy starcie puli,
+        każda kombinacja przelicza tylko sygnały i transakcje.
+
+        Args:
+            bars: Słupki
+            param_grid: {ścieżka_parametru: [wartości]}, np. {"buy_rules.oversold_rsi_fast.threshold": [30, 35]}
+            rules: Reguły bazowe (domyślnie reguły backtestera)
+            n_jobs: Liczba procesów (domyślnie liczba rdzeni)
+            indicators: Wstępnie policzone wskaźniki
+            session_mask: Opcjonalna maska sesji (S,) - transakcje tylko w wybranych sesjach
+            session_detail: Dołącz do wyników session_pnl i session_trades (tablice (S,))
+            max_combinations: Limit kombinacji - większa siatka jest losowo próbkowana
+            random_state: Ziarno losowania kombinacji
+            progress_callback: Opcjonalny callback postępu (stage, progress, message)
+
+        Returns:
+            Lista wyników posortowana malejąco po total_pnl
+        """
+        base_rules = rules or self.rules
+        indicators = indicators or compute_indicators(bars)
+        combinations = expand_param_grid(param_grid)
+        if max_combinations and len(combinations) > max_combinations:
+            rng = np.random.default_rng(random_state)
+            picked = np.sort(rng.choice(len(combinations), size=max_combinations, replace=False))
+            combinations = [combinations[i] for i in picked]
+
+        mask = None
+        if session_mask is not None:
+            n_sessions, n_slots, n_tickers = bars.shape
+            mask = np.tile(np.repeat(np.asarray(session_mask, dtype=bool), n_slots), n_tickers)
+
+        candidate_rules = []
+        for params in combinations:
+            combo_rules = copy.deepcopy(base_rules)
+            for path, value in params.items():
+                set_rule_param(combo_rules, path, value)
+            candidate_rules.append(combo_rules)
+
+        n_jobs = n_jobs or os.cpu_count() or 1
+        results = []
+
+        if n_jobs > 1 and len(combinations) > 1 and not multiprocessing.current_process().daemon:
+            with ProcessPoolExecutor(max_workers=min(n_jobs, len(combinations)),
+                                     mp_context=multiprocessing.get_context('spawn'),
+                                     initializer=_init_sweep_worker,
+                                     initargs=(self, bars, indicators, mask, session_detail)) as pool:
+                chunksize = max(1, len(combinations) // (n_jobs * 4))
+                summaries = pool.map(_run_sweep_combination, candidate_rules, chunksize=chunksize)
+                try:
+                    for i, summary in enumerate(summaries):
+                        results.append({'params': combinations[i], **summary})
+                        if progress_callback and (i + 1) % max(1, len(combinations) // 20) == 0:
+                            progress_callback('sweep', (i + 1) / len(combinations) * 100,
+                                              f"Przeliczono {i + 1}/{len(combinations)} kombinacji")
+                except BaseException:
+                    # Anulowanie (np. TrainingCancelled z callbacku) - nie czekaj na pozostałe kombinacje
+                    pool.shutdown(wait=False, cancel_futures=True)
+                    raise
+        else:
+            _init_sweep_worker(self, bars, indicators, mask, session_detail)
+            for i, combo_rules in enumerate(candidate_rules):
+                results.append({'params': combinations[i], **_run_sweep_combination(combo_rules)})
+                if progress_callback and (i + 1) % max(1, len(combinations) // 20) == 0:
+                    progress_callback('sweep', (i + 1) / len(combinations) * 100,
+                                      f"Przeliczono {i + 1}/{len(combinations)} kombinacji")
+
+        results.sort(key=lambda r: r['total_pnl'], reverse=True)
+        return results
+
+
+def main():
+    """Funkcja testowa"""
+    print("=== INTRADAY BACKTESTER TEST ===")
+
+    backtester = IntradayBacktester()
+    end_date = datetime.now().strftime('%Y-%m-%d')
+    start_date = (datetime.now() - timedelta(days=30)).strftime('%Y-%m-%d')
+
+    bars = backtester.load_bars(None, start_date, end_date)
+    if bars is None:
+        print("❌ Brak danych intraday")
+        return
+
+    result = backtester.run(bars)
+    print(f"📈 Wynik: {result['summary']}")
+    print(result['trades'].head(10))
+
+
+if __name__ == "__main__":
+    main()
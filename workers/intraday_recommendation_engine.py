@@ -6,6 +6,7 @@ Autor: GPW Investor System
 Data: 2025-06-24
 """
 
+import hashlib
 import json
 import os
 import sys
@@ -45,8 +46,8 @@ class IntradayRecommendationEngine:
         self.enable_tracking = enable_tracking
         if enable_tracking:
             try:
-                from workers.recommendation_tracker_postgresql import RecommendationTracker
-                self.recommendation_tracker = RecommendationTracker()
+                from workers.recommendation_tracker import get_recommendation_tracker
+                self.recommendation_tracker = get_recommendation_tracker()
                 logger.info("✓ Tracker rekomendacji zainicjalizowany")
             except Exception as e:
                 logger.warning(f"⚠️ Nie można zainicjalizować trackera: {e}")
@@ -345,7 +346,7 @@ class IntradayRecommendationEngine:
         }
     
     def analyze_ticker_intraday(self, ticker: str, entry_price: Optional[float] = None, 
-                               entry_time: Optional[datetime] = None) -> Dict:
+                               entry_time: Optional[datetime] = None, save_to_tracker: bool = True) -> Dict:
         """
         Główna metoda analizy dla tradingu intraday
         
@@ -353,6 +354,7 @@ class IntradayRecommendationEngine:
             ticker: Symbol spółki
             entry_price: Cena wejścia (jeśli mamy pozycję)
             entry_time: Czas wejścia (jeśli mamy pozycję)
+            save_to_tracker: Zapisz nową rekomendację od razu (skan zapisuje wszystkie naraz po analizie)
         """
         logger.info(f"🚀 Analiza intraday dla {ticker}")
         
@@ -426,6 +428,7 @@ class IntradayRecommendationEngine:
         
         # Zapisz rekomendację do trackera (tylko jeśli to nowa rekomendacja bez pozycji)
         if (self.recommendation_tracker and 
+            save_to_tracker and 
             entry_price is None and 
             final_recommendation in ['BUY', 'SELL']):
             try:
@@ -513,7 +516,7 @@ class IntradayRecommendationEngine:
         def analyze_single_ticker(ticker: str) -> Optional[Dict]:
             """Analizuj pojedynczą spółkę - funkcja pomocnicza dla wątków"""
             try:
-                result = self.analyze_ticker_intraday(ticker)
+                result = self.analyze_ticker_intraday(ticker, save_to_tracker=False)
                 if "error" not in result:
                     return result
                 else:
@@ -562,6 +565,9 @@ class IntradayRecommendationEngine:
         
         recommendations.sort(key=sort_key, reverse=True)
         
+        # Zapisz nowe rekomendacje BUY/SELL z całego skanu jednym zapytaniem
+        self._save_scan_recommendations(recommendations)
+        
         # Logowanie podsumowania
         buy_count = sum(1 for r in recommendations if r.get('final_recommendation', r.get('recommendation')) == 'BUY')
         sell_count = sum(1 for r in recommendations if r.get('final_recommendation', r.get('recommendation')) == 'SELL')
@@ -585,6 +591,21 @@ class IntradayRecommendationEngine:
         
         return recommendations
     
+    def _save_scan_recommendations(self, recommendations: List[Dict]):
+        """Zapisuje rekomendacje BUY/SELL ze skanu do trackera jedną paczką i uzupełnia recommendation_id"""
+        to_save = [r for r in recommendations
+                   if r.get('final_recommendation', r.get('recommendation')) in ['BUY', 'SELL']]
+        if not self.recommendation_tracker or not to_save:
+            return
+        
+        try:
+            recommendation_ids = self.recommendation_tracker.save_recommendations_batch(to_save, self.current_config)
+            for result, recommendation_id in zip(to_save, recommendation_ids):
+                result['recommendation_id'] = recommendation_id
+            logger.info(f"📝 Zapisano {len(recommendation_ids)}/{len(to_save)} rekomendacji skanu do trackera")
+        except Exception as e:
+            logger.warning(f"⚠️ Nie można zapisać rekomendacji skanu do trackera: {e}")
+    
     def get_top_intraday_opportunities(self, limit: int = 10) -> List[Dict]:
         """
         Pobierz top okazje intraday z bazy danych
@@ -945,7 +966,8 @@ class IntradayRecommendationEngine:
 
     def schedule_auto_evaluation(self, interval_minutes: int = 60) -> bool:
         """
-        Ustawia automatyczną ocenę rekomendacji co określony interwał
+        Włącza automatyczną ocenę rekomendacji we wspólnym harmonogramie zadań
+        (zadanie recommendation_evaluation, tylko w godzinach 9-18, jedna instancja na wszystkie procesy)
         
         Args:
             interval_minutes: Interwał w minutach między oceną
@@ -954,34 +976,11 @@ class IntradayRecommendationEngine:
             True jeśli harmonogram został ustawiony
         """
         try:
-            import threading
-            import time
-            
-            def auto_eval_loop():
-                """Pętla automatycznej oceny"""
-                while True:
-                    try:
-                        # Czekaj określony interwał
-                        time.sleep(interval_minutes * 60)
-                        
-                        # Uruchom automatyczną ocenę tylko w godzinach notowań lub tuż po nich
-                        current_hour = datetime.now().hour
-                        if 9 <= current_hour <= 18:  # Podczas i tuż po sesji
-                            logger.info(f"🔄 Automatyczna ocena rekomendacji (co {interval_minutes}min)")
-                            results = self.auto_evaluate_recommendations()
-                            eval_count = results.get('evaluated_count', 0)
-                            if eval_count > 0:
-                                logger.info(f"✅ Automatycznie oceniono {eval_count} rekomendacji")
-                        else:
-                            logger.debug(f"⏰ Pomijam automatyczną ocenę poza godzinami notowań ({current_hour}:00)")
-                            
-                    except Exception as e:
-                        logger.error(f"❌ Błąd w automatycznej ocenie: {e}")
-                        time.sleep(60)  # Krótka przerwa przed ponowną próbą
-            
-            # Uruchom w osobnym wątku
-            eval_thread = threading.Thread(target=auto_eval_loop, daemon=True)
-            eval_thread.start()
+            from scheduler.job_runner import RECOMMENDATION_EVALUATION_JOB, get_scheduler_service
+            
+            if not get_scheduler_service().set_job(RECOMMENDATION_EVALUATION_JOB, enabled=True,
+                                                   interval_seconds=interval_minutes * 60):
+                return False
             
             logger.info(f"✅ Ustawiono automatyczną ocenę rekomendacji co {interval_minutes} minut")
             return True
@@ -1092,13 +1091,18 @@ class IntradayRecommendationEngine:
                 title=f'Rekomendacja Intraday - {ticker}',
                 notification_type='intraday_recommendation',
                 ticker=ticker,
-                metadata={'confidence': confidence, 'recommendation': recommendation}
+                metadata={'confidence': confidence, 'recommendation': recommendation},
+                # Ta sama rekomendacja w kolejnych skanach nie jest wysyłana ponownie,
+                # a rekomendacje jednego skanu trafiają do wspólnego digestu
+                coalesce_key=f"{ticker}:{recommendation}:intraday_recommendation",
+                suppress_seconds=self._notification_suppress_seconds(),
+                digest_group='intraday_scan'
             )
             
             if success:
-                logger.info(f"✅ Wysłano powiadomienie Telegram: {ticker} {recommendation}")
+                logger.info(f"✅ Powiadomienie Telegram w kolejce wysyłki: {ticker} {recommendation}")
             else:
-                logger.warning(f"⚠️ Nie udało się wysłać powiadomienia: {ticker} {recommendation}")
+                logger.warning(f"⚠️ Nie udało się dodać powiadomienia do kolejki: {ticker} {recommendation}")
                 
             return success
             
@@ -1106,6 +1110,10 @@ class IntradayRecommendationEngine:
             logger.error(f"❌ Błąd wysyłania powiadomienia Telegram: {e}")
             return False
     
+    def _notification_suppress_seconds(self) -> int:
+        """Okno tłumienia powtórzonych powiadomień (general_settings.notification_suppress_minutes, domyślnie 30)"""
+        return int(self.rules.get("general_settings", {}).get("notification_suppress_minutes", 30) * 60)
+    
     def send_scan_summary_notification(self, scan_results: List[Dict], scan_config: Optional[Dict] = None) -> bool:
         """
         Wysyła powiadomienie z podsumowaniem skanowania intraday
@@ -1184,11 +1192,17 @@ class IntradayRecommendationEngine:
                     'total_recommendations': len(recommendations),
                     'buy_count': buy_count,
                     'sell_count': sell_count
-                }
+                },
+                # Hash zestawu sygnałów - klucz stałej długości niezależnie od liczby BUY/SELL
+                coalesce_key="scan_summary:" + hashlib.md5(",".join(sorted(
+                    f"{r['ticker']}:{r.get('final_recommendation', r.get('recommendation'))}" for r in recommendations
+                )).encode('utf-8')).hexdigest(),
+                suppress_seconds=self._notification_suppress_seconds(),
+                digest_group='intraday_scan'
             )
             
             if success:
-                logger.info(f"✅ Wysłano podsumowanie skanowania: {len(recommendations)} okazji")
+                logger.info(f"✅ Podsumowanie skanowania w kolejce wysyłki: {len(recommendations)} okazji")
             
             return success
             
@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+"""
+Optymalizator walk-forward parametrów reguł intraday
+Przeszukuje progi z rules_config_intraday.json na historycznych słupkach, wybiera
+konfigurację na oknach treningowych i raportuje wynik walk-forward poza próbą (out-of-sample).
+Autor: GPW Investor System
+Data: 2025-07-01
+"""
+
+import os
+import copy
+import json
+import shutil
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from workers.intraday_backtester import (
+    IntradayBacktester, IntradayBars, compute_indicators, get_default_rules_path, set_rule_param
+)
+
+# Konfiguracja logowania
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Domyślna przestrzeń przeszukiwania - parametry dostępne dziś w panelu /intraday_config
+DEFAULT_SEARCH_SPACE = {
+    'buy_rules.price_drop_intraday.threshold_percent': [-1.5, -2.0, -2.5, -3.0, -3.5],
+    'buy_rules.price_drop_intraday.min_volume_multiplier': [1.2, 1.5, 1.8, 2.2, 2.6],
+    'buy_rules.oversold_rsi_fast.threshold': [25, 30, 35, 40],
+    'sell_rules.overbought_rsi_aggressive.threshold': [60, 65, 70, 75],
+    'sell_rules.quick_profit_intraday.profit_threshold_percent': [1.0, 1.5, 2.0, 2.5],
+    'sell_rules.tight_stop_loss.loss_threshold_percent': [-1.0, -1.5, -2.0],
+}
+
+
+def walk_forward_windows(n_sessions: int, train_sessions: int, test_sessions: int,
+                         step_sessions: Optional[int] = None) -> List[Tuple[slice, slice]]:
+    """
+    Dzieli sesje na kolejne okna (trening, test) przesuwane o step_sessions
+
+    Returns:
+        Lista par (slice sesji treningowych, slice sesji testowych)
+    """
+    step_sessions = step_sessions or test_sessions
+    windows = []
+    start = 0
+    while start + train_sessions + test_sessions <= n_sessions:
+        train = slice(start, start + train_sessions)
+        test = slice(start + train_sessions, start + train_sessions + test_sessions)
+        windows.append((train, test))
+        start += step_sessions
+    return windows
+
+
+class IntradayRulesOptimizer:
+    """Optymalizacja walk-forward progów reguł IntradayRecommendationEngine"""
+
+    def __init__(self, backtester: Optional[IntradayBacktester] = None,
+                 search_space: Optional[Dict[str, List[Any]]] = None,
+                 train_sessions: int = 60, test_sessions: int = 20,
+                 step_sessions: Optional[int] = None, min_trades: int = 20,
+                 min_profitable_folds: float = 0.5):
+        """
+        Args:
+            backtester: Backtester z regułami bazowymi i kosztami transakcyjnymi
+            search_space: {ścieżka_parametru: [wartości]} (domyślnie DEFAULT_SEARCH_SPACE)
+            train_sessions: Długość okna treningowego (sesje)
+            test_sessions: Długość okna testowego (sesje)
+            step_sessions: Przesunięcie kolejnych okien (domyślnie długość okna testowego)
+            min_trades: Minimalna liczba transakcji w oknie treningowym (i łącznie w oknach testowych walk-forward)
+            min_profitable_folds: Minimalny odsetek okien z dodatnim P&L - treningowych dla zwycięzcy
+                                  i testowych dla wyniku walk-forward
+        """
+        self.backtester = backtester or IntradayBacktester()
+        self.search_space = search_space or DEFAULT_SEARCH_SPACE
+        self.train_sessions = train_sessions
+        self.test_sessions = test_sessions
+        self.step_sessions = step_sessions
+        self.min_trades = min_trades
+        self.min_profitable_folds = min_profitable_folds
+
+    def _base_rules(self) -> Dict[str, Any]:
+        """Reguły bazowe; reguły z przestrzeni przeszukiwania nieobecne w konfiguracji są dodawane jako włączone"""
+        rules = copy.deepcopy(self.backtester.rules)
+        for path in self.search_space:
+            section, rule_name = path.split('.')[:2]
+            if rule_name not in rules.setdefault(section, {}):
+                rules[section][rule_name] = {'enabled': True}
+        return rules
+
+    def build_config(self, params: Dict[str, Any], optimization: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Tworzy pełną konfigurację reguł (format rules_config_intraday.json) z wybranymi parametrami"""
+        config = self._base_rules()
+        for path, value in params.items():
+            set_rule_param(config, path, value)
+        if optimization is not None:
+            config.setdefault('meta', {})['optimization'] = optimization
+        return config
+
+    def optimize(self, bars: IntradayBars, n_jobs: Optional[int] = None, max_combinations: Optional[int] = None,
+                 top: int = 20, progress_callback: Optional[Callable] = None) -> Dict[str, Any]:
+        """
+        Przegląd walk-forward
+
+        Każda kombinacja jest symulowana raz na całym zakresie (wskaźniki są przyczynowe,
+        a pozycje zamykane w obrębie sesji), a wyniki per sesja pozwalają policzyć P&L
+        dowolnego okna bez ponownej symulacji.
+
+        W każdym oknie treningowym wybierana jest najlepsza kombinacja (co najmniej min_trades
+        transakcji; bez takiej kombinacji okno jest pomijane) i oceniana w następującym po nim
+        oknie testowym - suma tych ocen to wynik poza próbą.
+
+        Konfiguracja końcowa wybierana jest tylko na oknach treningowych: kandydat ma min_trades
+        w każdym z nich, dodatnią medianę i dodatni P&L w co najmniej min_profitable_folds okien;
+        spośród kandydatów wygrywa najczęściej wybierany w oknach, potem najlepszy średni P&L.
+        Jeśli brak kandydata albo wynik walk-forward nie spełnia tych samych warunków, wynik
+        zawiera 'error' i nie ma konfiguracji do zapisu.
+
+        Returns:
+            Słownik z najlepszymi parametrami, gotową konfiguracją, rankingiem i przebiegiem walk-forward
+        """
+        started = time.monotonic()
+        n_sessions = bars.shape[0]
+        windows = walk_forward_windows(n_sessions, self.train_sessions, self.test_sessions, self.step_sessions)
+        if not windows:
+            return {'error': f'Za mało sesji ({n_sessions}) dla okien {self.train_sessions}+{self.test_sessions}'}
+
+        if progress_callback:
+            progress_callback('indicators', 0, f"Wskaźniki dla {n_sessions} sesji")
+        indicators = compute_indicators(bars)
+
+        results = self.backtester.run_parameter_sweep(
+            bars, self.search_space, rules=self._base_rules(), indicators=indicators, n_jobs=n_jobs,
+            session_detail=True, max_combinations=max_combinations, progress_callback=progress_callback
+        )
+        if not results:
+            return {'error': 'Brak kombinacji parametrów do oceny'}
+
+        session_pnl = np.vstack([r['session_pnl'] for r in results])
+        session_trades = np.vstack([r['session_trades'] for r in results])
+
+        folds = []
+        fold_train_pnl = []
+        fold_train_trades = []
+        times_selected = np.zeros(len(results), dtype=int)
+        for train, test in windows:
+            in_sample = session_pnl[:, train].sum(axis=1)
+            in_sample_trades = session_trades[:, train].sum(axis=1)
+            fold_train_pnl.append(in_sample)
+            fold_train_trades.append(in_sample_trades)
+            fold = {
+                'train': [str(bars.sessions[train.start]), str(bars.sessions[train.stop - 1])],
+                'test': [str(bars.sessions[test.start]), str(bars.sessions[test.stop - 1])]
+            }
+
+            # Wybór "na żywo": najlepsza konfiguracja w oknie treningowym, oceniona w testowym
+            eligible = np.where(in_sample_trades >= self.min_trades, in_sample, -np.inf)
+            if not np.isfinite(eligible).any():
+                fold.update({
+                    'selected_params': None,
+                    'skipped': f'Żadna kombinacja nie ma co najmniej {self.min_trades} transakcji w oknie treningowym'
+                })
+                folds.append(fold)
+                continue
+            chosen = int(np.argmax(eligible))
+            times_selected[chosen] += 1
+            fold.update({
+                'selected_params': results[chosen]['params'],
+                'in_sample_pnl': float(in_sample[chosen]),
+                'out_of_sample_pnl': float(session_pnl[chosen, test].sum()),
+                'out_of_sample_trades': int(session_trades[chosen, test].sum())
+            })
+            folds.append(fold)
+
+        # Wynik poza próbą: każde okno testowe z konfiguracją wybraną na jego oknie treningowym.
+        # Okna pominięte liczą się jako nierentowne.
+        scored = [f for f in folds if f['selected_params'] is not None]
+        scored_pnl = np.array([f['out_of_sample_pnl'] for f in scored])
+        walk_forward = {
+            'folds': folds,
+            'scored_folds': len(scored),
+            'out_of_sample_pnl': float(scored_pnl.sum()),
+            'out_of_sample_trades': int(sum(f['out_of_sample_trades'] for f in scored)),
+            'median_fold_pnl': float(np.median(scored_pnl)) if scored else None,
+            'profitable_folds': int((scored_pnl > 0).sum())
+        }
+        walk_forward['qualified'] = bool(
+            scored and walk_forward['out_of_sample_trades'] >= self.min_trades
+            and walk_forward['median_fold_pnl'] > 0
+            and walk_forward['profitable_folds'] >= self.min_profitable_folds * len(windows)
+        )
+
+        # Konfiguracja końcowa wyłącznie na podstawie okien treningowych
+        fold_train_pnl = np.vstack(fold_train_pnl)
+        fold_train_trades = np.vstack(fold_train_trades)
+        mean_train_pnl = fold_train_pnl.mean(axis=0)
+        median_train_pnl = np.median(fold_train_pnl, axis=0)
+        profitable_train_folds = (fold_train_pnl > 0).sum(axis=0)
+        min_train_trades = fold_train_trades.min(axis=0)
+        candidate = ((min_train_trades >= self.min_trades) & (median_train_pnl > 0)
+                     & (profitable_train_folds >= self.min_profitable_folds * len(windows)))
+
+        # Najpierw kandydaci, potem najczęściej wybierane w oknach, potem średni P&L okien treningowych
+        ranking_order = np.lexsort((-mean_train_pnl, -times_selected, ~candidate))
+        ranking = []
+        for i in ranking_order[:top]:
+            ranking.append({
+                'params': results[i]['params'],
+                'qualified': bool(candidate[i]),
+                'times_selected': int(times_selected[i]),
+                'mean_train_pnl': float(mean_train_pnl[i]),
+                'median_train_pnl': float(median_train_pnl[i]),
+                'profitable_train_folds': int(profitable_train_folds[i]),
+                'min_train_trades': int(min_train_trades[i]),
+                'full_period_pnl': float(results[i]['total_pnl']),
+                'win_rate': results[i]['win_rate'],
+                'max_drawdown_percent': results[i]['max_drawdown_percent']
+            })
+
+        error = None
+        if not ranking[0]['qualified']:
+            error = (f'Żadna kombinacja nie ma co najmniej {self.min_trades} transakcji w każdym oknie '
+                     f'treningowym i stabilnie dodatniego wyniku w oknach treningowych')
+        elif not walk_forward['qualified']:
+            error = (f'Wynik walk-forward poza próbą nie spełnia warunków (P&L {walk_forward["out_of_sample_pnl"]:.2f}, '
+                     f'{walk_forward["out_of_sample_trades"]} transakcji, {walk_forward["profitable_folds"]}/'
+                     f'{len(windows)} okien z zyskiem)')
+        if error:
+            logger.warning(f"⚠️ Optymalizacja reguł intraday: {error} - konfiguracja nie zostanie zapisana")
+            return {
+                'error': error,
+                'ranking': ranking,
+                'walk_forward': walk_forward,
+                'combinations': len(results),
+                'elapsed_seconds': round(time.monotonic() - started, 2)
+            }
+
+        best = ranking[0]
+        optimization = {
+            'optimized_at': datetime.now().isoformat(),
+            'sessions': [str(bars.sessions[0]), str(bars.sessions[-1])],
+            'tickers': len(bars.tickers),
+            'folds': len(windows),
+            'train_sessions': self.train_sessions,
+            'test_sessions': self.test_sessions,
+            'combinations': len(results),
+            'min_trades': self.min_trades,
+            'qualified': True,
+            'times_selected': best['times_selected'],
+            'mean_train_pnl': best['mean_train_pnl'],
+            'scored_folds': walk_forward['scored_folds'],
+            'median_fold_pnl': walk_forward['median_fold_pnl'],
+            'profitable_folds': walk_forward['profitable_folds'],
+            'out_of_sample_pnl': walk_forward['out_of_sample_pnl'],
+            'out_of_sample_trades': walk_forward['out_of_sample_trades']
+        }
+
+        logger.info(f"✅ Optymalizacja reguł intraday: {len(results)} kombinacji, {len(windows)} okien, "
+                    f"wybrana {best['times_selected']}x, P&L walk-forward poza próbą {walk_forward['out_of_sample_pnl']:.2f}")
+
+        return {
+            'best_params': best['params'],
+            'config': self.build_config(best['params'], optimization),
+            'ranking': ranking,
+            'walk_forward': walk_forward,
+            'combinations': len(results),
+            'elapsed_seconds': round(time.monotonic() - started, 2)
+        }
+
+    def save_config(self, config: Dict[str, Any], path: Optional[str] = None, apply: bool = False) -> str:
+        """
+        Zapisuje konfigurację reguł
+
+        Args:
+            config: Konfiguracja z optimize()
+            path: Ścieżka docelowa (domyślnie rules_config_intraday_optimized.json obok pliku reguł)
+            apply: Nadpisz rules_config_intraday.json używany przez silnik (z kopią .bak)
+
+        Returns:
+            Ścieżka zapisanego pliku
+
+        Raises:
+            ValueError: apply dla konfiguracji, która nie przeszła warunków optimize()
+        """
+        rules_path = get_default_rules_path()
+        if apply and not config.get('meta', {}).get('optimization', {}).get('qualified'):
+            raise ValueError('Konfiguracja nie spełnia warunków optymalizacji - odmowa nadpisania reguł silnika')
+        if apply:
+            path = rules_path
+            if os.path.exists(rules_path):
+                shutil.copyfile(rules_path, rules_path + '.bak')
+        else:
+            path = path or os.path.join(os.path.dirname(rules_path), 'rules_config_intraday_optimized.json')
+
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(config, f, indent=2, ensure_ascii=False)
+        logger.info(f"✓ Zapisano zoptymalizowane reguły intraday do: {path}")
+        return path
+
+
+def main():
+    """Funkcja testowa"""
+    print("=== INTRADAY RULES OPTIMIZER TEST ===")
+
+    optimizer = IntradayRulesOptimizer(train_sessions=20, test_sessions=5)
+    end_date = datetime.now().strftime('%Y-%m-%d')
+    start_date = (datetime.now() - timedelta(days=90)).strftime('%Y-%m-%d')
+
+    bars = optimizer.backtester.load_bars(None, start_date, end_date)
+    if bars is None:
+        print("❌ Brak danych intraday")
+        return
+
+    result = optimizer.optimize(bars, max_combinations=200)
+    if 'error' in result:
+        print(f"❌ {result['error']}")
+        return
+
+    print(f"🏆 Najlepsze parametry: {result['best_params']}")
+    print(f"📁 Zapisano: {optimizer.save_config(result['config'])}")
+
+
+if __name__ == "__main__":
+    main()
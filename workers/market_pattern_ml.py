@@ -11,8 +11,10 @@ import pandas as pd
 import pickle
 import logging
 import os
+import threading
+from collections import deque
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Tuple, Any
+from typing import Callable, Dict, List, Optional, Tuple, Any
 from sqlalchemy import create_engine, text
 from dotenv import load_dotenv
 
@@ -34,6 +36,217 @@ except ImportError as e:
     StandardScaler = None
     logger.warning(f"⚠️ ML libraries not available: {e}")
 
+# Okresy zmian cen (5min/1h/2h) i okna wskaźników rynkowych, w słupkach 5-minutowych
+PRICE_CHANGE_PERIODS = [(1, '5min'), (12, '1h'), (24, '2h')]
+SMA_WINDOWS = (20, 60)
+RSI_WINDOW = 14
+
+
+class MarketFeatureState:
+    """
+    Kroczący stan cech rynkowych aktualizowany słupek po słupku
+    
+    Odtwarza wiersz create_market_features dla najnowszego momentu czasowego bez
+    przeliczania pivotu całej historii. Trzyma tylko to, czego wymagają okna cech:
+    24 ostatnie wektory cen spółek (zmiany 5min/1h/2h), 60 ostatnich średnich rynku
+    (SMA20/60), 14 ostatnich zysków/strat (RSI) oraz poprzedni wiersz (ffill).
+    Aktualizacja kosztuje O(liczba spółek) niezależnie od długości historii.
+    """
+    
+    def __init__(self, tickers: Optional[List[str]] = None):
+        """
+        Args:
+            tickers: Początkowe uniwersum spółek (mianownik udziałów spadających/rosnących);
+                     spółki spoza niego są dodawane przy pierwszym notowaniu
+        """
+        self.tickers: List[str] = []
+        self._ticker_index: Dict[str, int] = {}
+        self._history_len = max(periods for periods, _ in PRICE_CHANGE_PERIODS) + 1
+        # Bufor cykliczny cen z przeniesioną ostatnią znaną wartością (jak pct_change z 'pad')
+        self._price_history = np.full((self._history_len, 0), np.nan)
+        self._last_price = np.empty(0)
+        self._avg_raw = deque(maxlen=max(SMA_WINDOWS))
+        self._avg_filled = deque(maxlen=self._history_len)
+        self._gains = deque(maxlen=RSI_WINDOW)
+        self._losses = deque(maxlen=RSI_WINDOW)
+        self._last_avg_volume = np.float64(np.nan)
+        self.bars = 0
+        self.last_timestamp = None
+        self.latest: Optional[Dict[str, Any]] = None
+        self._ensure_tickers(sorted(tickers or []))
+    
+    def _ensure_tickers(self, tickers) -> None:
+        """Dodaje nowe spółki do uniwersum (kolumny NaN w historii)"""
+        new = [t for t in tickers if t not in self._ticker_index]
+        if not new:
+            return
+        for ticker in new:
+            self._ticker_index[ticker] = len(self.tickers)
+            self.tickers.append(ticker)
+        pad = np.full((self._history_len, len(new)), np.nan)
+        self._price_history = np.hstack([self._price_history, pad])
+        self._last_price = np.concatenate([self._last_price, np.full(len(new), np.nan)])
+    
+    def _lagged(self, values: deque, periods: int) -> float:
+        """Wartość sprzed `periods` słupków (NaN, gdy historia jest za krótka)"""
+        return values[-1 - periods] if len(values) > periods else np.nan
+    
+    def update(self, timestamp, prices: Dict[str, float], volumes: Optional[Dict[str, float]] = None) -> Dict[str, Any]:
+        """
+        Dodaje jeden moment czasowy (słupek) i zwraca wiersz cech rynkowych
+        
+        Args:
+            timestamp: Czas słupka
+            prices: {ticker: cena} spółek notowanych w tym słupku
+            volumes: {ticker: wolumen} spółek notowanych w tym słupku
+        
+        Returns:
+            Słownik cech w kolejności kolumn create_market_features (z 'datetime')
+        """
+        # Dzielenie przez zero daje inf, czyszczone na końcu tak jak w create_market_features
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return self._update(timestamp, prices, volumes)
+    
+    def _update(self, timestamp, prices: Dict[str, float], volumes: Optional[Dict[str, float]]) -> Dict[str, Any]:
+        """Właściwa aktualizacja stanu - patrz update()"""
+        self._ensure_tickers(prices)
+        if volumes:
+            self._ensure_tickers(volumes)
+        n_tickers = len(self.tickers)
+        
+        current = np.full(n_tickers, np.nan)
+        for ticker, price in prices.items():
+            current[self._ticker_index[ticker]] = price
+        
+        # Średnia i rozrzut liczone z surowych notowań słupka
+        quoted = current[~np.isnan(current)]
+        avg_price = quoted.mean() if len(quoted) else np.float64(np.nan)
+        price_std = float(quoted.std(ddof=1)) if len(quoted) > 1 else np.nan
+        
+        # Zmiany cen spółek liczone z ostatnich znanych cen
+        filled = np.where(np.isnan(current), self._last_price, current)
+        self._last_price = filled
+        row_index = self.bars % self._history_len
+        self._price_history[row_index] = filled
+        
+        self._avg_raw.append(avg_price)
+        previous_avg_filled = self._avg_filled[-1] if self._avg_filled else np.nan
+        self._avg_filled.append(previous_avg_filled if np.isnan(avg_price) else avg_price)
+        
+        features: Dict[str, Any] = {'datetime': timestamp}
+        features['market_avg_price'] = avg_price
+        features['market_price_std'] = price_std
+        
+        for periods, suffix in [(1, ''), (12, '_1h'), (24, '_2h')]:
+            base = self._lagged(self._avg_filled, periods)
+            features[f'market_price_change{suffix}'] = self._avg_filled[-1] / base - 1
+        
+        changes = {}
+        for periods, label in PRICE_CHANGE_PERIODS:
+            if self.bars >= periods:
+                base = self._price_history[(self.bars - periods) % self._history_len]
+                changes[periods] = filled / base - 1
+            else:
+                changes[periods] = np.full(n_tickers, np.nan)
+            falling = int((changes[periods] < 0).sum())
+            rising = int((changes[periods] > 0).sum())
+            features[f'stocks_falling_{label}'] = falling
+            features[f'stocks_rising_{label}'] = rising
+            features[f'stocks_falling_pct_{label}'] = falling / n_tickers if n_tickers else np.nan
+            features[f'stocks_rising_pct_{label}'] = rising / n_tickers if n_tickers else np.nan
+        
+        for periods, name in [(1, 'market_volatility'), (12, 'market_volatility_1h')]:
+            valid = changes[periods][~np.isnan(changes[periods])]
+            features[name] = float(valid.std(ddof=1)) if len(valid) > 1 else np.nan
+        
+        # SMA wymaga pełnego okna bez braków (jak rolling(window).mean())
+        for window in SMA_WINDOWS:
+            recent = list(self._avg_raw)[-window:]
+            features[f'market_sma_{window}'] = np.mean(recent) if len(recent) == window else np.float64(np.nan)
+        for window in SMA_WINDOWS:
+            sma = features[f'market_sma_{window}']
+            features[f'price_vs_sma{window}'] = (avg_price - sma) / sma
+        
+        # RSI: brakująca zmiana liczy się jako zero zysku i straty (jak _calculate_rsi)
+        delta = avg_price - self._avg_raw[-2] if len(self._avg_raw) > 1 else np.nan
+        self._gains.append(delta if delta > 0 else 0.0)
+        self._losses.append(-delta if delta < 0 else 0.0)
+        if len(self._gains) == RSI_WINDOW:
+            rs = np.mean(self._gains) / (np.mean(self._losses) + 1e-10)
+            features['market_rsi'] = 100 - (100 / (1 + rs))
+        else:
+            features['market_rsi'] = 50.0
+        
+        features['price_drop_0.5pct'] = int(features['market_price_change'] < -0.005)
+        features['price_drop_1pct'] = int(features['market_price_change'] < -0.01)
+        features['price_drop_2pct'] = int(features['market_price_change_1h'] < -0.02)
+        features['oversold_simple'] = int(features['price_vs_sma20'] < -0.02 and features['stocks_falling_pct_1h'] > 0.7)
+        features['oversold_rsi'] = int(features['market_rsi'] < 30)
+        
+        volume_values = [v for v in (volumes or {}).values() if v is not None and not np.isnan(v)]
+        avg_volume = np.mean(volume_values) if volume_values else np.float64(np.nan)
+        features['market_avg_volume'] = avg_volume
+        filled_volume = self._last_avg_volume if np.isnan(avg_volume) else avg_volume
+        features['market_volume_change'] = filled_volume / self._last_avg_volume - 1 if self.bars else np.nan
+        self._last_avg_volume = filled_volume
+        features['high_volume'] = int(features['market_volume_change'] > 0.5)
+        
+        ts = pd.Timestamp(timestamp)
+        features['hour'] = ts.hour
+        features['minute'] = ts.minute
+        features['is_morning'] = int(ts.hour < 12)
+        features['is_afternoon'] = int(ts.hour >= 12)
+        
+        # Czyszczenie jak w create_market_features: inf -> NaN, ffill z poprzedniego wiersza, reszta 0
+        for name, value in features.items():
+            if name == 'datetime':
+                continue
+            if value is None or (isinstance(value, float) and not np.isfinite(value)):
+                previous = self.latest.get(name) if self.latest else None
+                features[name] = previous if previous is not None else 0
+        
+        self.bars += 1
+        self.last_timestamp = timestamp
+        self.latest = features
+        return features
+    
+    def update_from_frame(self, df: pd.DataFrame) -> Optional[Dict[str, Any]]:
+        """
+        Dodaje kolejne momenty czasowe z ramki w formacie get_market_data
+        
+        Notowania tego samego tickera w jednym momencie są uśredniane (jak pivot_table).
+        Momenty nie późniejsze niż ostatnio przetworzony są pomijane.
+        
+        Returns:
+            Wiersz cech dla ostatniego momentu (albo poprzedni stan, gdy brak nowych danych)
+        """
+        if df is None or len(df) == 0:
+            return self.latest
+        
+        new_rows = df
+        if self.last_timestamp is not None:
+            new_rows = df[pd.to_datetime(df['datetime']) > pd.Timestamp(self.last_timestamp)]
+        if len(new_rows) == 0:
+            return self.latest
+        
+        grouped = (new_rows.assign(price=pd.to_numeric(new_rows['price'], errors='coerce'),
+                                   volume=pd.to_numeric(new_rows['volume'], errors='coerce'))
+                   .groupby(['datetime', 'ticker'], sort=True)[['price', 'volume']].mean())
+        
+        for timestamp, bar in grouped.groupby(level='datetime', sort=True):
+            bar = bar.droplevel('datetime')
+            prices = bar['price'].dropna().to_dict()
+            volumes = bar['volume'].dropna().to_dict()
+            self.update(timestamp, prices, volumes)
+        
+        return self.latest
+
+
+# Stan cech rynkowych na żywo, współdzielony przez instancje w procesie (klucz: zestaw tickerów)
+_live_feature_states: Dict[Tuple[str, ...], MarketFeatureState] = {}
+_live_feature_lock = threading.Lock()
+
+
 class MarketPatternML:
     """Model ML wykrywający wzorce zachowań rynkowych - panika, wyprzedaż, odbicia"""
     
@@ -69,14 +282,19 @@ class MarketPatternML:
         
         logger.info("✓ Market Pattern ML initialized")
     
-    def get_market_data(self, tickers: List[str], days_back: int = 2000) -> pd.DataFrame:
+    def get_market_data(self, tickers: List[str], days_back: int = 2000,
+                        since: Optional[datetime] = None) -> pd.DataFrame:
         """
         Pobiera WSZYSTKIE dane 5-minutowe dla wszystkich spółek z ostatnich N dni
         Kluczowe: analizujemy wszystkie spółki razem w tym samym czasie!
+        
+        Z `since` pobierane są tylko notowania późniejsze niż podany moment (dociąganie na żywo).
         """
         try:
             end_date = datetime.now()
             start_date = end_date - timedelta(days=days_back)
+            if since is not None:
+                start_date = since + timedelta(microseconds=1)
             
             # Zapytanie do PostgreSQL - pobieramy WSZYSTKIE dane intraday razem
             query = text("""
@@ -108,9 +326,14 @@ class MarketPatternML:
                 ])
             
             if len(df) == 0:
-                logger.warning(f"Brak danych dla tickerów: {tickers}")
+                if since is None:
+                    logger.warning(f"Brak danych dla tickerów: {tickers}")
                 return pd.DataFrame()
             
+            if since is not None:
+                logger.debug(f"Pobrano {len(df):,} nowych rekordów od {since}")
+                return df
+            
             logger.info(f"✓ Pobrano {len(df):,} rekordów dla {len(tickers)} spółek z {days_back} dni")
             return df
             
@@ -157,16 +380,20 @@ class MarketPatternML:
             df_pivot['market_price_change_2h'] = df_pivot['market_avg_price'].pct_change(periods=24)  # 2h = 24 x 5min
             
             # 3. Ile spółek spadło/wzrosło (sentiment rynku)
-            for periods, label in [(1, '5min'), (12, '1h'), (24, '2h')]:
-                changes = df_pivot[price_cols].pct_change(periods=periods)
+            # Zmiany liczone od ostatniej znanej ceny spółki (tak samo jak w MarketFeatureState)
+            filled_prices = df_pivot[price_cols].ffill()
+            price_changes = {periods: filled_prices / filled_prices.shift(periods) - 1
+                             for periods, _ in PRICE_CHANGE_PERIODS}
+            for periods, label in PRICE_CHANGE_PERIODS:
+                changes = price_changes[periods]
                 df_pivot[f'stocks_falling_{label}'] = (changes < 0).sum(axis=1)
                 df_pivot[f'stocks_rising_{label}'] = (changes > 0).sum(axis=1)
                 df_pivot[f'stocks_falling_pct_{label}'] = df_pivot[f'stocks_falling_{label}'] / len(price_cols)
                 df_pivot[f'stocks_rising_pct_{label}'] = df_pivot[f'stocks_rising_{label}'] / len(price_cols)
             
             # 4. Volatility rynku (czy jest panika?)
-            df_pivot['market_volatility'] = df_pivot[price_cols].pct_change().std(axis=1)
-            df_pivot['market_volatility_1h'] = df_pivot[price_cols].pct_change(periods=12).std(axis=1)
+            df_pivot['market_volatility'] = price_changes[1].std(axis=1)
+            df_pivot['market_volatility_1h'] = price_changes[12].std(axis=1)
             
             # 5. Wykrywanie wzorców wyprzedaży (OVERSOLD patterns)
             # Średnia ruchoma cen
@@ -280,7 +507,8 @@ class MarketPatternML:
             logger.error(f"Błąd tworzenia etykiet: {e}")
             return pd.Series([0] * len(df))
     
-    def prepare_training_data(self, tickers: List[str], days_back: int = 500) -> Tuple[pd.DataFrame, pd.Series]:
+    def prepare_training_data(self, tickers: List[str], days_back: int = 500,
+                              progress_callback: Optional[Callable] = None) -> Tuple[pd.DataFrame, pd.Series]:
         """
         Przygotowuje dane treningowe analizując WSZYSTKIE spółki razem przez N dni
         To jest właściwa metoda zgodna z Twoimi wymaganiami!
@@ -289,18 +517,27 @@ class MarketPatternML:
             logger.info(f"🔄 Preparing training data for {len(tickers)} tickers, {days_back} days back")
             
             # 1. Pobierz wszystkie dane rynkowe razem
+            if progress_callback:
+                progress_callback('load_data', 0, f"Pobieranie danych {len(tickers)} spółek z {days_back} dni")
+            
             df = self.get_market_data(tickers, days_back)
             
             if len(df) == 0:
                 return pd.DataFrame(), pd.Series()
             
             # 2. Stwórz cechy rynkowe (analizuje wszystkie spółki razem)
+            if progress_callback:
+                progress_callback('features', 0, f"Budowanie cech rynkowych z {len(df):,} rekordów")
+            
             features_df = self.create_market_features(df)
             
             if len(features_df) == 0:
                 return pd.DataFrame(), pd.Series()
             
             # 3. Stwórz etykiety (czy nastąpi odbicie rynku)
+            if progress_callback:
+                progress_callback('features', 50, f"Tworzenie etykiet dla {len(features_df):,} punktów czasowych")
+            
             labels = self.create_market_labels(features_df)
             
             # 4. Przygotuj finalne dane
@@ -315,13 +552,17 @@ class MarketPatternML:
             logger.info(f"✅ Training data prepared: {X.shape[0]} samples, {X.shape[1]} features")
             logger.info(f"   📊 Label distribution: {y.value_counts().to_dict()}")
             
+            if progress_callback:
+                progress_callback('features', 100, f"Przygotowano {X.shape[0]:,} próbek, {X.shape[1]} cech")
+            
             return X, y
             
         except Exception as e:
             logger.error(f"Błąd przygotowania danych treningowych: {e}")
             return pd.DataFrame(), pd.Series()
     
-    def train_model(self, tickers: List[str], days_back: int = 500) -> Dict[str, Any]:
+    def train_model(self, tickers: List[str], days_back: int = 500,
+                    progress_callback: Optional[Callable] = None) -> Dict[str, Any]:
         """Trenuje model na danych rynkowych"""
         try:
             if not ML_AVAILABLE or train_test_split is None or StandardScaler is None or RandomForestClassifier is None:
@@ -330,7 +571,7 @@ class MarketPatternML:
             logger.info(f"🤖 Training market pattern model...")
             
             # Prepare data
-            X, y = self.prepare_training_data(tickers, days_back)
+            X, y = self.prepare_training_data(tickers, days_back, progress_callback=progress_callback)
             
             if len(X) == 0:
                 return {'error': 'No training data available'}
@@ -346,6 +587,9 @@ class MarketPatternML:
             X_test_scaled = self.scaler.transform(X_test)
             
             # Train model
+            if progress_callback:
+                progress_callback('fit', 0, f"Trening RandomForest na {len(X_train):,} próbkach")
+            
             self.model = RandomForestClassifier(
                 n_estimators=100,
                 max_depth=10,
@@ -356,6 +600,9 @@ class MarketPatternML:
             self.model.fit(X_train_scaled, y_train)
             
             # Evaluate
+            if progress_callback:
+                progress_callback('evaluate', 100, "Ewaluacja modelu")
+            
             train_score = self.model.score(X_train_scaled, y_train)
             test_score = self.model.score(X_test_scaled, y_test)
             
@@ -391,42 +638,51 @@ class MarketPatternML:
             logger.error(f"Błąd trenowania modelu: {e}")
             return {'error': str(e)}
     
+    def _live_market_features(self, tickers: List[str], days_back: int = 2) -> Optional[Dict[str, Any]]:
+        """
+        Najnowszy wiersz cech rynkowych z kroczącego stanu
+        
+        Pierwsze wywołanie dla zestawu tickerów buduje stan z ostatnich `days_back` dni,
+        kolejne dociągają tylko nowe notowania i aktualizują stan słupek po słupku.
+        """
+        key = tuple(sorted(set(tickers)))
+        with _live_feature_lock:
+            state = _live_feature_states.get(key)
+            if state is None:
+                df = self.get_market_data(list(key), days_back=days_back)
+                if len(df) == 0:
+                    return None
+                state = MarketFeatureState(df['ticker'].unique().tolist())
+                state.update_from_frame(df)
+                _live_feature_states[key] = state
+                logger.info(f"✓ Stan cech rynkowych zbudowany: {state.bars} słupków, {len(state.tickers)} spółek")
+            else:
+                df = self.get_market_data(list(key), since=pd.Timestamp(state.last_timestamp).to_pydatetime())
+                state.update_from_frame(df)
+            return dict(state.latest) if state.latest else None
+    
     def predict_current_market(self, tickers: List[str]) -> Dict[str, Any]:
         """Przewiduje czy obecnie są warunki do wejścia na rynek"""
         try:
             if not self.is_trained or self.model is None or self.scaler is None:
                 return {'error': 'Model not trained'}
             
-            # Get recent market data (last 2 days for context)
-            df = self.get_market_data(tickers, days_back=2)
+            # Latest market-wide features (rolling state, only new bars are fetched)
+            latest_row = self._live_market_features(tickers)
             
-            if len(df) == 0:
+            if latest_row is None:
                 return {'error': 'No recent market data'}
             
-            # Create features
-            features_df = self.create_market_features(df)
-            
-            if len(features_df) == 0:
-                return {'error': 'Could not create features'}
-            
-            # Get latest features
-            latest_features = features_df[self.feature_names].iloc[-1:].copy()
-            
             # Handle missing features
-            for feature in self.feature_names:
-                if feature not in latest_features.columns:
-                    latest_features[feature] = 0
-            
-            latest_features = latest_features[self.feature_names]
+            latest_features = pd.DataFrame([{
+                feature: latest_row.get(feature, 0) for feature in self.feature_names
+            }], columns=self.feature_names)
             
             # Scale and predict
             latest_scaled = self.scaler.transform(latest_features)
             prediction = self.model.predict(latest_scaled)[0]
             probability = self.model.predict_proba(latest_scaled)[0]
             
-            # Get current market status
-            latest_row = features_df.iloc[-1]
-            
             result = {
                 'prediction': int(prediction),
                 'probability_buy': float(probability[1]) if len(probability) > 1 else 0.0,
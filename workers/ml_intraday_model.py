@@ -10,20 +10,23 @@ import numpy as np
 import pandas as pd
 import pickle
 import logging
+import math
 import os
+import time
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Tuple, Any
+from typing import Callable, Dict, List, Optional, Tuple, Any
 import sqlite3
 import json
 
 # ML libraries będą instalowane później
 try:
     from sklearn.ensemble import RandomForestClassifier, GradientBoostingClassifier
-    from sklearn.model_selection import train_test_split, cross_val_score, GridSearchCV
-    from sklearn.metrics import classification_report, confusion_matrix, accuracy_score
+    from sklearn.model_selection import train_test_split, cross_val_score, ParameterGrid, ParameterSampler
+    from sklearn.metrics import classification_report, confusion_matrix, accuracy_score, get_scorer
     from sklearn.preprocessing import StandardScaler
     import xgboost as xgb
     import lightgbm as lgb
+    from joblib import Parallel, delayed
     ML_AVAILABLE = True
 except ImportError:
     ML_AVAILABLE = False
@@ -33,6 +36,161 @@ except ImportError:
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Część chronologicznego końca okna treningowego odkładana na early stopping
+# (fold walidacyjny służy wyłącznie do oceny)
+EARLY_STOPPING_FRACTION = 0.15
+
+
+def _time_series_folds(X: pd.DataFrame, n_splits: int, gap: int,
+                       timestamps: Optional[pd.Series] = None) -> List[Tuple[np.ndarray, ...]]:
+    """
+    Foldy walk-forward (rosnące okno treningowe) bez przecieku przyszłości
+    
+    Jeśli podano timestamps, wiersze są sortowane globalnie po czasie. W przeciwnym
+    razie dane dzielone są osobno w obrębie każdego tickera (ticker_encoded), w którym
+    MLFeatureEngineer zachowuje kolejność chronologiczną. Między train a walidacją
+    pomijane jest `gap` próbek (horyzont etykiety).
+    
+    Koniec okna treningowego każdej grupy (EARLY_STOPPING_FRACTION) to holdout early stopping,
+    oddzielony od części do dopasowania przerwą `gap`.
+    
+    Returns:
+        Lista (indeksy train, indeksy walidacji, recency train, rola train, recency części fit) -
+        pozycje w X; recency to pozycja wiersza w historii swojej grupy (0 = najstarszy,
+        1 = najnowszy); rola: 0 = dopasowanie, 1 = holdout early stopping, -1 = przerwa
+    """
+    if timestamps is not None:
+        groups = [np.argsort(np.asarray(timestamps), kind='stable')]
+    elif 'ticker_encoded' in X.columns:
+        codes = X['ticker_encoded'].to_numpy()
+        groups = [np.flatnonzero(codes == code) for code in np.unique(codes)]
+    else:
+        groups = [np.arange(len(X))]
+    
+    folds = []
+    for k in range(1, n_splits + 1):
+        train_parts, val_parts, recency_parts, role_parts, fit_recency_parts = [], [], [], [], []
+        for idx in groups:
+            bounds = np.linspace(0, len(idx), n_splits + 2).astype(int)
+            train_part = idx[:max(0, bounds[k] - gap)]
+            train_parts.append(train_part)
+            val_parts.append(idx[bounds[k]:bounds[k + 1]])
+            recency_parts.append(np.linspace(0, 1, len(train_part), dtype=np.float32))
+            
+            n_train = len(train_part)
+            holdout_start = n_train - int(n_train * EARLY_STOPPING_FRACTION)
+            fit_end = max(0, holdout_start - gap)
+            role = np.full(n_train, -1, dtype=np.int8)
+            role[:fit_end] = 0
+            role[holdout_start:] = 1
+            fit_recency = np.full(n_train, -1.0, dtype=np.float32)
+            fit_recency[:fit_end] = np.linspace(0, 1, fit_end, dtype=np.float32)
+            role_parts.append(role)
+            fit_recency_parts.append(fit_recency)
+        folds.append((np.concatenate(train_parts), np.concatenate(val_parts), np.concatenate(recency_parts),
+                      np.concatenate(role_parts), np.concatenate(fit_recency_parts)))
+    
+    return folds
+
+
+def _build_fold_cache(X: pd.DataFrame, y: pd.Series, folds: List[Tuple[np.ndarray, ...]],
+                      scale: bool = False) -> List[Dict[str, np.ndarray]]:
+    """
+    Buduje raz macierze train/walidacja dla każdego foldu (skaler dopasowany tylko do train)
+    
+    Rundy successive halving z częścią danych wybierają najświeższe próbki według `recency`.
+    """
+    X_values = X.to_numpy(dtype=np.float32)
+    y_values = y.to_numpy()
+    
+    cache = []
+    for train_idx, val_idx, recency, role, fit_recency in folds:
+        X_train, X_val = X_values[train_idx], X_values[val_idx]
+        if scale:
+            scaler = StandardScaler()
+            X_train = scaler.fit_transform(X_train)
+            X_val = scaler.transform(X_val)
+        
+        cache.append({
+            'X_train': X_train,
+            'y_train': y_values[train_idx],
+            'X_val': X_val,
+            'y_val': y_values[val_idx],
+            'recency': recency,
+            'role': role,
+            'fit_recency': fit_recency
+        })
+    
+    return cache
+
+
+def _build_estimator(model_type: str, params: Dict[str, Any], random_state: int,
+                     early_stopping_rounds: int = 0, n_jobs: int = 1):
+    """Tworzy estymator dla podanego typu modelu i parametrów"""
+    if model_type == 'xgboost':
+        kwargs = dict(random_state=random_state, eval_metric='logloss', n_jobs=n_jobs, **params)
+        if early_stopping_rounds:
+            kwargs['early_stopping_rounds'] = early_stopping_rounds
+        return xgb.XGBClassifier(**kwargs)
+    elif model_type == 'lightgbm':
+        return lgb.LGBMClassifier(random_state=random_state, n_jobs=n_jobs, verbose=-1, **params)
+    elif model_type == 'random_forest':
+        return RandomForestClassifier(random_state=random_state, n_jobs=n_jobs, **params)
+    raise ValueError(f"Nieznany typ modelu: {model_type}")
+
+
+def _fit_and_score_fold(model_type: str, params: Dict[str, Any], fold: Dict[str, np.ndarray],
+                        resource: float, early_stopping_rounds: int, scoring: str,
+                        random_state: int) -> Tuple[float, float, Optional[int]]:
+    """
+    Trenuje i ocenia jednego kandydata na jednym foldzie (wykonywane w procesie joblib)
+    
+    Early stopping korzysta z holdoutu z końca okna treningowego; fold walidacyjny
+    nie bierze udziału w dopasowaniu ani w wyborze liczby drzew.
+    
+    Returns:
+        (wynik walidacji, czas wall-clock w sekundach, best_iteration z early stopping)
+    """
+    start = time.perf_counter()
+    
+    holdout = fold['role'] == 1
+    if model_type not in ('xgboost', 'lightgbm') or not holdout.any():
+        early_stopping_rounds = 0
+    
+    if early_stopping_rounds:
+        mask, recency = fold['role'] == 0, fold['fit_recency']
+    else:
+        mask, recency = np.ones(len(fold['y_train']), dtype=bool), fold['recency']
+    if resource < 1.0:
+        mask &= recency >= 1.0 - resource
+    X_train, y_train = fold['X_train'][mask], fold['y_train'][mask]
+    
+    if len(np.unique(y_train)) < 2 or len(fold['y_val']) == 0:
+        return float('nan'), time.perf_counter() - start, None
+    
+    model = _build_estimator(model_type, params, random_state, early_stopping_rounds)
+    
+    fit_kwargs = {}
+    if early_stopping_rounds:
+        eval_set = [(fold['X_train'][holdout], fold['y_train'][holdout])]
+        if model_type == 'xgboost':
+            fit_kwargs = {'eval_set': eval_set, 'verbose': False}
+        else:
+            fit_kwargs = {'eval_set': eval_set,
+                          'callbacks': [lgb.early_stopping(early_stopping_rounds, verbose=False)]}
+    
+    model.fit(X_train, y_train, **fit_kwargs)
+    score = float(get_scorer(scoring)(model, fold['X_val'], fold['y_val']))
+    
+    best_iteration = None
+    if early_stopping_rounds and model_type == 'xgboost':
+        best_iteration = getattr(model, 'best_iteration', None)
+    elif early_stopping_rounds and model_type == 'lightgbm':
+        best_iteration = getattr(model, 'best_iteration_', None)
+    
+    return score, time.perf_counter() - start, best_iteration
+
+
 class IntradayMLModel:
     """Model ML do predykcji sygnałów intraday trading"""
     
@@ -493,33 +651,56 @@ class IntradayMLModel:
         
         return info
     
-    def hyperparameter_tuning(self, X: pd.DataFrame, y: pd.Series, model_type: str = 'xgboost') -> Dict[str, Any]:
+    def hyperparameter_tuning(self, X: pd.DataFrame, y: pd.Series, model_type: str = 'xgboost',
+                              progress_callback: Optional[Callable] = None,
+                              n_candidates: int = 24, n_splits: int = 3, halving_factor: int = 3,
+                              min_resource: float = 0.25, early_stopping_rounds: int = 20,
+                              gap: int = 4, scoring: str = 'accuracy', n_jobs: int = -1,
+                              timestamps: Optional[pd.Series] = None,
+                              random_state: int = 42) -> Dict[str, Any]:
         """
-        Optymalizuje hiperparametry modelu
+        Optymalizuje hiperparametry modelu (randomized search + successive halving)
+        
+        Kandydaci losowani są z siatki parametrów i oceniani na foldach walk-forward
+        (bez przecieku przyszłości). Każda runda odrzuca (1 - 1/halving_factor)
+        najsłabszych kandydatów i zwiększa część danych treningowych, aż do pełnych foldów.
+        Foldy dla wszystkich kandydatów liczone są równolegle (joblib/loky), a macierze
+        cech foldów budowane są raz. XGBoost/LightGBM używają early stopping.
         
         Args:
             X: Cechy treningowe
             y: Etykiety
             model_type: Typ modelu do optymalizacji
+            progress_callback: Opcjonalny callback postępu (stage, progress, message, **metryki)
+            n_candidates: Liczba losowanych kandydatów
+            n_splits: Liczba foldów walk-forward
+            halving_factor: Współczynnik odrzucania kandydatów i wzrostu danych w rundzie
+            min_resource: Część danych treningowych foldu w pierwszej rundzie
+            early_stopping_rounds: Early stopping dla xgboost/lightgbm (0 = wyłączony)
+            gap: Liczba próbek przerwy między train a walidacją (horyzont etykiety)
+            scoring: Metryka sklearn
+            n_jobs: Liczba procesów (-1 = wszystkie rdzenie)
+            timestamps: Opcjonalne znaczniki czasu wierszy X (domyślnie kolejność w tickerze)
+            random_state: Ziarno losowania
             
         Returns:
-            Najlepsze parametry i wyniki
+            Najlepsze parametry, wyniki kandydatów i czasy (wall-clock) per kandydat
         """
         if not ML_AVAILABLE:
             return {'error': 'ML libraries not available'}
         
         try:
-            # Definicje siatek parametrów
+            # Definicje przestrzeni parametrów
             param_grids = {
                 'xgboost': {
-                    'n_estimators': [100, 200],
+                    'n_estimators': [200, 400],
                     'max_depth': [4, 6, 8],
                     'learning_rate': [0.05, 0.1, 0.2],
                     'subsample': [0.8, 0.9],
                     'colsample_bytree': [0.8, 0.9]
                 },
                 'lightgbm': {
-                    'n_estimators': [100, 200],
+                    'n_estimators': [200, 400],
                     'max_depth': [4, 6, 8],
                     'learning_rate': [0.05, 0.1, 0.2],
                     'feature_fraction': [0.8, 0.9],
@@ -536,44 +717,159 @@ class IntradayMLModel:
             if model_type not in param_grids:
                 return {'error': f'Brak siatki parametrów dla {model_type}'}
             
-            # Stwórz model
-            if model_type == 'xgboost':
-                base_model = xgb.XGBClassifier(random_state=42, eval_metric='logloss')
-            elif model_type == 'lightgbm':
-                base_model = lgb.LGBMClassifier(random_state=42)
-            elif model_type == 'random_forest':
-                base_model = RandomForestClassifier(random_state=42)
-            
-            # Grid search
-            logger.info(f"🔍 Rozpoczynam optymalizację parametrów dla {model_type}...")
-            
-            grid_search = GridSearchCV(
-                base_model,
-                param_grids[model_type],
-                cv=3,  # Zmniejszone CV dla szybszego działania
-                scoring='accuracy',
-                n_jobs=-1,
-                verbose=0
-            )
-            
-            # Przygotuj dane (skalowanie dla RF)
+            if model_type == 'random_forest':
+                early_stopping_rounds = 0
+            
+            search_start = time.perf_counter()
+            
+            # Foldy walk-forward i cache macierzy foldów (budowane raz dla wszystkich kandydatów)
+            folds = _time_series_folds(X, n_splits, gap, timestamps)
+            fold_cache = _build_fold_cache(X, y, folds, scale=(model_type == 'random_forest'))
+            
+            grid_size = len(ParameterGrid(param_grids[model_type]))
+            sampled = list(ParameterSampler(param_grids[model_type], n_iter=min(n_candidates, grid_size),
+                                            random_state=random_state))
+            candidates = [{
+                'candidate': i,
+                'params': params,
+                'rounds': [],
+                'wall_clock_seconds': 0.0,
+                'best_iterations': []
+            } for i, params in enumerate(sampled)]
+            
+            # Szacowana liczba zadań (kandydat x fold) we wszystkich rundach - dla postępu
+            total_tasks, alive_count, resource = 0, len(candidates), min_resource
+            while True:
+                total_tasks += alive_count * n_splits
+                if resource >= 1.0 or alive_count <= 1:
+                    break
+                alive_count = max(1, math.ceil(alive_count / halving_factor))
+                resource = min(1.0, resource * halving_factor)
+            
+            logger.info(f"🔍 Rozpoczynam optymalizację parametrów dla {model_type}: "
+                        f"{len(candidates)} kandydatów, {n_splits} foldów walk-forward")
+            if progress_callback:
+                progress_callback('tuning', 0, f"Successive halving dla {model_type}: {len(candidates)} kandydatów",
+                                  n_folds=n_splits, n_candidates=len(candidates))
+            
+            alive = candidates
+            resource = min_resource
+            round_no = 0
+            done_tasks = 0
+            best_score = None
+            
+            while True:
+                round_no += 1
+                round_start = time.perf_counter()
+                tasks = [(candidate, fold_no) for candidate in alive for fold_no in range(n_splits)]
+                fold_scores = {candidate['candidate']: [] for candidate in alive}
+                
+                parallel = Parallel(n_jobs=n_jobs, backend='loky', return_as='generator')
+                outputs = parallel(
+                    delayed(_fit_and_score_fold)(
+                        model_type, candidate['params'], fold_cache[fold_no], resource,
+                        early_stopping_rounds, scoring, random_state
+                    )
+                    for candidate, fold_no in tasks
+                )
+                
+                for (candidate, fold_no), (score, seconds, best_iteration) in zip(tasks, outputs):
+                    done_tasks += 1
+                    candidate['wall_clock_seconds'] += seconds
+                    fold_scores[candidate['candidate']].append(score)
+                    if best_iteration is not None and resource >= 1.0:
+                        candidate['best_iterations'].append(best_iteration)
+                    
+                    metrics = {'fold': fold_no + 1, 'n_folds': n_splits, 'round': round_no}
+                    scores = fold_scores[candidate['candidate']]
+                    if len(scores) == n_splits:
+                        mean_score = float(np.nanmean(scores)) if not np.all(np.isnan(scores)) else float('nan')
+                        if not np.isnan(mean_score) and (best_score is None or mean_score > best_score):
+                            best_score = mean_score
+                            metrics['best_score'] = best_score
+                    
+                    if progress_callback:
+                        progress_callback('tuning', done_tasks / total_tasks * 100,
+                                          f"Runda {round_no}, kandydat {candidate['candidate']}, "
+                                          f"fold {fold_no + 1}/{n_splits}", **metrics)
+                
+                for candidate in alive:
+                    scores = fold_scores[candidate['candidate']]
+                    candidate['rounds'].append({
+                        'round': round_no,
+                        'resource': resource,
+                        'fold_scores': scores,
+                        'mean_score': float(np.nanmean(scores)) if not np.all(np.isnan(scores)) else None
+                    })
+                
+                logger.info(f"   Runda {round_no}: {len(alive)} kandydatów, dane {resource:.0%}, "
+                            f"{time.perf_counter() - round_start:.1f}s")
+                
+                if resource >= 1.0 or len(alive) <= 1:
+                    break
+                
+                ranked = sorted(alive, key=lambda c: c['rounds'][-1]['mean_score']
+                                if c['rounds'][-1]['mean_score'] is not None else -np.inf, reverse=True)
+                alive = ranked[:max(1, math.ceil(len(alive) / halving_factor))]
+                resource = min(1.0, resource * halving_factor)
+            
+            finalists = [c for c in alive if c['rounds'][-1]['mean_score'] is not None]
+            if not finalists:
+                return {'error': 'Żaden kandydat nie dał poprawnego wyniku walidacji'}
+            
+            best = max(finalists, key=lambda c: c['rounds'][-1]['mean_score'])
+            best_params = dict(best['params'])
+            if best['best_iterations']:
+                # Liczba drzew z early stopping (mediana z foldów)
+                best_params['n_estimators'] = int(np.median(best['best_iterations'])) + 1
+            
+            # Refit najlepszego modelu na pełnych danych
+            scaler = None
+            X_fit = X.to_numpy(dtype=np.float32)
             if model_type == 'random_forest':
                 scaler = StandardScaler()
-                X_scaled = scaler.fit_transform(X)
-                grid_search.fit(X_scaled, y)
-            else:
-                grid_search.fit(X, y)
+                X_fit = scaler.fit_transform(X_fit)
+            best_model = _build_estimator(model_type, best_params, random_state, n_jobs=n_jobs)
+            best_model.fit(X_fit, y.to_numpy())
+            
+            candidate_timings = sorted([{
+                'candidate': c['candidate'],
+                'params': c['params'],
+                'rounds_completed': len(c['rounds']),
+                'final_score': c['rounds'][-1]['mean_score'],
+                'wall_clock_seconds': round(c['wall_clock_seconds'], 3),
+                'seconds_per_fold': round(c['wall_clock_seconds'] / (len(c['rounds']) * n_splits), 3)
+            } for c in candidates], key=lambda c: c['wall_clock_seconds'], reverse=True)
+            
+            total_seconds = time.perf_counter() - search_start
             
             results = {
-                'best_params': grid_search.best_params_,
-                'best_score': grid_search.best_score_,
-                'best_model': grid_search.best_estimator_,
-                'cv_results': grid_search.cv_results_
+                'best_params': best_params,
+                'best_score': best['rounds'][-1]['mean_score'],
+                'best_model': best_model,
+                'scaler': scaler,
+                'cv_results': [{
+                    'candidate': c['candidate'],
+                    'params': c['params'],
+                    'rounds': c['rounds']
+                } for c in candidates],
+                'candidate_timings': candidate_timings,
+                'rounds': round_no,
+                'n_candidates': len(candidates),
+                'n_splits': n_splits,
+                'total_seconds': round(total_seconds, 3)
             }
             
-            logger.info(f"✅ Optymalizacja zakończona")
-            logger.info(f"   📊 Najlepszy wynik: {grid_search.best_score_:.3f}")
-            logger.info(f"   📊 Najlepsze parametry: {grid_search.best_params_}")
+            if progress_callback:
+                progress_callback('tuning', 100, "Optymalizacja zakończona",
+                                  fold=n_splits, n_folds=n_splits, best_score=results['best_score'])
+            
+            logger.info(f"✅ Optymalizacja zakończona w {total_seconds:.1f}s")
+            logger.info(f"   📊 Najlepszy wynik: {results['best_score']:.3f}")
+            logger.info(f"   📊 Najlepsze parametry: {best_params}")
+            for timing in candidate_timings[:5]:
+                logger.info(f"   ⏱️ Kandydat {timing['candidate']}: {timing['wall_clock_seconds']:.1f}s "
+                            f"({timing['rounds_completed']} rund), wynik {timing['final_score']}")
             
             return results
             
@@ -641,43 +937,62 @@ class IntradayMLModel:
             logger.error(f"❌ Błąd backtestingu: {e}")
             return {'error': str(e)}
     
-    def _simulate_trading(self, predictions: Dict, features: pd.DataFrame, actual_labels: pd.Series) -> Dict[str, Any]:
+    def _simulate_trading(self, predictions: Dict, features: pd.DataFrame, actual_labels: pd.Series,
+                          label_horizon: int = 4) -> Dict[str, Any]:
         """
         Symuluje trading na podstawie predykcji
         
+        Sygnały BUY rozgrywane są w IntradayBacktester na cenach z cech: wyjście według reguł
+        intraday (take-profit, stop loss, koniec sesji), najpóźniej po horyzoncie etykiety,
+        z prowizją i poślizgiem.
+        
         Args:
             predictions: Predykcje modelu
             features: Cechy
             actual_labels: Rzeczywiste etykiety
+            label_horizon: Horyzont etykiety w rekordach (maksymalny czas trzymania pozycji)
             
         Returns:
             Wyniki symulacji
         """
         try:
-            buy_signals = predictions['predictions']
-            confidences = [pred['confidence'] for pred in predictions['detailed_predictions']]
+            from workers.intraday_backtester import IntradayBacktester
             
-            # Symulacja prostej strategii
-            total_trades = sum(buy_signals)
-            successful_trades = sum([buy_signals[i] == 1 and actual_labels.iloc[i] == 1 for i in range(len(buy_signals))])
-            
-            win_rate = successful_trades / total_trades if total_trades > 0 else 0
+            buy_signals = np.asarray(predictions['predictions']) == 1
+            confidences = [pred['confidence'] for pred in predictions['detailed_predictions']]
             
-            # Oszacowany P&L (zakładając 2% zysk przy sukcesie, -1% strata przy porażce)
-            estimated_pnl = 0
-            for i, signal in enumerate(buy_signals):
-                if signal == 1:  # BUY signal
-                    if actual_labels.iloc[i] == 1:  # Successful prediction
-                        estimated_pnl += 2.0  # 2% profit
-                    else:  # Failed prediction
-                        estimated_pnl -= 1.0  # 1% loss
+            close = features['close'].to_numpy(dtype=float)
+            high = features['high'].to_numpy(dtype=float) if 'high' in features.columns else close
+            low = features['low'].to_numpy(dtype=float) if 'low' in features.columns else close
+            
+            # Granice sesji: zmiana tickera lub cofnięcie się czasu sesji (kolejny dzień)
+            new_group = np.zeros(len(features), dtype=bool)
+            new_group[0] = True
+            if 'ticker_encoded' in features.columns:
+                codes = features['ticker_encoded'].to_numpy()
+                new_group[1:] |= codes[1:] != codes[:-1]
+            minutes = None
+            if 'session_time' in features.columns:
+                session_time = features['session_time'].to_numpy(dtype=float)
+                new_group[1:] |= session_time[1:] <= session_time[:-1]
+                minutes = np.round(session_time * 60).astype(int)
+            starts = np.flatnonzero(new_group)
+            group_end = np.repeat(np.r_[starts[1:], len(features)], np.diff(np.r_[starts, len(features)]))
+            
+            backtest = IntradayBacktester().run_signals(
+                close, high, low, group_end, buy_signals, minutes=minutes, max_holding_bars=label_horizon
+            )
+            summary = backtest['summary']
             
+            labels = np.asarray(actual_labels)
             return {
-                'total_trades': total_trades,
-                'successful_trades': successful_trades,
-                'win_rate': win_rate,
-                'estimated_pnl_percent': estimated_pnl,
-                'avg_confidence': np.mean(confidences) if confidences else 0
+                'total_trades': summary['total_trades'],
+                'successful_trades': summary['winning_trades'],
+                'win_rate': summary['win_rate'],
+                'estimated_pnl_percent': float(backtest['trades']['return_pct'].sum()),
+                'avg_confidence': np.mean(confidences) if confidences else 0,
+                'signal_precision': float(labels[buy_signals].mean()) if buy_signals.any() else 0,
+                'backtest': summary
             }
             
         except Exception as e:
@@ -7,21 +7,25 @@ Data: 2025-06-24
 """
 
 import os
-import re
 import sys
-import requests
 import feedparser
 from datetime import datetime, timedelta
 from bs4 import BeautifulSoup
 from sqlalchemy import create_engine, text
 from dotenv import load_dotenv
-from typing import List, Dict, Optional, Any, Union
-import time
+from typing import List, Dict, Optional, Any, Union, Set, Tuple
 import logging
 from urllib.parse import urljoin, urlparse
 import hashlib
 from pathlib import Path
 
+from utils.http_fetcher import get_http_fetcher
+from utils.ticker_matcher import get_ticker_matcher
+from utils.feed_state import FeedStateStore
+from utils.scraper_storage import (
+    companies_by_ticker_mapping, ensure_news_dedupe_index, load_known_article_urls, save_articles_batch
+)
+
 # Konfiguracja logowania
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -80,10 +84,18 @@ class NewsScraperOffline:
             'Upgrade-Insecure-Requests': '1'
         }
         
+        # Wspólny klient HTTP (pula keep-alive, limity per host, ponowienia)
+        self.fetcher = get_http_fetcher()
+        
+        # Stan feedów RSS (ETag / Last-Modified / hash) - pomijanie niezmienionych feedów
+        self.feed_state = FeedStateStore(self.engine)
+        
         # Lista aktywnych tickerów (będzie ładowana z bazy)
         self.active_tickers = []
         self.load_active_tickers()
         
+        self.ensure_dedupe_index()
+        
         logger.info("✓ News Scraper Offline zainicjalizowany")
         logger.info(f"✓ Katalog storage: {self.storage_dir}")
     
@@ -106,141 +118,141 @@ class NewsScraperOffline:
             self.active_tickers = ['PKN', 'CDPROJEKT', 'KGHM', 'JSW', 'CCC', 'PGE', 'ALIOR']
     
     def extract_tickers_from_content(self, title: str, content: str = "") -> List[str]:
-        """Wyciąga tickery spółek z tytułu i treści"""
-        text_to_search = f"{title} {content}".upper()
-        found_tickers = []
-        
-        # Wzorce do wyszukiwania tickerów
-        ticker_patterns = [
-            r'\b([A-Z]{2,10})\s*[-–]\s*',  # TICKER - tytuł
-            r'^\s*([A-Z]{2,10})\s*:',      # TICKER: tytuł
-            r'\(([A-Z]{2,10})\)',          # (TICKER)
-            r'\b([A-Z]{2,10})\s+S\.A\.',   # TICKER S.A.
-            r'^([A-Z]{2,10})\s+',          # TICKER na początku
-        ]
-        
-        for pattern in ticker_patterns:
-            matches = re.findall(pattern, text_to_search)
-            for match in matches:
-                if match in self.active_tickers and match not in found_tickers:
-                    found_tickers.append(match)
-        
-        # Mapowanie pełnych nazw na tickery
-        name_mapping = {
-            'PKN ORLEN': 'PKN',
-            'PKNORLEN': 'PKN',
-            'CD PROJEKT': 'CDPROJEKT',
-            'CDPROJEKT': 'CDPROJEKT',
-            'KGHM POLSKA MIEDŹ': 'KGHM',
-            'JASTRZĘBSKA SPÓŁKA WĘGLOWA': 'JSW',
-            'POLISH GAMES': 'PGS',
-            'ALLEGRO': 'ALE'
-        }
-        
-        for name, ticker in name_mapping.items():
-            if name in text_to_search and ticker not in found_tickers and ticker in self.active_tickers:
-                found_tickers.append(ticker)
-        
-        return found_tickers
+        """Wyciąga tickery spółek z tytułu i treści artykułu (tickery i nazwy spółek, jedno przejście)"""
+        matcher = get_ticker_matcher(self.engine, fallback_tickers=self.active_tickers)
+        return matcher.find_tickers(f"{title} {content}")
     
+
     def parse_rss_feed(self, rss_url: str, portal_name: str) -> List[Dict]:
         """Parsuje RSS feed z artykułami"""
         try:
             logger.info(f"📡 Pobieranie RSS feed {portal_name} z {rss_url}")
             
             # Pobierz RSS feed
-            response = requests.get(rss_url, headers=self.headers, timeout=30)
-            response.raise_for_status()
-            
-            # Parsuj feed
-            feed = feedparser.parse(response.content)
-            
-            if not feed.entries:
-                logger.warning(f"⚠️ Brak wpisów w RSS feed {portal_name}")
-                return []
-            
-            logger.info(f"✓ Znaleziono {len(feed.entries)} artykułów w RSS feed {portal_name}")
-            
-            articles = []
-            
-            for entry in feed.entries:
-                try:
-                    # Wyciągnij podstawowe dane z RSS
-                    title = str(entry.title) if hasattr(entry, 'title') and entry.title else ""
-                    link = str(entry.link) if hasattr(entry, 'link') and entry.link else ""
-                    description = str(entry.description) if hasattr(entry, 'description') and entry.description else ""
-                    
-                    # Parsuj datę publikacji
-                    pub_date = datetime.now()
-                    try:
-                        if hasattr(entry, 'published_parsed') and entry.published_parsed and isinstance(entry.published_parsed, tuple):
-                            pub_date = datetime(*entry.published_parsed[:6])
-                        elif hasattr(entry, 'updated_parsed') and entry.updated_parsed and isinstance(entry.updated_parsed, tuple):
-                            pub_date = datetime(*entry.updated_parsed[:6])
-                    except (TypeError, ValueError) as e:
-                        logger.debug(f"⚠️ Błąd parsowania daty: {e}")
-                        pub_date = datetime.now()
-                    
-                    # Sprawdź czy link jest poprawny
-                    if not link or not link.startswith('http'):
-                        logger.debug(f"⚠️ Niepoprawny link: {link}")
-                        continue
-                    
-                    # Utwórz ID artykułu na podstawie URL
-                    article_id = hashlib.md5(link.encode()).hexdigest()[:12]
-                    
-                    article = {
-                        'id': article_id,
-                        'title': title.strip(),
-                        'link': link,
-                        'description': description,
-                        'publication_date': pub_date,
-                        'portal': portal_name,
-                        'tickers': []  # Będą wyciągnięte po zapisaniu HTML
-                    }
-                    
-                    articles.append(article)
-                    
-                except Exception as e:
-                    logger.debug(f"⚠️ Błąd przetwarzania wpisu RSS: {e}")
-                    continue
+            response = self.fetcher.fetch(rss_url, headers=self.headers)
+            if not response.ok:
+                raise RuntimeError(response.error)
             
-            logger.info(f"✅ Przetworzone {len(articles)} artykułów z RSS {portal_name}")
-            return articles
+            return self.parse_feed_content(response.content, portal_name)
             
         except Exception as e:
             logger.error(f"❌ Błąd pobierania RSS feed {portal_name}: {e}")
             return []
     
+    def parse_feed_content(self, content: bytes, portal_name: str) -> List[Dict]:
+        """Parsuje pobraną treść RSS feed na listę artykułów"""
+        try:
+            articles, _ = self._parse_feed(content, portal_name)
+            return articles
+        except Exception as e:
+            logger.error(f"❌ Błąd parsowania RSS feed {portal_name}: {e}")
+            return []
+    
+    def _parse_feed(self, content: bytes, portal_name: str) -> Tuple[List[Dict], int]:
+        """
+        Parsuje treść RSS feed; błąd całego feedu (np. niepoprawny XML) jest zgłaszany wyjątkiem
+        
+        Returns:
+            (artykuły, liczba wpisów, których nie udało się przetworzyć)
+        """
+        # Parsuj feed
+        feed = feedparser.parse(content)
+        
+        if not feed.entries:
+            if feed.bozo:
+                raise ValueError(f"niepoprawna treść feedu: {feed.bozo_exception}")
+            logger.warning(f"⚠️ Brak wpisów w RSS feed {portal_name}")
+            return [], 0
+        
+        logger.info(f"✓ Znaleziono {len(feed.entries)} artykułów w RSS feed {portal_name}")
+        
+        articles = []
+        failed_entries = 0
+        
+        for entry in feed.entries:
+            try:
+                # Wyciągnij podstawowe dane z RSS
+                title = str(entry.title) if hasattr(entry, 'title') and entry.title else ""
+                link = str(entry.link) if hasattr(entry, 'link') and entry.link else ""
+                description = str(entry.description) if hasattr(entry, 'description') and entry.description else ""
+                
+                # Parsuj datę publikacji
+                pub_date = datetime.now()
+                try:
+                    if hasattr(entry, 'published_parsed') and entry.published_parsed and isinstance(entry.published_parsed, tuple):
+                        pub_date = datetime(*entry.published_parsed[:6])
+                    elif hasattr(entry, 'updated_parsed') and entry.updated_parsed and isinstance(entry.updated_parsed, tuple):
+                        pub_date = datetime(*entry.updated_parsed[:6])
+                except (TypeError, ValueError) as e:
+                    logger.debug(f"⚠️ Błąd parsowania daty: {e}")
+                    pub_date = datetime.now()
+                
+                # Sprawdź czy link jest poprawny
+                if not link or not link.startswith('http'):
+                    logger.debug(f"⚠️ Niepoprawny link: {link}")
+                    continue
+                
+                # Utwórz ID artykułu na podstawie URL
+                article_id = hashlib.md5(link.encode()).hexdigest()[:12]
+                
+                article = {
+                    'id': article_id,
+                    'title': title.strip(),
+                    'link': link,
+                    'description': description,
+                    'publication_date': pub_date,
+                    'portal': portal_name,
+                    'tickers': []  # Będą wyciągnięte po zapisaniu HTML
+                }
+                
+                articles.append(article)
+                
+            except Exception as e:
+                logger.warning(f"⚠️ Błąd przetwarzania wpisu RSS: {e}")
+                failed_entries += 1
+                continue
+        
+        logger.info(f"✅ Przetworzone {len(articles)} artykułów z RSS {portal_name}")
+        return articles, failed_entries
+        
+    
+    def get_article_html_path(self, article: Dict) -> Path:
+        """Ścieżka lokalnej kopii HTML artykułu"""
+        date_str = article['publication_date'].strftime('%Y-%m-%d')
+        filename = f"{date_str}_{article['portal']}_{article['id']}.html"
+        return self.storage_dir / filename
+    
     def save_article_html(self, article: Dict) -> Optional[str]:
         """Pobiera i zapisuje HTML artykułu lokalnie"""
         try:
-            url = article['link']
-            article_id = article['id']
-            portal = article['portal']
-            
-            # Utwórz ścieżkę do pliku
-            date_str = article['publication_date'].strftime('%Y-%m-%d')
-            filename = f"{date_str}_{portal}_{article_id}.html"
-            file_path = self.storage_dir / filename
+            file_path = self.get_article_html_path(article)
             
             # Sprawdź czy plik już istnieje
             if file_path.exists():
-                logger.debug(f"📁 HTML już istnieje: {filename}")
+                logger.debug(f"📁 HTML już istnieje: {file_path.name}")
                 return str(file_path)
             
             # Pobierz stronę
-            response = requests.get(url, headers=self.headers, timeout=20)
-            response.raise_for_status()
+            response = self.fetcher.fetch(article['link'], headers=self.headers)
+            return self.write_article_html(article, response)
             
-            # Lepsze zarządzanie kodowaniem - ważne dla skompresowanych odpowiedzi
-            response.encoding = response.apparent_encoding or 'utf-8'
+        except Exception as e:
+            logger.error(f"❌ Błąd zapisu HTML dla {article['title'][:50]}...: {e}")
+            return None
+    
+    def write_article_html(self, article: Dict, response) -> Optional[str]:
+        """Zapisuje pobraną stronę artykułu (FetchResult) do pliku HTML"""
+        try:
+            if not response.ok:
+                raise RuntimeError(response.error)
+            
+            file_path = self.get_article_html_path(article)
+            html = response.text
             
-            # Zapisz HTML do pliku używając response.text (nie response.content)
             with open(file_path, 'w', encoding='utf-8') as f:
-                f.write(response.text)
+                f.write(html)
             
-            logger.info(f"💾 Zapisano HTML: {filename} ({len(response.text)} znaków)")
+            logger.info(f"💾 Zapisano HTML: {file_path.name} ({len(html)} znaków)")
             return str(file_path)
             
         except Exception as e:
@@ -300,155 +312,170 @@ class NewsScraperOffline:
             logger.error(f"❌ Błąd wyciągania treści z {html_path}: {e}")
             return ""
     
+    def ensure_dedupe_index(self):
+        """Unikalny indeks news (URL, spółka) - bez niego zapis sprawdza istniejące wiersze"""
+        self.has_unique_index = ensure_news_dedupe_index(self.engine)
+    
+    def load_known_article_urls(self, since: datetime) -> Set[str]:
+        """Ładuje URL-e artykułów zapisanych od podanej daty (indeks deduplikacji na jedno uruchomienie)"""
+        return load_known_article_urls(self.engine, since)
+    
+    def prepare_article_for_db(self, article: Dict, html_path: str) -> Dict:
+        """Uzupełnia artykuł o treść i tickery wyciągnięte z zapisanego HTML"""
+        content = self.extract_content_from_html(html_path, article['portal'])
+        article['content'] = content
+        article['tickers'] = self.extract_tickers_from_content(article['title'], content)
+        return article
+    
+    def save_articles_batch(self, articles: List[Dict]) -> Optional[Set[str]]:
+        """
+        Zapisuje przygotowane artykuły do bazy jednym INSERT (spółki z ticker_mappings)
+        
+        Returns:
+            Zbiór URL-i artykułów, dla których zapisano co najmniej jeden wiersz (None przy błędzie zapisu)
+        """
+        return save_articles_batch(self.engine, articles, companies_by_ticker_mapping,
+                                   unique_index=self.has_unique_index, content_limit=1000)
+    
     def save_article_to_db(self, article: Dict, html_path: str) -> bool:
         """Zapisuje artykuł do bazy danych"""
         try:
-            # Wyciągnij treść z zapisanego HTML
-            content = self.extract_content_from_html(html_path, article['portal'])
-            
-            # Wyciągnij tickery z tytułu i treści
-            tickers = self.extract_tickers_from_content(article['title'], content)
-            
-            with self.engine.connect() as conn:
-                # Sprawdź czy artykuł już istnieje
-                existing = conn.execute(text("""
-                    SELECT id FROM news 
-                    WHERE source = :source
-                """), {'source': article['link']})
-                
-                if existing.fetchone():
-                    logger.debug(f"📋 Artykuł już istnieje: {article['id']}")
-                    return False
-                
-                # Zapisz artykuł - jeśli są tickery, zapisz osobno dla każdego
-                if tickers:
-                    for ticker in tickers:
-                        # Znajdź company_id dla tickera
-                        ticker_result = conn.execute(text("""
-                            SELECT company_id FROM ticker_mappings 
-                            WHERE ticker = :ticker AND is_active = true
-                            LIMIT 1
-                        """), {'ticker': ticker})
-                        
-                        ticker_row = ticker_result.fetchone()
-                        if ticker_row:
-                            company_id = ticker_row[0]
-                            
-                            conn.execute(text("""
-                                INSERT INTO news 
-                                (company_id, date, source, title, content)
-                                VALUES 
-                                (:company_id, :date, :source, :title, :content)
-                            """), {
-                                'company_id': company_id,
-                                'date': article['publication_date'],
-                                'source': article['link'],
-                                'title': article['title'],
-                                'content': content[:1000]  # Ogranicz treść w bazie
-                            })
-                else:
-                    # Zapisz artykuł bez powiązania ze spółką
-                    conn.execute(text("""
-                        INSERT INTO news 
-                        (company_id, date, source, title, content)
-                        VALUES 
-                        (:company_id, :date, :source, :title, :content)
-                    """), {
-                        'company_id': None,
-                        'date': article['publication_date'],
-                        'source': article['link'],
-                        'title': article['title'],
-                        'content': content[:1000]  # Ogranicz treść w bazie
-                    })
-                
-                conn.commit()
-                
-                ticker_info = f" (tickery: {', '.join(tickers)})" if tickers else " (brak tickerów)"
-                logger.info(f"✅ Zapisano artykuł: {article['title'][:50]}...{ticker_info}")
-                return True
-                
+            article = self.prepare_article_for_db(article, html_path)
         except Exception as e:
             logger.error(f"❌ Błąd zapisu artykułu do bazy: {e}")
             return False
+        return article['link'] in (self.save_articles_batch([article]) or set())
     
     def scrape_portal_articles(self, portal_name: str, days_back: int = 3) -> Dict[str, int]:
         """Scrapuje artykuły z konkretnego portalu"""
-        portal_config = self.portals.get(portal_name)
-        if not portal_config:
+        if portal_name not in self.portals:
             logger.error(f"❌ Nieznany portal: {portal_name}")
             return {'total': 0, 'saved': 0, 'html_saved': 0}
         
-        logger.info(f"🚀 Rozpoczynam scrapowanie artykułów z {portal_config['name']}")
-        
-        all_articles = []
+        return self._scrape_portals([portal_name], days_back)[portal_name]
+    
+    def _scrape_portals(self, portal_names: List[str], days_back: int) -> Dict[str, Dict[str, int]]:
+        """
+        Scrapuje artykuły z podanych portali
+        
+        RSS feedy wszystkich portali (warunkowo - niezmienione są pomijane) i strony nowych
+        artykułów (nieobecnych w bazie, bez lokalnej kopii HTML) są pobierane równolegle przez
+        wspólnego klienta HTTP (limity per host zamiast stałych przerw), a artykuły zapisywane
+        do bazy jednym zapytaniem.
+        """
         cutoff_date = datetime.now() - timedelta(days=days_back)
         
-        # Pobierz artykuły ze wszystkich RSS feedów portalu
-        for rss_url in portal_config['rss_urls']:
-            articles = self.parse_rss_feed(rss_url, portal_name)
-            all_articles.extend(articles)
-        
-        # Filtruj artykuły z ostatnich X dni
-        recent_articles = [
-            article for article in all_articles 
-            if article['publication_date'] >= cutoff_date
-        ]
-        
-        logger.info(f"✓ Znaleziono {len(recent_articles)} artykułów z ostatnich {days_back} dni")
-        
-        # Zapisz HTML i artykuły do bazy
-        saved_count = 0
-        html_saved_count = 0
-        
-        for i, article in enumerate(recent_articles, 1):
+        feed_portals = {url: portal_name for portal_name in portal_names
+                        for url in self.portals[portal_name]['rss_urls']}
+        logger.info(f"📡 Pobieranie {len(feed_portals)} RSS feedów z {len(portal_names)} portali")
+        feeds, feed_states = self.feed_state.fetch_changed(self.fetcher, feed_portals, cutoff_date, headers=self.headers)
+        
+        # Filtruj artykuły z ostatnich X dni (tylko ze zmienionych feedów)
+        recent_articles = {portal_name: [] for portal_name in portal_names}
+        article_feeds = {}
+        # Feedy z błędami parsowania lub pobierania artykułów - ich stan nie jest zapisywany
+        failed_feeds = set()
+        for rss_url, portal_name in feed_portals.items():
+            feed = feeds.get(rss_url)
+            if feed is None:
+                continue
+            if not feed.ok:
+                logger.error(f"❌ Błąd pobierania RSS feed {portal_name} z {rss_url}: {feed.error}")
+                continue
             try:
-                logger.info(f"📄 Przetwarzanie artykułu {i}/{len(recent_articles)}: {article['title'][:50]}...")
-                
-                # Zapisz HTML artykułu
-                html_path = self.save_article_html(article)
-                if html_path:
-                    html_saved_count += 1
-                    
-                    # Zapisz artykuł do bazy danych
-                    if self.save_article_to_db(article, html_path):
-                        saved_count += 1
-                
-                # Krótka przerwa między requestami
-                time.sleep(1)
-                
+                articles, failed_entries = self._parse_feed(feed.content, portal_name)
             except Exception as e:
-                logger.error(f"❌ Błąd przetwarzania artykułu: {e}")
+                logger.error(f"❌ Błąd parsowania RSS feed {portal_name} z {rss_url}: {e}")
+                failed_feeds.add(rss_url)
                 continue
+            if failed_entries:
+                failed_feeds.add(rss_url)
+            for article in articles:
+                if article['publication_date'] >= cutoff_date:
+                    recent_articles[portal_name].append(article)
+                    article_feeds.setdefault(article['link'], rss_url)
+        
+        article_count = sum(len(articles) for articles in recent_articles.values())
+        logger.info(f"✓ Znaleziono {article_count} artykułów z ostatnich {days_back} dni")
+        
+        # Pomiń artykuły już zapisane w bazie (i powtórzone w kilku feedach) przed pobraniem HTML
+        seen_urls = self.load_known_article_urls(cutoff_date - timedelta(days=1))
+        new_articles = {}
+        for portal_name, articles in recent_articles.items():
+            new_articles[portal_name] = []
+            for article in articles:
+                if article['link'] not in seen_urls:
+                    seen_urls.add(article['link'])
+                    new_articles[portal_name].append(article)
+        
+        new_count = sum(len(articles) for articles in new_articles.values())
+        logger.info(f"✓ Nowych artykułów: {new_count} (pominięto {article_count - new_count} znanych)")
+        
+        # Pobierz strony nowych artykułów, które nie mają jeszcze lokalnej kopii HTML
+        pages = self.fetcher.fetch_many(
+            (article['link'] for articles in new_articles.values() for article in articles
+             if not self.get_article_html_path(article).exists()),
+            headers=self.headers
+        )
+        
+        to_save = []
+        html_saved = {portal_name: 0 for portal_name in portal_names}
+        for portal_name, articles in new_articles.items():
+            for article in articles:
+                try:
+                    # Zapisz HTML artykułu
+                    html_path = self.get_article_html_path(article)
+                    if html_path.exists():
+                        html_path = str(html_path)
+                    elif article['link'] in pages:
+                        html_path = self.write_article_html(article, pages[article['link']])
+                    else:
+                        html_path = None
+                    
+                    if html_path:
+                        html_saved[portal_name] += 1
+                        to_save.append(self.prepare_article_for_db(article, html_path))
+                    else:
+                        failed_feeds.add(article_feeds[article['link']])
+                    
+                except Exception as e:
+                    logger.error(f"❌ Błąd przetwarzania artykułu: {e}")
+                    failed_feeds.add(article_feeds[article['link']])
+                    continue
         
-        logger.info(f"🎉 Portal {portal_config['name']}: zapisano {html_saved_count} HTML, {saved_count} do bazy z {len(recent_articles)} artykułów")
+        # Zapisz wszystkie artykuły do bazy jednym zapytaniem
+        saved_urls = self.save_articles_batch(to_save)
         
-        return {
-            'total': len(recent_articles),
-            'saved': saved_count,
-            'html_saved': html_saved_count
-        }
+        # Stan feedu zapisujemy dopiero po przetworzeniu - feed z nieudanym parsowaniem lub pobraniami zostanie odpytany ponownie
+        if saved_urls is not None:
+            self.feed_state.commit({url: state for url, state in feed_states.items() if url not in failed_feeds})
+        saved_urls = saved_urls or set()
+        
+        results = {}
+        for portal_name, articles in recent_articles.items():
+            saved_count = sum(1 for article in new_articles[portal_name] if article['link'] in saved_urls)
+            logger.info(f"🎉 Portal {self.portals[portal_name]['name']}: zapisano {html_saved[portal_name]} HTML, {saved_count} do bazy z {len(articles)} artykułów")
+            results[portal_name] = {
+                'total': len(articles),
+                'saved': saved_count,
+                'html_saved': html_saved[portal_name],
+                'skipped_known': len(articles) - len(new_articles[portal_name])
+            }
+        
+        return results
     
     def scrape_all_portals(self, days_back: int = 3) -> Dict[str, Dict[str, int]]:
         """Scrapuje artykuły ze wszystkich skonfigurowanych portali"""
         logger.info(f"🌐 Rozpoczynam scrapowanie artykułów ze wszystkich portali (ostatnie {days_back} dni)")
         
-        results = {}
-        total_saved = 0
-        total_html_saved = 0
+        try:
+            results = self._scrape_portals(list(self.portals.keys()), days_back)
+        except Exception as e:
+            logger.error(f"❌ Błąd scrapowania portali: {e}")
+            results = {portal_name: {'total': 0, 'saved': 0, 'html_saved': 0} for portal_name in self.portals}
         
-        for portal_name in self.portals.keys():
-            try:
-                portal_results = self.scrape_portal_articles(portal_name, days_back)
-                results[portal_name] = portal_results
-                total_saved += portal_results['saved']
-                total_html_saved += portal_results['html_saved']
-                
-                # Przerwa między portalami
-                time.sleep(2)
-                
-            except Exception as e:
-                logger.error(f"❌ Błąd scrapowania portalu {portal_name}: {e}")
-                results[portal_name] = {'total': 0, 'saved': 0, 'html_saved': 0}
+        total_saved = sum(r['saved'] for r in results.values())
+        total_html_saved = sum(r['html_saved'] for r in results.values())
         
         logger.info(f"🎉 Łącznie zapisano {total_html_saved} plików HTML i {total_saved} artykułów do bazy")
         
@@ -518,7 +545,6 @@ class NewsScraperOffline:
             return "Nieznane źródło"
         
         try:
-            from urllib.parse import urlparse
             domain = urlparse(url).netloc.lower()
             
             # Mapowanie domen na czytelne nazwy
@@ -9,18 +9,23 @@ Data: 2025-06-24
 import os
 import re
 import sys
-import requests
 import feedparser
 from datetime import datetime, timedelta
 from bs4 import BeautifulSoup
 from sqlalchemy import create_engine, text
 from dotenv import load_dotenv
-from typing import List, Dict, Optional
-import time
+from typing import List, Dict, Optional, Set, Tuple
 import logging
 from urllib.parse import urljoin, urlparse
 import hashlib
 
+from utils.http_fetcher import get_http_fetcher
+from utils.ticker_matcher import get_ticker_matcher
+from utils.feed_state import FeedStateStore
+from utils.scraper_storage import (
+    companies_by_ticker, ensure_news_dedupe_index, load_known_article_urls, save_articles_batch
+)
+
 # Konfiguracja logowania
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -90,10 +95,18 @@ class NewsScraperPortals:
             'Upgrade-Insecure-Requests': '1'
         }
         
+        # Wspólny klient HTTP (pula keep-alive, limity per host, ponowienia)
+        self.fetcher = get_http_fetcher()
+        
+        # Stan feedów RSS (ETag / Last-Modified / hash) - pomijanie niezmienionych feedów
+        self.feed_state = FeedStateStore(self.engine)
+        
         # Lista aktywnych tickerów (dla filtrowania artykułów)
         self.active_tickers = []
         self.load_active_tickers()
         
+        self.ensure_dedupe_index()
+        
         logger.info("✓ News Scraper zainicjalizowany")
     
     def load_active_tickers(self):
@@ -115,123 +128,118 @@ class NewsScraperPortals:
             self.active_tickers = ['PKN', 'CDPROJEKT', 'KGHM', 'JSW', 'CCC', 'PGE', 'ALIOR']
     
     def extract_tickers_from_content(self, title: str, content: str) -> List[str]:
-        """Wyciąga tickery spółek z tytułu i treści artykułu"""
-        found_tickers = []
-        text_to_search = f"{title} {content}".upper()
-        
-        # Szukaj tickerów z naszej listy aktywnych
-        for ticker in self.active_tickers:
-            patterns = [
-                f"\\b{ticker}\\b",  # Exact match
-                f"\\b{ticker}\\s+S\\.A\\.",  # TICKER S.A.
-                f"\\({ticker}\\)",  # (TICKER)
-            ]
-            
-            for pattern in patterns:
-                if re.search(pattern, text_to_search):
-                    if ticker not in found_tickers:
-                        found_tickers.append(ticker)
-                    break
-        
-        # Mapowanie pełnych nazw na tickery
-        name_mapping = {
-            'PKN ORLEN': 'PKN',
-            'PKNORLEN': 'PKN',
-            'CD PROJEKT': 'CDPROJEKT',
-            'CDPROJEKT': 'CDPROJEKT',
-            'KGHM POLSKA MIEDŹ': 'KGHM',
-            'JASTRZĘBSKA SPÓŁKA WĘGLOWA': 'JSW',
-            'POLISH GAMES': 'PGS',
-            'ALLEGRO': 'ALE'
-        }
-        
-        for name, ticker in name_mapping.items():
-            if name in text_to_search and ticker not in found_tickers and ticker in self.active_tickers:
-                found_tickers.append(ticker)
-        
-        return found_tickers
+        """Wyciąga tickery spółek z tytułu i treści artykułu (tickery i nazwy spółek, jedno przejście)"""
+        matcher = get_ticker_matcher(self.engine, fallback_tickers=self.active_tickers)
+        return matcher.find_tickers(f"{title} {content}")
     
+
     def parse_rss_feed(self, rss_url: str, portal_name: str) -> List[Dict]:
         """Parsuje RSS feed z artykułami"""
         try:
             logger.info(f"📡 Pobieranie RSS feed {portal_name} z {rss_url}")
             
             # Pobierz RSS feed
-            response = requests.get(rss_url, headers=self.headers, timeout=30)
-            response.raise_for_status()
-            
-            # Parsuj feed
-            feed = feedparser.parse(response.content)
-            
-            if not feed.entries:
-                logger.warning(f"⚠️ Brak wpisów w RSS feed {portal_name}")
-                return []
-            
-            logger.info(f"✓ Znaleziono {len(feed.entries)} artykułów w RSS feed {portal_name}")
-            
-            articles = []
+            response = self.fetcher.fetch(rss_url, headers=self.headers)
+            if not response.ok:
+                raise RuntimeError(response.error)
             
-            for entry in feed.entries:
-                try:
-                    # Wyciągnij podstawowe dane z RSS
-                    title = str(entry.title) if hasattr(entry, 'title') and entry.title else ""
-                    link = str(entry.link) if hasattr(entry, 'link') and entry.link else ""
-                    description = str(entry.description) if hasattr(entry, 'description') and entry.description else ""
-                    
-                    # Parsuj datę publikacji
-                    pub_date = datetime.now()
-                    try:
-                        if hasattr(entry, 'published_parsed') and entry.published_parsed and isinstance(entry.published_parsed, tuple):
-                            pub_date = datetime(*entry.published_parsed[:6])
-                        elif hasattr(entry, 'updated_parsed') and entry.updated_parsed and isinstance(entry.updated_parsed, tuple):
-                            pub_date = datetime(*entry.updated_parsed[:6])
-                    except (TypeError, ValueError) as e:
-                        logger.debug(f"⚠️ Błąd parsowania daty: {e}")
-                        pub_date = datetime.now()
-                    
-                    # Sprawdź czy link jest poprawny
-                    if not link or not link.startswith('http'):
-                        logger.debug(f"⚠️ Niepoprawny link: {link}")
-                        continue
-                    
-                    article = {
-                        'title': title.strip(),
-                        'link': link,
-                        'description': description.strip() if description else "",
-                        'publication_date': pub_date,
-                        'portal': portal_name,
-                        'content': "",  # Będzie pobrane osobno
-                        'tickers': []   # Będą wyciągnięte po pobraniu treści
-                    }
-                    
-                    articles.append(article)
-                    logger.debug(f"✓ Dodano artykuł: {title[:60]}...")
-                    
-                except Exception as e:
-                    logger.debug(f"⚠️ Błąd przetwarzania wpisu RSS: {e}")
-                    continue
-            
-            logger.info(f"✅ Przetworzone {len(articles)} artykułów z RSS {portal_name}")
-            return articles
+            return self.parse_feed_content(response.content, portal_name)
             
         except Exception as e:
             logger.error(f"❌ Błąd pobierania RSS feed {portal_name}: {e}")
             return []
     
+    def parse_feed_content(self, content: bytes, portal_name: str) -> List[Dict]:
+        """Parsuje pobraną treść RSS feed na listę artykułów"""
+        try:
+            articles, _ = self._parse_feed(content, portal_name)
+            return articles
+        except Exception as e:
+            logger.error(f"❌ Błąd parsowania RSS feed {portal_name}: {e}")
+            return []
+    
+    def _parse_feed(self, content: bytes, portal_name: str) -> Tuple[List[Dict], int]:
+        """
+        Parsuje treść RSS feed; błąd całego feedu (np. niepoprawny XML) jest zgłaszany wyjątkiem
+        
+        Returns:
+            (artykuły, liczba wpisów, których nie udało się przetworzyć)
+        """
+        # Parsuj feed
+        feed = feedparser.parse(content)
+        
+        if not feed.entries:
+            if feed.bozo:
+                raise ValueError(f"niepoprawna treść feedu: {feed.bozo_exception}")
+            logger.warning(f"⚠️ Brak wpisów w RSS feed {portal_name}")
+            return [], 0
+        
+        logger.info(f"✓ Znaleziono {len(feed.entries)} artykułów w RSS feed {portal_name}")
+        
+        articles = []
+        failed_entries = 0
+        
+        for entry in feed.entries:
+            try:
+                # Wyciągnij podstawowe dane z RSS
+                title = str(entry.title) if hasattr(entry, 'title') and entry.title else ""
+                link = str(entry.link) if hasattr(entry, 'link') and entry.link else ""
+                description = str(entry.description) if hasattr(entry, 'description') and entry.description else ""
+                
+                # Parsuj datę publikacji
+                pub_date = datetime.now()
+                try:
+                    if hasattr(entry, 'published_parsed') and entry.published_parsed and isinstance(entry.published_parsed, tuple):
+                        pub_date = datetime(*entry.published_parsed[:6])
+                    elif hasattr(entry, 'updated_parsed') and entry.updated_parsed and isinstance(entry.updated_parsed, tuple):
+                        pub_date = datetime(*entry.updated_parsed[:6])
+                except (TypeError, ValueError) as e:
+                    logger.debug(f"⚠️ Błąd parsowania daty: {e}")
+                    pub_date = datetime.now()
+                
+                # Sprawdź czy link jest poprawny
+                if not link or not link.startswith('http'):
+                    logger.debug(f"⚠️ Niepoprawny link: {link}")
+                    continue
+                
+                article = {
+                    'title': title.strip(),
+                    'link': link,
+                    'description': description.strip() if description else "",
+                    'publication_date': pub_date,
+                    'portal': portal_name,
+                    'content': "",  # Będzie pobrane osobno
+                    'tickers': []   # Będą wyciągnięte po pobraniu treści
+                }
+                
+                articles.append(article)
+                logger.debug(f"✓ Dodano artykuł: {title[:60]}...")
+                
+            except Exception as e:
+                logger.warning(f"⚠️ Błąd przetwarzania wpisu RSS: {e}")
+                failed_entries += 1
+                continue
+        
+        logger.info(f"✅ Przetworzone {len(articles)} artykułów z RSS {portal_name}")
+        return articles, failed_entries
+        
+    
     def extract_article_content(self, url: str, portal_name: str) -> Optional[str]:
         """Wyciąga pełną treść artykułu ze strony"""
         if not url:
             return None
         
+        response = self.fetcher.fetch(url, headers=self.headers)
+        if not response.ok:
+            logger.debug(f"⚠️ Błąd pobierania treści z {url}: {response.error}")
+            return None
+        
+        return self.parse_article_html(response.text, portal_name, url)
+    
+    def parse_article_html(self, html: str, portal_name: str, url: str = "") -> Optional[str]:
+        """Wyciąga treść artykułu z pobranego HTML"""
         try:
-            response = requests.get(url, headers=self.headers, timeout=20)
-            response.raise_for_status()
-            
-            # Proste ustawienie kodowania
-            if not response.encoding or response.encoding == 'ISO-8859-1':
-                response.encoding = 'utf-8'
-            
-            soup = BeautifulSoup(response.text, 'html.parser')
+            soup = BeautifulSoup(html, 'html.parser')
             
             # Pobierz selektory dla danego portalu
             portal_config = self.portals.get(portal_name, {})
@@ -282,7 +290,7 @@ class NewsScraperPortals:
             return self._clean_content(content) if content else None
             
         except Exception as e:
-            logger.debug(f"⚠️ Błąd pobierania treści z {url}: {e}")
+            logger.debug(f"⚠️ Błąd parsowania treści z {url}: {e}")
             return None
     
     def _clean_content(self, content: str) -> str:
@@ -305,150 +313,155 @@ class NewsScraperPortals:
         content_hash = hashlib.md5(f"{title}{url}".encode()).hexdigest()[:10]
         return f"NEWS_{content_hash}"
     
+    def ensure_dedupe_index(self):
+        """Unikalny indeks news (URL, spółka) - bez niego zapis sprawdza istniejące wiersze"""
+        self.has_unique_index = ensure_news_dedupe_index(self.engine)
+    
+    def load_known_article_urls(self, since: datetime) -> Set[str]:
+        """Ładuje URL-e artykułów zapisanych od podanej daty (indeks deduplikacji na jedno uruchomienie)"""
+        return load_known_article_urls(self.engine, since)
+    
+    def save_articles_batch(self, articles: List[Dict]) -> Optional[Set[str]]:
+        """
+        Zapisuje artykuły do bazy jednym INSERT (spółki z tabeli companies)
+        
+        Returns:
+            Zbiór URL-i artykułów, dla których zapisano co najmniej jeden wiersz (None przy błędzie zapisu)
+        """
+        return save_articles_batch(self.engine, articles, companies_by_ticker,
+                                   unique_index=self.has_unique_index)
+    
     def save_article(self, article: Dict) -> bool:
         """Zapisuje artykuł do bazy danych"""
-        try:
-            with self.engine.connect() as conn:
-                # Generuj ID artykułu
-                article_id = self.generate_article_id(article['title'], article['link'])
-                
-                # Sprawdź czy artykuł już istnieje (na podstawie URL)
-                existing = conn.execute(text("""
-                    SELECT id FROM news 
-                    WHERE source = :source AND title = :title
-                """), {
-                    'source': article['link'],
-                    'title': article['title']
-                })
-                
-                if existing.fetchone():
-                    logger.debug(f"📋 Artykuł już istnieje: {article['title'][:50]}...")
-                    return False
-                
-                # Jeśli artykuł ma tickery, zapisz dla każdego
-                if article['tickers']:
-                    for ticker in article['tickers']:
-                        # Pobierz company_id dla tickera
-                        company_result = conn.execute(text("""
-                            SELECT id FROM companies WHERE ticker = :ticker
-                        """), {'ticker': ticker})
-                        company_row = company_result.fetchone()
-                        company_id = company_row[0] if company_row else None
-                        
-                        # Zapisz artykuł
-                        conn.execute(text("""
-                            INSERT INTO news 
-                            (company_id, date, source, title, content)
-                            VALUES 
-                            (:company_id, :date, :source, :title, :content)
-                        """), {
-                            'company_id': company_id,
-                            'date': article['publication_date'],
-                            'source': article['link'],
-                            'title': article['title'],
-                            'content': article['content']
-                        })
-                else:
-                    # Zapisz artykuł bez powiązania ze spółką
-                    conn.execute(text("""
-                        INSERT INTO news 
-                        (company_id, date, source, title, content)
-                        VALUES 
-                        (:company_id, :date, :source, :title, :content)
-                    """), {
-                        'company_id': None,
-                        'date': article['publication_date'],
-                        'source': article['link'],
-                        'title': article['title'],
-                        'content': article['content']
-                    })
-                
-                conn.commit()
-                logger.info(f"✅ Zapisano artykuł: {article['title'][:50]}... (tickery: {', '.join(article['tickers']) if article['tickers'] else 'brak'})")
-                return True
-                
-        except Exception as e:
-            logger.error(f"❌ Błąd zapisu artykułu: {e}")
-            return False
+        return article['link'] in (self.save_articles_batch([article]) or set())
     
     def scrape_portal_articles(self, portal_name: str, days_back: int = 3) -> Dict[str, int]:
         """Scrapuje artykuły z konkretnego portalu"""
-        portal_config = self.portals.get(portal_name)
-        if not portal_config:
+        if portal_name not in self.portals:
             logger.error(f"❌ Nieznany portal: {portal_name}")
             return {'total': 0, 'saved': 0}
         
-        logger.info(f"🚀 Rozpoczynam scrapowanie artykułów z {portal_config['name']}")
-        
-        all_articles = []
+        return self._scrape_portals([portal_name], days_back)[portal_name]
+    
+    def _scrape_portals(self, portal_names: List[str], days_back: int) -> Dict[str, Dict[str, int]]:
+        """
+        Scrapuje artykuły z podanych portali
+        
+        Najpierw równolegle pobiera RSS feedy (warunkowo - niezmienione feedy są pomijane),
+        odrzuca artykuły już zapisane w bazie,
+        potem równolegle pobiera nowe artykuły z okna czasowego (limity per host pilnuje
+        wspólny klient HTTP), a na końcu zapisuje je do bazy jednym zapytaniem.
+        """
         cutoff_date = datetime.now() - timedelta(days=days_back)
         
-        # Pobierz artykuły ze wszystkich RSS feedów portalu
-        for rss_url in portal_config['rss_urls']:
-            articles = self.parse_rss_feed(rss_url, portal_name)
-            all_articles.extend(articles)
-        
-        # Filtruj artykuły z ostatnich X dni
-        recent_articles = [
-            article for article in all_articles 
-            if article['publication_date'] >= cutoff_date
-        ]
-        
-        logger.info(f"✓ Znaleziono {len(recent_articles)} artykułów z ostatnich {days_back} dni")
-        
-        # Pobierz pełną treść i zapisz artykuły
-        saved_count = 0
-        
-        for i, article in enumerate(recent_articles, 1):
+        feed_portals = {url: portal_name for portal_name in portal_names
+                        for url in self.portals[portal_name]['rss_urls']}
+        logger.info(f"📡 Pobieranie {len(feed_portals)} RSS feedów z {len(portal_names)} portali")
+        feeds, feed_states = self.feed_state.fetch_changed(self.fetcher, feed_portals, cutoff_date, headers=self.headers)
+        
+        # Filtruj artykuły z ostatnich X dni (tylko ze zmienionych feedów)
+        recent_articles = {portal_name: [] for portal_name in portal_names}
+        article_feeds = {}
+        # Feedy z błędami parsowania lub pobierania artykułów - ich stan nie jest zapisywany
+        failed_feeds = set()
+        for rss_url, portal_name in feed_portals.items():
+            feed = feeds.get(rss_url)
+            if feed is None:
+                continue
+            if not feed.ok:
+                logger.error(f"❌ Błąd pobierania RSS feed {portal_name} z {rss_url}: {feed.error}")
+                continue
             try:
-                logger.info(f"📄 Przetwarzanie artykułu {i}/{len(recent_articles)}: {article['title'][:50]}...")
-                
-                # Pobierz pełną treść artykułu
-                content = self.extract_article_content(article['link'], portal_name)
-                if content:
-                    article['content'] = content
-                    
-                    # Wyciągnij tickery z tytułu i treści
-                    article['tickers'] = self.extract_tickers_from_content(article['title'], content)
-                    
-                    # Zapisz artykuł do bazy
-                    if self.save_article(article):
-                        saved_count += 1
-                
-                # Krótka przerwa między requestami
-                time.sleep(1)
-                
+                articles, failed_entries = self._parse_feed(feed.content, portal_name)
             except Exception as e:
-                logger.error(f"❌ Błąd przetwarzania artykułu: {e}")
+                logger.error(f"❌ Błąd parsowania RSS feed {portal_name} z {rss_url}: {e}")
+                failed_feeds.add(rss_url)
                 continue
+            if failed_entries:
+                failed_feeds.add(rss_url)
+            for article in articles:
+                if article['publication_date'] >= cutoff_date:
+                    recent_articles[portal_name].append(article)
+                    article_feeds.setdefault(article['link'], rss_url)
+        
+        article_count = sum(len(articles) for articles in recent_articles.values())
+        logger.info(f"✓ Znaleziono {article_count} artykułów z ostatnich {days_back} dni")
+        
+        # Pomiń artykuły już zapisane (i powtórzone w kilku feedach) zanim pobierzemy ich treść
+        seen_urls = self.load_known_article_urls(cutoff_date - timedelta(days=1))
+        new_articles = {}
+        for portal_name, articles in recent_articles.items():
+            new_articles[portal_name] = []
+            for article in articles:
+                if article['link'] not in seen_urls:
+                    seen_urls.add(article['link'])
+                    new_articles[portal_name].append(article)
+        
+        new_count = sum(len(articles) for articles in new_articles.values())
+        logger.info(f"✓ Nowych artykułów do pobrania: {new_count} (pominięto {article_count - new_count} znanych)")
+        
+        # Pobierz pełną treść nowych artykułów
+        pages = self.fetcher.fetch_many(
+            (article['link'] for articles in new_articles.values() for article in articles),
+            headers=self.headers
+        )
+        
+        to_save = []
+        for portal_name, articles in new_articles.items():
+            for article in articles:
+                try:
+                    page = pages.get(article['link'])
+                    if page is None or not page.ok:
+                        logger.debug(f"⚠️ Błąd pobierania treści z {article['link']}: {page.error if page else 'brak'}")
+                        failed_feeds.add(article_feeds[article['link']])
+                        continue
+                    
+                    content = self.parse_article_html(page.text, portal_name, article['link'])
+                    if content:
+                        article['content'] = content
+                        
+                        # Wyciągnij tickery z tytułu i treści
+                        article['tickers'] = self.extract_tickers_from_content(article['title'], content)
+                        to_save.append(article)
+                    else:
+                        failed_feeds.add(article_feeds[article['link']])
+                    
+                except Exception as e:
+                    logger.error(f"❌ Błąd przetwarzania artykułu: {e}")
+                    failed_feeds.add(article_feeds[article['link']])
+                    continue
         
-        logger.info(f"🎉 Portal {portal_config['name']}: zapisano {saved_count}/{len(recent_articles)} artykułów")
+        # Zapisz wszystkie artykuły do bazy jednym zapytaniem
+        saved_urls = self.save_articles_batch(to_save)
         
-        return {
-            'total': len(recent_articles),
-            'saved': saved_count
-        }
+        # Stan feedu zapisujemy dopiero po przetworzeniu - feed z nieudanym parsowaniem lub pobraniami zostanie odpytany ponownie
+        if saved_urls is not None:
+            self.feed_state.commit({url: state for url, state in feed_states.items() if url not in failed_feeds})
+        saved_urls = saved_urls or set()
+        
+        results = {}
+        for portal_name, articles in recent_articles.items():
+            saved_count = sum(1 for article in new_articles[portal_name] if article['link'] in saved_urls)
+            logger.info(f"🎉 Portal {self.portals[portal_name]['name']}: zapisano {saved_count}/{len(articles)} artykułów")
+            results[portal_name] = {
+                'total': len(articles),
+                'saved': saved_count,
+                'skipped_known': len(articles) - len(new_articles[portal_name])
+            }
+        
+        return results
     
     def scrape_all_portals(self, days_back: int = 3) -> Dict[str, Dict[str, int]]:
         """Scrapuje artykuły ze wszystkich skonfigurowanych portali"""
         logger.info(f"🌐 Rozpoczynam scrapowanie artykułów ze wszystkich portali (ostatnie {days_back} dni)")
         
-        results = {}
-        total_saved = 0
-        
-        for portal_name in self.portals.keys():
-            try:
-                portal_results = self.scrape_portal_articles(portal_name, days_back)
-                results[portal_name] = portal_results
-                total_saved += portal_results['saved']
-                
-                # Przerwa między portalami
-                time.sleep(2)
-                
-            except Exception as e:
-                logger.error(f"❌ Błąd scrapowania portalu {portal_name}: {e}")
-                results[portal_name] = {'total': 0, 'saved': 0}
+        try:
+            results = self._scrape_portals(list(self.portals.keys()), days_back)
+        except Exception as e:
+            logger.error(f"❌ Błąd scrapowania portali: {e}")
+            results = {portal_name: {'total': 0, 'saved': 0} for portal_name in self.portals}
         
+        total_saved = sum(r['saved'] for r in results.values())
         logger.info(f"🎉 Łącznie zapisano {total_saved} nowych artykułów ze wszystkich portali")
         
         # Dodaj podsumowanie
@@ -0,0 +1,277 @@
+"""
+Buforowany zapis notowań intraday
+Notowania z cyklu scrapowania są zbierane w pamięci i zapisywane jednym wielowierszowym
+upsertem (pełne OHLCV), a ticker -> company_id rozwiązywany ze wspólnego TickerRegistry.
+Po każdym zapisie paczki wywoływane są zarejestrowane hooki (raz na paczkę, nie na notowanie)
+i publikowane jest zdarzenie quotes.updated (utils.event_bus).
+"""
+
+import json
+import logging
+import threading
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set
+
+from sqlalchemy import text
+
+from utils.event_bus import publish_quotes_updated
+from utils.ticker_registry import get_ticker_registry
+
+logger = logging.getLogger(__name__)
+
+# Hooki wywoływane po zapisie paczki: hook({ticker: najnowsze notowanie})
+QuoteHook = Callable[[Dict[str, Dict[str, Any]]], None]
+_quote_hooks: Dict[str, QuoteHook] = {}
+_quote_hooks_lock = threading.Lock()
+
+# Maksymalny rozmiar bufora - przy dłuższej awarii bazy najstarsze notowania są odrzucane
+MAX_BUFFERED_QUOTES = 10000
+
+# Po tylu nieudanych zapisach notowanie jest odrzucane (wadliwy wiersz nie blokuje bufora w nieskończoność)
+MAX_FLUSH_ATTEMPTS = 3
+
+# Najnowsze zapisane notowanie per ticker (w obrębie procesu)
+_latest_quotes: Dict[str, Dict[str, Any]] = {}
+_latest_quotes_lock = threading.Lock()
+
+
+def register_quote_hook(name: str, hook: QuoteHook):
+    """Rejestruje hook wywoływany raz po każdym zapisie paczki notowań (ponowna rejestracja nadpisuje)"""
+    with _quote_hooks_lock:
+        _quote_hooks[name] = hook
+
+
+def unregister_quote_hook(name: str):
+    with _quote_hooks_lock:
+        _quote_hooks.pop(name, None)
+
+
+def get_latest_quotes(tickers: Optional[Iterable[str]] = None) -> Dict[str, Dict[str, Any]]:
+    """Najnowsze notowania zapisane w tym procesie (opcjonalnie tylko dla podanych tickerów)"""
+    with _latest_quotes_lock:
+        if tickers is None:
+            return dict(_latest_quotes)
+        return {t.upper(): _latest_quotes[t.upper()] for t in tickers if t.upper() in _latest_quotes}
+
+
+def _update_latest_quotes(latest: Dict[str, Dict[str, Any]]):
+    with _latest_quotes_lock:
+        for ticker, quote in latest.items():
+            current = _latest_quotes.get(ticker)
+            if current is None or current['datetime'] <= quote['datetime']:
+                _latest_quotes[ticker] = quote
+
+
+class IntradayQuoteWriter:
+    """Bufor notowań intraday zapisywany paczkami do quotes_intraday"""
+
+    def __init__(self, engine):
+        """
+        Args:
+            engine: Silnik SQLAlchemy (unikalny indeks (company_id, datetime) tworzony przy pierwszym zapisie)
+        """
+        self.engine = engine
+        self._buffer: List[Dict[str, Any]] = []
+        self._buffer_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self.registry = get_ticker_registry(engine)
+        self._upsert: Optional[bool] = None
+
+    def _ensure_unique_index(self) -> bool:
+        """Unikalny indeks (company_id, datetime) - warunek dla ON CONFLICT ... DO UPDATE"""
+        try:
+            with self.engine.begin() as conn:
+                conn.execute(text("""
+                    CREATE UNIQUE INDEX IF NOT EXISTS idx_quotes_intraday_company_datetime_unique
+                    ON quotes_intraday (company_id, datetime)
+                """))
+            return True
+        except Exception as e:
+            logger.warning(f"⚠️ Brak unikalnego indeksu quotes_intraday (duplikaty w tabeli?) - "
+                           f"powtórzone notowania będą pomijane zamiast aktualizowane: {e}")
+            return False
+
+    def add(self, quote: Dict[str, Any]):
+        """
+        Dodaje notowanie do bufora
+
+        Args:
+            quote: Słownik z kluczami ticker, price oraz opcjonalnie open, high, low, volume,
+                   turnover, datetime (domyślnie chwila dodania)
+        """
+        if not quote.get('ticker') or not quote.get('price'):
+            return
+        row = {
+            'ticker': quote['ticker'].upper(),
+            'datetime': quote.get('datetime') or datetime.now(),
+            'open': quote.get('open') or None,
+            'high': quote.get('high') or None,
+            'low': quote.get('low') or None,
+            'price': quote['price'],
+            'volume': quote.get('volume') or 0,
+            'turnover': quote.get('turnover') or None
+        }
+        with self._buffer_lock:
+            self._buffer.append(row)
+
+    def pending(self) -> int:
+        with self._buffer_lock:
+            return len(self._buffer)
+
+    def known_tickers(self) -> Set[str]:
+        """Tickery, których company_id jest już w pamięci podręcznej"""
+        return self.registry.known_tickers()
+
+    def resolve_company_ids(self, tickers: Iterable[str]) -> Dict[str, int]:
+        """Zwraca {ticker: company_id}, tworząc brakujące spółki (TickerRegistry)"""
+        return self.registry.company_ids(tickers)
+
+    def flush(self) -> int:
+        """
+        Zapisuje bufor jednym zapytaniem i wywołuje hooki
+
+        Gdy zapis paczki się nie powiedzie, notowania są zapisywane osobno dla każdego tickera -
+        wadliwy wiersz blokuje tylko swój ticker. Niezapisane notowania wracają do bufora,
+        a po MAX_FLUSH_ATTEMPTS nieudanych próbach są odrzucane.
+
+        Returns:
+            Liczba zapisanych notowań (0 przy pustym buforze lub błędzie)
+        """
+        with self._flush_lock:
+            with self._buffer_lock:
+                batch, self._buffer = self._buffer, []
+            if not batch:
+                return 0
+
+            # Jedno notowanie na (ticker, datetime) - upsert nie może dotknąć wiersza dwa razy
+            rows_by_key = {(row['ticker'], row['datetime']): row for row in batch}
+            rows = list(rows_by_key.values())
+
+            try:
+                if self._upsert is None:
+                    self._upsert = self._ensure_unique_index()
+                company_ids = self.resolve_company_ids(row['ticker'] for row in rows)
+            except Exception as e:
+                logger.error(f"❌ Nie można przygotować zapisu {len(rows)} notowań intraday: {e}")
+                self._requeue(rows)
+                return 0
+
+            unknown = sorted({row['ticker'] for row in rows if row['ticker'] not in company_ids})
+            if unknown:
+                logger.warning(f"⚠️ Pomijam notowania tickerów bez spółki: {', '.join(unknown)}")
+            rows = [row for row in rows if row['ticker'] in company_ids]
+
+            try:
+                self._insert(rows, company_ids)
+                saved = rows
+            except Exception as e:
+                logger.warning(f"⚠️ Zapis paczki {len(rows)} notowań intraday nie powiódł się, "
+                               f"ponawiam osobno dla każdego tickera: {e}")
+                rows_by_ticker: Dict[str, List[Dict[str, Any]]] = {}
+                for row in rows:
+                    rows_by_ticker.setdefault(row['ticker'], []).append(row)
+                saved, failed = [], []
+                for ticker, ticker_rows in rows_by_ticker.items():
+                    try:
+                        self._insert(ticker_rows, company_ids)
+                        saved += ticker_rows
+                    except Exception as ticker_error:
+                        logger.error(f"❌ Błąd zapisu notowań intraday {ticker}: {ticker_error}")
+                        failed += ticker_rows
+                if failed:
+                    # company_id mogły się zdezaktualizować (usunięta spółka) - odśwież przy następnej próbie
+                    self.registry.invalidate()
+                    if not self._upsert:
+                        self._upsert = None
+                    self._requeue(failed)
+
+            if not saved:
+                return 0
+            logger.info(f"💾 Zapisano {len(saved)} notowań intraday")
+
+            latest = {}
+            for row in saved:
+                if row['ticker'] not in latest or latest[row['ticker']]['datetime'] <= row['datetime']:
+                    latest[row['ticker']] = row
+            _update_latest_quotes(latest)
+            self._run_hooks(latest)
+            # Subskrybenci (alerty, ocena rekomendacji) asynchronicznie - tylko dla tickerów z tej paczki
+            publish_quotes_updated(latest)
+            return len(saved)
+
+    def _insert(self, rows: List[Dict[str, Any]], company_ids: Dict[str, int]):
+        """Jeden wielowierszowy upsert notowań do quotes_intraday"""
+        payload = [{
+            'company_id': company_ids[row['ticker']],
+            'datetime': row['datetime'].isoformat(),
+            'open': row['open'],
+            'high': row['high'],
+            'low': row['low'],
+            'price': row['price'],
+            'volume': row['volume'],
+            'turnover': row['turnover']
+        } for row in rows]
+
+        conflict = """
+            ON CONFLICT (company_id, datetime) DO UPDATE SET
+                open_price = EXCLUDED.open_price,
+                high_price = EXCLUDED.high_price,
+                low_price = EXCLUDED.low_price,
+                price = EXCLUDED.price,
+                volume = EXCLUDED.volume,
+                turnover = EXCLUDED.turnover
+        """ if self._upsert else "ON CONFLICT DO NOTHING"
+
+        with self.engine.begin() as conn:
+            conn.execute(text(f"""
+                INSERT INTO quotes_intraday
+                    (company_id, datetime, open_price, high_price, low_price, price, volume, turnover)
+                SELECT r.company_id, r.datetime, r.open, r.high, r.low, r.price, r.volume, r.turnover
+                FROM jsonb_to_recordset(CAST(:rows AS JSONB))
+                     AS r(company_id INTEGER, datetime TIMESTAMP, open NUMERIC, high NUMERIC,
+                          low NUMERIC, price NUMERIC, volume BIGINT, turnover NUMERIC)
+                {conflict}
+            """), {'rows': json.dumps(payload)})
+
+    def _requeue(self, rows: List[Dict[str, Any]]):
+        """Zwraca niezapisane notowania do bufora (po MAX_FLUSH_ATTEMPTS próbach odrzuca)"""
+        retry, dropped = [], set()
+        for row in rows:
+            attempts = row.get('attempts', 0) + 1
+            if attempts >= MAX_FLUSH_ATTEMPTS:
+                dropped.add(row['ticker'])
+            else:
+                retry.append({**row, 'attempts': attempts})
+        if dropped:
+            logger.error(f"❌ Odrzucono notowania po {MAX_FLUSH_ATTEMPTS} nieudanych próbach zapisu: "
+                         f"{', '.join(sorted(dropped))}")
+        with self._buffer_lock:
+            self._buffer = (retry + self._buffer)[-MAX_BUFFERED_QUOTES:]
+
+    def _run_hooks(self, latest: Dict[str, Dict[str, Any]]):
+        with _quote_hooks_lock:
+            hooks = list(_quote_hooks.items())
+        for name, hook in hooks:
+            try:
+                hook(latest)
+            except Exception as e:
+                logger.warning(f"⚠️ Hook notowań '{name}' zakończył się błędem: {e}")
+
+    def write(self, quotes: Iterable[Dict[str, Any]]) -> int:
+        """Dodaje notowania i od razu zapisuje bufor"""
+        for quote in quotes:
+            self.add(quote)
+        return self.flush()
+
+
+_writers: Dict[str, IntradayQuoteWriter] = {}
+_writers_lock = threading.Lock()
+
+
+def get_quote_writer(engine) -> IntradayQuoteWriter:
+    """Zwraca współdzielony w procesie writer dla bazy silnika"""
+    key = str(engine.url)
+    with _writers_lock:
+        if key not in _writers:
+            _writers[key] = IntradayQuoteWriter(engine)
+        return _writers[key]
@@ -1,10 +1,11 @@
 import pandas as pd
 from sqlalchemy import create_engine
 from sqlalchemy.exc import IntegrityError
-from sqlalchemy import text
 from dotenv import load_dotenv
 import os
 
+from utils.ticker_registry import get_ticker_registry
+
 load_dotenv('.env')
 
 # Poprawne nazwy zmiennych środowiskowych (duże litery, bez spacji i cudzysłowów w .env)
@@ -23,6 +24,7 @@ assert db_name is not None, "DB_NAME nie jest ustawiony!"
 
 db_uri = f"postgresql://{db_user}:{db_password}@{db_host}:{db_port}/{db_name}"
 engine = create_engine(db_uri)
+ticker_registry = get_ticker_registry(engine)
 
 def fetch_stooq_data(ticker: str, interval: str = "d"):
     url = f"https://stooq.pl/q/d/l/?s={ticker}.pl&i={interval}"
@@ -38,16 +40,7 @@ def fetch_stooq_data(ticker: str, interval: str = "d"):
         return None
 
 def ensure_company_exists(ticker: str, name: str = "", sector: str = ""):
-    with engine.begin() as conn:
-        result = conn.execute(text("SELECT id FROM companies WHERE ticker = :ticker"), {"ticker": ticker})
-        row = result.fetchone()
-        if row:
-            return row[0]
-        res = conn.execute(
-            text("INSERT INTO companies (ticker, name, sector) VALUES (:ticker, :name, :sector) RETURNING id"),
-            {"ticker": ticker, "name": name, "sector": sector}
-        )
-        return res.fetchone()[0]
+    return ticker_registry.company_id(ticker, name=name or None, sector=sector)
 
 def save_daily_quotes(ticker: str):
     df = fetch_stooq_data(ticker, "d")
@@ -11,11 +11,12 @@ import os
 import sys
 from pathlib import Path
 from typing import Optional, List, Dict, Any
-from datetime import datetime
 
 # Dodaj ścieżkę do postgresql_ticker_manager
 sys.path.append(str(Path(__file__).parent.parent))
 
+from workers.quote_writer import get_quote_writer
+
 try:
     from postgresql_ticker_manager import PostgreSQLTickerManager
     TICKER_MANAGER_AVAILABLE = True
@@ -42,78 +43,68 @@ assert db_name is not None, "DB_NAME nie jest ustawiony!"
 db_uri = f"postgresql://{db_user}:{db_password}@{db_host}:{db_port}/{db_name}"
 engine = create_engine(db_uri)
 
+# Buforowany zapis notowań (ticker -> company_id ze wspólnego TickerRegistry)
+quote_writer = get_quote_writer(engine)
+
 def ensure_company_exists(ticker: str) -> Optional[int]:
     """Sprawdza czy firma istnieje w tabeli companies, jeśli nie - dodaje ją"""
     try:
-        with engine.begin() as conn:
-            # Sprawdź czy firma już istnieje
-            result = conn.execute(
-                text("SELECT id FROM companies WHERE ticker = :ticker"), 
-                {"ticker": ticker.upper()}
-            )
-            row = result.fetchone()
-            if row:
-                return row[0]
-            
-            # Dodaj nową firmę
-            res = conn.execute(
-                text("INSERT INTO companies (ticker, name, sector) VALUES (:ticker, :name, :sector) RETURNING id"),
-                {"ticker": ticker.upper(), "name": ticker.upper(), "sector": ""}
-            )
-            row = res.fetchone()
-            return row[0] if row else None
-            
+        return quote_writer.registry.company_id(ticker)
     except Exception as e:
         print(f"❌ Błąd zapewnienia istnienia firmy {ticker}: {e}")
         return None
 
+def _auto_register_tickers(tickers: List[str]):
+    """Auto-rejestracja tickerów z PostgreSQL Ticker Manager"""
+    if not TICKER_MANAGER_AVAILABLE:
+        return
+    from postgresql_ticker_manager import auto_register_ticker_from_scraping
+    for ticker in tickers:
+        try:
+            auto_register_ticker_from_scraping(
+                ticker=ticker,
+                source_name="quotes_intraday"
+            )
+        except Exception as e:
+            print(f"⚠️ Błąd auto-rejestracji tickera {ticker}: {e}")
+
 def save_intraday_quotes(ticker: str, price: Optional[float] = None, volume: Optional[int] = None) -> bool:
     """
     Zapisuje dane intraday do bazy danych
     """
+    # Jeśli nie podano danych, użyj wartości domyślnych
+    if price is None:
+        print(f"⚠️ Brak ceny dla {ticker}, pomijam zapis")
+        return False
+    
+    saved = save_intraday_quotes_batch([{'ticker': ticker, 'price': price, 'volume': volume or 0}])
+    if saved:
+        print(f"✅ Zapisano dane intraday dla {ticker}: {price} PLN (volume: {volume or 0:,})")
+    return saved > 0
+
+def save_intraday_quotes_batch(quotes: List[Dict[str, Any]]) -> int:
+    """
+    Zapisuje paczkę notowań intraday jednym zapytaniem
+    
+    Args:
+        quotes: Lista słowników z kluczami ticker, price i opcjonalnie open, high, low, volume, datetime
+    
+    Returns:
+        Liczba zapisanych notowań
+    """
     try:
-        # Auto-rejestracja tickera z PostgreSQL Ticker Manager
-        if TICKER_MANAGER_AVAILABLE:
-            try:
-                from postgresql_ticker_manager import auto_register_ticker_from_scraping
-                auto_register_ticker_from_scraping(
-                    ticker=ticker,
-                    source_name="quotes_intraday"
-                )
-            except Exception as e:
-                print(f"⚠️ Błąd auto-rejestracji tickera {ticker}: {e}")
+        # Auto-rejestracja tylko dla tickerów, których writer jeszcze nie zna
+        _auto_register_tickers(sorted({q['ticker'].upper() for q in quotes if q.get('ticker')}
+                                      - quote_writer.known_tickers()))
         
-        company_id = ensure_company_exists(ticker)
-        if not company_id:
-            print(f"❌ Nie można znaleźć/utworzyć firmy dla tickera: {ticker}")
-            return False
-        
-        # Jeśli nie podano danych, użyj wartości domyślnych
-        if price is None:
-            print(f"⚠️ Brak ceny dla {ticker}, pomijam zapis")
-            return False
-        
-        if volume is None:
-            volume = 0
-        
-        # Zapisz do bazy
-        with engine.begin() as conn:
-            conn.execute(text("""
-                INSERT INTO quotes_intraday (datetime, price, volume, company_id)
-                VALUES (:dt, :price, :volume, :company_id)
-            """), {
-                "dt": datetime.now(),
-                "price": price,
-                "volume": volume,
-                "company_id": company_id
-            })
-        
-        print(f"✅ Zapisano dane intraday dla {ticker}: {price} PLN (volume: {volume:,})")
-        return True
+        saved = quote_writer.write(quotes)
+        if not saved and quote_writer.pending():
+            print(f"❌ Błąd zapisu {quote_writer.pending()} notowań intraday - pozostają w buforze")
+        return saved
         
     except Exception as e:
-        print(f"❌ Błąd zapisu danych intraday dla {ticker}: {e}")
-        return False
+        print(f"❌ Błąd zapisu danych intraday: {e}")
+        return 0
 
 def get_intraday_quotes(ticker: str, limit: int = 100) -> List[Dict[str, Any]]:
     """
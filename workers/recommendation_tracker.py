@@ -8,13 +8,17 @@ Data: 2025-06-27
 
 from sqlalchemy import create_engine, text
 from dotenv import load_dotenv
+import argparse
 import json
 import os
+import threading
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional, Tuple
 import logging
 import pandas as pd
 
+from utils.price_lookup import prices_as_of
+
 def json_serial(obj):
     """JSON serializer for objects not serializable by default json code"""
     if isinstance(obj, (datetime, pd.Timestamp)):
@@ -25,6 +29,21 @@ def json_serial(obj):
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Ocena rekomendacji co godzinę od utworzenia aż do zamknięcia po długości sesji
+SESSION_LENGTH_HOURS = 8
+
+# Pominięte oceny godzinowe (np. po restarcie) są uzupełniane ceną as-of do tylu godzin wstecz
+EVALUATION_CATCH_UP_HOURS = 24
+
+# Klucz konfiguracji w rollupach - md5 kanonicznej postaci JSONB (kolejność kluczy bez znaczenia)
+CONFIG_HASH_SQL = "md5(COALESCE({column}, '{{}}'::jsonb)::text)"
+
+# Hash konfiguracji rekomendacji - nowe wiersze mają config_hash, starsze tylko pełne config_data
+RECOMMENDATION_CONFIG_HASH_SQL = f"COALESCE(r.config_hash, {CONFIG_HASH_SQL.format(column='r.config_data')})"
+
+# Dzień sesji rekomendacji (starsze wiersze mogą nie mieć session_date)
+SESSION_DATE_SQL = "COALESCE(r.session_date, CAST(r.created_at AS DATE))"
+
 class RecommendationTracker:
     """Klasa do śledzenia i oceny rekomendacji intraday w PostgreSQL"""
     
@@ -45,7 +64,7 @@ class RecommendationTracker:
         self.engine = create_engine(db_uri)
         
         self._init_database()
-        logger.info(f"✓ RecommendationTracker zainicjalizowany (PostgreSQL)")
+        logger.info("✓ RecommendationTracker zainicjalizowany (PostgreSQL)")
     
     def _init_database(self):
         """Inicjalizuje bazę danych i tworzy tabele"""
@@ -139,6 +158,54 @@ class RecommendationTracker:
                     )
                 '''))
                 
+                # Konfiguracje rekomendacji (jeden wiersz na unikalną konfigurację)
+                conn.execute(text('''
+                    CREATE TABLE IF NOT EXISTS recommendation_configs (
+                        config_hash VARCHAR(32) PRIMARY KEY,
+                        config_data JSONB NOT NULL,
+                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    )
+                '''))
+                
+                # Rollup zamkniętych rekomendacji per (dzień, konfiguracja) - aktualizowany przy zapisie wyniku
+                conn.execute(text('''
+                    CREATE TABLE IF NOT EXISTS recommendation_daily_rollup (
+                        session_date DATE NOT NULL,
+                        config_hash VARCHAR(32) NOT NULL,
+                        closed_count INTEGER DEFAULT 0,
+                        successful_count INTEGER DEFAULT 0,
+                        failed_count INTEGER DEFAULT 0,
+                        profit_sum DOUBLE PRECISION DEFAULT 0,
+                        loss_sum DOUBLE PRECISION DEFAULT 0,
+                        profit_loss_sum DOUBLE PRECISION DEFAULT 0,
+                        best_profit_loss DOUBLE PRECISION,
+                        worst_profit_loss DOUBLE PRECISION,
+                        duration_sum BIGINT DEFAULT 0,
+                        PRIMARY KEY (session_date, config_hash)
+                    )
+                '''))
+                
+                # Rollup ocen godzinowych per (dzień, konfiguracja, typ, godzina) - aktualizowany przy zapisie oceny
+                conn.execute(text('''
+                    CREATE TABLE IF NOT EXISTS recommendation_hour_rollup (
+                        session_date DATE NOT NULL,
+                        config_hash VARCHAR(32) NOT NULL,
+                        recommendation VARCHAR(20) NOT NULL,
+                        evaluation_hour INTEGER NOT NULL,
+                        evaluation_count INTEGER DEFAULT 0,
+                        profitable_count INTEGER DEFAULT 0,
+                        profit_loss_sum DOUBLE PRECISION DEFAULT 0,
+                        max_profit_loss DOUBLE PRECISION,
+                        min_profit_loss DOUBLE PRECISION,
+                        optimal_exit_count INTEGER DEFAULT 0,
+                        optimal_profit_loss_sum DOUBLE PRECISION DEFAULT 0,
+                        PRIMARY KEY (session_date, config_hash, recommendation, evaluation_hour)
+                    )
+                '''))
+                
+                # Konfiguracja nowych rekomendacji tylko przez hash (pełna treść w recommendation_configs)
+                conn.execute(text('ALTER TABLE recommendations ADD COLUMN IF NOT EXISTS config_hash VARCHAR(32)'))
+                
                 # Indeksy dla wydajności
                 conn.execute(text('CREATE INDEX IF NOT EXISTS idx_recommendations_ticker ON recommendations(ticker)'))
                 conn.execute(text('CREATE INDEX IF NOT EXISTS idx_recommendations_date ON recommendations(session_date)'))
@@ -154,6 +221,23 @@ class RecommendationTracker:
         except Exception as e:
             logger.error(f"❌ Błąd inicjalizacji bazy danych: {e}")
             raise
+        
+        self._bootstrap_rollups()
+    
+    def _bootstrap_rollups(self):
+        """Jednorazowo buduje rollupy, gdy są puste, a w bazie są już wyniki (pierwsze uruchomienie)"""
+        try:
+            with self.engine.connect() as conn:
+                empty = conn.execute(text('''
+                    SELECT NOT EXISTS (SELECT 1 FROM recommendation_daily_rollup)
+                       AND NOT EXISTS (SELECT 1 FROM recommendation_hour_rollup)
+                       AND (EXISTS (SELECT 1 FROM recommendation_results WHERE status = 'CLOSED')
+                            OR EXISTS (SELECT 1 FROM recommendation_time_evaluations))
+                ''')).scalar()
+            if empty:
+                self.rebuild_rollups()
+        except Exception as e:
+            logger.warning(f"⚠️ Nie można zainicjalizować rollupów statystyk: {e}")
     
     def save_recommendation(self, ticker: str, analysis_result: Dict, config: Optional[Dict] = None) -> int:
         """
@@ -163,127 +247,133 @@ class RecommendationTracker:
             ticker: Symbol spółki
             analysis_result: Wynik analizy z silnika rekomendacji
             config: Konfiguracja użyta do analizy
-            
+        
         Returns:
             ID zapisanej rekomendacji
         """
+        ids = self.save_recommendations_batch([{**analysis_result, 'ticker': ticker}], config)
+        return ids[0] if ids else -1
+    
+    @staticmethod
+    def _recommendation_row(analysis_result: Dict, session_date) -> Dict:
+        """Wiersz tabeli recommendations z wyniku analizy (bez konfiguracji)"""
+        recommendation = analysis_result.get('final_recommendation', analysis_result.get('recommendation', 'WAIT'))
+        entry_price = analysis_result.get('current_price', 0.0)
+        
+        buy_analysis = analysis_result.get('buy_analysis', {})
+        sell_analysis = analysis_result.get('sell_analysis', {})
+        
+        # News impact data
+        news_impact = 0.0
+        news_data = {}
+        for signal in buy_analysis.get('signals', []):
+            if signal.get('signal') == 'news_impact':
+                news_impact = signal.get('confidence', 0.0)
+                news_data = {
+                    'description': signal.get('description', ''),
+                    'source': signal.get('source', '')
+                }
+                break
+        
+        # Oblicz target price i stop loss na podstawie rekomendacji
+        target_price = None
+        stop_loss = None
+        if recommendation == 'BUY':
+            target_price = round(entry_price * 1.05, 2)  # 5% zysk
+            stop_loss = round(entry_price * 0.98, 2)     # 2% strata
+        elif recommendation == 'SELL':
+            target_price = round(entry_price * 0.95, 2)  # 5% profit na short
+            stop_loss = round(entry_price * 1.02, 2)     # 2% strata na short
+        
+        return {
+            'ticker': analysis_result['ticker'],
+            'recommendation': recommendation,
+            'entry_price': entry_price,
+            'target_price': target_price,
+            'stop_loss': stop_loss,
+            'buy_confidence': buy_analysis.get('total_confidence', 0.0),
+            'sell_confidence': sell_analysis.get('total_confidence', 0.0),
+            'signal_count': buy_analysis.get('signal_count', 0) + sell_analysis.get('signal_count', 0),
+            'signals_data': {
+                'buy_signals': buy_analysis.get('signals', []),
+                'sell_signals': sell_analysis.get('signals', []),
+                'technical_analysis': analysis_result.get('technical_analysis', {})
+            },
+            'news_impact': news_impact,
+            'news_data': news_data,
+            'session_date': session_date
+        }
+    
+    def save_recommendations_batch(self, analysis_results: List[Dict], config: Optional[Dict] = None) -> List[int]:
+        """
+        Zapisuje rekomendacje z całego skanu jednym wielowierszowym INSERT
+        
+        Konfiguracja jest rejestrowana raz w recommendation_configs, a wiersze rekomendacji
+        dostają tylko jej hash zamiast kopii pełnego JSON-a.
+        
+        Args:
+            analysis_results: Wyniki analizy (każdy z kluczem 'ticker')
+            config: Konfiguracja użyta do analizy (wspólna dla skanu)
+        
+        Returns:
+            ID zapisanych rekomendacji w kolejności wejścia (pusta lista przy błędzie)
+        """
+        if not analysis_results:
+            return []
+        
         try:
+            session_date = datetime.now().date().isoformat()
+            rows = [{'idx': i, **self._recommendation_row(result, session_date)}
+                    for i, result in enumerate(analysis_results)]
+            
             with self.engine.begin() as conn:
-                # Przygotuj dane do zapisu
-                recommendation = analysis_result.get('final_recommendation', analysis_result.get('recommendation', 'WAIT'))
-                entry_price = analysis_result.get('current_price', 0.0)
-                
-                buy_analysis = analysis_result.get('buy_analysis', {})
-                sell_analysis = analysis_result.get('sell_analysis', {})
-                
-                buy_confidence = buy_analysis.get('total_confidence', 0.0)
-                sell_confidence = sell_analysis.get('total_confidence', 0.0)
-                signal_count = buy_analysis.get('signal_count', 0) + sell_analysis.get('signal_count', 0)
-                
-                # Serialize complex data
-                signals_data = {
-                    'buy_signals': buy_analysis.get('signals', []),
-                    'sell_signals': sell_analysis.get('signals', []),
-                    'technical_analysis': analysis_result.get('technical_analysis', {})
-                }
-                
-                config_data = config or {}
-                
-                # News impact data
-                news_impact = 0.0
-                news_data = {}
-                for signal in buy_analysis.get('signals', []):
-                    if signal.get('signal') == 'news_impact':
-                        news_impact = signal.get('confidence', 0.0)
-                        news_data = {
-                            'description': signal.get('description', ''),
-                            'source': signal.get('source', '')
-                        }
-                        break
+                config_hash = self._register_config(conn, config or {})
                 
-                # Oblicz target price i stop loss na podstawie rekomendacji
-                target_price = None
-                stop_loss = None
-                if recommendation == 'BUY':
-                    target_price = round(entry_price * 1.05, 2)  # 5% zysk
-                    stop_loss = round(entry_price * 0.98, 2)     # 2% strata
-                elif recommendation == 'SELL':
-                    target_price = round(entry_price * 0.95, 2)  # 5% profit na short
-                    stop_loss = round(entry_price * 1.02, 2)     # 2% strata na short
-                
-                # Wstaw rekomendację
-                query = text("""
+                # Id z sekwencji są przydzielane w kolejności ORDER BY - posortowane odpowiadają kolejności wejścia
+                result = conn.execute(text('''
                     INSERT INTO recommendations (
                         ticker, recommendation, entry_price, target_price, stop_loss,
                         buy_confidence, sell_confidence, signal_count,
-                        signals_data, config_data, news_impact, news_data,
+                        signals_data, config_hash, news_impact, news_data,
                         session_date, status
-                    ) VALUES (
-                        :ticker, :recommendation, :entry_price, :target_price, :stop_loss,
-                        :buy_confidence, :sell_confidence, :signal_count,
-                        :signals_data, :config_data, :news_impact, :news_data,
-                        :session_date, :status
-                    ) RETURNING id
-                """)
-                
-                result = conn.execute(query, {
-                    'ticker': ticker,
-                    'recommendation': recommendation,
-                    'entry_price': entry_price,
-                    'target_price': target_price,
-                    'stop_loss': stop_loss,
-                    'buy_confidence': buy_confidence,
-                    'sell_confidence': sell_confidence,
-                    'signal_count': signal_count,
-                    'signals_data': json.dumps(signals_data, default=json_serial),
-                    'config_data': json.dumps(config_data, default=json_serial),
-                    'news_impact': news_impact,
-                    'news_data': json.dumps(news_data, default=json_serial),
-                    'session_date': datetime.now().date(),
-                    'status': 'ACTIVE'
-                })
-                
-                row = result.fetchone()
-                recommendation_id = row[0] if row else -1
-                
-                logger.info(f"✅ Zapisano rekomendację #{recommendation_id}: {ticker} {recommendation} @ {entry_price}")
-                return recommendation_id
+                    )
+                    SELECT r.ticker, r.recommendation, r.entry_price, r.target_price, r.stop_loss,
+                           r.buy_confidence, r.sell_confidence, r.signal_count,
+                           r.signals_data, :config_hash, r.news_impact, r.news_data,
+                           r.session_date, 'ACTIVE'
+                    FROM jsonb_to_recordset(CAST(:rows AS JSONB)) AS r(
+                        idx INTEGER, ticker TEXT, recommendation TEXT, entry_price NUMERIC, target_price NUMERIC,
+                        stop_loss NUMERIC, buy_confidence NUMERIC, sell_confidence NUMERIC, signal_count INTEGER,
+                        signals_data JSONB, news_impact NUMERIC, news_data JSONB, session_date DATE
+                    )
+                    ORDER BY r.idx
+                    RETURNING id
+                '''), {'rows': json.dumps(rows, default=json_serial), 'config_hash': config_hash})
                 
+                recommendation_ids = sorted(row[0] for row in result.fetchall())
+            
+            if len(rows) == 1:
+                row = rows[0]
+                logger.info(f"✅ Zapisano rekomendację #{recommendation_ids[0]}: "
+                            f"{row['ticker']} {row['recommendation']} @ {row['entry_price']}")
+            else:
+                logger.info(f"✅ Zapisano {len(recommendation_ids)} rekomendacji jednym zapytaniem")
+            return recommendation_ids
+        
         except Exception as e:
             logger.error(f"❌ Błąd zapisu rekomendacji: {e}")
-            return -1
-                target_price = None
-                stop_loss = None
-                
-                if recommendation == 'BUY':
-                    target_price = entry_price * 1.015  # 1.5% zysk intraday
-                    stop_loss = entry_price * 0.985    # 1.5% strata
-                elif recommendation == 'SELL':
-                    target_price = entry_price * 0.985  # 1.5% zysk na short
-                    stop_loss = entry_price * 1.015    # 1.5% strata na short
-                
-                # Wstaw do bazy
-                cursor.execute('''
-                    INSERT INTO recommendations (
-                        ticker, recommendation, entry_price, target_price, stop_loss,
-                        buy_confidence, sell_confidence, signal_count, signals_data,
-                        config_data, news_impact, news_data, session_date
-                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (
-                    ticker, recommendation, entry_price, target_price, stop_loss,
-                    buy_confidence, sell_confidence, signal_count, signals_data,
-                    config_data, news_impact, news_data, datetime.now().date()
-                ))
-                
-                recommendation_id = cursor.lastrowid or -1
-                conn.commit()
-                
-                logger.info(f"✓ Zapisano rekomendację #{recommendation_id}: {ticker} {recommendation} @ {entry_price:.2f}")
-                return recommendation_id
-                
-        except Exception as e:
-            logger.error(f"❌ Błąd zapisywania rekomendacji dla {ticker}: {e}")
-            return -1
+            return []
+
+    @staticmethod
+    def _profit_loss_percent(recommendation: str, entry_price: float, price: float) -> float:
+        """Zysk/strata w % dla pozycji długiej (BUY) lub krótkiej (SELL)"""
+        if not entry_price:
+            return 0.0
+        if recommendation == 'BUY':
+            return ((price - entry_price) / entry_price) * 100
+        if recommendation == 'SELL':
+            return ((entry_price - price) / entry_price) * 100
+        return 0.0
     
     def get_active_recommendations(self, max_age_hours: int = 8) -> List[Dict]:
         """
@@ -291,50 +381,40 @@ class RecommendationTracker:
         
         Args:
             max_age_hours: Maksymalny wiek rekomendacji w godzinach
-            
+        
         Returns:
             Lista aktywnych rekomendacji
         """
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                
+            with self.engine.connect() as conn:
                 cutoff_time = datetime.now() - timedelta(hours=max_age_hours)
                 
-                cursor.execute('''
-                    SELECT r.*, rr.status as result_status
+                result = conn.execute(text('''
+                    SELECT r.*, rr.status as result_status, rc.config_data AS shared_config_data
                     FROM recommendations r
                     LEFT JOIN recommendation_results rr ON r.id = rr.recommendation_id
-                    WHERE r.status = 'ACTIVE' 
-                    AND r.created_at >= ?
+                    LEFT JOIN recommendation_configs rc ON rc.config_hash = r.config_hash
+                    WHERE r.status = 'ACTIVE'
+                    AND r.created_at >= :cutoff_time
                     AND (rr.status IS NULL OR rr.status = 'OPEN')
                     ORDER BY r.created_at DESC
-                ''', (cutoff_time,))
+                '''), {'cutoff_time': cutoff_time})
                 
-                columns = [description[0] for description in cursor.description]
-                recommendations = []
-                
-                for row in cursor.fetchall():
-                    rec_dict = dict(zip(columns, row))
-                    
-                    # Deserialize JSON data
-                    try:
-                        rec_dict['signals_data'] = json.loads(rec_dict['signals_data'] or '{}')
-                        rec_dict['config_data'] = json.loads(rec_dict['config_data'] or '{}')
-                        rec_dict['news_data'] = json.loads(rec_dict['news_data'] or '{}')
-                    except:
-                        pass
-                        
-                    recommendations.append(rec_dict)
+                # Kolumny JSONB są już zdeserializowane przez sterownik
+                recommendations = [dict(row) for row in result.mappings().all()]
+                for rec in recommendations:
+                    shared_config = rec.pop('shared_config_data')
+                    if rec.get('config_data') is None:
+                        rec['config_data'] = shared_config
                 
                 logger.info(f"✓ Pobrano {len(recommendations)} aktywnych rekomendacji")
                 return recommendations
-                
+        
         except Exception as e:
             logger.error(f"❌ Błąd pobierania aktywnych rekomendacji: {e}")
             return []
     
-    def evaluate_recommendation(self, recommendation_id: int, current_price: float, 
+    def evaluate_recommendation(self, recommendation_id: int, current_price: float,
                                exit_reason: Optional[str] = None) -> Dict:
         """
         Ocenia skuteczność rekomendacji na podstawie aktualnej ceny
@@ -343,54 +423,45 @@ class RecommendationTracker:
             recommendation_id: ID rekomendacji do oceny
             current_price: Aktualna cena spółki
             exit_reason: Powód zamknięcia pozycji (opcjonalny)
-            
+        
         Returns:
             Słownik z wynikami oceny
         """
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                
+            with self.engine.begin() as conn:
                 # Pobierz dane rekomendacji
-                cursor.execute('''
-                    SELECT * FROM recommendations WHERE id = ?
-                ''', (recommendation_id,))
+                recommendation = conn.execute(text('''
+                    SELECT id, ticker, recommendation, entry_price, target_price, stop_loss, created_at
+                    FROM recommendations WHERE id = :id
+                '''), {'id': recommendation_id}).mappings().fetchone()
                 
-                rec = cursor.fetchone()
-                if not rec:
+                if not recommendation:
                     logger.warning(f"❌ Nie znaleziono rekomendacji #{recommendation_id}")
                     return {}
                 
-                columns = [description[0] for description in cursor.description]
-                recommendation = dict(zip(columns, rec))
-                
-                entry_price = recommendation['entry_price']
-                entry_time = datetime.fromisoformat(recommendation['created_at'])
+                entry_price = float(recommendation['entry_price'])
+                target_price = float(recommendation['target_price']) if recommendation['target_price'] is not None else None
+                stop_loss = float(recommendation['stop_loss']) if recommendation['stop_loss'] is not None else None
+                entry_time = recommendation['created_at']
                 current_time = datetime.now()
                 
                 # Oblicz wyniki
                 duration_minutes = int((current_time - entry_time).total_seconds() / 60)
-                
-                if recommendation['recommendation'] == 'BUY':
-                    profit_loss_percent = ((current_price - entry_price) / entry_price) * 100
-                elif recommendation['recommendation'] == 'SELL':
-                    profit_loss_percent = ((entry_price - current_price) / entry_price) * 100
-                else:
-                    profit_loss_percent = 0.0
+                profit_loss_percent = self._profit_loss_percent(recommendation['recommendation'], entry_price, current_price)
                 
                 # Sprawdź czy to sukces (osiągnięto target lub przekroczono czas)
                 success = False
                 status = 'OPEN'
                 
                 if recommendation['recommendation'] in ['BUY', 'SELL']:
-                    target_reached = (
-                        (recommendation['recommendation'] == 'BUY' and current_price >= recommendation['target_price']) or
-                        (recommendation['recommendation'] == 'SELL' and current_price <= recommendation['target_price'])
+                    target_reached = target_price is not None and (
+                        (recommendation['recommendation'] == 'BUY' and current_price >= target_price) or
+                        (recommendation['recommendation'] == 'SELL' and current_price <= target_price)
                     )
                     
-                    stop_loss_hit = (
-                        (recommendation['recommendation'] == 'BUY' and current_price <= recommendation['stop_loss']) or
-                        (recommendation['recommendation'] == 'SELL' and current_price >= recommendation['stop_loss'])
+                    stop_loss_hit = stop_loss is not None and (
+                        (recommendation['recommendation'] == 'BUY' and current_price <= stop_loss) or
+                        (recommendation['recommendation'] == 'SELL' and current_price >= stop_loss)
                     )
                     
                     if target_reached:
@@ -401,56 +472,128 @@ class RecommendationTracker:
                         success = False
                         status = 'CLOSED'
                         exit_reason = exit_reason or 'STOP_LOSS'
-                    elif duration_minutes > 480:  # 8 godzin - koniec sesji
+                    elif duration_minutes > SESSION_LENGTH_HOURS * 60:  # koniec sesji
                         success = profit_loss_percent > 0
                         status = 'CLOSED'
                         exit_reason = exit_reason or 'SESSION_END'
                 
-                # Zapisz lub zaktualizuj wynik
-                cursor.execute('''
-                    INSERT OR REPLACE INTO recommendation_results (
+                # Zapisz lub zastąp wynik (jeden wiersz na rekomendację)
+                previous = conn.execute(text('''
+                    DELETE FROM recommendation_results WHERE recommendation_id = :id
+                    RETURNING status, success, profit_loss_percent, duration_minutes
+                '''), {'id': recommendation_id}).fetchall()
+                conn.execute(text('''
+                    INSERT INTO recommendation_results (
                         recommendation_id, ticker, original_recommendation,
                         entry_price, exit_price, entry_time, exit_time,
-                        duration_minutes, profit_loss_percent,
+                        duration_minutes, profit_loss_percent, profit_loss_amount,
                         status, exit_reason, success
-                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (
-                    recommendation_id, recommendation['ticker'], recommendation['recommendation'],
-                    entry_price, current_price, entry_time, current_time,
-                    duration_minutes, profit_loss_percent,
-                    status, exit_reason, success
-                ))
-                
-                # Zaktualizuj status rekomendacji jeśli zamknięta
-                if status == 'CLOSED':
-                    cursor.execute('''
-                        UPDATE recommendations SET status = 'CLOSED' WHERE id = ?
-                    ''', (recommendation_id,))
-                
-                conn.commit()
-                
-                result = {
+                    ) VALUES (
+                        :recommendation_id, :ticker, :original_recommendation,
+                        :entry_price, :exit_price, :entry_time, :exit_time,
+                        :duration_minutes, :profit_loss_percent, :profit_loss_amount,
+                        :status, :exit_reason, :success
+                    )
+                '''), {
                     'recommendation_id': recommendation_id,
                     'ticker': recommendation['ticker'],
-                    'recommendation': recommendation['recommendation'],
+                    'original_recommendation': recommendation['recommendation'],
                     'entry_price': entry_price,
-                    'current_price': current_price,
-                    'profit_loss_percent': profit_loss_percent,
+                    'exit_price': current_price,
+                    'entry_time': entry_time,
+                    'exit_time': current_time,
                     'duration_minutes': duration_minutes,
+                    'profit_loss_percent': profit_loss_percent,
+                    'profit_loss_amount': current_price - entry_price,
                     'status': status,
-                    'success': success,
-                    'exit_reason': exit_reason
-                }
-                
-                logger.info(f"✓ Oceniono rekomendację #{recommendation_id}: {recommendation['ticker']} "
-                           f"{profit_loss_percent:+.2f}% ({status})")
+                    'exit_reason': exit_reason,
+                    'success': success
+                })
                 
-                return result
+                # Rollup dzienny: odejmij zastąpione zamknięte wyniki, dodaj nowy
+                closed_results = [(row[1], float(row[2] or 0), row[3] or 0, -1) for row in previous if row[0] == 'CLOSED']
+                if status == 'CLOSED':
+                    closed_results.append((success, profit_loss_percent, duration_minutes, 1))
+                self._apply_daily_rollup(conn, recommendation_id, closed_results)
                 
+                # Zaktualizuj status rekomendacji jeśli zamknięta
+                if status == 'CLOSED':
+                    conn.execute(text("UPDATE recommendations SET status = 'CLOSED' WHERE id = :id"),
+                                 {'id': recommendation_id})
+            
+            result = {
+                'recommendation_id': recommendation_id,
+                'ticker': recommendation['ticker'],
+                'recommendation': recommendation['recommendation'],
+                'entry_price': entry_price,
+                'current_price': current_price,
+                'profit_loss_percent': profit_loss_percent,
+                'duration_minutes': duration_minutes,
+                'status': status,
+                'success': success,
+                'exit_reason': exit_reason
+            }
+            
+            logger.info(f"✓ Oceniono rekomendację #{recommendation_id}: {recommendation['ticker']} "
+                       f"{profit_loss_percent:+.2f}% ({status})")
+            
+            return result
+        
         except Exception as e:
             logger.error(f"❌ Błąd oceny rekomendacji #{recommendation_id}: {e}")
             return {}
     
+    def rescore_active_recommendations(self, prices: Dict[str, float]) -> Dict:
+        """
+        Ponowna ocena aktywnych rekomendacji po nowych notowaniach (zdarzenie quotes.updated)
+        
+        Jednym zapytaniem wybiera tylko rekomendacje podanych tickerów, których target lub
+        stop loss został osiągnięty przy nowej cenie, i zamyka je przez evaluate_recommendation.
+        Pozostałe nie są ruszane - ocenę w interwałach robi nadal zadanie cykliczne.
+        
+        Args:
+            prices: Najnowsze ceny {ticker: cena}
+        
+        Returns:
+            Słownik z liczbą sprawdzonych tickerów i zamkniętych rekomendacji
+        """
+        if not prices:
+            return {'tickers': 0, 'closed': 0}
+        
+        try:
+            with self.engine.connect() as conn:
+                hits = conn.execute(text('''
+                    SELECT r.id, r.ticker, p.price
+                    FROM recommendations r
+                    JOIN jsonb_to_recordset(CAST(:prices AS JSONB)) AS p(ticker TEXT, price NUMERIC)
+                      ON p.ticker = UPPER(r.ticker)
+                    WHERE r.status = 'ACTIVE'
+                    AND r.recommendation IN ('BUY', 'SELL')
+                    AND r.created_at >= :oldest
+                    AND (
+                        (r.recommendation = 'BUY' AND (p.price >= r.target_price OR p.price <= r.stop_loss)) OR
+                        (r.recommendation = 'SELL' AND (p.price <= r.target_price OR p.price >= r.stop_loss))
+                    )
+                    ORDER BY r.id
+                '''), {
+                    'prices': json.dumps([{'ticker': t.upper(), 'price': p} for t, p in prices.items()]),
+                    'oldest': datetime.now() - timedelta(hours=SESSION_LENGTH_HOURS)
+                }).fetchall()
+            
+            closed = 0
+            for rec_id, ticker, price in hits:
+                result = self.evaluate_recommendation(rec_id, float(price))
+                if result.get('status') == 'CLOSED':
+                    closed += 1
+            
+            if closed:
+                logger.info(f"🎯 Zamknięto {closed} rekomendacji po nowych notowaniach ({len(prices)} tickerów)")
+            return {'tickers': len(prices), 'closed': closed}
+        
+        except Exception as e:
+            logger.error(f"❌ Błąd ponownej oceny rekomendacji: {e}")
+            return {'tickers': len(prices), 'closed': 0, 'error': str(e)}
+    
     def auto_evaluate_active_recommendations(self) -> Dict:
         """
         Automatycznie ocenia wszystkie aktywne rekomendacje
@@ -472,71 +615,56 @@ class RecommendationTracker:
         
         if total_evaluations == 0:
             logger.info("ℹ️ Brak rekomendacji do oceny w żadnym interwale czasowym")
-            
-            # Sprawdź czy są stare rekomendacje do zamknięcia
-            active_recommendations = self.get_active_recommendations()
-            if not active_recommendations:
-                return {'evaluated_count': 0, 'results': []}
         
-        # Dodatkowo uruchom standardową ocenę dla zamykania pozycji po 8h
+        # Dodatkowo zamknij pozycje starsze niż długość sesji
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                
-                # Znajdź rekomendacje starsze niż 8h które nie zostały jeszcze zamknięte
-                cutoff_time = datetime.now() - timedelta(hours=8)
-                cursor.execute('''
-                    SELECT id, ticker, recommendation, entry_price, created_at
-                    FROM recommendations 
+            with self.engine.connect() as conn:
+                cutoff_time = datetime.now() - timedelta(hours=SESSION_LENGTH_HOURS)
+                old_recommendations = conn.execute(text('''
+                    SELECT id, ticker, created_at
+                    FROM recommendations
                     WHERE status = 'ACTIVE'
-                    AND created_at <= ?
+                    AND created_at <= :cutoff_time
                     AND recommendation IN ('BUY', 'SELL')
-                ''', (cutoff_time,))
-                
-                old_recommendations = cursor.fetchall()
-                
-                closed_count = 0
-                successful_closed = 0
-                results = []
-                
-                for rec_id, ticker, recommendation, entry_price, created_at in old_recommendations:
-                    try:
-                        # Pobierz aktualną cenę dla finalnego zamknięcia
-                        from workers.technical_analysis import TechnicalAnalyzer
-                        analyzer = TechnicalAnalyzer()
-                        analysis = analyzer.analyze_ticker(ticker, days_back=5)
-                        
-                        if analysis and 'current_price' in analysis:
-                            current_price = analysis['current_price']
-                            
-                            # Oceń finalnie rekomendację
-                            result = self.evaluate_recommendation(rec_id, current_price, 'SESSION_END_8H')
-                            
-                            if result:
-                                results.append(result)
-                                closed_count += 1
-                                if result.get('success', False):
-                                    successful_closed += 1
-                                    
-                    except Exception as e:
-                        logger.error(f"❌ Błąd zamykania rekomendacji {rec_id}: {e}")
-                        continue
-                
-                # Zaktualizuj statystyki dzienne
-                self.update_daily_stats()
-                
-                logger.info(f"✅ Oceniono {total_evaluations} w interwałach + zamknięto {closed_count} starych rekomendacji")
-                
-                return {
-                    'evaluated_count': total_evaluations + closed_count,
-                    'successful_count': successful_closed,
-                    'failed_count': closed_count - successful_closed,
-                    'success_rate': successful_closed / closed_count if closed_count > 0 else 0,
-                    'closed_old_recommendations': closed_count,
-                    'multi_hour_results': multi_hour_results,
-                    'results': results
-                }
+                '''), {'cutoff_time': cutoff_time}).fetchall()
                 
+                # Cena z chwili upływu sesji (as-of) dla wszystkich rekomendacji jednym zapytaniem
+                close_at = {row[0]: (row[1].upper(), row[2] + timedelta(hours=SESSION_LENGTH_HOURS))
+                            for row in old_recommendations}
+                prices = prices_as_of(conn, close_at.values())
+            
+            closed_count = 0
+            successful_closed = 0
+            results = []
+            
+            for rec_id, ticker, created_at in old_recommendations:
+                quote = prices.get(close_at[rec_id])
+                if not quote:
+                    logger.warning(f"⚠️ Brak ceny do zamknięcia rekomendacji #{rec_id} ({ticker})")
+                    continue
+                
+                result = self.evaluate_recommendation(rec_id, quote['price'], 'SESSION_END_8H')
+                if result:
+                    results.append(result)
+                    closed_count += 1
+                    if result.get('success', False):
+                        successful_closed += 1
+            
+            # Zaktualizuj statystyki dzienne
+            self.update_daily_stats()
+            
+            logger.info(f"✅ Oceniono {total_evaluations} w interwałach + zamknięto {closed_count} starych rekomendacji")
+            
+            return {
+                'evaluated_count': total_evaluations + closed_count,
+                'successful_count': successful_closed,
+                'failed_count': closed_count - successful_closed,
+                'success_rate': successful_closed / closed_count if closed_count > 0 else 0,
+                'closed_old_recommendations': closed_count,
+                'multi_hour_results': multi_hour_results,
+                'results': results
+            }
+        
         except Exception as e:
             logger.error(f"❌ Błąd automatycznej oceny: {e}")
             return {
@@ -550,153 +678,422 @@ class RecommendationTracker:
     
     def update_daily_stats(self, date: Optional[datetime] = None) -> bool:
         """
-        Aktualizuje statystyki dzienne
+        Aktualizuje statystyki dzienne (performance_stats) z rollupu dziennego
         
         Args:
             date: Data dla której aktualizować statystyki (domyślnie dziś)
-            
+        
         Returns:
             True jeśli sukces
         """
         try:
             target_date = date.date() if date else datetime.now().date()
-            
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                
-                # Pobierz statystyki z danego dnia
-                cursor.execute('''
-                    SELECT 
-                        COUNT(*) as total_recommendations,
-                        COUNT(CASE WHEN rr.success = 1 THEN 1 END) as successful_recommendations,
-                        COUNT(CASE WHEN rr.success = 0 THEN 1 END) as failed_recommendations,
-                        ROUND(AVG(CASE WHEN rr.success = 1 THEN rr.profit_loss_percent END), 2) as avg_profit_percent,
-                        ROUND(AVG(CASE WHEN rr.success = 0 THEN rr.profit_loss_percent END), 2) as avg_loss_percent,
-                        ROUND(SUM(rr.profit_loss_percent), 2) as total_profit_loss,
-                        MAX(rr.profit_loss_percent) as best_recommendation_profit,
-                        MIN(rr.profit_loss_percent) as worst_recommendation_loss,
-                        ROUND(AVG(rr.duration_minutes)) as avg_duration_minutes
-                    FROM recommendations r
-                    LEFT JOIN recommendation_results rr ON r.id = rr.recommendation_id
-                    WHERE r.session_date = ? AND rr.status = 'CLOSED'
-                ''', (target_date,))
-                
-                stats = cursor.fetchone()
-                
-                if stats and stats[0] > 0:  # Jeśli są dane
-                    total_recs = stats[0]
-                    successful_recs = stats[1] or 0
-                    success_rate = (successful_recs / total_recs * 100) if total_recs > 0 else 0
-                    
-                    cursor.execute('''
-                        INSERT OR REPLACE INTO performance_stats (
-                            date, total_recommendations, successful_recommendations,
-                            failed_recommendations, success_rate, avg_profit_percent,
-                            avg_loss_percent, total_profit_loss, best_recommendation_profit,
-                            worst_recommendation_loss, avg_duration_minutes
-                        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                    ''', (
-                        target_date, total_recs, successful_recs, stats[2] or 0,
-                        round(success_rate, 2), stats[3] or 0.0, stats[4] or 0.0,
-                        stats[5] or 0.0, stats[6] or 0.0, stats[7] or 0.0,
-                        stats[8] or 0
-                    ))
-                    
-                    conn.commit()
-                    logger.info(f"✓ Zaktualizowano statystyki dzienne dla {target_date}: {total_recs} rekomendacji, "
-                               f"{success_rate:.1f}% skuteczność")
-                    
+            stats = self._daily_stats(target_date, target_date)
+            if not stats:
                 return True
-                
+            
+            stats = stats[0]
+            with self.engine.begin() as conn:
+                conn.execute(text('''
+                    INSERT INTO performance_stats (
+                        date, total_recommendations, successful_recommendations,
+                        failed_recommendations, success_rate, avg_profit_percent,
+                        avg_loss_percent, total_profit_loss, best_recommendation_profit,
+                        worst_recommendation_loss, avg_duration_minutes
+                    ) VALUES (
+                        :date, :total_recommendations, :successful_recommendations,
+                        :failed_recommendations, :success_rate, :avg_profit_percent,
+                        :avg_loss_percent, :total_profit_loss, :best_recommendation_profit,
+                        :worst_recommendation_loss, :avg_duration_minutes
+                    )
+                    ON CONFLICT (date) DO UPDATE SET
+                        total_recommendations = EXCLUDED.total_recommendations,
+                        successful_recommendations = EXCLUDED.successful_recommendations,
+                        failed_recommendations = EXCLUDED.failed_recommendations,
+                        success_rate = EXCLUDED.success_rate,
+                        avg_profit_percent = EXCLUDED.avg_profit_percent,
+                        avg_loss_percent = EXCLUDED.avg_loss_percent,
+                        total_profit_loss = EXCLUDED.total_profit_loss,
+                        best_recommendation_profit = EXCLUDED.best_recommendation_profit,
+                        worst_recommendation_loss = EXCLUDED.worst_recommendation_loss,
+                        avg_duration_minutes = EXCLUDED.avg_duration_minutes
+                '''), stats)
+            
+            logger.info(f"✓ Zaktualizowano statystyki dzienne dla {target_date}: {stats['total_recommendations']} rekomendacji, "
+                       f"{stats['success_rate']:.1f}% skuteczność")
+            return True
+        
         except Exception as e:
             logger.error(f"❌ Błąd aktualizacji statystyk dziennych: {e}")
             return False
     
+    def _daily_stats(self, start_date, end_date=None) -> List[Dict]:
+        """Statystyki per dzień z rollupu dziennego (kolumny jak w performance_stats)"""
+        with self.engine.connect() as conn:
+            rows = conn.execute(text('''
+                SELECT session_date,
+                       SUM(closed_count), SUM(successful_count), SUM(failed_count),
+                       SUM(profit_sum), SUM(loss_sum), SUM(profit_loss_sum),
+                       MAX(best_profit_loss), MIN(worst_profit_loss), SUM(duration_sum)
+                FROM recommendation_daily_rollup
+                WHERE session_date >= :start_date
+                AND (CAST(:end_date AS DATE) IS NULL OR session_date <= :end_date)
+                GROUP BY session_date
+                HAVING SUM(closed_count) > 0
+                ORDER BY session_date DESC
+            '''), {'start_date': start_date, 'end_date': end_date}).fetchall()
+        
+        stats = []
+        for day, total, successful, failed, profit_sum, loss_sum, pl_sum, best, worst, duration_sum in rows:
+            stats.append({
+                'date': day,
+                'total_recommendations': int(total),
+                'successful_recommendations': int(successful),
+                'failed_recommendations': int(failed),
+                'success_rate': round(successful / total * 100, 2),
+                'avg_profit_percent': round(profit_sum / successful, 2) if successful else 0.0,
+                'avg_loss_percent': round(loss_sum / failed, 2) if failed else 0.0,
+                'total_profit_loss': round(pl_sum, 2),
+                'best_recommendation_profit': best or 0.0,
+                'worst_recommendation_loss': worst or 0.0,
+                'avg_duration_minutes': int(round(duration_sum / total))
+            })
+        return stats
+
     def get_performance_stats(self, days_back: int = 7) -> List[Dict]:
         """
-        Pobiera statystyki wydajności z ostatnich dni
+        Pobiera statystyki wydajności z ostatnich dni (z rollupu - bez przeliczania wyników)
         
         Args:
             days_back: Liczba dni wstecz
-            
+        
         Returns:
             Lista statystyk dziennych
         """
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                
-                start_date = datetime.now().date() - timedelta(days=days_back)
-                
-                cursor.execute('''
-                    SELECT * FROM performance_stats 
-                    WHERE date >= ? 
-                    ORDER BY date DESC
-                ''', (start_date,))
-                
-                columns = [description[0] for description in cursor.description]
-                stats = []
-                
-                for row in cursor.fetchall():
-                    stats.append(dict(zip(columns, row)))
-                
-                return stats
-                
+            return self._daily_stats(datetime.now().date() - timedelta(days=days_back))
         except Exception as e:
             logger.error(f"❌ Błąd pobierania statystyk wydajności: {e}")
             return []
-    
+
     def get_best_configurations(self, limit: int = 5) -> List[Dict]:
         """
-        Znajduje najlepsze konfiguracje na podstawie historycznych wyników
+        Znajduje najlepsze konfiguracje na podstawie historycznych wyników (z rollupu dziennego)
         
         Args:
             limit: Maksymalna liczba konfiguracji do zwrócenia
-            
+        
         Returns:
             Lista najlepszych konfiguracji
         """
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                
-                cursor.execute('''
-                    SELECT 
-                        r.config_data,
-                        COUNT(*) as total_count,
-                        COUNT(CASE WHEN rr.success = 1 THEN 1 END) as success_count,
-                        ROUND(AVG(rr.profit_loss_percent), 2) as avg_return,
-                        ROUND(COUNT(CASE WHEN rr.success = 1 THEN 1 END) * 100.0 / COUNT(*), 2) as success_rate
-                    FROM recommendations r
-                    JOIN recommendation_results rr ON r.id = rr.recommendation_id
-                    WHERE rr.status = 'CLOSED' AND r.config_data != '{}'
-                    GROUP BY r.config_data
-                    HAVING COUNT(*) >= 3
+            with self.engine.connect() as conn:
+                rows = conn.execute(text('''
+                    SELECT
+                        c.config_data,
+                        SUM(d.closed_count) as total_count,
+                        SUM(d.successful_count) as success_count,
+                        ROUND(CAST(SUM(d.profit_loss_sum) / SUM(d.closed_count) AS NUMERIC), 2) as avg_return,
+                        ROUND(SUM(d.successful_count) * 100.0 / SUM(d.closed_count), 2) as success_rate
+                    FROM recommendation_daily_rollup d
+                    JOIN recommendation_configs c ON c.config_hash = d.config_hash
+                    WHERE c.config_data <> '{}'::jsonb
+                    GROUP BY c.config_hash
+                    HAVING SUM(d.closed_count) >= 3
                     ORDER BY success_rate DESC, avg_return DESC
-                    LIMIT ?
-                ''', (limit,))
-                
-                results = []
-                for row in cursor.fetchall():
-                    try:
-                        config_data = json.loads(row[0])
-                        results.append({
-                            'config': config_data,
-                            'total_count': row[1],
-                            'success_count': row[2],
-                            'avg_return': row[3],
-                            'success_rate': row[4]
-                        })
-                    except:
-                        continue
-                
-                return results
-                
+                    LIMIT :limit
+                '''), {'limit': limit}).fetchall()
+                
+                return [{
+                    'config': row[0],
+                    'total_count': int(row[1]),
+                    'success_count': int(row[2]),
+                    'avg_return': float(row[3]) if row[3] is not None else None,
+                    'success_rate': float(row[4]) if row[4] is not None else None
+                } for row in rows]
+        
         except Exception as e:
             logger.error(f"❌ Błąd pobierania najlepszych konfiguracji: {e}")
             return []
     
-    def evaluate_recommendation_at_hour(self, recommendation_id: int, evaluation_hour: int, 
+    # ------------------------------------------------------------------
+    # Rollupy statystyk
+    # ------------------------------------------------------------------
+    
+    def _register_config(self, conn, config_data: Dict) -> str:
+        """Zapisuje konfigurację w recommendation_configs (jeśli nowa) i zwraca jej hash"""
+        return conn.execute(text(f'''
+            INSERT INTO recommendation_configs (config_hash, config_data)
+            SELECT {CONFIG_HASH_SQL.format(column='c.config')}, c.config
+            FROM (SELECT CAST(:config AS JSONB) AS config) c
+            ON CONFLICT (config_hash) DO UPDATE SET config_hash = EXCLUDED.config_hash
+            RETURNING config_hash
+        '''), {'config': json.dumps(config_data or {}, default=json_serial)}).scalar()
+    
+    def _apply_daily_rollup(self, conn, recommendation_id: int, closed_results: List[Tuple]):
+        """
+        Dodaje (znak +1) lub odejmuje (znak -1) zamknięte wyniki w rollupie dziennym
+        
+        Args:
+            closed_results: Krotki (success, profit_loss_percent, duration_minutes, znak)
+        """
+        if not closed_results:
+            return
+        
+        delta = {'closed': 0, 'successful': 0, 'failed': 0, 'profit_sum': 0.0, 'loss_sum': 0.0,
+                 'profit_loss_sum': 0.0, 'duration_sum': 0, 'best': None, 'worst': None}
+        for success, profit_loss, duration, sign in closed_results:
+            delta['closed'] += sign
+            delta['successful' if success else 'failed'] += sign
+            delta['profit_sum' if success else 'loss_sum'] += sign * profit_loss
+            delta['profit_loss_sum'] += sign * profit_loss
+            delta['duration_sum'] += sign * int(duration)
+            # Ekstrema tylko rosną - odjęcie wyniku koryguje dopiero rebuild_rollups()
+            if sign > 0:
+                delta['best'] = profit_loss if delta['best'] is None else max(delta['best'], profit_loss)
+                delta['worst'] = profit_loss if delta['worst'] is None else min(delta['worst'], profit_loss)
+        
+        conn.execute(text(f'''
+            INSERT INTO recommendation_configs (config_hash, config_data)
+            SELECT {RECOMMENDATION_CONFIG_HASH_SQL}, COALESCE(r.config_data, '{{}}'::jsonb)
+            FROM recommendations r WHERE r.id = :id AND r.config_hash IS NULL
+            ON CONFLICT (config_hash) DO NOTHING
+        '''), {'id': recommendation_id})
+        conn.execute(text(f'''
+            INSERT INTO recommendation_daily_rollup AS d (
+                session_date, config_hash, closed_count, successful_count, failed_count,
+                profit_sum, loss_sum, profit_loss_sum, best_profit_loss, worst_profit_loss, duration_sum
+            )
+            SELECT {SESSION_DATE_SQL}, {RECOMMENDATION_CONFIG_HASH_SQL},
+                   :closed, :successful, :failed, :profit_sum, :loss_sum, :profit_loss_sum,
+                   CAST(:best AS DOUBLE PRECISION), CAST(:worst AS DOUBLE PRECISION), :duration_sum
+            FROM recommendations r WHERE r.id = :id
+            ON CONFLICT (session_date, config_hash) DO UPDATE SET
+                closed_count = d.closed_count + EXCLUDED.closed_count,
+                successful_count = d.successful_count + EXCLUDED.successful_count,
+                failed_count = d.failed_count + EXCLUDED.failed_count,
+                profit_sum = d.profit_sum + EXCLUDED.profit_sum,
+                loss_sum = d.loss_sum + EXCLUDED.loss_sum,
+                profit_loss_sum = d.profit_loss_sum + EXCLUDED.profit_loss_sum,
+                best_profit_loss = GREATEST(d.best_profit_loss, EXCLUDED.best_profit_loss),
+                worst_profit_loss = LEAST(d.worst_profit_loss, EXCLUDED.worst_profit_loss),
+                duration_sum = d.duration_sum + EXCLUDED.duration_sum
+        '''), {'id': recommendation_id, **delta})
+    
+    def _apply_hour_rollup(self, conn, deltas: List[Dict]):
+        """
+        Nakłada przyrosty ocen godzinowych na rollup godzinowy (jedno zapytanie)
+        
+        Args:
+            deltas: Słowniki z kluczami recommendation_id, evaluation_hour, count_delta, profitable_delta,
+                    profit_loss_delta, optimal_delta, optimal_profit_loss_delta, profit_loss (nowa wartość lub None)
+        """
+        if not deltas:
+            return
+        
+        conn.execute(text(f'''
+            INSERT INTO recommendation_hour_rollup AS h (
+                session_date, config_hash, recommendation, evaluation_hour,
+                evaluation_count, profitable_count, profit_loss_sum, max_profit_loss, min_profit_loss,
+                optimal_exit_count, optimal_profit_loss_sum
+            )
+            SELECT {SESSION_DATE_SQL}, {RECOMMENDATION_CONFIG_HASH_SQL}, r.recommendation, e.evaluation_hour,
+                   SUM(e.count_delta), SUM(e.profitable_delta), SUM(e.profit_loss_delta),
+                   MAX(e.profit_loss), MIN(e.profit_loss),
+                   SUM(e.optimal_delta), SUM(e.optimal_profit_loss_delta)
+            FROM jsonb_to_recordset(CAST(:rows AS JSONB)) AS e(
+                recommendation_id INTEGER, evaluation_hour INTEGER, count_delta INTEGER, profitable_delta INTEGER,
+                profit_loss_delta DOUBLE PRECISION, optimal_delta INTEGER, optimal_profit_loss_delta DOUBLE PRECISION,
+                profit_loss DOUBLE PRECISION
+            )
+            JOIN recommendations r ON r.id = e.recommendation_id
+            GROUP BY 1, 2, 3, 4
+            ON CONFLICT (session_date, config_hash, recommendation, evaluation_hour) DO UPDATE SET
+                evaluation_count = h.evaluation_count + EXCLUDED.evaluation_count,
+                profitable_count = h.profitable_count + EXCLUDED.profitable_count,
+                profit_loss_sum = h.profit_loss_sum + EXCLUDED.profit_loss_sum,
+                max_profit_loss = GREATEST(h.max_profit_loss, EXCLUDED.max_profit_loss),
+                min_profit_loss = LEAST(h.min_profit_loss, EXCLUDED.min_profit_loss),
+                optimal_exit_count = h.optimal_exit_count + EXCLUDED.optimal_exit_count,
+                optimal_profit_loss_sum = h.optimal_profit_loss_sum + EXCLUDED.optimal_profit_loss_sum
+        '''), {'rows': json.dumps(deltas)})
+    
+    def rebuild_rollups(self, days_back: Optional[int] = None) -> Dict:
+        """
+        Przelicza rollupy od zera z recommendation_results i recommendation_time_evaluations
+        
+        Do backfillu po imporcie danych lub ręcznych zmianach w tabelach (oraz korekty ekstremów
+        po nadpisaniu ocen). Wszystko w jednej transakcji - czytelnicy widzą stare albo nowe rollupy.
+        
+        Args:
+            days_back: Przelicz tylko ostatnie N dni (domyślnie całą historię)
+        
+        Returns:
+            Liczba wierszy rollupów per tabela
+        """
+        start_date = datetime.now().date() - timedelta(days=days_back) if days_back else datetime.min.date()
+        params = {'start_date': start_date}
+        config_hash = RECOMMENDATION_CONFIG_HASH_SQL
+        
+        with self.engine.begin() as conn:
+            conn.execute(text('DELETE FROM recommendation_daily_rollup WHERE session_date >= :start_date'), params)
+            conn.execute(text('DELETE FROM recommendation_hour_rollup WHERE session_date >= :start_date'), params)
+            
+            conn.execute(text(f'''
+                INSERT INTO recommendation_configs (config_hash, config_data)
+                SELECT DISTINCT {config_hash}, COALESCE(r.config_data, '{{}}'::jsonb)
+                FROM recommendations r
+                WHERE {SESSION_DATE_SQL} >= :start_date AND r.config_hash IS NULL
+                ON CONFLICT (config_hash) DO NOTHING
+            '''), params)
+            
+            daily = conn.execute(text(f'''
+                INSERT INTO recommendation_daily_rollup (
+                    session_date, config_hash, closed_count, successful_count, failed_count,
+                    profit_sum, loss_sum, profit_loss_sum, best_profit_loss, worst_profit_loss, duration_sum
+                )
+                SELECT {SESSION_DATE_SQL}, {config_hash},
+                       COUNT(*),
+                       COUNT(*) FILTER (WHERE rr.success),
+                       COUNT(*) FILTER (WHERE NOT rr.success),
+                       COALESCE(SUM(rr.profit_loss_percent) FILTER (WHERE rr.success), 0),
+                       COALESCE(SUM(rr.profit_loss_percent) FILTER (WHERE NOT rr.success), 0),
+                       COALESCE(SUM(rr.profit_loss_percent), 0),
+                       MAX(rr.profit_loss_percent), MIN(rr.profit_loss_percent),
+                       COALESCE(SUM(rr.duration_minutes), 0)
+                FROM recommendations r
+                JOIN recommendation_results rr ON rr.recommendation_id = r.id
+                WHERE rr.status = 'CLOSED' AND {SESSION_DATE_SQL} >= :start_date
+                GROUP BY 1, 2
+            '''), params).rowcount
+            
+            hourly = conn.execute(text(f'''
+                INSERT INTO recommendation_hour_rollup (
+                    session_date, config_hash, recommendation, evaluation_hour,
+                    evaluation_count, profitable_count, profit_loss_sum, max_profit_loss, min_profit_loss,
+                    optimal_exit_count, optimal_profit_loss_sum
+                )
+                SELECT {SESSION_DATE_SQL}, {config_hash}, r.recommendation, rte.evaluation_hour,
+                       COUNT(*),
+                       COUNT(*) FILTER (WHERE rte.profit_loss_percent > 0),
+                       SUM(rte.profit_loss_percent),
+                       MAX(rte.profit_loss_percent), MIN(rte.profit_loss_percent),
+                       COUNT(*) FILTER (WHERE rte.is_optimal_exit),
+                       COALESCE(SUM(rte.profit_loss_percent) FILTER (WHERE rte.is_optimal_exit), 0)
+                FROM recommendation_time_evaluations rte
+                JOIN recommendations r ON r.id = rte.recommendation_id
+                WHERE {SESSION_DATE_SQL} >= :start_date
+                GROUP BY 1, 2, 3, 4
+            '''), params).rowcount
+        
+        logger.info(f"🔁 Przebudowano rollupy statystyk od {start_date}: {daily} dziennych, {hourly} godzinowych")
+        return {'start_date': start_date.isoformat(), 'daily_rows': daily, 'hour_rows': hourly}
+
+    def _write_time_evaluations(self, conn, evaluations: List[Dict]) -> int:
+        """
+        Zapisuje oceny czasowe jednym zapytaniem (ponowna ocena tej samej godziny nadpisuje poprzednią)
+        
+        Args:
+            conn: Otwarte połączenie (transakcja wywołującego)
+            evaluations: Słowniki z kluczami recommendation_id, ticker, evaluation_hour, price_at_evaluation,
+                         profit_loss_percent, profit_loss_amount, volume_at_evaluation, rsi_at_evaluation,
+                         market_conditions
+        """
+        if not evaluations:
+            return 0
+        
+        # Poprzednie wartości nadpisywanych ocen - rollup dostaje tylko różnicę
+        previous = {(row[0], row[1]): (float(row[2]), row[3]) for row in conn.execute(text('''
+            SELECT rte.recommendation_id, rte.evaluation_hour, rte.profit_loss_percent, rte.is_optimal_exit
+            FROM recommendation_time_evaluations rte
+            JOIN jsonb_to_recordset(CAST(:keys AS JSONB)) AS k(recommendation_id INTEGER, evaluation_hour INTEGER)
+              ON k.recommendation_id = rte.recommendation_id AND k.evaluation_hour = rte.evaluation_hour
+        '''), {'keys': json.dumps([{'recommendation_id': e['recommendation_id'],
+                                      'evaluation_hour': e['evaluation_hour']} for e in evaluations])}).fetchall()}
+        
+        conn.execute(text('''
+            INSERT INTO recommendation_time_evaluations (
+                recommendation_id, ticker, evaluation_hour, price_at_evaluation,
+                profit_loss_percent, profit_loss_amount, volume_at_evaluation,
+                rsi_at_evaluation, market_conditions
+            )
+            SELECT e.recommendation_id, e.ticker, e.evaluation_hour, e.price_at_evaluation,
+                   e.profit_loss_percent, e.profit_loss_amount, COALESCE(e.volume_at_evaluation, 0),
+                   e.rsi_at_evaluation, e.market_conditions
+            FROM jsonb_to_recordset(CAST(:rows AS JSONB)) AS e(
+                recommendation_id INTEGER, ticker TEXT, evaluation_hour INTEGER, price_at_evaluation NUMERIC,
+                profit_loss_percent NUMERIC, profit_loss_amount NUMERIC, volume_at_evaluation BIGINT,
+                rsi_at_evaluation NUMERIC, market_conditions JSONB
+            )
+            ON CONFLICT (recommendation_id, evaluation_hour) DO UPDATE SET
+                price_at_evaluation = EXCLUDED.price_at_evaluation,
+                profit_loss_percent = EXCLUDED.profit_loss_percent,
+                profit_loss_amount = EXCLUDED.profit_loss_amount,
+                volume_at_evaluation = EXCLUDED.volume_at_evaluation,
+                rsi_at_evaluation = EXCLUDED.rsi_at_evaluation,
+                market_conditions = EXCLUDED.market_conditions,
+                evaluation_timestamp = CURRENT_TIMESTAMP
+        '''), {'rows': json.dumps(evaluations, default=json_serial)})
+        
+        deltas = []
+        for e in evaluations:
+            profit_loss = float(e['profit_loss_percent'])
+            old_profit_loss, was_optimal = previous.get((e['recommendation_id'], e['evaluation_hour']), (None, False))
+            deltas.append({
+                'recommendation_id': e['recommendation_id'],
+                'evaluation_hour': e['evaluation_hour'],
+                'count_delta': 0 if old_profit_loss is not None else 1,
+                'profitable_delta': int(profit_loss > 0) - int(old_profit_loss is not None and old_profit_loss > 0),
+                'profit_loss_delta': profit_loss - (old_profit_loss or 0.0),
+                'optimal_delta': 0,
+                'optimal_profit_loss_delta': profit_loss - old_profit_loss if was_optimal else 0.0,
+                'profit_loss': profit_loss
+            })
+        self._apply_hour_rollup(conn, deltas)
+        return len(evaluations)
+    
+    def _mark_optimal_exits(self, conn, recommendation_ids: List[int]) -> Dict[int, Tuple[int, float]]:
+        """
+        Oznacza optymalny moment wyjścia (maksymalny zysk) dla wielu rekomendacji jednym zapytaniem
+        
+        Returns:
+            {recommendation_id: (optymalna godzina, zysk %)}
+        """
+        if not recommendation_ids:
+            return {}
+        
+        best = conn.execute(text('''
+            SELECT DISTINCT ON (recommendation_id) recommendation_id, id, evaluation_hour, profit_loss_percent
+            FROM recommendation_time_evaluations
+            WHERE recommendation_id = ANY(:ids)
+            ORDER BY recommendation_id, profit_loss_percent DESC, evaluation_hour
+        '''), {'ids': list(recommendation_ids)}).fetchall()
+        if not best:
+            return {}
+        
+        # Aktualizowane są tylko wiersze, którym zmienia się oznaczenie - one trafiają do rollupu
+        changed = conn.execute(text('''
+            UPDATE recommendation_time_evaluations rte
+            SET is_optimal_exit = (rte.id = ANY(:best_ids))
+            WHERE rte.recommendation_id = ANY(:ids)
+            AND rte.is_optimal_exit IS DISTINCT FROM (rte.id = ANY(:best_ids))
+            RETURNING rte.recommendation_id, rte.evaluation_hour, rte.is_optimal_exit, rte.profit_loss_percent
+        '''), {'ids': list(recommendation_ids), 'best_ids': [row[1] for row in best]}).fetchall()
+        
+        self._apply_hour_rollup(conn, [{
+            'recommendation_id': rec_id,
+            'evaluation_hour': hour,
+            'count_delta': 0,
+            'profitable_delta': 0,
+            'profit_loss_delta': 0.0,
+            'optimal_delta': 1 if is_optimal else -1,
+            'optimal_profit_loss_delta': float(profit_loss) if is_optimal else -float(profit_loss),
+            'profit_loss': None
+        } for rec_id, hour, is_optimal, profit_loss in changed])
+        
+        return {row[0]: (row[2], float(row[3])) for row in best}
+    
+    def evaluate_recommendation_at_hour(self, recommendation_id: int, evaluation_hour: int,
                                        current_price: float, market_data: Optional[Dict] = None) -> bool:
         """
         Zapisuje ocenę rekomendacji w określonej godzinie od jej utworzenia
@@ -706,65 +1103,46 @@ class RecommendationTracker:
             evaluation_hour: Godzina od utworzenia (1-8)
             current_price: Cena w tym momencie
             market_data: Dodatkowe dane rynkowe (volume, RSI, itp.)
-            
+        
         Returns:
             True jeśli ocena została zapisana
         """
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                
+            with self.engine.begin() as conn:
                 # Pobierz dane rekomendacji
-                cursor.execute('''
-                    SELECT ticker, recommendation, entry_price, created_at
-                    FROM recommendations WHERE id = ?
-                ''', (recommendation_id,))
+                result = conn.execute(text('''
+                    SELECT ticker, recommendation, entry_price
+                    FROM recommendations WHERE id = :id
+                '''), {'id': recommendation_id}).fetchone()
                 
-                result = cursor.fetchone()
                 if not result:
                     logger.warning(f"❌ Nie znaleziono rekomendacji #{recommendation_id}")
                     return False
                 
-                ticker, recommendation, entry_price, created_at = result
-                
-                # Oblicz zysk/stratę
-                if recommendation == 'BUY':
-                    profit_loss_percent = ((current_price - entry_price) / entry_price) * 100
-                elif recommendation == 'SELL':
-                    profit_loss_percent = ((entry_price - current_price) / entry_price) * 100
-                else:
-                    profit_loss_percent = 0.0
-                
-                profit_loss_amount = current_price - entry_price
-                
-                # Przygotuj dodatkowe dane
-                volume_at_evaluation = market_data.get('current_volume', 0) if market_data else 0
-                rsi_at_evaluation = market_data.get('rsi') if market_data else None
-                market_conditions = json.dumps({
-                    'bb_position': market_data.get('bb_position') if market_data else None,
-                    'macd_histogram': market_data.get('macd_histogram') if market_data else None,
-                    'price_change_1d': market_data.get('price_change_1d') if market_data else None,
-                    'volume_ratio': market_data.get('volume_ratio') if market_data else None
-                }, default=json_serial) if market_data else '{}'
-                
-                # Zapisz ocenę czasową
-                cursor.execute('''
-                    INSERT OR REPLACE INTO recommendation_time_evaluations (
-                        recommendation_id, ticker, evaluation_hour, price_at_evaluation,
-                        profit_loss_percent, profit_loss_amount, volume_at_evaluation,
-                        rsi_at_evaluation, market_conditions
-                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (
-                    recommendation_id, ticker, evaluation_hour, current_price,
-                    profit_loss_percent, profit_loss_amount, volume_at_evaluation,
-                    rsi_at_evaluation, market_conditions
-                ))
-                
-                conn.commit()
-                
-                logger.info(f"✓ Zapisano ocenę {evaluation_hour}h dla #{recommendation_id}: {ticker} {profit_loss_percent:+.2f}%")
-                return True
+                ticker, recommendation, entry_price = result
+                entry_price = float(entry_price)
+                profit_loss_percent = self._profit_loss_percent(recommendation, entry_price, current_price)
                 
+                self._write_time_evaluations(conn, [{
+                    'recommendation_id': recommendation_id,
+                    'ticker': ticker,
+                    'evaluation_hour': evaluation_hour,
+                    'price_at_evaluation': current_price,
+                    'profit_loss_percent': profit_loss_percent,
+                    'profit_loss_amount': current_price - entry_price,
+                    'volume_at_evaluation': market_data.get('current_volume', 0) if market_data else 0,
+                    'rsi_at_evaluation': market_data.get('rsi') if market_data else None,
+                    'market_conditions': {
+                        'bb_position': market_data.get('bb_position'),
+                        'macd_histogram': market_data.get('macd_histogram'),
+                        'price_change_1d': market_data.get('price_change_1d'),
+                        'volume_ratio': market_data.get('volume_ratio')
+                    } if market_data else {}
+                }])
+            
+            logger.info(f"✓ Zapisano ocenę {evaluation_hour}h dla #{recommendation_id}: {ticker} {profit_loss_percent:+.2f}%")
+            return True
+        
         except Exception as e:
             logger.error(f"❌ Błąd zapisu oceny czasowej #{recommendation_id}: {e}")
             return False
@@ -775,271 +1153,248 @@ class RecommendationTracker:
         
         Args:
             recommendation_id: ID rekomendacji do analizy
-            
+        
         Returns:
             True jeśli analiza została wykonana
         """
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                
-                # Pobierz wszystkie oceny czasowe dla rekomendacji
-                cursor.execute('''
-                    SELECT id, evaluation_hour, profit_loss_percent
-                    FROM recommendation_time_evaluations
-                    WHERE recommendation_id = ?
-                    ORDER BY evaluation_hour ASC
-                ''', (recommendation_id,))
-                
-                evaluations = cursor.fetchall()
-                if not evaluations:
-                    return False
-                
-                # Znajdź optymalny moment sprzedaży (maksymalny zysk)
-                best_evaluation = max(evaluations, key=lambda x: x[2])  # maksymalny profit_loss_percent
-                best_eval_id = best_evaluation[0]
-                
-                # Resetuj wszystkie oznaczenia
-                cursor.execute('''
-                    UPDATE recommendation_time_evaluations 
-                    SET is_optimal_exit = FALSE 
-                    WHERE recommendation_id = ?
-                ''', (recommendation_id,))
-                
-                # Oznacz optymalny moment
-                cursor.execute('''
-                    UPDATE recommendation_time_evaluations 
-                    SET is_optimal_exit = TRUE 
-                    WHERE id = ?
-                ''', (best_eval_id,))
-                
-                conn.commit()
-                
-                optimal_hour = best_evaluation[1]
-                optimal_profit = best_evaluation[2]
-                logger.info(f"✓ Optymalny exit dla #{recommendation_id}: {optimal_hour}h ({optimal_profit:+.2f}%)")
-                
-                return True
-                
+            with self.engine.begin() as conn:
+                optimal = self._mark_optimal_exits(conn, [recommendation_id])
+            
+            if recommendation_id not in optimal:
+                return False
+            
+            optimal_hour, optimal_profit = optimal[recommendation_id]
+            logger.info(f"✓ Optymalny exit dla #{recommendation_id}: {optimal_hour}h ({optimal_profit:+.2f}%)")
+            return True
+        
         except Exception as e:
             logger.error(f"❌ Błąd oznaczania optymalnego exit #{recommendation_id}: {e}")
             return False
-
+    
     def auto_evaluate_active_recommendations_multi_hour(self) -> Dict:
         """
         Automatycznie ocenia rekomendacje w wielu interwałach czasowych (1-8h)
         
+        Wszystkie należne pary (rekomendacja, godzina) wyszukiwane są jednym zapytaniem,
+        cena każdej pary to notowanie as-of z chwili created_at + godzina (jedno zapytanie
+        dla wszystkich par), a oceny zapisywane są jednym wielowierszowym INSERT.
+        Godziny pominięte (np. po restarcie) są uzupełniane tą samą ceną as-of.
+        
         Returns:
             Słownik z podsumowaniem oceny
         """
         try:
-            from workers.technical_analysis import TechnicalAnalyzer
-            analyzer = TechnicalAnalyzer()
+            current_time = datetime.now()
             
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
+            with self.engine.begin() as conn:
+                # Pary (rekomendacja, godzina), których godzina już minęła
+                # i które nie zostały jeszcze ocenione w tym interwale
+                due = conn.execute(text('''
+                    SELECT r.id, r.ticker, r.recommendation, r.entry_price, r.created_at, h.hour
+                    FROM recommendations r
+                    CROSS JOIN generate_series(1, :max_hour) AS h(hour)
+                    WHERE r.status = 'ACTIVE'
+                    AND r.recommendation IN ('BUY', 'SELL')
+                    AND r.created_at > :oldest
+                    AND r.created_at <= :now - h.hour * INTERVAL '1 hour'
+                    AND NOT EXISTS (
+                        SELECT 1 FROM recommendation_time_evaluations rte
+                        WHERE rte.recommendation_id = r.id
+                        AND rte.evaluation_hour = h.hour
+                    )
+                    ORDER BY r.id, h.hour
+                '''), {
+                    'max_hour': SESSION_LENGTH_HOURS,
+                    'now': current_time,
+                    'oldest': current_time - timedelta(hours=SESSION_LENGTH_HOURS + EVALUATION_CATCH_UP_HOURS)
+                }).fetchall()
                 
-                current_time = datetime.now()
-                evaluations_made = []
+                prices = prices_as_of(conn, [(row[1], row[4] + timedelta(hours=row[5])) for row in due])
                 
-                # Sprawdź rekomendacje dla każdej godziny (1-8h)
-                for hour in range(1, 9):
-                    cutoff_time = current_time - timedelta(hours=hour)
-                    
-                    # Znajdź rekomendacje które są właśnie w tej godzinie
-                    # i jeszcze nie zostały ocenione w tym interwale
-                    cursor.execute('''
-                        SELECT r.id, r.ticker, r.recommendation, r.entry_price, r.created_at
-                        FROM recommendations r
-                        WHERE r.status = 'ACTIVE'
-                        AND r.created_at <= ?
-                        AND r.created_at > ?
-                        AND r.recommendation IN ('BUY', 'SELL')
-                        AND NOT EXISTS (
-                            SELECT 1 FROM recommendation_time_evaluations rte
-                            WHERE rte.recommendation_id = r.id 
-                            AND rte.evaluation_hour = ?
-                        )
-                    ''', (cutoff_time, cutoff_time - timedelta(minutes=30), hour))
-                    
-                    recommendations_for_hour = cursor.fetchall()
+                evaluations = []
+                evaluations_made = []
+                for rec_id, ticker, recommendation, entry_price, created_at, hour in due:
+                    quote = prices.get((ticker.upper(), created_at + timedelta(hours=hour)))
+                    if not quote:
+                        logger.warning(f"⚠️ Brak ceny dla {ticker} - pomijam ocenę {hour}h #{rec_id}")
+                        continue
                     
-                    for rec_id, ticker, recommendation, entry_price, created_at in recommendations_for_hour:
-                        try:
-                            # Pobierz aktualną cenę i dane techniczne
-                            analysis = analyzer.analyze_ticker(ticker, days_back=5)
-                            if not analysis or 'current_price' not in analysis:
-                                continue
-                            
-                            current_price = analysis['current_price']
-                            
-                            # Przygotuj dane rynkowe
-                            market_data = {
-                                'current_volume': analysis.get('current_volume', 0),
-                                'rsi': analysis.get('rsi'),
-                                'bb_position': analysis.get('bb_position'),
-                                'macd_histogram': analysis.get('macd_histogram'),
-                                'price_change_1d': analysis.get('price_change_1d'),
-                                'volume_ratio': analysis.get('current_volume', 1) / analysis.get('avg_volume_20', 1) if analysis.get('avg_volume_20', 0) > 0 else 1
-                            }
-                            
-                            # Zapisz ocenę czasową
-                            success = self.evaluate_recommendation_at_hour(
-                                rec_id, hour, current_price, market_data
-                            )
-                            
-                            if success:
-                                evaluations_made.append({
-                                    'recommendation_id': rec_id,
-                                    'ticker': ticker,
-                                    'hour': hour,
-                                    'price': current_price
-                                })
-                                
-                                # Jeśli to już 8 godzin, oznacz optymalny exit
-                                if hour == 8:
-                                    self.mark_optimal_exit_points(rec_id)
-                                    
-                        except Exception as e:
-                            logger.error(f"❌ Błąd oceny {hour}h dla {ticker}: {e}")
-                            continue
-                
-                logger.info(f"🔄 Wielogodzinne oceny zakończone: {len(evaluations_made)} ocen")
-                
-                # Grupuj wyniki według godzin
-                by_hour = {}
-                for eval_data in evaluations_made:
-                    hour = eval_data['hour']
-                    if hour not in by_hour:
-                        by_hour[hour] = []
-                    by_hour[hour].append(eval_data)
+                    entry_price = float(entry_price)
+                    current_price = quote['price']
+                    evaluations.append({
+                        'recommendation_id': rec_id,
+                        'ticker': ticker,
+                        'evaluation_hour': hour,
+                        'price_at_evaluation': current_price,
+                        'profit_loss_percent': self._profit_loss_percent(recommendation, entry_price, current_price),
+                        'profit_loss_amount': current_price - entry_price,
+                        'volume_at_evaluation': quote['volume'],
+                        'rsi_at_evaluation': None,
+                        'market_conditions': {'price_source': quote['source'], 'quote_time': quote['quote_time']}
+                    })
+                    evaluations_made.append({
+                        'recommendation_id': rec_id,
+                        'ticker': ticker,
+                        'hour': hour,
+                        'price': current_price
+                    })
                 
-                return {
-                    'total_evaluations': len(evaluations_made),
-                    'evaluations_by_hour': by_hour,
-                    'hours_evaluated': list(by_hour.keys()),
-                    'timestamp': current_time.isoformat()
-                }
+                self._write_time_evaluations(conn, evaluations)
                 
+                # Po ostatniej godzinie oznacz optymalny exit
+                self._mark_optimal_exits(conn, [e['recommendation_id'] for e in evaluations
+                                                if e['evaluation_hour'] == SESSION_LENGTH_HOURS])
+            
+            logger.info(f"🔄 Wielogodzinne oceny zakończone: {len(evaluations_made)} ocen")
+            
+            # Grupuj wyniki według godzin
+            by_hour = {}
+            for eval_data in evaluations_made:
+                by_hour.setdefault(eval_data['hour'], []).append(eval_data)
+            
+            return {
+                'total_evaluations': len(evaluations_made),
+                'evaluations_by_hour': by_hour,
+                'hours_evaluated': list(by_hour.keys()),
+                'timestamp': current_time.isoformat()
+            }
+        
         except Exception as e:
             logger.error(f"❌ Błąd wielogodzinnej automatycznej oceny: {e}")
             return {'error': str(e)}
     
     def get_optimal_exit_analysis(self, days_back: int = 30) -> Dict:
         """
-        Analizuje optymalne momenty sprzedaży na podstawie historycznych danych
+        Analizuje optymalne momenty sprzedaży na podstawie historycznych danych (z rollupu godzinowego)
         
         Args:
             days_back: Liczba dni wstecz do analizy
-            
+        
         Returns:
             Słownik z analizą optymalnych czasów sprzedaży
         """
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                
-                cutoff_date = datetime.now() - timedelta(days=days_back)
+            with self.engine.connect() as conn:
+                cutoff_date = (datetime.now() - timedelta(days=days_back)).date()
                 
                 # Pobierz statystyki dla każdej godziny
-                cursor.execute('''
-                    SELECT 
-                        rte.evaluation_hour,
-                        COUNT(*) as total_evaluations,
-                        AVG(rte.profit_loss_percent) as avg_profit_loss,
-                        MAX(rte.profit_loss_percent) as max_profit_loss,
-                        MIN(rte.profit_loss_percent) as min_profit_loss,
-                        COUNT(CASE WHEN rte.is_optimal_exit = 1 THEN 1 END) as optimal_exit_count,
-                        COUNT(CASE WHEN rte.profit_loss_percent > 0 THEN 1 END) as profitable_count
-                    FROM recommendation_time_evaluations rte
-                    JOIN recommendations r ON rte.recommendation_id = r.id
-                    WHERE r.created_at >= ?
-                    GROUP BY rte.evaluation_hour
-                    ORDER BY rte.evaluation_hour
-                ''', (cutoff_date,))
-                
-                hourly_stats = cursor.fetchall()
+                hourly_stats = conn.execute(text('''
+                    SELECT
+                        evaluation_hour,
+                        SUM(evaluation_count) as total_evaluations,
+                        SUM(profit_loss_sum) / SUM(evaluation_count) as avg_profit_loss,
+                        MAX(max_profit_loss) as max_profit_loss,
+                        MIN(min_profit_loss) as min_profit_loss,
+                        SUM(optimal_exit_count) as optimal_exit_count,
+                        SUM(profitable_count) as profitable_count
+                    FROM recommendation_hour_rollup
+                    WHERE session_date >= :cutoff_date
+                    GROUP BY evaluation_hour
+                    HAVING SUM(evaluation_count) > 0
+                    ORDER BY evaluation_hour
+                '''), {'cutoff_date': cutoff_date}).fetchall()
                 
                 # Pobierz najlepsze momenty sprzedaży według typu rekomendacji
-                cursor.execute('''
-                    SELECT 
-                        r.recommendation,
-                        rte.evaluation_hour,
-                        COUNT(*) as count,
-                        AVG(rte.profit_loss_percent) as avg_profit
-                    FROM recommendation_time_evaluations rte
-                    JOIN recommendations r ON rte.recommendation_id = r.id
-                    WHERE r.created_at >= ?
-                    AND rte.is_optimal_exit = 1
-                    GROUP BY r.recommendation, rte.evaluation_hour
-                    ORDER BY r.recommendation, avg_profit DESC
-                ''', (cutoff_date,))
-                
-                optimal_by_type = cursor.fetchall()
-                
-                # Przygotuj wyniki
-                analysis = {
-                    'period_days': days_back,
-                    'hourly_performance': [],
-                    'optimal_exit_patterns': {},
-                    'recommendations': {},
-                    'timestamp': datetime.now().isoformat()
-                }
-                
-                # Statystyki godzinowe
-                for hour, total, avg_profit, max_profit, min_profit, optimal_count, profitable_count in hourly_stats:
-                    success_rate = profitable_count / total if total > 0 else 0
-                    optimal_rate = optimal_count / total if total > 0 else 0
-                    
-                    analysis['hourly_performance'].append({
-                        'hour': hour,
-                        'total_evaluations': total,
-                        'avg_profit_loss': avg_profit,
-                        'max_profit': max_profit,
-                        'min_loss': min_profit,
-                        'success_rate': success_rate,
-                        'optimal_exit_rate': optimal_rate,
-                        'profitable_count': profitable_count
-                    })
-                
-                # Wzorce optymalnych wyjść
-                for rec_type, hour, count, avg_profit in optimal_by_type:
-                    if rec_type not in analysis['optimal_exit_patterns']:
-                        analysis['optimal_exit_patterns'][rec_type] = []
-                    
-                    analysis['optimal_exit_patterns'][rec_type].append({
-                        'hour': hour,
-                        'count': count,
-                        'avg_profit': avg_profit
-                    })
-                
-                # Rekomendacje na podstawie analizy
-                if analysis['hourly_performance']:
-                    best_hour = max(analysis['hourly_performance'], key=lambda x: x['avg_profit_loss'])
-                    safest_hour = max(analysis['hourly_performance'], key=lambda x: x['success_rate'])
-                    
-                    analysis['recommendations'] = {
-                        'best_profit_hour': {
-                            'hour': best_hour['hour'],
-                            'avg_profit': best_hour['avg_profit_loss'],
-                            'reason': 'Najwyższy średni zysk'
-                        },
-                        'safest_hour': {
-                            'hour': safest_hour['hour'],
-                            'success_rate': safest_hour['success_rate'],
-                            'reason': 'Najwyższa skuteczność'
-                        }
+                optimal_by_type = conn.execute(text('''
+                    SELECT
+                        recommendation,
+                        evaluation_hour,
+                        SUM(optimal_exit_count) as count,
+                        SUM(optimal_profit_loss_sum) / SUM(optimal_exit_count) as avg_profit
+                    FROM recommendation_hour_rollup
+                    WHERE session_date >= :cutoff_date
+                    GROUP BY recommendation, evaluation_hour
+                    HAVING SUM(optimal_exit_count) > 0
+                    ORDER BY recommendation, avg_profit DESC
+                '''), {'cutoff_date': cutoff_date}).fetchall()
+            
+            # Przygotuj wyniki
+            analysis = {
+                'period_days': days_back,
+                'hourly_performance': [],
+                'optimal_exit_patterns': {},
+                'recommendations': {},
+                'timestamp': datetime.now().isoformat()
+            }
+            
+            # Statystyki godzinowe
+            for hour, total, avg_profit, max_profit, min_profit, optimal_count, profitable_count in hourly_stats:
+                total, optimal_count, profitable_count = int(total), int(optimal_count), int(profitable_count)
+                success_rate = profitable_count / total if total > 0 else 0
+                optimal_rate = optimal_count / total if total > 0 else 0
+                
+                analysis['hourly_performance'].append({
+                    'hour': hour,
+                    'total_evaluations': total,
+                    'avg_profit_loss': float(avg_profit),
+                    'max_profit': float(max_profit),
+                    'min_loss': float(min_profit),
+                    'success_rate': success_rate,
+                    'optimal_exit_rate': optimal_rate,
+                    'profitable_count': profitable_count
+                })
+            
+            # Wzorce optymalnych wyjść
+            for rec_type, hour, count, avg_profit in optimal_by_type:
+                analysis['optimal_exit_patterns'].setdefault(rec_type, []).append({
+                    'hour': hour,
+                    'count': int(count),
+                    'avg_profit': float(avg_profit)
+                })
+            
+            # Rekomendacje na podstawie analizy
+            if analysis['hourly_performance']:
+                best_hour = max(analysis['hourly_performance'], key=lambda x: x['avg_profit_loss'])
+                safest_hour = max(analysis['hourly_performance'], key=lambda x: x['success_rate'])
+                
+                analysis['recommendations'] = {
+                    'best_profit_hour': {
+                        'hour': best_hour['hour'],
+                        'avg_profit': best_hour['avg_profit_loss'],
+                        'reason': 'Najwyższy średni zysk'
+                    },
+                    'safest_hour': {
+                        'hour': safest_hour['hour'],
+                        'success_rate': safest_hour['success_rate'],
+                        'reason': 'Najwyższa skuteczność'
                     }
-                
-                return analysis
-                
+                }
+            
+            return analysis
+        
         except Exception as e:
             logger.error(f"❌ Błąd analizy optymalnych wyjść: {e}")
             return {'error': str(e)}
 
+_tracker = None
+_tracker_lock = threading.Lock()
+
+
+def get_recommendation_tracker() -> RecommendationTracker:
+    """Zwraca współdzielony w procesie tracker (tabele inicjalizowane raz)"""
+    global _tracker
+    with _tracker_lock:
+        if _tracker is None:
+            _tracker = RecommendationTracker()
+        return _tracker
+
+
 def main():
-    """Funkcja testowa"""
-    tracker = RecommendationTracker("test_recommendations.db")
+    """
+    Funkcja testowa
+    
+    Przebudowa rollupów statystyk (backfill): python -m workers.recommendation_tracker --rebuild-rollups [--days N]
+    """
+    parser = argparse.ArgumentParser(description='Tracker rekomendacji')
+    parser.add_argument('--rebuild-rollups', action='store_true', help='Przelicz rollupy statystyk od zera')
+    parser.add_argument('--days', type=int, default=None, help='Przelicz tylko ostatnie N dni')
+    args = parser.parse_args()
+    
+    tracker = RecommendationTracker()
+    if args.rebuild_rollups:
+        print(f"✓ Przebudowano rollupy: {tracker.rebuild_rollups(args.days)}")
+        return
     
     # Test zapisywania rekomendacji
     test_analysis = {
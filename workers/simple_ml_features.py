@@ -10,7 +10,7 @@ import numpy as np
 import pandas as pd
 import logging
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Tuple
+from typing import Callable, Dict, List, Optional, Tuple
 from sqlalchemy import create_engine, text
 from dotenv import load_dotenv
 import os
@@ -66,52 +66,8 @@ class SimpleMLFeatures:
                 logger.warning(f"Za mało danych dla {ticker} na {date}: {len(df)} rekordów")
                 return None
             
-            # Podstawowe cechy
-            df['price_change'] = df['price'].pct_change()
-            df['price_change_abs'] = df['price'].diff()
-            
-            # Moving averages
-            df['ma_3'] = df['price'].rolling(window=3).mean()
-            df['ma_5'] = df['price'].rolling(window=min(5, len(df))).mean()
-            
-            # Volatility
-            df['volatility'] = df['price'].rolling(window=3).std()
-            
-            # Volume features
-            df['volume_change'] = df['volume'].pct_change() if 'volume' in df.columns else 0
-            df['volume_ma'] = df['volume'].rolling(window=3).mean() if 'volume' in df.columns else 0
-            
-            # Price position
-            if 'high_price' in df.columns and 'low_price' in df.columns:
-                df['price_range'] = df['high_price'] - df['low_price']
-                df['price_position'] = (df['price'] - df['low_price']) / (df['price_range'] + 0.001)
-            else:
-                df['price_range'] = 0
-                df['price_position'] = 0.5
-            
-            # Trend indicators
-            df['trend_3'] = (df['price'] > df['ma_3']).astype(int)
-            df['trend_5'] = (df['price'] > df['ma_5']).astype(int)
-            
-            # Momentum
-            df['momentum_3'] = df['price'] - df['price'].shift(3)
-            df['momentum_5'] = df['price'] - df['price'].shift(min(5, len(df)-1))
-            
-            # Clean data
-            df = df.fillna(0)
-            df = df.replace([np.inf, -np.inf], 0)
-            
-            # Select features
-            feature_cols = [
-                'price_change', 'price_change_abs', 'ma_3', 'ma_5', 'volatility',
-                'volume_change', 'volume_ma', 'price_range', 'price_position',
-                'trend_3', 'trend_5', 'momentum_3', 'momentum_5'
-            ]
-            
-            features = df[feature_cols].copy()
+            features = self._compute_features(df)
             features['ticker'] = ticker
-            features['datetime'] = df['datetime']
-            features['price'] = df['price']
             
             logger.info(f"✅ Utworzono {len(features)} cech dla {ticker} na {date}")
             return features
@@ -120,6 +76,114 @@ class SimpleMLFeatures:
             logger.error(f"Błąd tworzenia cech dla {ticker}: {e}")
             return None
     
+    def _compute_features(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Liczy cechy dla notowań jednej spółki z jednej sesji
+        
+        Args:
+            df: DataFrame z kolumnami datetime, price, volume, open_price, high_price, low_price
+            
+        Returns:
+            DataFrame z cechami oraz kolumnami datetime i price
+        """
+        df = df.copy()
+        
+        # Podstawowe cechy
+        df['price_change'] = df['price'].pct_change()
+        df['price_change_abs'] = df['price'].diff()
+        
+        # Moving averages
+        df['ma_3'] = df['price'].rolling(window=3).mean()
+        df['ma_5'] = df['price'].rolling(window=min(5, len(df))).mean()
+        
+        # Volatility
+        df['volatility'] = df['price'].rolling(window=3).std()
+        
+        # Volume features
+        df['volume_change'] = df['volume'].pct_change() if 'volume' in df.columns else 0
+        df['volume_ma'] = df['volume'].rolling(window=3).mean() if 'volume' in df.columns else 0
+        
+        # Price position
+        if 'high_price' in df.columns and 'low_price' in df.columns:
+            df['price_range'] = df['high_price'] - df['low_price']
+            df['price_position'] = (df['price'] - df['low_price']) / (df['price_range'] + 0.001)
+        else:
+            df['price_range'] = 0
+            df['price_position'] = 0.5
+        
+        # Trend indicators
+        df['trend_3'] = (df['price'] > df['ma_3']).astype(int)
+        df['trend_5'] = (df['price'] > df['ma_5']).astype(int)
+        
+        # Momentum
+        df['momentum_3'] = df['price'] - df['price'].shift(3)
+        df['momentum_5'] = df['price'] - df['price'].shift(min(5, len(df)-1))
+        
+        # Clean data
+        df = df.fillna(0)
+        df = df.replace([np.inf, -np.inf], 0)
+        
+        # Select features
+        feature_cols = [
+            'price_change', 'price_change_abs', 'ma_3', 'ma_5', 'volatility',
+            'volume_change', 'volume_ma', 'price_range', 'price_position',
+            'trend_3', 'trend_5', 'momentum_3', 'momentum_5'
+        ]
+        
+        features = df[feature_cols].copy()
+        features['datetime'] = df['datetime']
+        features['price'] = df['price']
+        
+        return features
+    
+    def create_features_for_range(self, tickers: List[str], start_date: str, end_date: str) -> pd.DataFrame:
+        """
+        Tworzy cechy dla wielu tickerów i sesji jednym zapytaniem (na potrzeby backtestu)
+        
+        Args:
+            tickers: Lista tickerów
+            start_date: Data początkowa
+            end_date: Data końcowa (włącznie)
+        
+        Returns:
+            DataFrame z cechami oraz kolumnami ticker, date, datetime i price
+        """
+        query = text("""
+            SELECT c.ticker, qi.datetime, qi.price, qi.volume,
+                   qi.open as open_price, qi.high as high_price, qi.low as low_price
+            FROM quotes_intraday qi
+            JOIN companies c ON qi.company_id = c.id
+            WHERE c.ticker = ANY(:tickers)
+            AND DATE(qi.datetime) BETWEEN :start_date AND :end_date
+            ORDER BY c.ticker, qi.datetime ASC
+        """)
+        
+        with self.engine.connect() as conn:
+            df = pd.read_sql_query(query, conn, params={
+                "tickers": list(tickers), "start_date": start_date, "end_date": end_date
+            })
+        
+        if df.empty:
+            return pd.DataFrame()
+        
+        df['date'] = pd.to_datetime(df['datetime']).dt.date
+        
+        all_features = []
+        for (ticker, date), session in df.groupby(['ticker', 'date'], sort=False):
+            if len(session) < 3:
+                continue
+            features = self._compute_features(session.reset_index(drop=True))
+            features['ticker'] = ticker
+            features['date'] = date
+            all_features.append(features)
+        
+        if not all_features:
+            return pd.DataFrame()
+        
+        result = pd.concat(all_features, ignore_index=True)
+        logger.info(f"✅ Utworzono cechy dla {result['ticker'].nunique()} tickerów, {len(result)} rekordów")
+        return result
+    
     def create_labels(self, ticker: str, date: str, profit_threshold: float = 0.02) -> Optional[pd.Series]:
         """
         Tworzy etykiety dla danych (1 = BUY opportunity, 0 = no opportunity)
@@ -172,13 +236,15 @@ class SimpleMLFeatures:
             logger.error(f"Błąd tworzenia etykiet dla {ticker}: {e}")
             return None
     
-    def prepare_training_data(self, tickers: List[str], dates: List[str]) -> Tuple[pd.DataFrame, pd.Series]:
+    def prepare_training_data(self, tickers: List[str], dates: List[str],
+                              progress_callback: Optional[Callable] = None) -> Tuple[pd.DataFrame, pd.Series]:
         """
         Przygotowuje dane treningowe dla wielu tickerów i dat
         
         Args:
             tickers: Lista tickerów
             dates: Lista dat
+            progress_callback: Opcjonalny callback postępu (stage, progress, message)
             
         Returns:
             Tuple (X - cechy, y - etykiety)
@@ -186,8 +252,15 @@ class SimpleMLFeatures:
         all_features = []
         all_labels = []
         
+        total_steps = max(1, len(tickers) * len(dates))
+        step = 0
+        
         for ticker in tickers:
             for date in dates:
+                step += 1
+                if progress_callback:
+                    progress_callback('features', step / total_steps * 100,
+                                      f"Cechy {ticker} {date} ({step}/{total_steps})")
                 try:
                     features = self.create_simple_features(ticker, date)
                     labels = self.create_labels(ticker, date)
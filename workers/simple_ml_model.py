@@ -12,7 +12,7 @@ import pickle
 import os
 import logging
 from datetime import datetime
-from typing import Dict, List, Optional, Tuple, Any
+from typing import Callable, Dict, List, Optional, Tuple, Any
 
 try:
     from sklearn.ensemble import RandomForestClassifier
@@ -47,13 +47,15 @@ class SimpleMLModel:
         
         logger.info("✓ Simple ML Model zainicjalizowany")
     
-    def train_model(self, X: pd.DataFrame, y: pd.Series) -> Dict[str, Any]:
+    def train_model(self, X: pd.DataFrame, y: pd.Series,
+                    progress_callback: Optional[Callable] = None) -> Dict[str, Any]:
         """
         Trenuje model ML
         
         Args:
             X: Cechy
             y: Etykiety
+            progress_callback: Opcjonalny callback postępu (stage, progress, message)
             
         Returns:
             Wyniki treningu
@@ -85,6 +87,9 @@ class SimpleMLModel:
             X_test_scaled = self.scaler.transform(X_test)
             
             # Trening modelu
+            if progress_callback:
+                progress_callback('fit', 0, f"Trening RandomForest na {len(X_train)} próbkach")
+            
             self.model = RandomForestClassifier(
                 n_estimators=50,
                 max_depth=10,
@@ -96,6 +101,9 @@ class SimpleMLModel:
             self.model.fit(X_train_scaled, y_train)
             
             # Ewaluacja
+            if progress_callback:
+                progress_callback('evaluate', 100, "Ewaluacja modelu")
+            
             y_pred = self.model.predict(X_test_scaled)
             accuracy = accuracy_score(y_test, y_pred)
             
@@ -251,6 +259,10 @@ class SimpleMLModel:
         """
         Backtest modelu
         
+        Cechy dla wszystkich tickerów i sesji liczone są jednym zapytaniem, predykcje jednym
+        wywołaniem modelu, a sygnały BUY rozgrywane w IntradayBacktester z regułami wyjścia
+        intraday (take-profit, stop loss, koniec sesji), prowizją i poślizgiem.
+        
         Args:
             tickers: Lista tickerów
             start_date: Data początkowa
@@ -263,20 +275,46 @@ class SimpleMLModel:
             if not self.is_trained:
                 return {'error': 'Model nie został wytrenowany'}
             
-            results = []
+            from workers.intraday_backtester import IntradayBacktester
             
-            for ticker in tickers:
-                pred_result = self.predict_intraday(ticker, start_date)
-                if 'error' not in pred_result:
-                    results.append(pred_result)
-            
-            if not results:
+            features = SimpleMLFeatures().create_features_for_range(tickers, start_date, end_date)
+            if features.empty:
                 return {'error': 'Brak wyników do backtestingu'}
             
-            # Statystyki
-            total_predictions = sum(r['total_predictions'] for r in results)
-            total_buy_signals = sum(r['buy_signals'] for r in results)
-            avg_confidence = sum(r['average_confidence'] for r in results) / len(results)
+            X = features.reindex(columns=self.feature_names, fill_value=0)
+            X_scaled = self.scaler.transform(X)
+            predictions = self.model.predict(X_scaled)
+            probabilities = self.model.predict_proba(X_scaled)
+            buy_probability = probabilities[:, 1] if probabilities.shape[1] > 1 else np.zeros(len(X))
+            
+            # Koniec grupy (ticker, sesja) dla każdego wiersza - wiersze są posortowane po tickerze i czasie
+            session_key = features['ticker'].astype(str) + '|' + features['date'].astype(str)
+            starts = np.flatnonzero(np.r_[True, session_key.to_numpy()[1:] != session_key.to_numpy()[:-1]])
+            group_end = np.repeat(np.r_[starts[1:], len(features)], np.diff(np.r_[starts, len(features)]))
+            timestamps = pd.to_datetime(features['datetime'])
+            minutes = (timestamps.dt.hour * 60 + timestamps.dt.minute).to_numpy()
+            
+            price = features['price'].to_numpy(dtype=float)
+            backtest = IntradayBacktester().run_signals(
+                price, price, price, group_end, predictions == 1, minutes=minutes
+            )
+            trades = backtest['trades']
+            
+            individual_results = []
+            for ticker, group in features.assign(prediction=predictions, buy_probability=buy_probability).groupby('ticker'):
+                buy_mask = group['prediction'] == 1
+                ticker_trades = features['ticker'].to_numpy()[trades['entry_index']] == ticker
+                individual_results.append({
+                    'ticker': ticker,
+                    'total_predictions': int(len(group)),
+                    'buy_signals': int(buy_mask.sum()),
+                    'average_confidence': float(group.loc[buy_mask, 'buy_probability'].mean()) if buy_mask.any() else 0.0,
+                    'trades': int(ticker_trades.sum()),
+                    'pnl': float(trades['pnl'][ticker_trades].sum())
+                })
+            
+            total_predictions = int(len(predictions))
+            total_buy_signals = int((predictions == 1).sum())
             
             return {
                 'tickers': tickers,
@@ -285,8 +323,9 @@ class SimpleMLModel:
                 'total_predictions': total_predictions,
                 'total_buy_signals': total_buy_signals,
                 'buy_ratio': total_buy_signals / total_predictions if total_predictions > 0 else 0,
-                'average_confidence': avg_confidence,
-                'individual_results': results,
+                'average_confidence': float(buy_probability[predictions == 1].mean()) if total_buy_signals else 0,
+                'trading_simulation': backtest['summary'],
+                'individual_results': individual_results,
                 'timestamp': datetime.now().isoformat()
             }
             